@@ -2,30 +2,84 @@
 # -*- coding: utf-8 -*-
 
 import json
+import mimetypes
 import os
-import hashlib
-import sqlite3
 import time
 import base64
+import csv
+import io
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, session, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, session, send_file, send_from_directory, g, stream_with_context
 from flask_cors import CORS
 import secrets
 import uuid
 
+import backup
+import blobstore
+import budget
+import calendar_events
+import compression
+import database
+import diary
+import events
+import file_index
+import inventory
+import membership
+import onboarding
+import passwords
+import presence
+import profiling
+import querytrace
+import ratelimit
+import repository
+import search
+import serializer
+import server_archive
+import static_assets
+import surveys
+import tasks
+import wiki
+import writebehind
+import writer
+from config import Config
+
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(32)
+app.json = serializer.FastJSONProvider(app)
 CORS(app, supports_credentials=True)
+static_site = static_assets.StaticSite('index.html')
+
+@app.before_request
+def start_request_profile():
+    """PROFILE_REQUESTS / SQL_TRACE 有効時、/api.cgi の計測を開始"""
+    if request.path == '/api.cgi':
+        profiling.start_request(request.form.get('action'), request.path)
+        if Config.SQL_TRACE:
+            g.sql_trace = querytrace.start()
+
+@app.after_request
+def finish_request_profile(response):
+    trace = g.pop('sql_trace', None)
+    if trace is not None:
+        querytrace.stop(trace)
+        querytrace.annotate_response(response, trace, request.form.get('action'))
+    return profiling.finish_request(response, session.get('user_id'))
+
+@app.after_request
+def compress_response(response):
+    """/api.cgi と index.html のレスポンスを Accept-Encoding に応じて圧縮"""
+    if request.path in ('/', '/api.cgi'):
+        return compression.compress_response(response, request.headers.get('Accept-Encoding'))
+    return response
 
-# データベース初期化
+# データベース初期化（DATABASE_URL のバックエンドに同じスキーマを作る）
 def init_database():
-    os.makedirs('data', exist_ok=True)
     os.makedirs('files', exist_ok=True)
     os.makedirs('files/uploads', exist_ok=True)
     os.makedirs('files/avatars', exist_ok=True)
     os.makedirs('files/whiteboards', exist_ok=True)
     
-    conn = sqlite3.connect('data/circle_platform.db')
+    conn = database.connect_raw()
     cursor = conn.cursor()
     
     # ユーザーテーブル（拡張）
@@ -56,18 +110,8 @@ def init_database():
     ''')
 
     # 既存データベースとの互換性確保: 古いスキーマに対して必要なカラムを追加
-    try:
-        cursor.execute("PRAGMA table_info(users)")
-        cols = [row[1] for row in cursor.fetchall()]
-        if 'last_login' not in cols:
-            try:
-                cursor.execute("ALTER TABLE users ADD COLUMN last_login TIMESTAMP")
-            except Exception:
-                # SQLite の古いバージョンや予期せぬエラーは無視して続行
-                pass
-    except Exception:
-        # PRAGMA がサポートされていない環境でも無視
-        pass
+    if 'last_login' not in database.columns(cursor, 'users'):
+        cursor.execute("ALTER TABLE users ADD COLUMN last_login TIMESTAMP")
     
     # サーバー（サークル）テーブル（拡張）
     cursor.execute('''
@@ -89,27 +133,19 @@ def init_database():
     ''')
 
     # 既存データベースとの互換性確保: servers テーブルに必要なカラムを追加
-    try:
-        cursor.execute("PRAGMA table_info(servers)")
-        cols = [row[1] for row in cursor.fetchall()]
-        server_alters = [
-            ("description", "TEXT", "NULL"),
-            ("banner", "TEXT", "NULL"),
-            ("is_public", "BOOLEAN", "0"),
-            ("invite_code", "TEXT", "NULL"),
-            ("max_members", "INTEGER", "100"),
-            ("settings", "TEXT", "'{}'"),
-            ("updated_at", "TIMESTAMP", "CURRENT_TIMESTAMP")
-        ]
-        for name, typ, default in server_alters:
-            if name not in cols:
-                try:
-                    cursor.execute(f"ALTER TABLE servers ADD COLUMN {name} {typ} DEFAULT {default}")
-                except Exception:
-                    # ALTER が失敗しても続行（SQLite の制約など）
-                    pass
-    except Exception:
-        pass
+    cols = database.columns(cursor, 'servers')
+    server_alters = [
+        ("description", "TEXT", "NULL"),
+        ("banner", "TEXT", "NULL"),
+        ("is_public", "BOOLEAN", "0"),
+        ("invite_code", "TEXT", "NULL"),
+        ("max_members", "INTEGER", "100"),
+        ("settings", "TEXT", "'{}'"),
+        ("updated_at", "TIMESTAMP", "CURRENT_TIMESTAMP")
+    ]
+    for name, typ, default in server_alters:
+        if name not in cols:
+            cursor.execute(f"ALTER TABLE servers ADD COLUMN {name} {typ} DEFAULT {default}")
     
     # サーバーメンバーシップテーブル
     cursor.execute('''
@@ -170,6 +206,20 @@ def init_database():
         )
     ''')
     
+    # 機能テーブル（files が参照するので先に作る。PostgreSQL は未作成のテーブルを参照できない）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS features (
+            id TEXT PRIMARY KEY,
+            server_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            icon TEXT NOT NULL,
+            position INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (server_id) REFERENCES servers (id)
+        )
+    ''')
+    
     # ファイルテーブル
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS files (
@@ -190,31 +240,42 @@ def init_database():
             FOREIGN KEY (feature_id) REFERENCES features (id)
         )
     ''')
+    file_index.init_file_indexes(cursor)
     
-    # 機能テーブル
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS features (
-            id TEXT PRIMARY KEY,
-            server_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            type TEXT NOT NULL,
-            icon TEXT NOT NULL,
-            position INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (server_id) REFERENCES servers (id)
-        )
-    ''')
-    
-    # コンテンツテーブル（JSON形式で様々なデータを保存）
-    cursor.execute('''
+    # コンテンツテーブル（JSON形式で様々なデータを保存。PostgreSQL では BYTEA、repository.content_value を参照）
+    cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS feature_content (
             feature_id TEXT PRIMARY KEY,
-            content TEXT NOT NULL,
+            content {'BYTEA' if database.is_postgres(conn) else 'TEXT'} NOT NULL,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (feature_id) REFERENCES features (id)
         )
     ''')
     
+    # 全文検索インデックス
+    search.init_search_index(cursor)
+    
+    # アンケート回答と集計
+    surveys.init_survey_tables(cursor)
+    
+    # プロジェクトのタスク
+    tasks.init_task_tables(cursor)
+    
+    # カレンダーのイベント
+    calendar_events.init_calendar_tables(cursor)
+    
+    # 予算管理の台帳と集計
+    budget.init_budget_tables(cursor)
+    
+    # 物品管理のアイテム
+    inventory.init_inventory_tables(cursor)
+    
+    # Wiki ページと版の履歴
+    wiki.init_wiki_tables(cursor)
+    
+    # 日記のエントリ
+    diary.init_diary_tables(cursor)
+    
     # セッションテーブル
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS sessions (
@@ -230,22 +291,88 @@ def init_database():
     conn.close()
 
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    return passwords.hash_password(password)
+
+# ログイン・登録の試行回数（DB やハッシュ計算の前に確認する）
+login_user_limiter = ratelimit.TokenBucketLimiter(Config.LOGIN_USER_BURST, Config.LOGIN_USER_PER_MINUTE)
+login_ip_limiter = ratelimit.TokenBucketLimiter(Config.LOGIN_IP_BURST, Config.LOGIN_IP_PER_MINUTE)
+RATE_LIMITED_ERROR = '試行回数が多すぎます。しばらく待ってから再度お試しください'
 
 def get_db_connection():
-    os.makedirs('data', exist_ok=True)
-    conn = sqlite3.connect('data/circle_platform.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    # SQLite は sqlite3.Row、PostgreSQL は同じように読めるラッパーの接続（どちらも SQL を計測する）
+    return database.connect()
+
+memberships = membership.MembershipCache(get_db_connection)
+# 最終ログイン時刻やダウンロード数は後からまとめて書き込む
+bookkeeping = writebehind.create_buffer(get_db_connection)
+# 投稿などの書き込みは1本のスレッドでまとめてコミットする
+writes = writer.create_writer(get_db_connection)
+# アップロードファイルなどの実体の保存先（ローカルの files/ か S3 互換ストレージ）
+blobs = blobstore.create_blob_store()
+# チャットの投稿などのリアルタイムのイベント（EVENT_TRANSPORT で複数ノードに配信）
+event_bus = events.create_bus()
+
+def publish_event(feature_id, kind, data=None):
+    """機能の変更をそのサーバーのメンバーに通知する"""
+    server_id = memberships.feature_server(feature_id)
+    if server_id is not None:
+        event_bus.publish(server_id, kind, feature_id, data)
+
+# オンライン状態と入力中の表示（メモリのみ。ほかのノードとはイベントバスで共有）
+presences = presence.PresenceTracker(event_bus.publish)
+event_bus.add_listener(presences.apply)
+
+# featureId を受け取るアクション（その機能のサーバーのメンバーだけが使える）
+FEATURE_MEMBER_ACTIONS = frozenset({
+    'addSubItem', 'addWhiteboard', 'saveWhiteboard', 'postMessage', 'createSurvey',
+    'submitSurveyResponse', 'createProject', 'createTask', 'updateTaskStatus', 'listTasks',
+    'getEvents', 'getBudgetSummary', 'listInventory', 'importInventory', 'exportInventory',
+    'listDiaryEntries', 'getDiaryEntry', 'saveDiaryEntry', 'deleteDiaryEntry',
+    'listWikiPages', 'getWikiPage', 'getWikiRevision', 'saveWikiPage', 'uploadFile',
+    'saveWhiteboardImage', 'updateFeatureContent', 'getFeatureContent', 'getSurveyResults',
+    'presenceHeartbeat', 'setTyping',
+})
+# serverId を受け取るアクション（そのサーバーのメンバーだけが使える）
+SERVER_MEMBER_ACTIONS = frozenset({'uploadFile', 'createInvite', 'createInvites', 'importMembers',
+                                   'updateMemberRole', 'getServerMembers', 'exportServer', 'pollEvents',
+                                   'presenceHeartbeat'})
+
+def check_member_access(action):
+    """呼び出し元が対象のサーバーのメンバーか確認し、そうでなければエラーレスポンスを返す"""
+    user_id = session.get('user_id')
+    if user_id is None:
+        # 未ログインは各ハンドラーが Not authenticated を返す
+        return None
+    if action in FEATURE_MEMBER_ACTIONS:
+        feature_id = request.form.get('featureId')
+        if feature_id and memberships.feature_role(user_id, feature_id) is None:
+            return jsonify({'success': False, 'error': 'この機能にアクセスする権限がありません'})
+    if action in SERVER_MEMBER_ACTIONS:
+        server_id = request.form.get('serverId')
+        if server_id and memberships.role(user_id, server_id) is None:
+            return jsonify({'success': False, 'error': 'サーバーのメンバーではありません'})
+    return None
+
+def get_session_user():
+    """DB を引かずにセッションのユーザー（id と username）を返す。古いセッションだけ DB で補う"""
+    user_id = session.get('user_id')
+    if user_id is None:
+        return None
+    username = session.get('username')
+    if username is None:
+        user = get_current_user()
+        if not user:
+            return None
+        username = session['username'] = user['username']
+    return {'id': user_id, 'username': username}
 
+@profiling.timed('auth')
 def get_current_user():
     if 'user_id' not in session:
         return None
     
     conn = get_db_connection()
-    user = conn.execute(
-        'SELECT * FROM users WHERE id = ?', (session['user_id'],)
-    ).fetchone()
+    user = repository.get_user(conn, session['user_id'])
     conn.close()
     
     if user:
@@ -260,21 +387,14 @@ def get_current_user():
         }
     return None
 
+@profiling.timed('state')
 def get_user_state(user_id):
     """ユーザーの全体的な状態を取得"""
     conn = get_db_connection()
     
     # ユーザーが参加しているサーバー一覧を取得
     servers = {}
-    server_rows = conn.execute('''
-        SELECT s.*, sm.role, sm.joined_at
-        FROM servers s
-        JOIN server_members sm ON s.id = sm.server_id
-        WHERE sm.user_id = ?
-        ORDER BY sm.joined_at
-    ''', (user_id,)).fetchall()
-    
-    for server in server_rows:
+    for server in repository.user_servers(conn, user_id):
         servers[server['id']] = {
             'id': server['id'],
             'name': server['name'],
@@ -288,74 +408,57 @@ def get_user_state(user_id):
             'joinedAt': server['joined_at']
         }
     
-    # 各サーバーの機能を取得
-    features = {}
-    for server_id in servers.keys():
-        feature_rows = conn.execute(
-            'SELECT * FROM features WHERE server_id = ? ORDER BY position, created_at',
-            (server_id,)
-        ).fetchall()
-        features[server_id] = []
-        for feature in feature_rows:
-            features[server_id].append({
-                'id': feature['id'],
-                'name': feature['name'],
-                'type': feature['type'],
-                'icon': feature['icon'],
-                'server_id': feature['server_id']
-            })
-    
-    # 各機能のコンテンツを取得
+    # 各サーバーの機能を取得（サーバーごとのクエリを1回にまとめる）
+    features = {server_id: [] for server_id in servers.keys()}
+    for feature in repository.server_features(conn, servers.keys()):
+        features[feature['server_id']].append({
+            'id': feature['id'],
+            'name': feature['name'],
+            'type': feature['type'],
+            'icon': feature['icon'],
+            'server_id': feature['server_id']
+        })
+    
+    # 各機能のコンテンツを取得（参加しているサーバーの機能だけ）
     content = {}
-    content_rows = conn.execute('SELECT * FROM feature_content').fetchall()
-    for row in content_rows:
+    feature_ids = [f['id'] for fs in features.values() for f in fs]
+    for feature_id, raw in repository.load_raw_contents(conn, feature_ids).items():
         try:
-            content[row['feature_id']] = json.loads(row['content'])
+            content[feature_id] = serializer.decode_content(raw)
         except json.JSONDecodeError:
-            content[row['feature_id']] = {}
-    
-    # ファイル情報を取得
-    files = []
-    if servers:
-        placeholders = ','.join(['?' for _ in servers.keys()])
-        file_rows = conn.execute(f'''
-            SELECT f.*, u.username as uploader_name
-            FROM files f
-            LEFT JOIN users u ON f.upload_by = u.id
-            WHERE f.server_id IN ({placeholders})
-            ORDER BY f.created_at DESC
-        ''', list(servers.keys())).fetchall()
-    else:
-        file_rows = []
-    
-    for file_row in file_rows:
-        files.append({
-            'id': file_row['id'],
-            'filename': file_row['original_filename'],
-            'serverId': file_row['server_id'],
-            'featureId': file_row['feature_id'],
-            'size': file_row['file_size'],
-            'uploadedBy': file_row['uploader_name'],
-            'uploadedAt': file_row['created_at'],
-            'mimeType': file_row['mime_type'],
-            'downloadCount': file_row['download_count']
-        })
+            content[feature_id] = {}
     
+    # アンケートは本人の回答だけを戻す（他人の生の回答は送らない）
+    surveys.merge_own_responses(content, surveys.own_responses(conn, user_id))
+    
+    # タスク・イベント・予算・物品・Wiki は専用テーブルにあり、ここでは戻さない
+    # （機能を開いたときに getFeatureContent で取得する）。ホーム画面には
+    # 自分の未完了タスクと今日から1週間のイベントだけを渡す
+    user = get_current_user()
+    project_feature_ids = [f['id'] for fs in features.values() for f in fs if f['type'] == 'projects']
+    calendar_feature_ids = [f['id'] for fs in features.values() for f in fs if f['type'] == 'calendar']
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    hub = {
+        'tasks': tasks.open_tasks_for_user(conn, project_feature_ids, user['username'] if user else None),
+        'events': calendar_events.upcoming_events(conn, calendar_feature_ids, today,
+                                                  today + timedelta(days=8, seconds=-1)),
+    }
+    
+    # ファイル一覧は件数が多くなるので含めない（listFiles でページ単位に取得）
     conn.close()
     
     return {
         'servers': servers,
         'features': features,
         'content': content,
-        'files': files,
-        'currentUser': get_current_user(),
+        'hub': hub,
+        'currentUser': user,
         'loggedIn': True
     }
 
-def create_default_features(server_id):
-    """新しいサーバーに標準機能を作成"""
-    conn = get_db_connection()
-    
+def create_default_features(conn, server_id, username=None):
+    """新しいサーバーに標準機能を作成（コミットは呼び出し側）"""
+
     default_features = [
         {'name': 'チャット', 'type': 'chat', 'icon': 'message-circle'},
         {'name': 'フォーラム', 'type': 'forum', 'icon': 'message-square'},
@@ -374,20 +477,14 @@ def create_default_features(server_id):
     
     for i, feature in enumerate(default_features):
         feature_id = f"{server_id}_{feature['type']}_{int(time.time() * 1000)}_{i}"
-        conn.execute('''
-            INSERT INTO features (id, server_id, name, type, icon, position)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (feature_id, server_id, feature['name'], feature['type'], feature['icon'], i))
+        repository.add_feature(conn, feature_id, server_id, feature['name'], feature['type'], feature['icon'], i)
         
         # 初期コンテンツを作成
         initial_content = create_initial_content(feature['type'])
-        conn.execute('''
-            INSERT INTO feature_content (feature_id, content)
-            VALUES (?, ?)
-        ''', (feature_id, json.dumps(initial_content)))
-    
-    conn.commit()
-    conn.close()
+        # Wiki のページなどはブロブから派生テーブルへ移すので、updateFeatureContent と同じ経路で保存する
+        on_feature_content_saved(conn, feature_id, initial_content, username,
+                                 feature={'type': feature['type'], 'server_id': server_id}, new_feature=True)
+        repository.store_content(conn, feature_id, initial_content)
 
 def create_initial_content(feature_type):
     """機能タイプに基づいて初期コンテンツを作成"""
@@ -470,30 +567,104 @@ def create_initial_content(feature_type):
     else:
         return {}
 
+def on_feature_content_saved(conn, feature_id, content, username=None, feature=None, new_feature=False):
+    """feature_content を保存する直前に呼び、検索インデックスや派生テーブルを更新"""
+    if feature is None:
+        feature = repository.get_feature(conn, feature_id)
+    if not feature:
+        return
+    if feature['type'] == 'diary':
+        # 日記のブロブは一部のエントリしか持たないので、書き込んだものだけを索引する
+        for entry_id, entry in diary.sync_from_content(conn, feature_id, content, username).items():
+            search.index_document(conn, feature_id, search.diary_document(entry_id, entry))
+        return
+    search.index_feature(conn, feature_id, content, feature['type'], feature['server_id'], new_feature)
+    if feature['type'] == 'survey':
+        surveys.sync_from_content(conn, feature_id, content, username)
+    elif feature['type'] == 'projects':
+        tasks.sync_from_content(conn, feature_id, content)
+    elif feature['type'] == 'calendar':
+        calendar_events.sync_from_content(conn, feature_id, content)
+    elif feature['type'] == 'budget':
+        budget.sync_from_content(conn, feature_id, content)
+    elif feature['type'] == 'inventory':
+        inventory.sync_from_content(conn, feature_id, content)
+    elif feature['type'] == 'wiki':
+        wiki.sync_from_content(conn, feature_id, content, username)
+
+# 専用テーブルに移した機能: 種類 → (テーブルから読む関数, content に戻す関数)
+TABLE_CONTENT = {
+    'projects': (tasks.tasks_by_feature, tasks.merge_into_content),
+    'calendar': (calendar_events.events_by_feature, calendar_events.merge_into_content),
+    'budget': (budget.content_by_feature, budget.merge_into_content),
+    'inventory': (inventory.items_by_feature, inventory.merge_into_content),
+    'wiki': (wiki.pages_by_feature, wiki.merge_into_content),
+}
+
 # APIエンドポイント
 @app.route('/')
 def index():
+    if Config.STATIC_PRECOMPRESS:
+        return static_site.index_response(request)
     return send_file('index.html')
 
+@app.route('/assets/<name>')
+def serve_asset(name):
+    """index.html から切り出したハッシュ付きアセットを配信"""
+    response = static_site.asset_response(name, request)
+    if response is None:
+        return jsonify({'error': 'File not found'}), 404
+    return response
+
 
 @app.route('/favicon.ico')
 def favicon():
     # Return 204 No Content for favicon requests to avoid noisy 404s in the browser console
     return ('', 204)
 
+def blob_response(key):
+    """ローカル以外の保存先のファイルを少しずつ読みながら返す"""
+    stream = blobs.open(key)
+    
+    def generate():
+        try:
+            while True:
+                chunk = stream.read(blobstore.COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            stream.close()
+    
+    mimetype = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+    return Response(generate(), mimetype=mimetype)
+
 @app.route('/files/<path:filename>')
 def serve_file(filename):
     """ファイルを安全に配信"""
     try:
-        return send_from_directory('files', filename)
+        if blobs.kind == 'local':
+            response = send_from_directory(blobs.root, filename)
+        else:
+            response = blob_response(filename)
     except Exception as e:
         return jsonify({'error': 'File not found'}), 404
+    # アップロードファイルのダウンロード数（ファイル名は "<ファイルID><拡張子>"）
+    directory, name = os.path.split(filename)
+    if directory == 'uploads' and response.status_code == 200:
+        bookkeeping.increment('UPDATE files SET download_count = download_count + ? WHERE id = ?',
+                              os.path.splitext(name)[0])
+    return response
 
 @app.route('/api.cgi', methods=['POST'])
 def api_handler():
     action = request.form.get('action')
     
     try:
+        denied = check_member_access(action)
+        if denied is not None:
+            return denied
+        
         if action == 'login':
             return handle_login()
         elif action == 'register':
@@ -522,6 +693,36 @@ def api_handler():
             return handle_create_task()
         elif action == 'updateTaskStatus':
             return handle_update_task_status()
+        elif action == 'listTasks':
+            return handle_list_tasks()
+        elif action == 'getEvents':
+            return handle_get_events()
+        elif action == 'getBudgetSummary':
+            return handle_get_budget_summary()
+        elif action == 'listInventory':
+            return handle_list_inventory()
+        elif action == 'importInventory':
+            return handle_import_inventory()
+        elif action == 'exportInventory':
+            return handle_export_inventory()
+        elif action == 'listFiles':
+            return handle_list_files()
+        elif action == 'listDiaryEntries':
+            return handle_list_diary_entries()
+        elif action == 'getDiaryEntry':
+            return handle_get_diary_entry()
+        elif action == 'saveDiaryEntry':
+            return handle_save_diary_entry()
+        elif action == 'deleteDiaryEntry':
+            return handle_delete_diary_entry()
+        elif action == 'listWikiPages':
+            return handle_list_wiki_pages()
+        elif action == 'getWikiPage':
+            return handle_get_wiki_page()
+        elif action == 'getWikiRevision':
+            return handle_get_wiki_revision()
+        elif action == 'saveWikiPage':
+            return handle_save_wiki_page()
         elif action == 'updateProfile':
             return handle_update_profile()
         elif action == 'uploadFile':
@@ -530,6 +731,18 @@ def api_handler():
             return handle_create_invite()
         elif action == 'acceptInvite':
             return handle_accept_invite()
+        elif action == 'createInvites':
+            return handle_create_invites()
+        elif action == 'importMembers':
+            return handle_import_members()
+        elif action == 'exportServer':
+            return handle_export_server()
+        elif action == 'importServer':
+            return handle_import_server()
+        elif action == 'createBackup':
+            return handle_create_backup()
+        elif action == 'listBackups':
+            return handle_list_backups()
         elif action == 'updateMemberRole':
             return handle_update_member_role()
         elif action == 'requestPasswordRecovery':
@@ -546,11 +759,22 @@ def api_handler():
             return handle_update_feature_content()
         elif action == 'getFeatureContent':
             return handle_get_feature_content()
+        elif action == 'search':
+            return handle_search()
+        elif action == 'getSurveyResults':
+            return handle_get_survey_results()
+        elif action == 'pollEvents':
+            return handle_poll_events()
+        elif action == 'presenceHeartbeat':
+            return handle_presence_heartbeat()
+        elif action == 'setTyping':
+            return handle_set_typing()
         else:
             return jsonify({'success': False, 'error': f'Unknown action: {action}'})
     
     except Exception as e:
         print(f"API Error: {e}")
+        profiling.record_error(e)
         return jsonify({'success': False, 'error': str(e)})
 
 def handle_login():
@@ -563,28 +787,31 @@ def handle_login():
     if not password:
         return jsonify({'success': False, 'error': 'パスワードを入力してください'})
     
+    if Config.LOGIN_RATE_LIMIT and not (login_ip_limiter.allow(request.remote_addr or '')
+                                        and login_user_limiter.allow(username)):
+        return jsonify({'success': False, 'error': RATE_LIMITED_ERROR})
+    
     conn = get_db_connection()
-    user = conn.execute(
-        'SELECT * FROM users WHERE username = ?', (username,)
-    ).fetchone()
+    user = repository.find_user(conn, username)
+    conn.close()
     
     if not user:
-        conn.close()
         return jsonify({'success': False, 'error': 'ユーザー名が見つかりません'})
     
     # パスワード確認
-    provided_hash = hash_password(password)
-    if user['password_hash'] != provided_hash:
-        conn.close()
+    matched, needs_rehash = passwords.verify_password(password, user['password_hash'])
+    if not matched:
         return jsonify({'success': False, 'error': 'パスワードが間違っています'})
     
-    # ログイン成功 - 最終ログイン時刻を更新
-    conn.execute(
-        'UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?',
-        (user['id'],)
-    )
-    conn.commit()
-    conn.close()
+    # 以前の形式や古いコストのハッシュは現在の設定で保存し直す
+    if needs_rehash:
+        new_hash = passwords.hash_password(password)
+        writes.run(lambda conn: repository.set_password_hash(conn, user['id'], new_hash,
+                                                             expected=user['password_hash']))
+    
+    # ログイン成功 - 最終ログイン時刻を更新（書き込みは後でまとめて行う）
+    bookkeeping.set_value('UPDATE users SET last_login = ? WHERE id = ?',
+                          user['id'], writebehind.utc_timestamp())
     
     session['user_id'] = user['id']
     session['username'] = user['username']
@@ -605,31 +832,27 @@ def handle_register():
     if len(password) < 6:
         return jsonify({'success': False, 'error': 'Password must be at least 6 characters'})
     
-    conn = get_db_connection()
-    
-    # Check if user exists
-    existing_user = conn.execute(
-        'SELECT id FROM users WHERE username = ?', (username,)
-    ).fetchone()
-    
-    if existing_user:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Username already exists'})
+    if Config.LOGIN_RATE_LIMIT and not login_ip_limiter.allow(request.remote_addr or ''):
+        return jsonify({'success': False, 'error': RATE_LIMITED_ERROR})
     
-    # Create new user
+    # ハッシュの計算は書き込みスレッドを止めないよう先に行う
+    password_hash = hash_password(password)
+
+    def register(conn):
+        # Check if user exists
+        if repository.username_exists(conn, username):
+            return 'Username already exists'
+        # Create new user
+        repository.create_user(conn, username, password_hash)
+        return None
+
     try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO users (username, password_hash)
-            VALUES (?, ?)
-        ''', (username, hash_password(password)))
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'success': True, 'data': {'message': 'User registered successfully'}})
+        error = writes.run(register)
     except Exception as e:
-        conn.close()
         return jsonify({'success': False, 'error': str(e)})
+    if error:
+        return jsonify({'success': False, 'error': error})
+    return jsonify({'success': True, 'data': {'message': 'User registered successfully'}})
 
 def handle_logout():
     session.clear()
@@ -657,25 +880,15 @@ def handle_add_server():
     server_id = f"server_{int(time.time() * 1000)}"
     invite_code = secrets.token_urlsafe(8)
     
-    conn = get_db_connection()
-    
-    # サーバーを作成
-    conn.execute('''
-        INSERT INTO servers (id, name, icon, owner_id, invite_code)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (server_id, name, icon, user['id'], invite_code))
-    
-    # オーナーをメンバーとして追加
-    conn.execute('''
-        INSERT INTO server_members (server_id, user_id, role)
-        VALUES (?, ?, 'owner')
-    ''', (server_id, user['id']))
-    
-    conn.commit()
-    conn.close()
-    
-    # デフォルト機能を作成
-    create_default_features(server_id)
+    def add_server(conn):
+        # サーバーを作成し、オーナーをメンバーとして追加
+        repository.create_server(conn, server_id, name, icon, user['id'], invite_code)
+
+        # デフォルト機能を作成
+        create_default_features(conn, server_id, user['username'])
+
+    writes.run(add_server)
+    memberships.invalidate_user(user['id'])
     
     # 最新の状態を返す
     state = get_user_state(user['id'])
@@ -693,36 +906,30 @@ def handle_add_subitem():
     if not feature_id or not name:
         return jsonify({'success': False, 'error': 'Feature ID and name are required'})
     
-    conn = get_db_connection()
-    content_row = conn.execute(
-        'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-    ).fetchone()
-    
-    if not content_row:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Feature not found'})
-    
-    content = json.loads(content_row['content'])
-    if 'subItems' not in content:
-        content['subItems'] = {}
-    
-    subitem_id = f"{item_type}_{int(time.time() * 1000)}"
-    content['subItems'][subitem_id] = {
-        'id': subitem_id,
-        'name': name,
-        'type': item_type,
-        'messages': [] if item_type == 'channel' else [],
-        'posts': [] if item_type == 'thread' else []
-    }
-    
-    conn.execute('''
-        UPDATE feature_content 
-        SET content = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE feature_id = ?
-    ''', (json.dumps(content), feature_id))
-    conn.commit()
-    conn.close()
-    
+    def add_subitem(conn):
+        content = repository.load_content(conn, feature_id)
+        if content is None:
+            return 'Feature not found'
+
+        if 'subItems' not in content:
+            content['subItems'] = {}
+
+        subitem_id = f"{item_type}_{int(time.time() * 1000)}"
+        content['subItems'][subitem_id] = {
+            'id': subitem_id,
+            'name': name,
+            'type': item_type,
+            'messages': [] if item_type == 'channel' else [],
+            'posts': [] if item_type == 'thread' else []
+        }
+
+        repository.store_content(conn, feature_id, content)
+        return None
+
+    error = writes.run(add_subitem)
+    if error:
+        return jsonify({'success': False, 'error': error})
+
     state = get_user_state(user['id'])
     return jsonify({'success': True, 'data': state})
 
@@ -737,36 +944,30 @@ def handle_add_whiteboard():
     if not feature_id or not name:
         return jsonify({'success': False, 'error': 'Feature ID and name are required'})
     
-    conn = get_db_connection()
-    content_row = conn.execute(
-        'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-    ).fetchone()
-    
-    if not content_row:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Feature not found'})
-    
-    content = json.loads(content_row['content'])
-    if 'boards' not in content:
-        content['boards'] = {}
-    
-    board_id = f"board_{int(time.time() * 1000)}"
-    content['boards'][board_id] = {
-        'id': board_id,
-        'name': name,
-        'elements': {},
-        'created_by': user['username'],
-        'created_at': time.time()
-    }
-    
-    conn.execute('''
-        UPDATE feature_content 
-        SET content = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE feature_id = ?
-    ''', (json.dumps(content), feature_id))
-    conn.commit()
-    conn.close()
-    
+    def add_whiteboard(conn):
+        content = repository.load_content(conn, feature_id)
+        if content is None:
+            return 'Feature not found'
+
+        if 'boards' not in content:
+            content['boards'] = {}
+
+        board_id = f"board_{int(time.time() * 1000)}"
+        content['boards'][board_id] = {
+            'id': board_id,
+            'name': name,
+            'elements': {},
+            'created_by': user['username'],
+            'created_at': time.time()
+        }
+
+        repository.store_content(conn, feature_id, content)
+        return None
+
+    error = writes.run(add_whiteboard)
+    if error:
+        return jsonify({'success': False, 'error': error})
+
     state = get_user_state(user['id'])
     return jsonify({'success': True, 'data': state})
 
@@ -782,34 +983,32 @@ def handle_save_whiteboard():
     if not feature_id or not board_id or not elements:
         return jsonify({'success': False, 'error': 'Feature ID, board ID, and elements are required'})
     
-    conn = get_db_connection()
-    content_row = conn.execute(
-        'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-    ).fetchone()
-    
-    if not content_row:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Feature not found'})
-    
-    content = json.loads(content_row['content'])
-    if 'boards' not in content or board_id not in content['boards']:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Board not found'})
-    
     try:
-        content['boards'][board_id]['elements'] = json.loads(elements)
-        content['boards'][board_id]['updated_at'] = time.time()
+        parsed_elements = serializer.loads(elements)
     except json.JSONDecodeError:
-        conn.close()
         return jsonify({'success': False, 'error': 'Invalid elements data'})
-    
-    conn.execute('''
-        UPDATE feature_content 
-        SET content = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE feature_id = ?
-    ''', (json.dumps(content), feature_id))
-    conn.commit()
-    conn.close()
+    updated_at = time.time()
+
+    def save_whiteboard(conn):
+        content = repository.load_content(conn, feature_id)
+        if content is None:
+            return 'Feature not found'
+
+        if 'boards' not in content or board_id not in content['boards']:
+            return 'Board not found'
+
+        content['boards'][board_id]['elements'] = parsed_elements
+        content['boards'][board_id]['updated_at'] = updated_at
+        repository.store_content(conn, feature_id, content)
+        return None
+
+    error = writes.run(save_whiteboard)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    # 要素は大きくなりうるので、受け取った側が必要なら取得し直す
+    publish_event(feature_id, 'whiteboard', {'boardId': board_id,
+                                             'updatedAt': updated_at,
+                                             'updatedBy': user['username']})
     
     state = get_user_state(user['id'])
     return jsonify({'success': True, 'data': state})
@@ -826,20 +1025,6 @@ def handle_post_message():
     if not feature_id or not sub_item_id or not content_text:
         return jsonify({'success': False, 'error': 'Feature ID, sub item ID, and content are required'})
     
-    conn = get_db_connection()
-    content_row = conn.execute(
-        'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-    ).fetchone()
-    
-    if not content_row:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Feature not found'})
-    
-    content = json.loads(content_row['content'])
-    if 'subItems' not in content or sub_item_id not in content['subItems']:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Sub item not found'})
-    
     message = {
         'id': str(uuid.uuid4()),
         'authorId': user['username'],
@@ -848,23 +1033,33 @@ def handle_post_message():
         'timestamp': int(time.time())
     }
     
-    subitem = content['subItems'][sub_item_id]
-    if subitem['type'] == 'channel':
-        if 'messages' not in subitem:
-            subitem['messages'] = []
-        subitem['messages'].append(message)
-    elif subitem['type'] == 'thread':
-        if 'posts' not in subitem:
-            subitem['posts'] = []
-        subitem['posts'].append(message)
-    
-    conn.execute('''
-        UPDATE feature_content 
-        SET content = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE feature_id = ?
-    ''', (json.dumps(content), feature_id))
-    conn.commit()
-    conn.close()
+    def post(conn):
+        content = repository.load_content(conn, feature_id)
+        if content is None:
+            return 'Feature not found'
+        
+        if 'subItems' not in content or sub_item_id not in content['subItems']:
+            return 'Sub item not found'
+        
+        subitem = content['subItems'][sub_item_id]
+        if subitem['type'] == 'channel':
+            if 'messages' not in subitem:
+                subitem['messages'] = []
+            subitem['messages'].append(message)
+        elif subitem['type'] == 'thread':
+            if 'posts' not in subitem:
+                subitem['posts'] = []
+            subitem['posts'].append(message)
+        
+        repository.store_content(conn, feature_id, content)
+        search.index_message(conn, feature_id, sub_item_id, subitem, message)
+        return None
+    
+    # 読み込みから書き込みまでを書き込みスレッドで行い、ほかの投稿とまとめてコミットする
+    error = writes.run(post)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    publish_event(feature_id, 'message', {'subItemId': sub_item_id, 'message': message})
     
     state = get_user_state(user['id'])
     return jsonify({'success': True, 'data': state})
@@ -882,43 +1077,38 @@ def handle_create_survey():
         return jsonify({'success': False, 'error': 'Feature ID, title, and questions are required'})
     
     try:
-        questions = json.loads(questions_json)
+        questions = serializer.loads(questions_json)
     except json.JSONDecodeError:
         return jsonify({'success': False, 'error': 'Invalid questions format'})
     
-    conn = get_db_connection()
-    content_row = conn.execute(
-        'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-    ).fetchone()
-    
-    if not content_row:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Feature not found'})
-    
-    content = json.loads(content_row['content'])
-    if 'surveys' not in content:
-        content['surveys'] = {}
-    if 'responses' not in content:
-        content['responses'] = {}
-    
-    survey_id = f"survey_{int(time.time() * 1000)}"
-    content['surveys'][survey_id] = {
-        'id': survey_id,
-        'title': title,
-        'questions': questions,
-        'created_by': user['username'],
-        'created_at': time.time(),
-        'status': 'active'
-    }
-    content['responses'][survey_id] = {}
-    
-    conn.execute('''
-        UPDATE feature_content 
-        SET content = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE feature_id = ?
-    ''', (json.dumps(content), feature_id))
-    conn.commit()
-    conn.close()
+    def create_survey(conn):
+        content = repository.load_content(conn, feature_id)
+        if content is None:
+            return 'Feature not found'
+
+        if 'surveys' not in content:
+            content['surveys'] = {}
+        if 'responses' not in content:
+            content['responses'] = {}
+
+        survey_id = f"survey_{int(time.time() * 1000)}"
+        content['surveys'][survey_id] = {
+            'id': survey_id,
+            'title': title,
+            'questions': questions,
+            'created_by': user['username'],
+            'created_at': time.time(),
+            'status': 'active'
+        }
+        content['responses'][survey_id] = {}
+
+        on_feature_content_saved(conn, feature_id, content)
+        repository.store_content(conn, feature_id, content)
+        return None
+
+    error = writes.run(create_survey)
+    if error:
+        return jsonify({'success': False, 'error': error})
     
     state = get_user_state(user['id'])
     return jsonify({'success': True, 'data': state})
@@ -936,38 +1126,27 @@ def handle_submit_survey_response():
         return jsonify({'success': False, 'error': 'Feature ID, survey ID, and responses are required'})
     
     try:
-        responses = json.loads(responses_json)
+        responses = serializer.loads(responses_json)
     except json.JSONDecodeError:
         return jsonify({'success': False, 'error': 'Invalid responses format'})
     
-    conn = get_db_connection()
-    content_row = conn.execute(
-        'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-    ).fetchone()
-    
-    if not content_row:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Feature not found'})
-    
-    content = json.loads(content_row['content'])
-    if 'responses' not in content:
-        content['responses'] = {}
-    if survey_id not in content['responses']:
-        content['responses'][survey_id] = {}
-    
-    content['responses'][survey_id][user['username']] = {
-        'responses': responses,
-        'user': user['username'],
-        'submitted_at': time.time()
-    }
-    
-    conn.execute('''
-        UPDATE feature_content 
-        SET content = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE feature_id = ?
-    ''', (json.dumps(content), feature_id))
-    conn.commit()
-    conn.close()
+    def submit_response(conn):
+        content = repository.load_content(conn, feature_id)
+        if content is None:
+            return 'Feature not found'
+
+        survey = (content.get('surveys') or {}).get(survey_id)
+        if not survey:
+            return 'Survey not found'
+
+        # 回答は専用テーブルに保存し、ブロブは書き換えない
+        surveys.record_response(conn, feature_id, survey_id, survey, user['username'], responses,
+                                user_id=user['id'])
+        return None
+
+    error = writes.run(submit_response)
+    if error:
+        return jsonify({'success': False, 'error': error})
     
     state = get_user_state(user['id'])
     return jsonify({'success': True, 'data': state})
@@ -984,36 +1163,30 @@ def handle_create_project():
     if not feature_id or not name:
         return jsonify({'success': False, 'error': 'Feature ID and name are required'})
     
-    conn = get_db_connection()
-    content_row = conn.execute(
-        'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-    ).fetchone()
-    
-    if not content_row:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Feature not found'})
-    
-    content = json.loads(content_row['content'])
-    if 'projects' not in content:
-        content['projects'] = {}
-    
-    project_id = f"project_{int(time.time() * 1000)}"
-    content['projects'][project_id] = {
-        'id': project_id,
-        'name': name,
-        'description': description,
-        'status': 'active',
-        'created_by': user['username'],
-        'created_at': time.time()
-    }
-    
-    conn.execute('''
-        UPDATE feature_content 
-        SET content = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE feature_id = ?
-    ''', (json.dumps(content), feature_id))
-    conn.commit()
-    conn.close()
+    def create_project(conn):
+        content = repository.load_content(conn, feature_id)
+        if content is None:
+            return 'Feature not found'
+
+        if 'projects' not in content:
+            content['projects'] = {}
+
+        project_id = f"project_{int(time.time() * 1000)}"
+        content['projects'][project_id] = {
+            'id': project_id,
+            'name': name,
+            'description': description,
+            'status': 'active',
+            'created_by': user['username'],
+            'created_at': time.time()
+        }
+
+        repository.store_content(conn, feature_id, content)
+        return None
+
+    error = writes.run(create_project)
+    if error:
+        return jsonify({'success': False, 'error': error})
     
     state = get_user_state(user['id'])
     return jsonify({'success': True, 'data': state})
@@ -1033,37 +1206,18 @@ def handle_create_task():
         return jsonify({'success': False, 'error': 'Feature ID, project ID, and title are required'})
     
     conn = get_db_connection()
-    content_row = conn.execute(
-        'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-    ).fetchone()
+    feature = repository.get_feature(conn, feature_id)
+    conn.close()
     
-    if not content_row:
-        conn.close()
+    if not feature or feature['type'] != 'projects':
         return jsonify({'success': False, 'error': 'Feature not found'})
     
-    content = json.loads(content_row['content'])
-    if 'tasks' not in content:
-        content['tasks'] = {}
-    
-    task_id = f"task_{int(time.time() * 1000)}"
-    content['tasks'][task_id] = {
-        'id': task_id,
-        'project_id': project_id,
-        'title': title,
-        'description': description,
-        'priority': priority,
-        'status': 'todo',
-        'created_by': user['username'],
-        'created_at': time.time()
-    }
-    
-    conn.execute('''
-        UPDATE feature_content 
-        SET content = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE feature_id = ?
-    ''', (json.dumps(content), feature_id))
-    conn.commit()
-    conn.close()
+    # タスクは専用テーブルに保存し、ブロブは書き換えない
+    assigned_to = request.form.get('assignedTo')
+    due_date = request.form.get('dueDate')
+    writes.run(lambda conn: tasks.create_task(conn, feature_id, project_id, title, description, priority,
+                                              created_by=user['username'],
+                                              assigned_to=assigned_to, due_date=due_date))
     
     state = get_user_state(user['id'])
     return jsonify({'success': True, 'data': state})
@@ -1080,50 +1234,451 @@ def handle_update_task_status():
     if not feature_id or not task_id or not status:
         return jsonify({'success': False, 'error': 'Feature ID, task ID, and status are required'})
     
-    conn = get_db_connection()
-    content_row = conn.execute(
-        'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-    ).fetchone()
+    if not writes.run(lambda conn: tasks.update_status(conn, feature_id, task_id, status)):
+        return jsonify({'success': False, 'error': 'Task not found'})
     
-    if not content_row:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Feature not found'})
+    state = get_user_state(user['id'])
+    return jsonify({'success': True, 'data': state})
+
+def handle_list_tasks():
+    """タスクを条件・並び順・ページ指定で取得（ボードの列ごとの件数付き）"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
     
-    content = json.loads(content_row['content'])
-    if 'tasks' not in content or task_id not in content['tasks']:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Task not found'})
+    feature_id = request.form.get('featureId')
+    if not feature_id:
+        return jsonify({'success': False, 'error': 'Feature ID is required'})
     
-    content['tasks'][task_id]['status'] = status
-    content['tasks'][task_id]['updated_at'] = time.time()
+    statuses = [s for s in (request.form.get('status') or '').split(',') if s]
+    try:
+        page = max(1, int(request.form.get('page', 1)))
+        page_size = max(1, min(int(request.form.get('pageSize', tasks.DEFAULT_PAGE_SIZE)),
+                               tasks.MAX_PAGE_SIZE))
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'error': 'ページ指定が不正です'})
     
-    conn.execute('''
-        UPDATE feature_content 
-        SET content = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE feature_id = ?
-    ''', (json.dumps(content), feature_id))
-    conn.commit()
+    conn = get_db_connection()
+    items, total, counts = tasks.list_tasks(
+        conn, feature_id,
+        project_id=request.form.get('projectId'),
+        statuses=statuses or None,
+        priority=request.form.get('priority'),
+        assigned_to=request.form.get('assignedTo'),
+        created_by=request.form.get('createdBy'),
+        sort=request.form.get('sort', 'created_at'),
+        descending=request.form.get('order', 'asc').lower() == 'desc',
+        limit=page_size, offset=(page - 1) * page_size
+    )
     conn.close()
     
-    state = get_user_state(user['id'])
-    return jsonify({'success': True, 'data': state})
+    return jsonify({'success': True, 'data': {
+        'tasks': items,
+        'total': total,
+        'counts': counts,
+        'page': page,
+        'pageSize': page_size
+    }})
 
-def handle_update_profile():
+def handle_get_events():
+    """表示期間（from〜to）と重なるイベントを取得。繰り返しイベントは展開して返す"""
     user = get_current_user()
     if not user:
         return jsonify({'success': False, 'error': 'Not authenticated'})
     
+    feature_id = request.form.get('featureId')
+    range_from = request.form.get('from')
+    range_to = request.form.get('to')
+    if not feature_id or not range_from or not range_to:
+        return jsonify({'success': False, 'error': 'Feature ID, from, and to are required'})
+    
+    try:
+        start = calendar_events.parse_datetime(range_from)
+        end = calendar_events.parse_datetime(range_to, end_of_day=True)
+    except ValueError:
+        return jsonify({'success': False, 'error': '日付の形式が不正です'})
+    if end < start:
+        return jsonify({'success': False, 'error': '終了日は開始日以降を指定してください'})
+    if (end - start).days > calendar_events.MAX_RANGE_DAYS:
+        return jsonify({'success': False,
+                        'error': f'期間は{calendar_events.MAX_RANGE_DAYS}日以内で指定してください'})
+    
     conn = get_db_connection()
+    events, truncated = calendar_events.get_events(conn, feature_id, start, end)
+    conn.close()
     
-    # 更新可能なフィールド
-    fields = {}
-    if request.form.get('nickname'):
-        fields['nickname'] = request.form.get('nickname')
-    if request.form.get('email'):
-        fields['email'] = request.form.get('email')
-    if request.form.get('admission_year'):
-        try:
-            fields['admission_year'] = int(request.form.get('admission_year'))
+    return jsonify({'success': True, 'data': {
+        'events': events,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'truncated': truncated
+    }})
+
+def handle_get_budget_summary():
+    """口座残高と月別・年度別の収支（集計済みの値）を取得"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    if not feature_id:
+        return jsonify({'success': False, 'error': 'Feature ID is required'})
+    try:
+        year = int(request.form['fiscalYear']) if request.form.get('fiscalYear') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'fiscalYear は数字で指定してください'})
+    
+    conn = get_db_connection()
+    summary = budget.get_summary(conn, feature_id, year, request.form.get('accountId'))
+    conn.close()
+    return jsonify({'success': True, 'data': summary})
+
+def handle_list_inventory():
+    """物品をカテゴリ・保管場所・状態で絞り込み、並べ替え・ページ指定で取得"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    if not feature_id:
+        return jsonify({'success': False, 'error': 'Feature ID is required'})
+    
+    statuses = [s for s in (request.form.get('status') or '').split(',') if s]
+    try:
+        page = max(1, int(request.form.get('page', 1)))
+        page_size = max(1, min(int(request.form.get('pageSize', inventory.DEFAULT_PAGE_SIZE)),
+                               inventory.MAX_PAGE_SIZE))
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'error': 'ページ指定が不正です'})
+    
+    conn = get_db_connection()
+    items, total, categories, locations = inventory.list_items(
+        conn, feature_id,
+        category=request.form.get('category'),
+        location=request.form.get('location'),
+        statuses=statuses or None,
+        query=(request.form.get('query') or '').strip() or None,
+        low_stock=request.form.get('lowStock', 'false').lower() == 'true',
+        sort=request.form.get('sort', 'name'),
+        descending=request.form.get('order', 'asc').lower() == 'desc',
+        limit=page_size, offset=(page - 1) * page_size
+    )
+    conn.close()
+    
+    return jsonify({'success': True, 'data': {
+        'items': items,
+        'total': total,
+        'categoryCounts': categories,
+        'locationCounts': locations,
+        'page': page,
+        'pageSize': page_size
+    }})
+
+def handle_import_inventory():
+    """CSV ファイル（UTF-8、BOM 可）から物品をまとめて取り込む"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    if not feature_id:
+        return jsonify({'success': False, 'error': 'Feature ID is required'})
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'success': False, 'error': 'ファイルが選択されていません'})
+    
+    conn = get_db_connection()
+    feature = repository.get_feature(conn, feature_id)
+    conn.close()
+    if not feature or feature['type'] != 'inventory':
+        return jsonify({'success': False, 'error': 'Feature not found'})
+    
+    stream = io.TextIOWrapper(request.files['file'].stream, encoding='utf-8-sig', newline='')
+    try:
+        # CSV を読み終えてから IMPORT_BATCH_SIZE 件ずつ書き込みジョブに渡す
+        imported, errors = inventory.import_csv(writes.run, feature_id, stream, user['username'])
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'error': f'CSV の読み込みに失敗しました: {str(e)}'})
+    
+    return jsonify({'success': True, 'data': {'imported': imported, 'errors': errors}})
+
+def handle_export_inventory():
+    """物品を CSV でストリーム出力する"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    if not feature_id:
+        return jsonify({'success': False, 'error': 'Feature ID is required'})
+    
+    statuses = [s for s in (request.form.get('status') or '').split(',') if s]
+    conn = get_db_connection()
+    
+    def generate():
+        try:
+            yield from inventory.export_csv(
+                conn, feature_id,
+                category=request.form.get('category'),
+                location=request.form.get('location'),
+                statuses=statuses or None,
+                query=(request.form.get('query') or '').strip() or None
+            )
+        finally:
+            conn.close()
+    
+    return Response(stream_with_context(generate()), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename="inventory_{time.strftime("%Y%m%d")}.csv"'
+    })
+
+def handle_list_files():
+    """ファイル一覧（新しい順、cursor で続きを取得）"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    try:
+        limit = int(request.form.get('limit', file_index.DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'ページ指定が不正です'})
+    
+    conn = get_db_connection()
+    try:
+        files, next_cursor = file_index.list_files(
+            conn, user['id'],
+            server_id=request.form.get('serverId'),
+            feature_id=request.form.get('featureId'),
+            mime_prefix=request.form.get('mimePrefix'),
+            cursor=request.form.get('cursor'),
+            limit=limit
+        )
+    except file_index.CursorError:
+        return jsonify({'success': False, 'error': 'カーソルが不正です'})
+    finally:
+        conn.close()
+    return jsonify({'success': True, 'data': {'files': files, 'nextCursor': next_cursor}})
+
+def handle_list_wiki_pages():
+    """Wiki のページ一覧（本文なし）"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    if not feature_id:
+        return jsonify({'success': False, 'error': 'Feature ID is required'})
+    
+    conn = get_db_connection()
+    pages = wiki.list_pages(conn, feature_id)
+    conn.close()
+    return jsonify({'success': True, 'data': {'pages': pages}})
+
+def handle_get_wiki_page():
+    """Wiki のページ1件（本文と版の一覧付き）"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    page_id = request.form.get('pageId')
+    if not feature_id or not page_id:
+        return jsonify({'success': False, 'error': 'Feature ID and page ID are required'})
+    
+    conn = get_db_connection()
+    page = wiki.get_page(conn, feature_id, page_id)
+    conn.close()
+    if not page:
+        return jsonify({'success': False, 'error': 'Page not found'})
+    return jsonify({'success': True, 'data': page})
+
+def handle_get_wiki_revision():
+    """Wiki のページの過去の版"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    page_id = request.form.get('pageId')
+    if not feature_id or not page_id:
+        return jsonify({'success': False, 'error': 'Feature ID and page ID are required'})
+    try:
+        revision = int(request.form.get('revision', ''))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'revision は数字で指定してください'})
+    
+    conn = get_db_connection()
+    result = wiki.get_revision(conn, feature_id, page_id, revision)
+    conn.close()
+    if not result:
+        return jsonify({'success': False, 'error': 'Revision not found'})
+    return jsonify({'success': True, 'data': result})
+
+def handle_save_wiki_page():
+    """Wiki のページ1件だけを保存する（pageId が無ければ新規作成）"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    title = (request.form.get('title') or '').strip()
+    if not feature_id or not title:
+        return jsonify({'success': False, 'error': 'Feature ID and title are required'})
+    
+    page_id = request.form.get('pageId') or str(int(time.time() * 1000))
+    body = request.form.get('content', '')
+    tags = request.form.get('tags')
+    
+    def save_page(conn):
+        feature = repository.get_feature(conn, feature_id)
+        if not feature or feature['type'] != 'wiki':
+            return None
+
+        existing = wiki.get_page(conn, feature_id, page_id)
+        page = {k: v for k, v in (existing or {}).items() if k not in ('revision', 'revisions')}
+        page.update({
+            'id': page_id,
+            'title': title,
+            'content': body,
+            'updated_at': time.time()
+        })
+        if not existing:
+            page.update({'author': user['username'], 'created_at': time.time()})
+        if tags is not None:
+            page['tags'] = [t.strip() for t in tags.split(',') if t.strip()]
+
+        wiki.save_page(conn, feature_id, page_id, page, user['username'])
+        search.index_document(conn, feature_id, search.wiki_document(page_id, page))
+        return wiki.get_page(conn, feature_id, page_id)
+    
+    page = writes.run(save_page)
+    if page is None:
+        return jsonify({'success': False, 'error': 'Feature not found'})
+    return jsonify({'success': True, 'data': page})
+
+def handle_list_diary_entries():
+    """日記の1か月分のエントリと、エントリのある月の一覧"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    if not feature_id:
+        return jsonify({'success': False, 'error': 'Feature ID is required'})
+    month = request.form.get('month') or time.strftime('%Y-%m')
+    author = request.form.get('author') or None
+    try:
+        diary.month_range(month)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'month は YYYY-MM で指定してください'})
+    
+    conn = get_db_connection()
+    entries = diary.list_month(conn, feature_id, month, user['username'], author)
+    months = diary.month_counts(conn, feature_id, user['username'], author)
+    conn.close()
+    return jsonify({'success': True, 'data': {'month': month, 'entries': entries, 'months': months}})
+
+def handle_get_diary_entry():
+    """日記のエントリ1件"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    entry_id = request.form.get('entryId')
+    if not feature_id or not entry_id:
+        return jsonify({'success': False, 'error': 'Feature ID and entry ID are required'})
+    
+    conn = get_db_connection()
+    entry = diary.get_entry(conn, feature_id, entry_id, user['username'])
+    conn.close()
+    if not entry:
+        return jsonify({'success': False, 'error': 'Entry not found'})
+    return jsonify({'success': True, 'data': entry})
+
+def handle_save_diary_entry():
+    """日記のエントリ1件だけを保存する（entryId が無ければ新規作成、既存は本人のみ更新可）"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    title = (request.form.get('title') or '').strip()
+    if not feature_id or not title:
+        return jsonify({'success': False, 'error': 'Feature ID and title are required'})
+    
+    entry_id = request.form.get('entryId')
+    form = request.form
+
+    def save_entry(conn):
+        feature = repository.get_feature(conn, feature_id)
+        if not feature or feature['type'] != 'diary':
+            return 'Feature not found', None
+
+        existing = diary.get_entry(conn, feature_id, entry_id, user['username']) if entry_id else None
+        if existing and existing['author'] != user['username']:
+            return '他のユーザーの日記は編集できません', None
+        entry = existing or {
+            'id': entry_id or str(int(time.time() * 1000)),
+            'author': user['username'],
+            'created_at': time.time()
+        }
+        entry.update({
+            'title': title,
+            'content': form.get('content', ''),
+            'category': form.get('category') or entry.get('category') or '一般',
+            'mood': form.get('mood') or entry.get('mood'),
+            'private': form.get('private') in ('true', '1', 'on')
+        })
+        if form.get('tags') is not None:
+            entry['tags'] = [t.strip() for t in form['tags'].split(',') if t.strip()]
+        if existing:
+            entry['updated_at'] = time.time()
+
+        if not diary.save_entry(conn, feature_id, entry['id'], entry, user['username']):
+            # 見えない他人の非公開エントリと同じ ID を指定された
+            return '他のユーザーの日記は編集できません', None
+        search.index_document(conn, feature_id, search.diary_document(entry['id'], entry))
+        return None, entry
+
+    error, entry = writes.run(save_entry)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    return jsonify({'success': True, 'data': entry})
+
+def handle_delete_diary_entry():
+    """自分の日記のエントリを削除する"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    entry_id = request.form.get('entryId')
+    if not feature_id or not entry_id:
+        return jsonify({'success': False, 'error': 'Feature ID and entry ID are required'})
+    
+    def delete_entry(conn):
+        deleted = diary.delete_entry(conn, feature_id, entry_id, user['username'])
+        if deleted:
+            search.remove_document(conn, feature_id, 'diary', entry_id)
+        return deleted
+
+    if not writes.run(delete_entry):
+        return jsonify({'success': False, 'error': 'Entry not found'})
+    return jsonify({'success': True, 'data': {'entryId': entry_id}})
+
+def handle_update_profile():
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    # 更新可能なフィールド
+    fields = {}
+    if request.form.get('nickname'):
+        fields['nickname'] = request.form.get('nickname')
+    if request.form.get('email'):
+        fields['email'] = request.form.get('email')
+    if request.form.get('admission_year'):
+        try:
+            fields['admission_year'] = int(request.form.get('admission_year'))
         except (ValueError, TypeError):
             return jsonify({'success': False, 'error': '入学年は数字で入力してください'})
     if request.form.get('graduation_year'):
@@ -1147,20 +1702,9 @@ def handle_update_profile():
         fields['timezone'] = request.form.get('timezone')
     
     if not fields:
-        conn.close()
         return jsonify({'success': False, 'error': '更新するフィールドがありません'})
     
-    # SQLの更新クエリを構築
-    set_clause = ', '.join([f"{k} = ?" for k in fields.keys()])
-    values = list(fields.values()) + [user['id']]
-    
-    conn.execute(f'''
-        UPDATE users 
-        SET {set_clause}, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', values)
-    conn.commit()
-    conn.close()
+    writes.run(lambda conn: repository.update_profile(conn, user['id'], fields))
     
     state = get_user_state(user['id'])
     return jsonify({'success': True, 'data': state})
@@ -1192,19 +1736,12 @@ def handle_upload_file():
     
     # ファイルを保存
     file_path = os.path.join('files', 'uploads', safe_filename)
-    file.save(file_path)
+    file_size = blobs.put(f'uploads/{safe_filename}', file.stream)
     
     # データベースに記録
-    conn = get_db_connection()
-    conn.execute('''
-        INSERT INTO files (id, filename, original_filename, file_path, file_size, 
-                          mime_type, upload_by, server_id, feature_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (file_id, safe_filename, file.filename, file_path, 
-          os.path.getsize(file_path), file.content_type or 'application/octet-stream',
-          user['id'], server_id, feature_id))
-    conn.commit()
-    conn.close()
+    writes.run(lambda conn: repository.add_file(conn, file_id, safe_filename, file.filename, file_path, file_size,
+                                                file.content_type or 'application/octet-stream', user['id'],
+                                                server_id, feature_id))
     # 返却データに保存後の安全なファイル名とURLを含める
     stored_filename = safe_filename
     file_url = f"/files/uploads/{stored_filename}"
@@ -1212,7 +1749,7 @@ def handle_upload_file():
         'fileId': file_id,
         'originalFilename': file.filename,
         'storedFilename': stored_filename,
-        'fileSize': os.path.getsize(file_path),
+        'fileSize': file_size,
         'url': file_url
     }})
 
@@ -1225,16 +1762,8 @@ def handle_create_invite():
     if not server_id:
         return jsonify({'success': False, 'error': 'サーバーIDが必要です'})
     
-    conn = get_db_connection()
-    
     # サーバーの管理者権限を確認
-    membership = conn.execute('''
-        SELECT role FROM server_members 
-        WHERE server_id = ? AND user_id = ?
-    ''', (server_id, user['id'])).fetchone()
-    
-    if not membership or membership['role'] not in ['owner', 'admin']:
-        conn.close()
+    if memberships.role(user['id'], server_id) not in membership.ADMIN_ROLES:
         return jsonify({'success': False, 'error': '招待する権限がありません'})
     
     # 招待コードを生成
@@ -1244,12 +1773,8 @@ def handle_create_invite():
     # 有効期限（24時間後）
     expires_at = datetime.utcnow() + timedelta(hours=24)
     
-    conn.execute('''
-        INSERT INTO server_invites (id, server_id, inviter_id, invite_code, expires_at)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (invite_id, server_id, user['id'], invite_code, expires_at))
-    conn.commit()
-    conn.close()
+    writes.run(lambda conn: repository.create_invites(conn, server_id, user['id'], [(invite_id, invite_code)],
+                                                      expires_at))
     
     return jsonify({'success': True, 'data': {
         'inviteId': invite_id,
@@ -1266,46 +1791,155 @@ def handle_accept_invite():
     if not invite_code:
         return jsonify({'success': False, 'error': '招待コードが必要です'})
     
-    conn = get_db_connection()
+    def accept_invite(conn):
+        # 招待コードを確認
+        invite = repository.find_valid_invite(conn, invite_code)
+        if not invite:
+            return '無効または期限切れの招待コードです'
+
+        # 既にメンバーかどうか確認
+        if repository.is_member(conn, invite['server_id'], user['id']):
+            return '既にこのサーバーのメンバーです'
+
+        # メンバーとして追加し、招待を使用済みにマーク
+        repository.add_member(conn, invite['server_id'], user['id'], 'member', invite['inviter_id'])
+        repository.mark_invite_used(conn, invite['id'], user['id'])
+        return None
+
+    error = writes.run(accept_invite)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    memberships.invalidate_user(user['id'])
     
-    # 招待コードを確認
-    invite = conn.execute('''
-        SELECT * FROM server_invites 
-        WHERE invite_code = ? AND used_at IS NULL AND expires_at > CURRENT_TIMESTAMP
-    ''', (invite_code,)).fetchone()
+    state = get_user_state(user['id'])
+    return jsonify({'success': True, 'data': state})
+
+def handle_create_invites():
+    """招待コードを1回でまとめて発行する"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
     
-    if not invite:
-        conn.close()
-        return jsonify({'success': False, 'error': '無効または期限切れの招待コードです'})
+    server_id = request.form.get('serverId')
+    if not server_id:
+        return jsonify({'success': False, 'error': 'サーバーIDが必要です'})
+    if memberships.role(user['id'], server_id) not in membership.ADMIN_ROLES:
+        return jsonify({'success': False, 'error': '招待する権限がありません'})
+    try:
+        count = int(request.form.get('count', 1))
+        hours = int(request.form.get('hours', 24))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'count と hours は数字で指定してください'})
     
-    # 既にメンバーかどうか確認
-    existing_member = conn.execute('''
-        SELECT id FROM server_members 
-        WHERE server_id = ? AND user_id = ?
-    ''', (invite['server_id'], user['id'])).fetchone()
+    try:
+        invites = writes.run(lambda conn: onboarding.create_invites(conn, server_id, user['id'], count, hours))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
+    return jsonify({'success': True, 'data': {'invites': invites}})
+
+def handle_import_members():
+    """ユーザー名の CSV（UTF-8、BOM 可）から既存ユーザーをメンバーとしてまとめて追加する"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
     
-    if existing_member:
-        conn.close()
-        return jsonify({'success': False, 'error': '既にこのサーバーのメンバーです'})
+    server_id = request.form.get('serverId')
+    if not server_id:
+        return jsonify({'success': False, 'error': 'サーバーIDが必要です'})
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'success': False, 'error': 'ファイルが選択されていません'})
+    if memberships.role(user['id'], server_id) not in membership.ADMIN_ROLES:
+        return jsonify({'success': False, 'error': 'メンバーを追加する権限がありません'})
     
-    # メンバーとして追加
-    conn.execute('''
-        INSERT INTO server_members (server_id, user_id, role, invited_by)
-        VALUES (?, ?, 'member', ?)
-    ''', (invite['server_id'], user['id'], invite['inviter_id']))
+    stream = io.TextIOWrapper(request.files['file'].stream, encoding='utf-8-sig', newline='')
+    try:
+        # CSV を読み終えてから IMPORT_BATCH_SIZE 件ずつ書き込みジョブに渡す
+        results, added_user_ids = onboarding.import_members(writes.run, server_id, user['id'], stream)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'error': f'CSV の読み込みに失敗しました: {str(e)}'})
+    for user_id in added_user_ids:
+        memberships.invalidate_user(user_id)
+    
+    return jsonify({'success': True, 'data': {
+        'results': results,
+        'counts': onboarding.summarize(results)
+    }})
+
+def handle_export_server():
+    """サーバーの行とファイルを tar.gz でストリーム出力する（所有者・管理者のみ）"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
     
-    # 招待を使用済みにマーク
-    conn.execute('''
-        UPDATE server_invites 
-        SET used_at = CURRENT_TIMESTAMP, used_by = ?, current_uses = current_uses + 1
-        WHERE id = ?
-    ''', (user['id'], invite['id']))
+    server_id = request.form.get('serverId')
+    if not server_id:
+        return jsonify({'success': False, 'error': 'サーバーIDが必要です'})
+    if memberships.role(user['id'], server_id) not in membership.ADMIN_ROLES:
+        return jsonify({'success': False, 'error': 'サーバーをエクスポートする権限がありません'})
     
-    conn.commit()
-    conn.close()
+    conn = get_db_connection()
     
-    state = get_user_state(user['id'])
-    return jsonify({'success': True, 'data': state})
+    def generate():
+        try:
+            yield from server_archive.export_server(conn, server_id, blobs)
+        finally:
+            conn.close()
+    
+    return Response(stream_with_context(generate()), mimetype='application/gzip', headers={
+        'Content-Disposition': f'attachment; filename="{server_id}_{time.strftime("%Y%m%d")}.tar.gz"'
+    })
+
+def handle_import_server():
+    """exportServer のアーカイブを新しいサーバーとして取り込む（呼び出したユーザーが所有者になる）"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'success': False, 'error': 'ファイルが選択されていません'})
+    
+    stream = request.files['file'].stream
+    try:
+        # このインスタンスにいないユーザーは作成せず、skippedUsers で返す。
+        # 展開とファイルの書き込みはジョブの外、行は BATCH_SIZE 件ずつのジョブで入れ、失敗したら消す
+        summary = server_archive.import_server(writes.run, stream, blobs, owner_id=user['id'],
+                                               on_content=on_feature_content_saved)
+    except (server_archive.ArchiveError,) + database.Error as e:
+        return jsonify({'success': False, 'error': f'インポートに失敗しました: {str(e)}'})
+    for user_id in summary.pop('userIds'):
+        memberships.invalidate_user(user_id)
+    
+    return jsonify({'success': True, 'data': summary})
+
+def is_backup_admin(user):
+    return user['username'] in Config.BACKUP_ADMINS
+
+def handle_create_backup():
+    """稼働中のデータベースのバックアップを作成する（BACKUP_ADMINS のユーザーのみ）"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    if not is_backup_admin(user):
+        return jsonify({'success': False, 'error': 'バックアップを作成する権限がありません'})
+    
+    method = request.form.get('method', 'backup')
+    compression = request.form.get('compression') or None
+    try:
+        result = backup.create_backup(method=method, compression=compression)
+    except backup.BackupError as e:
+        return jsonify({'success': False, 'error': str(e)})
+    
+    result.pop('path')
+    return jsonify({'success': True, 'data': result})
+
+def handle_list_backups():
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    if not is_backup_admin(user):
+        return jsonify({'success': False, 'error': 'バックアップを参照する権限がありません'})
+    
+    backups = [{key: value for key, value in b.items() if key != 'path'} for b in backup.list_backups()]
+    return jsonify({'success': True, 'data': {'backups': backups}})
 
 def handle_update_member_role():
     user = get_current_user()
@@ -1322,26 +1956,18 @@ def handle_update_member_role():
     if new_role not in ['member', 'moderator', 'admin']:
         return jsonify({'success': False, 'error': '無効なロールです'})
     
-    conn = get_db_connection()
+    try:
+        target_user_id = int(target_user_id)
+    except ValueError:
+        return jsonify({'success': False, 'error': '無効なユーザーIDです'})
     
     # 管理者権限を確認
-    admin_role = conn.execute('''
-        SELECT role FROM server_members 
-        WHERE server_id = ? AND user_id = ?
-    ''', (server_id, user['id'])).fetchone()
-    
-    if not admin_role or admin_role['role'] not in ['owner', 'admin']:
-        conn.close()
+    if memberships.role(user['id'], server_id) not in membership.ADMIN_ROLES:
         return jsonify({'success': False, 'error': 'ロールを変更する権限がありません'})
     
     # ロールを更新
-    conn.execute('''
-        UPDATE server_members 
-        SET role = ? 
-        WHERE server_id = ? AND user_id = ?
-    ''', (new_role, server_id, target_user_id))
-    conn.commit()
-    conn.close()
+    writes.run(lambda conn: repository.set_member_role(conn, server_id, target_user_id, new_role))
+    memberships.invalidate_user(target_user_id)
     
     return jsonify({'success': True, 'data': {'message': 'ロールを更新しました'}})
 
@@ -1352,36 +1978,28 @@ def handle_request_password_recovery():
     if not username or not partner_username:
         return jsonify({'success': False, 'error': 'ユーザー名とパートナーのユーザー名が必要です'})
     
-    conn = get_db_connection()
-    
-    # ユーザーを確認
-    user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-    partner = conn.execute('SELECT * FROM users WHERE username = ?', (partner_username,)).fetchone()
-    
-    if not user or not partner:
-        conn.close()
-        return jsonify({'success': False, 'error': 'ユーザーが見つかりません'})
-    
-    # 既存のリクエストを確認
-    existing = conn.execute('''
-        SELECT * FROM password_recovery 
-        WHERE user_id = ? AND recovery_partner_id = ? AND status = 'pending'
-    ''', (user['id'], partner['id'])).fetchone()
-    
-    if existing:
-        conn.close()
-        return jsonify({'success': False, 'error': '既にパスワード復旧リクエストが存在します'})
-    
     # 復旧トークンを生成
     recovery_token = secrets.token_urlsafe(32)
     expires_at = datetime.utcnow() + timedelta(hours=24)
     
-    conn.execute('''
-        INSERT INTO password_recovery (user_id, recovery_partner_id, initiated_by, recovery_token, expires_at)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user['id'], partner['id'], user['id'], recovery_token, expires_at))
-    conn.commit()
-    conn.close()
+    def request_recovery(conn):
+        # ユーザーを確認
+        user = repository.find_user(conn, username)
+        partner = repository.find_user(conn, partner_username)
+
+        if not user or not partner:
+            return 'ユーザーが見つかりません'
+
+        # 既存のリクエストを確認
+        if repository.has_pending_recovery(conn, user['id'], partner['id']):
+            return '既にパスワード復旧リクエストが存在します'
+
+        repository.create_recovery(conn, user['id'], partner['id'], recovery_token, expires_at)
+        return None
+    
+    error = writes.run(request_recovery)
+    if error:
+        return jsonify({'success': False, 'error': error})
     
     return jsonify({'success': True, 'data': {
         'message': 'パスワード復旧リクエストを送信しました',
@@ -1397,27 +2015,19 @@ def handle_approve_password_recovery():
     if not recovery_token:
         return jsonify({'success': False, 'error': '復旧トークンが必要です'})
     
-    conn = get_db_connection()
-    
-    # 復旧リクエストを確認
-    recovery = conn.execute('''
-        SELECT * FROM password_recovery 
-        WHERE recovery_token = ? AND recovery_partner_id = ? AND status = 'pending'
-    ''', (recovery_token, user['id'])).fetchone()
+    def approve(conn):
+        # 復旧リクエストを確認
+        recovery = repository.find_pending_recovery(conn, recovery_token, user['id'])
+        if not recovery:
+            return False
+
+        # 承認
+        repository.approve_recovery(conn, recovery['id'])
+        return True
     
-    if not recovery:
-        conn.close()
+    if not writes.run(approve):
         return jsonify({'success': False, 'error': '無効な復旧トークンです'})
     
-    # 承認
-    conn.execute('''
-        UPDATE password_recovery 
-        SET status = 'approved', approved_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (recovery['id'],))
-    conn.commit()
-    conn.close()
-    
     return jsonify({'success': True, 'data': {'message': 'パスワード復旧を承認しました'}})
 
 def handle_reset_password():
@@ -1430,36 +2040,23 @@ def handle_reset_password():
     if len(new_password) < 6:
         return jsonify({'success': False, 'error': 'パスワードは6文字以上にしてください'})
     
-    conn = get_db_connection()
+    # ハッシュの計算は書き込みスレッドを止めないよう先に行う
+    new_hash = hash_password(new_password)
     
-    # 承認済みの復旧リクエストを確認
-    recovery = conn.execute('''
-        SELECT * FROM password_recovery 
-        WHERE recovery_token = ? AND status = 'approved' AND expires_at > CURRENT_TIMESTAMP
-    ''', (recovery_token,)).fetchone()
+    def reset(conn):
+        # 承認済みの復旧リクエストを確認
+        recovery = repository.find_approved_recovery(conn, recovery_token)
+        if not recovery:
+            return False
+
+        # パスワードを更新し、復旧リクエストを完了にマーク
+        repository.set_password_hash(conn, recovery['user_id'], new_hash)
+        repository.complete_recovery(conn, recovery['id'])
+        return True
     
-    if not recovery:
-        conn.close()
+    if not writes.run(reset):
         return jsonify({'success': False, 'error': '無効または期限切れの復旧トークンです'})
     
-    # パスワードを更新
-    new_hash = hash_password(new_password)
-    conn.execute('''
-        UPDATE users 
-        SET password_hash = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (new_hash, recovery['user_id']))
-    
-    # 復旧リクエストを完了にマーク
-    conn.execute('''
-        UPDATE password_recovery 
-        SET status = 'completed', completed_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (recovery['id'],))
-    
-    conn.commit()
-    conn.close()
-    
     return jsonify({'success': True, 'data': {'message': 'パスワードをリセットしました'}})
 
 def handle_get_server_members():
@@ -1471,26 +2068,14 @@ def handle_get_server_members():
     if not server_id:
         return jsonify({'success': False, 'error': 'サーバーIDが必要です'})
     
-    conn = get_db_connection()
-    
     # メンバーシップを確認
-    membership = conn.execute('''
-        SELECT role FROM server_members 
-        WHERE server_id = ? AND user_id = ?
-    ''', (server_id, user['id'])).fetchone()
-    
-    if not membership:
-        conn.close()
+    if memberships.role(user['id'], server_id) is None:
         return jsonify({'success': False, 'error': 'サーバーのメンバーではありません'})
     
+    conn = get_db_connection()
+    
     # メンバー一覧を取得
-    members = conn.execute('''
-        SELECT u.id, u.username, u.nickname, u.avatar, sm.role, sm.joined_at
-        FROM server_members sm
-        JOIN users u ON sm.user_id = u.id
-        WHERE sm.server_id = ?
-        ORDER BY sm.joined_at
-    ''', (server_id,)).fetchall()
+    members = repository.server_members(conn, server_id)
     
     conn.close()
     
@@ -1528,20 +2113,12 @@ def handle_save_whiteboard_image():
         # ファイルを保存
         image_id = str(uuid.uuid4())
         file_path = os.path.join('files', 'whiteboards', f"{image_id}.png")
-        
-        with open(file_path, 'wb') as f:
-            f.write(image_bytes)
+        blobs.put(f'whiteboards/{image_id}.png', image_bytes)
         
         # データベースに記録
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO files (id, filename, original_filename, file_path, file_size, 
-                              mime_type, upload_by, feature_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (image_id, f"{image_id}.png", f"whiteboard_{board_id}.png", 
-              file_path, len(image_bytes), 'image/png', user['id'], feature_id))
-        conn.commit()
-        conn.close()
+        writes.run(lambda conn: repository.add_file(conn, image_id, f"{image_id}.png", f"whiteboard_{board_id}.png",
+                                                    file_path, len(image_bytes), 'image/png', user['id'],
+                                                    feature_id=feature_id))
         
         return jsonify({'success': True, 'data': {
             'imageId': image_id,
@@ -1565,31 +2142,15 @@ def handle_update_feature_content():
     
     try:
         # JSONデータの検証
-        content = json.loads(content_data)
+        content = serializer.loads(content_data)
         
-        conn = get_db_connection()
+        def save(conn):
+            on_feature_content_saved(conn, feature_id, content, user['username'])
+            # 既存のコンテンツを更新（無ければ作成）
+            repository.store_content(conn, feature_id, content)
         
-        # 既存のコンテンツを取得
-        existing_row = conn.execute(
-            'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-        ).fetchone()
-        
-        if existing_row:
-            # 既存コンテンツを更新
-            conn.execute('''
-                UPDATE feature_content 
-                SET content = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE feature_id = ?
-            ''', (json.dumps(content), feature_id))
-        else:
-            # 新規コンテンツを作成
-            conn.execute('''
-                INSERT INTO feature_content (feature_id, content, updated_at)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-            ''', (feature_id, json.dumps(content)))
-        
-        conn.commit()
-        conn.close()
+        writes.run(save)
+        publish_event(feature_id, 'content', {'updatedBy': user['username']})
         
         # 更新された状態を返す
         state = get_user_state(user['id'])
@@ -1612,22 +2173,154 @@ def handle_get_feature_content():
         return jsonify({'success': False, 'error': 'Feature ID is required'})
     
     conn = get_db_connection()
-    content_row = conn.execute(
-        'SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)
-    ).fetchone()
+    try:
+        content = repository.load_content(conn, feature_id)
+    except json.JSONDecodeError:
+        conn.close()
+        return jsonify({'success': False, 'error': 'Invalid content data'})
+    
+    if content is not None:
+        # 派生テーブルから戻す内容は機能の種類で決める（on_feature_content_saved と同じ分岐）
+        feature = repository.get_feature(conn, feature_id)
+        feature_type = feature['type'] if feature else None
+        if feature_type == 'survey':
+            surveys.merge_own_responses({feature_id: content},
+                                        surveys.own_responses(conn, user['id'], feature_id))
+        elif feature_type in TABLE_CONTENT:
+            load, merge = TABLE_CONTENT[feature_type]
+            merge({feature_id: content}, load(conn, [feature_id]))
+        conn.close()
+        return jsonify({'success': True, 'data': content})
+    else:
+        conn.close()
+        return jsonify({'success': True, 'data': {}})
+
+def handle_get_survey_results():
+    """アンケートの集計結果（質問ごとの件数・選択肢分布・数値統計）を取得"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    feature_id = request.form.get('featureId')
+    survey_id = request.form.get('surveyId')
+    if not feature_id or not survey_id:
+        return jsonify({'success': False, 'error': 'Feature ID and survey ID are required'})
+    try:
+        text_limit = int(request.form.get('textLimit', surveys.DEFAULT_TEXT_LIMIT))
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'error': 'textLimit は数字で指定してください'})
+    
+    conn = get_db_connection()
+    content = repository.load_content(conn, feature_id)
+    if content is None:
+        conn.close()
+        return jsonify({'success': False, 'error': 'Feature not found'})
+    
+    survey = (content.get('surveys') or {}).get(survey_id)
+    if not survey:
+        conn.close()
+        return jsonify({'success': False, 'error': 'Survey not found'})
+    
+    results = surveys.get_results(conn, feature_id, survey_id, survey, text_limit)
+    conn.close()
+    return jsonify({'success': True, 'data': results})
+
+def handle_search():
+    """所属サーバー内のチャット・フォーラム・Wiki・日記・アンケートを全文検索"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+    
+    query = (request.form.get('query') or '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': '検索語を入力してください'})
+    
+    kinds = [k for k in (request.form.get('kinds') or '').split(',') if k in search.SEARCH_KINDS]
+    try:
+        page = max(1, int(request.form.get('page', 1)))
+        page_size = max(1, min(int(request.form.get('pageSize', 20)), search.MAX_PAGE_SIZE))
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'error': 'ページ指定が不正です'})
+    
+    conn = get_db_connection()
+    try:
+        hits, total = search.search(
+            conn, user['id'], user['username'], query,
+            kinds=kinds or None, server_id=request.form.get('serverId'),
+            limit=page_size, offset=(page - 1) * page_size
+        )
+    except database.OperationalError as e:
+        conn.close()
+        return jsonify({'success': False, 'error': f'検索エラー: {str(e)}'})
     conn.close()
     
-    if content_row:
-        try:
-            content = json.loads(content_row['content'])
-            return jsonify({'success': True, 'data': content})
-        except json.JSONDecodeError:
-            return jsonify({'success': False, 'error': 'Invalid content data'})
+    return jsonify({'success': True, 'data': {
+        'hits': hits,
+        'total': total,
+        'page': page,
+        'pageSize': page_size
+    }})
+
+def handle_poll_events():
+    """所属サーバーのイベントを since の続きから返す（無ければ timeout 秒まで待つ）"""
+    user = get_session_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+
+    server_id = request.form.get('serverId')
+    server_ids = {server_id} if server_id else set(memberships.roles(user['id']))
+    try:
+        since = request.form.get('since')
+        since = int(since) if since not in (None, '') else None
+        timeout = float(request.form.get('timeout', Config.EVENT_POLL_TIMEOUT))
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'error': 'since と timeout は数値で指定してください'})
+    timeout = max(0.0, min(timeout, Config.EVENT_POLL_TIMEOUT))
+
+    # DB の接続は持たずに待つ
+    result = event_bus.wait(server_ids, since, timeout)
+    return jsonify({'success': True, 'data': result})
+
+def handle_presence_heartbeat():
+    """オンラインの期限を延ばし、サーバーのオンラインのユーザーとチャンネルの入力中のユーザーを返す"""
+    user = get_session_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+
+    server_id = request.form.get('serverId')
+    feature_id = request.form.get('featureId')
+    sub_item_id = request.form.get('subItemId')
+    if not server_id:
+        return jsonify({'success': False, 'error': 'サーバーIDが必要です'})
+    if feature_id and memberships.feature_server(feature_id) != server_id:
+        return jsonify({'success': False, 'error': 'この機能にアクセスする権限がありません'})
+
+    if request.form.get('online', 'true').lower() == 'false':
+        presences.leave(server_id, user['username'])
     else:
-        return jsonify({'success': True, 'data': {}})
+        presences.heartbeat(server_id, user['username'])
+    return jsonify({'success': True, 'data': presences.snapshot(server_id, feature_id, sub_item_id)})
+
+def handle_set_typing():
+    """チャンネルで入力中かどうかを設定する（キー入力ごとに呼んでもまとめて通知する）"""
+    user = get_session_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'Not authenticated'})
+
+    feature_id = request.form.get('featureId')
+    sub_item_id = request.form.get('subItemId')
+    if not feature_id or not sub_item_id:
+        return jsonify({'success': False, 'error': 'Feature ID and sub item ID are required'})
+
+    typing = request.form.get('typing', 'true').lower() != 'false'
+    presences.set_typing(memberships.feature_server(feature_id), feature_id, sub_item_id,
+                         user['username'], typing)
+    return jsonify({'success': True})
 
 if __name__ == '__main__':
     init_database()
     print("Database initialized")
+    if Config.STATIC_PRECOMPRESS:
+        static_site.build()
     print("Starting Circle Management Platform on port 8060...")
     app.run(host='0.0.0.0', port=8060, debug=True)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""データベースのオンラインバックアップと復元・検証
+
+稼働中の data/circle_platform.db をファイルコピーすると、書き込み途中の状態を
+写して壊れたバックアップになることがある。ここでは SQLite のオンライン
+バックアップ API で BACKUP_PAGES_PER_STEP ページずつ写し、ステップの間に
+BACKUP_STEP_SLEEP_MS 待つことで、バックアップ中もリクエストの書き込みを
+止めない（ステップの間は読み込みロックを持たない）。写している間に他の接続が
+書き込むとバックアップ API は最初からやり直すため、やり直しが
+BACKUP_MAX_RESTARTS 回を超えたら VACUUM INTO（1回の読み込みトランザクションで
+詰めた複製を作る）に切り替える。
+
+作成したファイルは整合性を確認してから gzip / zstd で圧縮し、
+circle_platform-YYYYmmdd-HHMMSS.db[.gz|.zst] として BACKUP_DIR に置く。
+
+    python backup.py create [--method backup|vacuum] [--compression gzip|zstd|none]
+    python backup.py list
+    python backup.py verify data/backups/circle_platform-20240401-030000.db.gz
+    python backup.py restore data/backups/circle_platform-20240401-030000.db.gz
+"""
+
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import database
+from config import Config
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 任意依存
+    zstandard = None
+
+METHODS = ('backup', 'vacuum')
+COMPRESSIONS = ('gzip', 'zstd', 'none')
+EXTENSIONS = {'gzip': '.db.gz', 'zstd': '.db.zst', 'none': '.db'}
+NAME_PREFIX = 'circle_platform-'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_DECOMPRESS_ERRORS = (OSError, EOFError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+_backup_lock = threading.Lock()
+
+
+class BackupError(Exception):
+    """バックアップ・復元できない（実行中・検証失敗など）"""
+
+
+class _RestartLimit(Exception):
+    pass
+
+
+def default_compression():
+    """設定された圧縮方式（zstandard が無ければ gzip）"""
+    method = Config.BACKUP_COMPRESSION.lower()
+    if method not in COMPRESSIONS:
+        method = 'gzip'
+    if method == 'zstd' and zstandard is None:
+        return 'gzip'
+    return method
+
+
+def _compression_of(path):
+    for method, extension in EXTENSIONS.items():
+        if method != 'none' and path.endswith(extension):
+            return method
+    return 'none'
+
+
+def _online_backup(source, target_path, pages, sleep_ms, max_restarts):
+    """バックアップ API でページを少しずつ写す。やり直しの回数を返す"""
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        # 他の接続が書き込むと次のステップは最初からやり直すので、
+        # 残りページ数が減らなければやり直し（またはロック待ち）とみなす
+        if state['remaining'] is not None and remaining >= state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > max_restarts:
+                raise _RestartLimit()
+        state['remaining'] = remaining
+        if remaining and sleep_ms:
+            time.sleep(sleep_ms / 1000.0)
+
+    target = sqlite3.connect(target_path)
+    try:
+        # ロック待ち（SQLITE_BUSY）の再試行もステップの間隔で行う
+        source.backup(target, pages=max(1, pages), progress=progress, sleep=sleep_ms / 1000.0)
+    finally:
+        target.close()
+    return state['restarts']
+
+
+def _vacuum_into(source, target_path):
+    source.execute('VACUUM INTO ?', (target_path,))
+
+
+def _compress(path, dest, method):
+    if method == 'gzip':
+        with open(path, 'rb') as src, gzip.open(dest, 'wb', compresslevel=6) as out:
+            shutil.copyfileobj(src, out, COPY_CHUNK_SIZE)
+    elif method == 'zstd':
+        with open(path, 'rb') as src, open(dest, 'wb') as out:
+            zstandard.ZstdCompressor(level=10).copy_stream(src, out, read_size=COPY_CHUNK_SIZE)
+    else:
+        shutil.copyfile(path, dest)
+
+
+def _decompress(path, dest):
+    method = _compression_of(path)
+    if method == 'gzip':
+        with gzip.open(path, 'rb') as src, open(dest, 'wb') as out:
+            shutil.copyfileobj(src, out, COPY_CHUNK_SIZE)
+    elif method == 'zstd':
+        if zstandard is None:
+            raise BackupError('zstd で圧縮されたバックアップを読むには zstandard が必要です')
+        with open(path, 'rb') as src, open(dest, 'wb') as out:
+            zstandard.ZstdDecompressor().copy_stream(src, out, read_size=COPY_CHUNK_SIZE)
+    else:
+        shutil.copyfile(path, dest)
+
+
+def inspect_database(path):
+    """整合性チェックの結果とテーブルごとの行数を返す"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        integrity = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        counts = {}
+        for table in tables:
+            # FTS などの仮想テーブルはモジュールが無いと数えられない
+            try:
+                counts[table] = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            except sqlite3.Error:
+                counts[table] = None
+    except sqlite3.DatabaseError as e:
+        return {'ok': False, 'integrity': [str(e)], 'tables': {}}
+    finally:
+        conn.close()
+    return {'ok': integrity == ['ok'], 'integrity': integrity, 'tables': counts}
+
+
+def verify_backup(path):
+    """バックアップファイル（圧縮されていてもよい）を展開して検証する"""
+    if not os.path.exists(path):
+        raise BackupError(f'バックアップが見つかりません: {path}')
+    workdir = tempfile.mkdtemp(prefix='circle-verify-')
+    try:
+        plain = os.path.join(workdir, 'backup.db')
+        try:
+            _decompress(path, plain)
+        except _DECOMPRESS_ERRORS as e:
+            return {'ok': False, 'integrity': [f'展開できません: {e}'], 'tables': {}}
+        return inspect_database(plain)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _default_db_path():
+    path = database.sqlite_path()
+    if path is None:
+        raise BackupError('バックアップは SQLite のデータベースのみ対応しています（PostgreSQL は pg_dump を使用）')
+    return path
+
+
+def create_backup(db_path=None, backup_dir=None, method='backup', compression=None,
+                  pages=None, sleep_ms=None, keep=None):
+    """バックアップを作成して {name, path, size, method, restarts, seconds, tables} を返す"""
+    db_path = db_path or _default_db_path()
+    backup_dir = backup_dir or Config.BACKUP_DIR
+    compression = compression or default_compression()
+    if method not in METHODS:
+        raise BackupError(f'不明なバックアップ方式です: {method}')
+    if compression not in COMPRESSIONS:
+        raise BackupError(f'不明な圧縮方式です: {compression}')
+    if compression == 'zstd' and zstandard is None:
+        raise BackupError('zstd で圧縮するには zstandard が必要です')
+    if not os.path.exists(db_path):
+        raise BackupError(f'データベースが見つかりません: {db_path}')
+    if not _backup_lock.acquire(blocking=False):
+        raise BackupError('バックアップを実行中です')
+    try:
+        os.makedirs(backup_dir, exist_ok=True)
+        start = time.perf_counter()
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        name = NAME_PREFIX + stamp + EXTENSIONS[compression]
+        # 同じ秒に作ったバックアップ（復元前の退避と復元元など）を上書きしない
+        suffix = 1
+        while os.path.exists(os.path.join(backup_dir, name)):
+            name = f'{NAME_PREFIX}{stamp}-{suffix}{EXTENSIONS[compression]}'
+            suffix += 1
+        path = os.path.join(backup_dir, name)
+        workdir = tempfile.mkdtemp(prefix='.backup-', dir=backup_dir)
+        try:
+            plain = os.path.join(workdir, 'backup.db')
+            source = sqlite3.connect(db_path)
+            restarts = 0
+            try:
+                if method == 'backup':
+                    try:
+                        restarts = _online_backup(
+                            source, plain,
+                            Config.BACKUP_PAGES_PER_STEP if pages is None else pages,
+                            Config.BACKUP_STEP_SLEEP_MS if sleep_ms is None else sleep_ms,
+                            Config.BACKUP_MAX_RESTARTS,
+                        )
+                    except _RestartLimit:
+                        # 書き込みが多く写し終わらない場合は一度に複製する
+                        restarts = Config.BACKUP_MAX_RESTARTS + 1
+                        method = 'vacuum'
+                        os.remove(plain)
+                if method == 'vacuum':
+                    _vacuum_into(source, plain)
+            finally:
+                source.close()
+
+            report = inspect_database(plain)
+            if not report['ok']:
+                raise BackupError('作成したバックアップの整合性チェックに失敗しました: '
+                                  + '; '.join(report['integrity'][:5]))
+            partial = os.path.join(workdir, name)
+            _compress(plain, partial, compression)
+            os.replace(partial, path)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        removed = prune_backups(backup_dir, Config.BACKUP_KEEP if keep is None else keep)
+        return {
+            'name': name,
+            'path': path,
+            'size': os.path.getsize(path),
+            'method': method,
+            'compression': compression,
+            'restarts': restarts,
+            'seconds': round(time.perf_counter() - start, 3),
+            'tables': report['tables'],
+            'pruned': removed,
+        }
+    finally:
+        _backup_lock.release()
+
+
+def list_backups(backup_dir=None):
+    """新しい順に [{name, path, size, createdAt}]"""
+    backup_dir = backup_dir or Config.BACKUP_DIR
+    if not os.path.isdir(backup_dir):
+        return []
+    backups = []
+    for name in os.listdir(backup_dir):
+        if not name.startswith(NAME_PREFIX) or not name.endswith(tuple(EXTENSIONS.values())):
+            continue
+        path = os.path.join(backup_dir, name)
+        stat = os.stat(path)
+        backups.append((stat.st_mtime, {
+            'name': name,
+            'path': path,
+            'size': stat.st_size,
+            'createdAt': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds'),
+        }))
+    backups.sort(key=lambda item: item[0], reverse=True)
+    return [backup for _, backup in backups]
+
+
+def prune_backups(backup_dir, keep):
+    """新しいものから keep 件を残して削除し、削除したファイル名を返す（keep <= 0 は削除しない）"""
+    if keep <= 0:
+        return []
+    removed = []
+    for backup in list_backups(backup_dir)[keep:]:
+        try:
+            os.remove(backup['path'])
+            removed.append(backup['name'])
+        except OSError:
+            pass
+    return removed
+
+
+def restore_backup(path, db_path=None):
+    """検証したバックアップでデータベースを置き換える。
+
+    置き換える前に現在のデータベースを pre-restore として BACKUP_DIR に保存する。
+    書き込みはバックアップ API で1ステップで行うので、途中の状態は見えない。
+    アプリのメモリ上のキャッシュは古くなるため、復元後はアプリを再起動すること。
+    """
+    db_path = db_path or _default_db_path()
+    report = verify_backup(path)
+    if not report['ok']:
+        raise BackupError('バックアップの検証に失敗しました: ' + '; '.join(report['integrity'][:5]))
+
+    saved = None
+    if os.path.exists(db_path):
+        saved = create_backup(db_path, keep=0)['path']
+        directory, name = os.path.split(saved)
+        renamed = os.path.join(directory, name.replace(NAME_PREFIX, NAME_PREFIX + 'pre-restore-', 1))
+        os.replace(saved, renamed)
+        saved = renamed
+
+    workdir = tempfile.mkdtemp(prefix='circle-restore-')
+    try:
+        plain = os.path.join(workdir, 'backup.db')
+        _decompress(path, plain)
+        source = sqlite3.connect(plain)
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        target = sqlite3.connect(db_path, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'restored': path, 'previous': saved, 'tables': report['tables']}
+
+
+def _print_report(report):
+    print('INTEGRITY:', 'ok' if report['ok'] else '; '.join(report['integrity'][:20]))
+    for table, count in sorted(report['tables'].items()):
+        print(f'  {table:32} {"-" if count is None else count}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    create = sub.add_parser('create', help='バックアップを作成')
+    create.add_argument('--db', default=None, help='既定は DATABASE_URL の SQLite のファイル')
+    create.add_argument('--dir', default=Config.BACKUP_DIR)
+    create.add_argument('--method', choices=METHODS, default='backup')
+    create.add_argument('--compression', choices=COMPRESSIONS, default=None)
+    create.add_argument('--pages', type=int, default=None, help='1ステップで写すページ数')
+    create.add_argument('--sleep-ms', type=float, default=None, help='ステップの間に待つミリ秒')
+    create.add_argument('--keep', type=int, default=None, help='残すバックアップの数（0 は無制限）')
+
+    listing = sub.add_parser('list', help='バックアップの一覧')
+    listing.add_argument('--dir', default=Config.BACKUP_DIR)
+
+    verify = sub.add_parser('verify', help='バックアップを検証')
+    verify.add_argument('path')
+
+    restore = sub.add_parser('restore', help='バックアップから復元（アプリを止めてから実行）')
+    restore.add_argument('path')
+    restore.add_argument('--db', default=None, help='既定は DATABASE_URL の SQLite のファイル')
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'create':
+            result = create_backup(args.db, args.dir, args.method, args.compression,
+                                   args.pages, args.sleep_ms, args.keep)
+            print(f"{result['path']} ({result['size']} bytes, {result['method']}, "
+                  f"{result['seconds']} s, restarts={result['restarts']})")
+            for name in result['pruned']:
+                print('removed', name)
+        elif args.command == 'list':
+            for backup in list_backups(args.dir):
+                print(f"{backup['createdAt']}  {backup['size']:>12}  {backup['name']}")
+        elif args.command == 'verify':
+            report = verify_backup(args.path)
+            _print_report(report)
+            return 0 if report['ok'] else 1
+        elif args.command == 'restore':
+            result = restore_backup(args.path, args.db)
+            if result['previous']:
+                print('以前のデータベースを保存しました:', result['previous'])
+            print('復元しました:', args.db)
+            _print_report({'ok': True, 'integrity': ['ok'], 'tables': result['tables']})
+    except BackupError as e:
+        print('ERROR:', e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""/api.cgi の負荷テスト・ベンチマーク
+
+一時ディレクトリに新しいデータベースを作り、合成データを投入した上で
+Flask のテストクライアントからアクションを重み付きでリプレイする。
+アクションごとの p50 / p95 / p99 レイテンシ、スループット、RSS の増分を計測し、
+--output で JSON に保存する（benchmarks/compare.py でリビジョン間比較）。
+
+    python benchmarks/bench_api.py --users 50 --servers 5 --messages 2000 --requests 2000
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# 同じ IP から大量に登録・ログインするので試行回数の制限は外す（Config の読み込み前に設定）
+os.environ.setdefault('LOGIN_RATE_LIMIT', 'False')
+
+from bench_serializer import make_chat, make_whiteboard, make_wiki  # noqa: E402
+
+PASSWORD = 'benchpass'
+
+# アクション名 -> 重み
+DEFAULT_MIX = {
+    'checkSession': 25,
+    'postMessage': 25,
+    'getFeatureContent': 15,
+    'search': 10,
+    'saveWhiteboard': 5,
+    'updateFeatureContent': 5,
+    'getServerMembers': 10,
+    'login': 5,
+}
+
+
+def _rss_kb():
+    """現在の RSS（KB）。/proc が無い環境ではピーク値で代用"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # 最近順位法（ceil(p/100 * n) 番目）。round() は偶数丸めなので使わない
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Dataset:
+    """合成データ（ユーザー・サークル・機能ID）"""
+
+    def __init__(self):
+        self.users = []
+        self.servers = []
+        self.features = {}  # server_id -> {type: feature_id}
+        self.members = defaultdict(list)  # username -> [server_id]
+
+
+def generate_dataset(app_module, args, rng):
+    """ユーザーとサークルを作成し、チャット・Wiki・ホワイトボードにデータを投入"""
+    import serializer
+
+    app = app_module.app
+    dataset = Dataset()
+
+    client = app.test_client()
+    for i in range(args.users):
+        username = f'bench{i:05d}'
+        client.post('/api.cgi', data={'action': 'register', 'username': username, 'password': PASSWORD})
+        dataset.users.append(username)
+
+    conn = app_module.get_db_connection()
+    user_ids = {row['username']: row['id'] for row in conn.execute('SELECT id, username FROM users')}
+    conn.close()
+
+    for s in range(args.servers):
+        owner = dataset.users[s % len(dataset.users)]
+        client = app.test_client()
+        client.post('/api.cgi', data={'action': 'login', 'username': owner, 'password': PASSWORD})
+        # handle_add_server -> create_default_features を経由して作成
+        client.post('/api.cgi', data={'action': 'addServer', 'name': f'ベンチサークル{s}'})
+        conn = app_module.get_db_connection()
+        server_id = conn.execute(
+            'SELECT id FROM servers WHERE owner_id = ? ORDER BY created_at DESC, id DESC LIMIT 1',
+            (user_ids[owner],)
+        ).fetchone()['id']
+        dataset.servers.append(server_id)
+        dataset.features[server_id] = {
+            row['type']: row['id']
+            for row in conn.execute('SELECT id, type FROM features WHERE server_id = ?', (server_id,))
+        }
+        dataset.members[owner].append(server_id)
+
+        # メンバーを追加（招待フローは対象外なので直接登録）
+        members = rng.sample(dataset.users, min(args.members_per_server, len(dataset.users)))
+        for username in members:
+            if username == owner:
+                continue
+            conn.execute(
+                "INSERT OR IGNORE INTO server_members (server_id, user_id, role) VALUES (?, ?, 'member')",
+                (server_id, user_ids[username])
+            )
+            dataset.members[username].append(server_id)
+
+        # 大きめの機能コンテンツを投入
+        seeded = {
+            'chat': make_chat(rng, args.messages),
+            'wiki': make_wiki(rng, args.pages),
+            'whiteboard': make_whiteboard(rng, args.elements),
+        }
+        for feature_type, content in seeded.items():
+            feature_id = dataset.features[server_id][feature_type]
+            # updateFeatureContent と同じく検索インデックスと専用テーブルを更新してから保存
+            app_module.on_feature_content_saved(conn, feature_id, content)
+            conn.execute(
+                'UPDATE feature_content SET content = ?, updated_at = CURRENT_TIMESTAMP WHERE feature_id = ?',
+                (serializer.encode_content(content), feature_id)
+            )
+        conn.commit()
+        conn.close()
+        # 同じミリ秒でサーバーIDが重複しないように
+        time.sleep(0.002)
+
+    # メンバーを直接登録したので、キャッシュ済みのロールを捨てる
+    app_module.memberships.clear()
+    return dataset
+
+
+class Replayer:
+    """アクションを重み付きで実行し、計測結果を集める"""
+
+    def __init__(self, app, dataset, mix, seed):
+        self.app = app
+        self.dataset = dataset
+        self.actions = list(mix.keys())
+        self.weights = [mix[a] for a in self.actions]
+        self.seed = seed
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rss_delta = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def _params(self, action, rng, username):
+        server_id = rng.choice(self.dataset.members[username])
+        features = self.dataset.features[server_id]
+        if action == 'login':
+            return {'username': username, 'password': PASSWORD}
+        if action == 'postMessage':
+            return {'featureId': features['chat'], 'subItemId': 'general',
+                    'content': f'ベンチマーク投稿 {rng.random():.6f}'}
+        if action == 'getFeatureContent':
+            return {'featureId': features[rng.choice(['chat', 'wiki', 'whiteboard'])]}
+        if action == 'search':
+            return {'query': rng.choice(['ミーティング', '合宿', '資料 確認', 'slides'])}
+        if action == 'saveWhiteboard':
+            board = make_whiteboard(rng, 20)['boards']['main']['elements']
+            return {'featureId': features['whiteboard'], 'boardId': 'main', 'elements': json.dumps(board)}
+        if action == 'updateFeatureContent':
+            return {'featureId': features['wiki'], 'content': json.dumps(make_wiki(rng, 20))}
+        if action == 'getServerMembers':
+            return {'serverId': server_id}
+        return {}
+
+    def worker(self, worker_id, count):
+        rng = random.Random(self.seed + worker_id)
+        candidates = [u for u in self.dataset.users if self.dataset.members[u]]
+        username = rng.choice(candidates)
+        client = self.app.test_client()
+        client.post('/api.cgi', data={'action': 'login', 'username': username, 'password': PASSWORD})
+
+        for _ in range(count):
+            action = rng.choices(self.actions, self.weights)[0]
+            data = dict(self._params(action, rng, username), action=action)
+            rss_before = _rss_kb()
+            start = time.perf_counter()
+            response = client.post('/api.cgi', data=data)
+            elapsed = time.perf_counter() - start
+            rss_after = _rss_kb()
+            ok = response.status_code == 200 and (response.get_json() or {}).get('success')
+            with self.lock:
+                self.latencies[action].append(elapsed)
+                self.rss_delta[action] += rss_after - rss_before
+                if not ok:
+                    self.errors[action] += 1
+
+    def run(self, total, threads):
+        per_thread = [total // threads + (1 if i < total % threads else 0) for i in range(threads)]
+        start = time.perf_counter()
+        if threads == 1:
+            self.worker(0, per_thread[0])
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                for f in [pool.submit(self.worker, i, n) for i, n in enumerate(per_thread)]:
+                    f.result()
+        return time.perf_counter() - start
+
+    def summary(self):
+        actions = {}
+        for action, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            actions[action] = {
+                'count': len(values),
+                'errors': self.errors[action],
+                'mean_ms': round(sum(values) / len(values) * 1000, 3),
+                'p50_ms': round(_percentile(values, 50) * 1000, 3),
+                'p95_ms': round(_percentile(values, 95) * 1000, 3),
+                'p99_ms': round(_percentile(values, 99) * 1000, 3),
+                'rss_delta_kb': self.rss_delta[action],
+            }
+        return actions
+
+
+def _parse_mix(text):
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=30)
+    parser.add_argument('--servers', type=int, default=3)
+    parser.add_argument('--members-per-server', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=1000, help='サークルごとのチャット件数')
+    parser.add_argument('--pages', type=int, default=50, help='サークルごとの Wiki ページ数')
+    parser.add_argument('--elements', type=int, default=300, help='サークルごとのホワイトボード要素数')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--mix', help='アクションの重み（例: checkSession=5,postMessage=3）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='結果を JSON で保存するパス')
+    parser.add_argument('--keep', action='store_true', help='作業ディレクトリを削除しない')
+    args = parser.parse_args()
+
+    original_cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='circle-bench-')
+    shutil.copy(os.path.join(ROOT, 'index.html'), workdir)
+    # app.py は相対パスで data/ と files/ を使うため、作業ディレクトリを移してから読み込む
+    os.chdir(workdir)
+    import app as app_module
+    app_module.init_database()
+
+    rng = random.Random(args.seed)
+    rss_start = _rss_kb()
+    seed_start = time.perf_counter()
+    dataset = generate_dataset(app_module, args, rng)
+    seed_seconds = time.perf_counter() - seed_start
+
+    replayer = Replayer(app_module.app, dataset, _parse_mix(args.mix), args.seed)
+    elapsed = replayer.run(args.requests, args.threads)
+    actions = replayer.summary()
+
+    result = {
+        'meta': {
+            'revision': _git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'params': {k: v for k, v in vars(args).items() if k not in ('output', 'keep')},
+            'seed_seconds': round(seed_seconds, 3),
+            'db_size_bytes': os.path.getsize(os.path.join(workdir, 'data', 'circle_platform.db')),
+        },
+        'total': {
+            'requests': sum(a['count'] for a in actions.values()),
+            'errors': sum(a['errors'] for a in actions.values()),
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(args.requests / elapsed, 2) if elapsed else 0,
+            'rss_start_kb': rss_start,
+            'rss_end_kb': _rss_kb(),
+        },
+        'actions': actions,
+    }
+
+    print(f"{'action':22s} {'count':>6s} {'err':>4s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'rssΔKB':>8s}")
+    for action, r in actions.items():
+        print(f"{action:22s} {r['count']:6d} {r['errors']:4d} {r['p50_ms']:9.2f} "
+              f"{r['p95_ms']:9.2f} {r['p99_ms']:9.2f} {r['rss_delta_kb']:8d}")
+    total = result['total']
+    print(f"total {total['requests']} requests in {total['seconds']} s "
+          f"({total['throughput_rps']} req/s), RSS {total['rss_start_kb']} -> {total['rss_end_kb']} KB")
+
+    if args.output:
+        output = os.path.join(original_cwd, args.output)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    # 後からまとめて書き込む記録を作業ディレクトリの DB に書き終えてから片付ける
+    app_module.bookkeeping.close()
+    app_module.writes.close()
+    app_module.event_bus.close()
+
+    if not args.keep:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
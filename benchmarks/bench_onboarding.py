@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""招待の一括発行とメンバー一括登録のベンチマーク
+
+一時ディレクトリの新しいデータベースにユーザーを直接投入し、人数を変えながら
+createInvites と importMembers を /api.cgi 経由で実行する。1人あたりの時間が
+人数によらずほぼ一定（線形に増える）ことを確認する。
+
+    python benchmarks/bench_onboarding.py --sizes 100,300,1000,3000
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'benchpass'
+
+
+def _seed_users(app_module, count):
+    conn = app_module.get_db_connection()
+    password_hash = app_module.hash_password(PASSWORD)
+    conn.executemany('INSERT INTO users (username, password_hash) VALUES (?, ?)',
+                     [(f'fresh{i:06d}', password_hash) for i in range(count)])
+    conn.commit()
+    conn.close()
+
+
+def _login_owner(app_module):
+    client = app_module.app.test_client()
+    client.post('/api.cgi', data={'action': 'register', 'username': 'owner', 'password': PASSWORD})
+    client.post('/api.cgi', data={'action': 'login', 'username': 'owner', 'password': PASSWORD})
+    return client
+
+
+def _new_server(client, name):
+    state = client.post('/api.cgi', data={'action': 'addServer', 'name': name}).get_json()['data']
+    return max(state['servers'])
+
+
+def _csv(size, missing):
+    lines = ['username'] + [f'fresh{i:06d}' for i in range(size)] + [f'nobody{i}' for i in range(missing)]
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def run_size(client, size, missing):
+    server_id = _new_server(client, f'新入生{size}')
+
+    start = time.perf_counter()
+    remaining = size
+    while remaining:
+        count = min(remaining, 500)
+        result = client.post('/api.cgi', data={
+            'action': 'createInvites', 'serverId': server_id, 'count': count
+        }).get_json()
+        assert result['success'], result
+        remaining -= count
+    invite_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = client.post('/api.cgi', data={
+        'action': 'importMembers', 'serverId': server_id,
+        'file': (io.BytesIO(_csv(size, missing)), 'members.csv')
+    }, content_type='multipart/form-data').get_json()
+    import_seconds = time.perf_counter() - start
+    assert result['success'], result
+    counts = result['data']['counts']
+    assert counts.get('added') == size and counts.get('not_found', 0) == missing, counts
+    return invite_seconds, import_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100,300,1000,3000', help='人数（カンマ区切り）')
+    parser.add_argument('--missing', type=int, default=10, help='CSV に混ぜる存在しないユーザー数')
+    parser.add_argument('--keep', action='store_true', help='作業ディレクトリを削除しない')
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+
+    original_cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='circle-bench-')
+    shutil.copy(os.path.join(ROOT, 'index.html'), workdir)
+    # app.py は相対パスで data/ と files/ を使うため、作業ディレクトリを移してから読み込む
+    os.chdir(workdir)
+    import app as app_module
+    app_module.init_database()
+    _seed_users(app_module, max(sizes))
+    client = _login_owner(app_module)
+
+    print(f"{'size':>6} {'invites s':>10} {'us/invite':>10} {'import s':>10} {'us/member':>10}")
+    per_member = []
+    for size in sizes:
+        invite_seconds, import_seconds = run_size(client, size, args.missing)
+        per_member.append(import_seconds / size)
+        print(f"{size:6d} {invite_seconds:10.3f} {invite_seconds / size * 1e6:10.1f} "
+              f"{import_seconds:10.3f} {import_seconds / size * 1e6:10.1f}")
+    if len(per_member) > 1:
+        print(f"1人あたりの取り込み時間の比（最大人数 / 最小人数）: {per_member[-1] / per_member[0]:.2f}")
+
+    app_module.bookkeeping.close()
+    app_module.writes.close()
+    app_module.event_bus.close()
+    if not args.keep:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""feature_content 用シリアライザのベンチマーク
+
+実際の機能ドキュメントに近いデータ（チャット履歴・Wiki・ホワイトボード）を生成し、
+利用可能な JSON バックエンドごとのエンコード／デコード時間と、
+保存形式・圧縮方式ごとの SQLite ファイルサイズを比較する。
+
+    python benchmarks/bench_serializer.py --messages 5000 --rows 200
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import serializer  # noqa: E402
+
+WORDS = ['今日', '練習', 'ミーティング', '資料', '確認', 'お願いします', '了解です',
+         '部室', '来週', '合宿', '予算', '備品', 'the', 'meeting', 'slides', 'ok']
+
+
+def _sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def make_chat(rng, messages):
+    return {'subItems': {
+        'general': {
+            'id': 'general', 'name': '一般', 'type': 'channel',
+            'messages': [{
+                'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'authorId': f'user{rng.randint(1, 300)}',
+                'authorName': f'ユーザー{rng.randint(1, 300)}',
+                'content': _sentence(rng, rng.randint(3, 30)),
+                'timestamp': 1700000000 + i * 37,
+            } for i in range(messages)]
+        }
+    }}
+
+
+def make_wiki(rng, pages):
+    return {'pages': {
+        f'page_{i}': {
+            'id': f'page_{i}',
+            'title': _sentence(rng, 3),
+            'content': '\n'.join(_sentence(rng, 20) for _ in range(rng.randint(5, 60))),
+            'author': f'user{rng.randint(1, 300)}',
+            'created_at': 1700000000.0 + i,
+            'updated_at': 1700000000.0 + i * 2,
+            'tags': [rng.choice(WORDS) for _ in range(3)],
+        } for i in range(pages)
+    }}
+
+
+def make_whiteboard(rng, elements):
+    return {'boards': {
+        'main': {
+            'id': 'main', 'name': 'メインボード',
+            'elements': {
+                f'el_{i}': {
+                    'type': rng.choice(['path', 'rect', 'circle', 'text']),
+                    'left': rng.uniform(0, 1920), 'top': rng.uniform(0, 1080),
+                    'stroke': '#%06x' % rng.getrandbits(24), 'strokeWidth': 2,
+                    'path': [[rng.uniform(0, 1920), rng.uniform(0, 1080)] for _ in range(rng.randint(2, 40))],
+                } for i in range(elements)
+            }
+        }
+    }}
+
+
+def _backends():
+    backends = {'json': (
+        lambda o: json.dumps(o, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+        json.loads,
+    )}
+    if serializer.orjson is not None:
+        backends['orjson'] = (
+            lambda o: serializer.orjson.dumps(o, option=serializer.orjson.OPT_NON_STR_KEYS),
+            serializer.orjson.loads,
+        )
+    if serializer.msgspec is not None:
+        backends['msgspec'] = (serializer.msgspec.json.encode, serializer.msgspec.json.decode)
+    if serializer.msgpack_available():
+        backends['msgpack'] = (serializer._msgpack_dumps, serializer._msgpack_loads)
+    return backends
+
+
+def _timeit(fn, arg, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_codecs(docs, repeat):
+    results = {}
+    for name, (enc, dec) in _backends().items():
+        results[name] = {}
+        for doc_name, doc in docs.items():
+            enc_time, blob = _timeit(enc, doc, repeat)
+            dec_time, _ = _timeit(dec, blob, repeat)
+            results[name][doc_name] = {
+                'encode_ms': round(enc_time * 1000, 3),
+                'decode_ms': round(dec_time * 1000, 3),
+                'bytes': len(blob),
+            }
+    return results
+
+
+def bench_db_size(docs, rows):
+    sizes = {}
+    encodings = ['json'] + (['msgpack'] if serializer.msgpack_available() else [])
+    methods = ['none', 'zlib'] + (['zstd'] if serializer.compression.zstandard is not None else [])
+    original = serializer.Config.CONTENT_COMPRESSION
+    try:
+        for encoding in encodings:
+            for method in methods:
+                serializer.Config.CONTENT_COMPRESSION = method
+                with tempfile.TemporaryDirectory() as tmp:
+                    path = os.path.join(tmp, 'bench.db')
+                    conn = sqlite3.connect(path)
+                    conn.execute('CREATE TABLE feature_content (feature_id TEXT PRIMARY KEY, content TEXT NOT NULL)')
+                    for i in range(rows):
+                        for doc_name, doc in docs.items():
+                            conn.execute('INSERT INTO feature_content VALUES (?, ?)',
+                                         (f'{doc_name}_{i}', serializer.encode_content(doc, encoding)))
+                    conn.commit()
+                    conn.execute('VACUUM')
+                    conn.close()
+                    sizes[f'{encoding}+{method}'] = os.path.getsize(path)
+    finally:
+        serializer.Config.CONTENT_COMPRESSION = original
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--pages', type=int, default=100)
+    parser.add_argument('--elements', type=int, default=500)
+    parser.add_argument('--rows', type=int, default=20, help='DB サイズ計測で書き込むドキュメント数（種類ごと）')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='結果を JSON で保存するパス')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    docs = {
+        'chat': make_chat(rng, args.messages),
+        'wiki': make_wiki(rng, args.pages),
+        'whiteboard': make_whiteboard(rng, args.elements),
+    }
+
+    result = {
+        'active_backend': serializer.BACKEND,
+        'codecs': bench_codecs(docs, args.repeat),
+        'db_size_bytes': bench_db_size(docs, args.rows),
+    }
+
+    for name, per_doc in result['codecs'].items():
+        for doc_name, r in per_doc.items():
+            print(f"{name:8s} {doc_name:10s} encode {r['encode_ms']:8.3f} ms  "
+                  f"decode {r['decode_ms']:8.3f} ms  {r['bytes']:>10,d} bytes")
+    for encoding, size in result['db_size_bytes'].items():
+        print(f'DB ({encoding}): {size:,d} bytes')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""bench_api.py の結果 JSON を2つ比較する
+
+    python benchmarks/compare.py before.json after.json [--threshold 10]
+
+しきい値（%）を超えて p95 が悪化したアクションがあれば終了コード 1 を返す。
+"""
+
+import argparse
+import json
+import sys
+
+
+def _pct(before, after):
+    if not before:
+        return 0.0
+    return (after - before) / before * 100.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0, help='p95 悪化とみなす割合（%%）')
+    args = parser.parse_args()
+
+    with open(args.before, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(args.after, encoding='utf-8') as f:
+        after = json.load(f)
+
+    print(f"before: {before['meta'].get('revision')}  after: {after['meta'].get('revision')}")
+    print(f"{'action':22s} {'p50':>18s} {'p95':>18s} {'p99':>18s}")
+    regressed = []
+    for action in sorted(set(before['actions']) | set(after['actions'])):
+        b = before['actions'].get(action)
+        a = after['actions'].get(action)
+        if not b or not a:
+            print(f"{action:22s} {'(only in ' + ('after' if a else 'before') + ')':>18s}")
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            cells.append(f"{b[key]:7.2f}->{a[key]:7.2f} {_pct(b[key], a[key]):+5.0f}%")
+        print(f"{action:22s} " + ' '.join(cells))
+        if _pct(b['p95_ms'], a['p95_ms']) > args.threshold:
+            regressed.append(action)
+
+    bt, at = before['total'], after['total']
+    print(f"throughput {bt['throughput_rps']} -> {at['throughput_rps']} req/s "
+          f"({_pct(bt['throughput_rps'], at['throughput_rps']):+.0f}%)")
+
+    if regressed:
+        print('regressed (p95): ' + ', '.join(regressed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
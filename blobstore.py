@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""アップロードファイルなどの実体の保存先
+
+キーは files/ からの相対パス（uploads/<ID>.png、whiteboards/<ID>.png）で、
+files テーブルの file_path（files/uploads/...）とは key_for_path で対応する。
+
+- local: files/ 以下に保存する（既定）。配信は send_from_directory のまま。
+- s3: S3 互換のオブジェクトストレージ（MinIO など、boto3 が必要）に保存し、
+  複数のアプリのノードから同じファイルを読めるようにする。
+  認証情報は boto3 の標準の方法（AWS_ACCESS_KEY_ID などの環境変数）で渡す。
+"""
+
+import os
+import posixpath
+import shutil
+import tempfile
+
+from config import Config
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover - 任意依存
+    boto3 = None
+    ClientError = None
+
+COPY_CHUNK_SIZE = 64 * 1024
+PATH_PREFIX = 'files/'
+
+
+def normalize_key(key):
+    """files/ 配下を指す正規化したキー（外に出るキーは ValueError）"""
+    key = posixpath.normpath(str(key).replace('\\', '/')).lstrip('/')
+    if key in ('', '.') or key == '..' or key.startswith('../'):
+        raise ValueError(f'不正なキーです: {key}')
+    return key
+
+
+def key_for_path(file_path):
+    """files テーブルの file_path（files/uploads/... ）からキーを得る"""
+    path = str(file_path).replace('\\', '/')
+    if path.startswith(PATH_PREFIX):
+        path = path[len(PATH_PREFIX):]
+    return normalize_key(path)
+
+
+class _CountingReader:
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self.size += len(data)
+        return data
+
+
+class LocalBlobStore:
+    kind = 'local'
+
+    def __init__(self, root='files'):
+        self.root = root
+
+    def local_path(self, key):
+        return os.path.join(self.root, *normalize_key(key).split('/'))
+
+    def put(self, key, data):
+        """bytes かファイルオブジェクトを保存してサイズを返す（書き終えてから置き換える）"""
+        path = self.local_path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, partial = tempfile.mkstemp(prefix='.partial-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    out.write(data)
+                else:
+                    shutil.copyfileobj(data, out, COPY_CHUNK_SIZE)
+            os.replace(partial, path)
+        except BaseException:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            raise
+        return os.path.getsize(path)
+
+    def open(self, key):
+        """読み込み用のファイルオブジェクト（無ければ FileNotFoundError）"""
+        return open(self.local_path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.isfile(self.local_path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.local_path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore:
+    kind = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError('S3 に保存するには boto3 をインストールしてください')
+            client = boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def _object_key(self, key):
+        return self.prefix + normalize_key(key)
+
+    def local_path(self, key):
+        return None
+
+    def put(self, key, data):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=bytes(data))
+            return len(data)
+        reader = _CountingReader(data)
+        # upload_fileobj は大きなファイルをマルチパートで少しずつ送る
+        self.client.upload_fileobj(reader, self.bucket, self._object_key(key))
+        return reader.size
+
+    def open(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))['Body']
+        except ClientError as e:
+            if _not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def _head(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if _not_found(e):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def size(self, key):
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(key)
+        return head['ContentLength']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+def _not_found(error):
+    return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+def create_blob_store():
+    """BLOB_BACKEND の設定から保存先を作成する"""
+    if Config.BLOB_BACKEND == 's3':
+        if not Config.BLOB_S3_BUCKET:
+            raise RuntimeError('BLOB_BACKEND=s3 には BLOB_S3_BUCKET が必要です')
+        return S3BlobStore(Config.BLOB_S3_BUCKET, Config.BLOB_S3_PREFIX,
+                           Config.BLOB_S3_ENDPOINT_URL, Config.BLOB_S3_REGION)
+    return LocalBlobStore(Config.BLOB_LOCAL_ROOT)
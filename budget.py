@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""予算管理の台帳と集計
+
+取引は budget_ledger に追記だけで保存する（削除・変更は取り消し行を追記）。
+口座の残高（budget_accounts.balance）と月別・年度別の集計（budget_rollups）は
+追記のたびに差分で更新するので、getBudgetSummary は取引を合計し直さずに返せる。
+台帳の金額は残高に加える符号付きで持つ（収入は正、支出は負）。クライアントは支出も
+正の金額で category='expense' として保存するので、カテゴリで符号を決める。
+年度の開始月は Config.BUDGET_FISCAL_YEAR_START_MONTH（既定は4月）。
+"""
+
+import time
+from datetime import date
+
+import database
+import repository
+import serializer
+from config import Config
+
+ENTRY_TRANSACTION = 'transaction'
+ENTRY_REVERSAL = 'reversal'
+RECENT_LIMIT = 10
+# account_id が空文字の集計行は全口座の合計
+ALL_ACCOUNTS = ''
+
+
+def init_budget_tables(cursor):
+    """予算用テーブルを作成し、新規作成時は既存ブロブの口座と取引を取り込む"""
+    exists = database.table_exists(cursor, 'budget_ledger')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS budget_accounts (
+            feature_id TEXT NOT NULL,
+            account_id TEXT NOT NULL,
+            name TEXT,
+            opening_balance REAL NOT NULL DEFAULT 0,
+            balance REAL NOT NULL DEFAULT 0,
+            data TEXT NOT NULL,
+            updated_at REAL,
+            PRIMARY KEY (feature_id, account_id),
+            FOREIGN KEY (feature_id) REFERENCES features (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS budget_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            feature_id TEXT NOT NULL,
+            transaction_id TEXT NOT NULL,
+            entry_type TEXT NOT NULL,
+            reverses INTEGER,
+            account_id TEXT,
+            amount REAL NOT NULL,
+            category TEXT,
+            date TEXT NOT NULL,
+            balance_after REAL,
+            data TEXT NOT NULL,
+            created_by TEXT,
+            created_at REAL,
+            FOREIGN KEY (feature_id) REFERENCES features (id),
+            FOREIGN KEY (reverses) REFERENCES budget_ledger (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_budget_ledger_feature
+        ON budget_ledger (feature_id, entry_type, id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_budget_ledger_reverses
+        ON budget_ledger (reverses) WHERE reverses IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS budget_rollups (
+            feature_id TEXT NOT NULL,
+            period_type TEXT NOT NULL,
+            period TEXT NOT NULL,
+            account_id TEXT NOT NULL,
+            income REAL NOT NULL DEFAULT 0,
+            expense REAL NOT NULL DEFAULT 0,
+            transfer REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (feature_id, period_type, period, account_id)
+        )
+    ''')
+    # transfer 列が無いのは収入・支出を金額の符号だけで分けていた頃の集計なので作り直す
+    if 'transfer' not in database.columns(cursor, 'budget_rollups'):
+        cursor.execute('ALTER TABLE budget_rollups ADD COLUMN transfer REAL NOT NULL DEFAULT 0')
+        rebuild_rollups(cursor)
+    normalize_ledger_signs(cursor)
+
+    if not exists:
+        rows = cursor.execute('''
+            SELECT f.id, fc.content FROM features f
+            JOIN feature_content fc ON fc.feature_id = f.id
+            WHERE f.type = 'budget'
+        ''').fetchall()
+        for feature_id, raw in rows:
+            try:
+                content = serializer.decode_content(raw)
+            except serializer.DecodeError:
+                continue
+            if sync_from_content(cursor, feature_id, content):
+                repository.update_content(cursor, feature_id, content)
+
+
+def fiscal_year(day):
+    """日付（'YYYY-MM-DD'）が属する年度（開始月の年）"""
+    year, month = int(day[:4]), int(day[5:7])
+    return year if month >= Config.BUDGET_FISCAL_YEAR_START_MONTH else year - 1
+
+
+def _fiscal_months(year):
+    start = Config.BUDGET_FISCAL_YEAR_START_MONTH
+    return [f'{year + (start + i - 1) // 12:04d}-{(start + i - 1) % 12 + 1:02d}' for i in range(12)]
+
+
+def _entry_date(transaction):
+    value = str(transaction.get('date') or '')[:10]
+    try:
+        date.fromisoformat(value)
+        return value
+    except ValueError:
+        try:
+            created = float(transaction.get('created_at') or transaction.get('createdAt') or time.time())
+        except (TypeError, ValueError):
+            created = time.time()
+        # クライアントによってはミリ秒で入っている
+        return date.fromtimestamp(created / 1000 if created > 1e11 else created).isoformat()
+
+
+def _amount(transaction):
+    try:
+        return float(transaction.get('amount') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _account_of(transaction):
+    account_id = transaction.get('account_id') or transaction.get('account')
+    return str(account_id) if account_id else None
+
+
+def _signed(amount, category):
+    """残高に加える金額。収入は正、支出は負にし、振替とカテゴリの無い取引は入力の符号のまま"""
+    if category == 'income':
+        return abs(amount)
+    if category == 'expense':
+        return -abs(amount)
+    return amount
+
+
+def _split(amount, category):
+    """(収入, 支出, 振替)。カテゴリで分け、カテゴリが無いときだけ金額の符号で分ける。
+    収入 - 支出 + 振替 は残高の増減（_signed）と一致する"""
+    if category == 'income':
+        return abs(amount), 0.0, 0.0
+    if category == 'expense':
+        return 0.0, abs(amount), 0.0
+    if category == 'transfer':
+        return 0.0, 0.0, amount
+    return (amount, 0.0, 0.0) if amount > 0 else (0.0, -amount, 0.0)
+
+
+def _apply_rollups(conn, feature_id, day, account_id, amount, category, sign):
+    """集計行を差分更新する。取り消しは元の取引と同じ列から引く（sign=-1）"""
+    income, expense, transfer = _split(amount, category)
+    periods = (('month', day[:7]), ('fiscal_year', str(fiscal_year(day))))
+    accounts = (ALL_ACCOUNTS,) + ((account_id,) if account_id else ())
+    for period_type, period in periods:
+        for account in accounts:
+            conn.execute('''
+                INSERT INTO budget_rollups (feature_id, period_type, period, account_id,
+                                            income, expense, transfer, count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (feature_id, period_type, period, account_id)
+                DO UPDATE SET income = budget_rollups.income + excluded.income,
+                              expense = budget_rollups.expense + excluded.expense,
+                              transfer = budget_rollups.transfer + excluded.transfer,
+                              count = budget_rollups.count + excluded.count
+            ''', (feature_id, period_type, period, account, sign * income, sign * expense,
+                  sign * transfer, sign))
+
+
+def rebuild_rollups(conn):
+    """台帳から集計行をすべて作り直す"""
+    conn.execute('DELETE FROM budget_rollups')
+    rows = conn.execute('''
+        SELECT feature_id, entry_type, account_id, amount, category, date FROM budget_ledger ORDER BY id
+    ''').fetchall()
+    for feature_id, entry_type, account_id, amount, category, day in rows:
+        if entry_type == ENTRY_REVERSAL:
+            # 取り消し行の金額は元の取引の符号を反転したもの
+            _apply_rollups(conn, feature_id, day, account_id, -amount, category, -1)
+        else:
+            _apply_rollups(conn, feature_id, day, account_id, amount, category, 1)
+
+
+def normalize_ledger_signs(conn):
+    """支出を正の金額のまま記録していた頃の台帳の行の符号を直し、口座の残高を計算し直す"""
+    wrong = [row[0] for row in conn.execute('''
+        SELECT id FROM budget_ledger
+        WHERE (category = 'expense' AND ((entry_type = 'transaction' AND amount > 0)
+                                         OR (entry_type = 'reversal' AND amount < 0)))
+           OR (category = 'income' AND ((entry_type = 'transaction' AND amount < 0)
+                                        OR (entry_type = 'reversal' AND amount > 0)))
+    ''')]
+    if not wrong:
+        return
+    conn.executemany('UPDATE budget_ledger SET amount = -amount WHERE id = ?', [(i,) for i in wrong])
+    balances = {
+        (row[0], row[1]): row[2]
+        for row in conn.execute('SELECT feature_id, account_id, opening_balance FROM budget_accounts')
+    }
+    for entry_id, feature_id, account_id, amount in conn.execute('''
+        SELECT id, feature_id, account_id, amount FROM budget_ledger ORDER BY id
+    ''').fetchall():
+        key = (feature_id, account_id)
+        if key not in balances:
+            continue
+        balances[key] += amount
+        conn.execute('UPDATE budget_ledger SET balance_after = ? WHERE id = ?', (balances[key], entry_id))
+    conn.executemany('UPDATE budget_accounts SET balance = ? WHERE feature_id = ? AND account_id = ?',
+                     [(balance, feature_id, account_id) for (feature_id, account_id), balance in balances.items()])
+
+
+def _apply_balance(conn, feature_id, account_id, amount):
+    """口座の残高を更新し、更新後の残高を返す（未登録の口座なら None）"""
+    if not account_id:
+        return None
+    row = conn.execute('''
+        UPDATE budget_accounts SET balance = balance + ?, updated_at = ?
+        WHERE feature_id = ? AND account_id = ?
+        RETURNING balance
+    ''', (amount, time.time(), feature_id, account_id)).fetchone()
+    return row[0] if row else None
+
+
+def append_transaction(conn, feature_id, transaction, created_by=None):
+    """取引を台帳に追記し、残高と集計を更新する。台帳の行 ID を返す"""
+    transaction_id = str(transaction.get('id') or f"transaction_{int(time.time() * 1000)}")
+    transaction = dict(transaction, id=transaction_id)
+    amount = _signed(_amount(transaction), transaction.get('category'))
+    account_id = _account_of(transaction)
+    day = _entry_date(transaction)
+    balance = _apply_balance(conn, feature_id, account_id, amount)
+    cur = conn.execute('''
+        INSERT INTO budget_ledger (feature_id, transaction_id, entry_type, account_id, amount,
+                                   category, date, balance_after, data, created_by, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (feature_id, transaction_id, ENTRY_TRANSACTION, account_id, amount,
+          transaction.get('category'), day, balance, serializer.dumps(transaction),
+          created_by or transaction.get('createdBy') or transaction.get('created_by'), time.time()))
+    _apply_rollups(conn, feature_id, day, account_id, amount, transaction.get('category'), 1)
+    return cur.lastrowid
+
+
+def reverse_entry(conn, feature_id, entry_id, created_by=None):
+    """台帳の行を取り消す行を追記する（元の行は変更しない）"""
+    row = conn.execute('''
+        SELECT transaction_id, account_id, amount, category, date, data FROM budget_ledger
+        WHERE id = ? AND feature_id = ? AND entry_type = ?
+    ''', (entry_id, feature_id, ENTRY_TRANSACTION)).fetchone()
+    if not row:
+        return None
+    transaction_id, account_id, amount, category, day, data = tuple(row)
+    balance = _apply_balance(conn, feature_id, account_id, -amount)
+    cur = conn.execute('''
+        INSERT INTO budget_ledger (feature_id, transaction_id, entry_type, reverses, account_id, amount,
+                                   category, date, balance_after, data, created_by, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (feature_id, transaction_id, ENTRY_REVERSAL, entry_id, account_id, -amount,
+          category, day, balance, data, created_by, time.time()))
+    _apply_rollups(conn, feature_id, day, account_id, amount, category, -1)
+    return cur.lastrowid
+
+
+_LIVE_ENTRIES = '''
+    SELECT l.id, l.transaction_id, l.data FROM budget_ledger l
+    WHERE l.feature_id = ? AND l.entry_type = 'transaction'
+      AND NOT EXISTS (SELECT 1 FROM budget_ledger r WHERE r.reverses = l.id)
+'''
+
+
+def sync_from_content(conn, feature_id, content):
+    """ブロブの accounts / transactions を台帳に反映し、ブロブからは取り除く。
+    ブロブに無くなった取引は取り消し、内容が変わった取引は取り消して追記する。ブロブを変更したら True"""
+    if not isinstance(content, dict):
+        return False
+    incoming_accounts = content.get('accounts')
+    incoming = content.get('transactions')
+    if not isinstance(incoming_accounts, dict) and not isinstance(incoming, dict):
+        return False
+    changed = bool(incoming_accounts) or bool(incoming)
+
+    known_accounts = {
+        row[0]: row[1]
+        for row in conn.execute(
+            'SELECT account_id, data FROM budget_accounts WHERE feature_id = ?', (feature_id,)
+        )
+    }
+    new_accounts = {}
+    if isinstance(incoming_accounts, dict):
+        for account_id, account in incoming_accounts.items():
+            if not isinstance(account, dict):
+                continue
+            account_id = str(account_id)
+            # 残高はサーバー側で管理するので比較・保存の対象にしない
+            fields = {k: v for k, v in account.items() if k != 'balance'}
+            data = serializer.dumps(fields)
+            previous = known_accounts.pop(account_id, None)
+            if previous is None:
+                new_accounts[account_id] = (account, data)
+            elif serializer.loads(previous) != fields:
+                conn.execute('''
+                    UPDATE budget_accounts SET name = ?, data = ?, updated_at = ?
+                    WHERE feature_id = ? AND account_id = ?
+                ''', (account.get('name'), data, time.time(), feature_id, account_id))
+        if known_accounts:
+            conn.executemany('DELETE FROM budget_accounts WHERE feature_id = ? AND account_id = ?',
+                             [(feature_id, account_id) for account_id in known_accounts])
+        content['accounts'] = {}
+
+    if isinstance(incoming, dict):
+        live = {row[1]: (row[0], row[2]) for row in conn.execute(_LIVE_ENTRIES, (feature_id,))}
+        for transaction_id, transaction in incoming.items():
+            if not isinstance(transaction, dict):
+                continue
+            transaction_id = str(transaction_id)
+            transaction = dict(transaction, id=transaction_id)
+            current = live.pop(transaction_id, None)
+            if current is not None:
+                if serializer.loads(current[1]) == transaction:
+                    continue
+                reverse_entry(conn, feature_id, current[0])
+            append_transaction(conn, feature_id, transaction)
+        for entry_id, _ in live.values():
+            reverse_entry(conn, feature_id, entry_id)
+        content['transactions'] = {}
+
+    # 新しい口座の期首残高 = クライアントの残高 - 台帳にある取引の合計
+    for account_id, (account, data) in new_accounts.items():
+        try:
+            balance = float(account.get('balance') or 0)
+        except (TypeError, ValueError):
+            balance = 0.0
+        posted = conn.execute(
+            'SELECT COALESCE(SUM(amount), 0) FROM budget_ledger WHERE feature_id = ? AND account_id = ?',
+            (feature_id, account_id)
+        ).fetchone()[0]
+        conn.execute('''
+            INSERT INTO budget_accounts (feature_id, account_id, name, opening_balance, balance,
+                                         data, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (feature_id, account_id, account.get('name'), balance - posted, balance, data, time.time()))
+    return changed
+
+
+def content_by_feature(conn, feature_ids):
+    """{feature_id: {'accounts': ..., 'transactions': ...}} を返す（口座は現在の残高付き）"""
+    result = {feature_id: {'accounts': {}, 'transactions': {}} for feature_id in feature_ids}
+    if not result:
+        return result
+    placeholders = ','.join('?' for _ in result)
+    for row in conn.execute(f'''
+        SELECT feature_id, account_id, balance, data FROM budget_accounts
+        WHERE feature_id IN ({placeholders})
+    ''', list(result)):
+        account = serializer.loads(row[3])
+        account['balance'] = row[2]
+        result[row[0]]['accounts'][row[1]] = account
+    for row in conn.execute(f'''
+        SELECT l.feature_id, l.transaction_id, l.data FROM budget_ledger l
+        WHERE l.feature_id IN ({placeholders}) AND l.entry_type = 'transaction'
+          AND NOT EXISTS (SELECT 1 FROM budget_ledger r WHERE r.reverses = l.id)
+        ORDER BY l.id
+    ''', list(result)):
+        result[row[0]]['transactions'][row[1]] = serializer.loads(row[2])
+    return result
+
+
+def merge_into_content(content_by_feature_id, by_feature):
+    """既存クライアント向けに content['accounts'] / content['transactions'] を戻す"""
+    for feature_id, budget in by_feature.items():
+        content = content_by_feature_id.get(feature_id)
+        if isinstance(content, dict):
+            content.update(budget)
+
+
+def _rollup_rows(conn, feature_id, period_type, account_id, periods=None):
+    sql = '''
+        SELECT period, income, expense, transfer, count FROM budget_rollups
+        WHERE feature_id = ? AND period_type = ? AND account_id = ?
+    '''
+    params = [feature_id, period_type, account_id]
+    if periods:
+        sql += ' AND period IN (%s)' % ','.join('?' for _ in periods)
+        params.extend(periods)
+    return {
+        row[0]: {'income': row[1], 'expense': row[2], 'net': row[1] - row[2], 'transfer': row[3], 'count': row[4]}
+        for row in conn.execute(sql + ' ORDER BY period', params)
+    }
+
+
+def get_summary(conn, feature_id, year=None, account_id=None):
+    """口座残高・年度別の集計・指定年度の月別集計・最近の取引を返す"""
+    account_key = account_id or ALL_ACCOUNTS
+    if year is None:
+        year = fiscal_year(date.today().isoformat())
+
+    accounts = []
+    for row in conn.execute('''
+        SELECT account_id, name, opening_balance, balance FROM budget_accounts
+        WHERE feature_id = ? ORDER BY name
+    ''', (feature_id,)):
+        accounts.append({'id': row[0], 'name': row[1], 'openingBalance': row[2], 'balance': row[3]})
+
+    fiscal_years = _rollup_rows(conn, feature_id, 'fiscal_year', account_key)
+    months = _fiscal_months(year)
+    monthly = _rollup_rows(conn, feature_id, 'month', account_key, months)
+    empty = {'income': 0.0, 'expense': 0.0, 'net': 0.0, 'transfer': 0.0, 'count': 0}
+
+    recent_sql = _LIVE_ENTRIES + (' AND l.account_id = ?' if account_id else '') + ' ORDER BY l.id DESC LIMIT ?'
+    recent_params = [feature_id] + ([account_id] if account_id else []) + [RECENT_LIMIT]
+    recent = [serializer.loads(row[2]) for row in conn.execute(recent_sql, recent_params)]
+
+    totals = {
+        'income': sum(r['income'] for r in fiscal_years.values()),
+        'expense': sum(r['expense'] for r in fiscal_years.values()),
+        'transfer': sum(r['transfer'] for r in fiscal_years.values()),
+    }
+    totals['net'] = totals['income'] - totals['expense']
+    return {
+        'accounts': accounts,
+        'totalBalance': sum(a['balance'] for a in accounts if not account_id or a['id'] == account_id),
+        'totals': totals,
+        'fiscalYearStartMonth': Config.BUDGET_FISCAL_YEAR_START_MONTH,
+        'fiscalYear': year,
+        'fiscalYearTotals': fiscal_years.get(str(year), dict(empty)),
+        'fiscalYears': [dict(v, year=int(k)) for k, v in fiscal_years.items()],
+        'months': [dict(monthly.get(month, empty), month=month) for month in months],
+        'recentTransactions': recent,
+    }
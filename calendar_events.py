@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""カレンダーのイベント保存と期間検索
+
+イベントは calendar_events に1行ずつ保存し、開始・終了日時のインデックスで
+表示期間と重なるものだけを取り出す。繰り返しイベントは系列として1行で持ち、
+getEvents の期間内に入る回だけを展開して返す。
+
+日時はタイムゾーン無しのローカル日時として 'YYYY-MM-DDTHH:MM:SS' 形式の文字列で保存する
+（文字列の大小比較がそのまま日時の比較になる）。
+"""
+
+import calendar
+from datetime import date, datetime, time as dt_time, timedelta
+
+import database
+import repository
+import serializer
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+FREQUENCIES = ('daily', 'weekly', 'monthly', 'yearly')
+MAX_RANGE_DAYS = 400
+MAX_OCCURRENCES = 2000
+
+
+def init_calendar_tables(cursor):
+    """イベント用テーブルを作成し、新規作成時は既存ブロブのイベントを取り込む"""
+    exists = database.table_exists(cursor, 'calendar_events')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS calendar_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            feature_id TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            title TEXT,
+            start_at TEXT NOT NULL,
+            end_at TEXT NOT NULL,
+            all_day BOOLEAN DEFAULT 0,
+            rrule TEXT,
+            series_end TEXT,
+            data TEXT NOT NULL,
+            UNIQUE(feature_id, event_id),
+            FOREIGN KEY (feature_id) REFERENCES features (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_calendar_events_start
+        ON calendar_events (feature_id, start_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_calendar_events_end
+        ON calendar_events (feature_id, end_at)
+    ''')
+    # 繰り返しイベントだけの部分インデックス（系列は期間外から始まることがあるため別に引く）
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_calendar_events_recurring
+        ON calendar_events (feature_id, start_at) WHERE rrule IS NOT NULL
+    ''')
+
+    if not exists:
+        rows = cursor.execute('''
+            SELECT f.id, fc.content FROM features f
+            JOIN feature_content fc ON fc.feature_id = f.id
+            WHERE f.type = 'calendar'
+        ''').fetchall()
+        for feature_id, raw in rows:
+            try:
+                content = serializer.decode_content(raw)
+            except serializer.DecodeError:
+                continue
+            if sync_from_content(cursor, feature_id, content):
+                repository.update_content(cursor, feature_id, content)
+
+
+def parse_datetime(value, end_of_day=False):
+    """'YYYY-MM-DD' または ISO 形式の日時を datetime にする（日付だけなら 0:00 か 23:59:59）"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, dt_time.max.replace(microsecond=0) if end_of_day else dt_time.min)
+    text = str(value).strip()
+    if len(text) == 10:
+        return parse_datetime(date.fromisoformat(text), end_of_day)
+    parsed = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    return parsed.replace(tzinfo=None, microsecond=0)
+
+
+def _format(value):
+    return value.strftime(DATETIME_FORMAT)
+
+
+def _parse_rule(recurrence):
+    """recurrence（'weekly' のような文字列か {'freq', 'interval', 'until', 'count'}）を正規化"""
+    if not recurrence:
+        return None
+    if isinstance(recurrence, str):
+        recurrence = {'freq': recurrence}
+    if not isinstance(recurrence, dict):
+        return None
+    freq = str(recurrence.get('freq') or recurrence.get('frequency') or '').lower()
+    if freq not in FREQUENCIES:
+        return None
+    rule = {'freq': freq, 'interval': 1}
+    try:
+        rule['interval'] = max(1, int(recurrence.get('interval') or 1))
+        if recurrence.get('count'):
+            rule['count'] = max(1, int(recurrence['count']))
+        if recurrence.get('until'):
+            rule['until'] = _format(parse_datetime(recurrence['until'], end_of_day=True))
+    except (TypeError, ValueError):
+        return None
+    return rule
+
+
+def _span(event):
+    """イベントの (開始, 終了, 終日か)。日付が無いか不正なら None"""
+    try:
+        all_day = not event.get('time')
+        start = parse_datetime(f"{event['date']}T{event['time']}" if not all_day else event['date'])
+        end_date = event.get('endDate') or event.get('end_date') or event['date']
+        end_time = event.get('endTime') or event.get('end_time')
+        if end_time:
+            end = parse_datetime(f'{end_date}T{end_time}')
+        elif all_day or end_date != event['date']:
+            end = parse_datetime(end_date, end_of_day=True)
+        else:
+            end = start
+    except (KeyError, TypeError, ValueError):
+        return None
+    return start, max(start, end), all_day
+
+
+def _add_months(value, months):
+    # 月末を超える日付（1/31 の翌月など）はその月の末日にそろえる
+    month_index = value.month - 1 + months
+    year, month = value.year + month_index // 12, month_index % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+def _occurrence(start, rule, index):
+    step = rule['interval'] * index
+    freq = rule['freq']
+    if freq == 'daily':
+        return start + timedelta(days=step)
+    if freq == 'weekly':
+        return start + timedelta(weeks=step)
+    if freq == 'monthly':
+        return _add_months(start, step)
+    return _add_months(start, step * 12)
+
+
+def _first_index(start, rule, earliest):
+    """earliest 以降に始まる可能性がある最初の回の番号（少し手前から数える）"""
+    if earliest <= start:
+        return 0
+    freq = rule['freq']
+    if freq in ('daily', 'weekly'):
+        step_days = rule['interval'] * (7 if freq == 'weekly' else 1)
+        return max(0, (earliest - start).days // step_days - 1)
+    months = (earliest.year - start.year) * 12 + earliest.month - start.month
+    step_months = rule['interval'] * (12 if freq == 'yearly' else 1)
+    return max(0, months // step_months - 1)
+
+
+def _series_end(start, end, rule):
+    """繰り返しの最後の回の終了日時（無期限なら None）"""
+    last = None
+    if rule.get('count'):
+        last = _occurrence(start, rule, rule['count'] - 1)
+    if rule.get('until'):
+        until = datetime.strptime(rule['until'], DATETIME_FORMAT)
+        last = until if last is None else min(last, until)
+    return None if last is None else _format(last + (end - start))
+
+
+def _upsert(conn, feature_id, event_id, event, data):
+    span = _span(event)
+    if span is None:
+        # 日付が読めないイベントも消さずに保存する（空文字なのでどの期間にも入らない）
+        conn.execute('''
+            INSERT INTO calendar_events (feature_id, event_id, title, start_at, end_at, data)
+            VALUES (?, ?, ?, '', '', ?)
+            ON CONFLICT (feature_id, event_id) DO UPDATE SET
+                title = excluded.title, start_at = '', end_at = '', all_day = 0,
+                rrule = NULL, series_end = NULL, data = excluded.data
+        ''', (feature_id, event_id, event.get('title'), data))
+        return
+    start, end, all_day = span
+    rule = _parse_rule(event.get('recurrence') or event.get('repeat'))
+    conn.execute('''
+        INSERT INTO calendar_events (feature_id, event_id, title, start_at, end_at, all_day,
+                                     rrule, series_end, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (feature_id, event_id) DO UPDATE SET
+            title = excluded.title, start_at = excluded.start_at, end_at = excluded.end_at,
+            all_day = excluded.all_day, rrule = excluded.rrule,
+            series_end = excluded.series_end, data = excluded.data
+    ''', (feature_id, event_id, event.get('title'), _format(start), _format(end), 1 if all_day else 0,
+          serializer.dumps(rule) if rule else None,
+          _series_end(start, end, rule) if rule else None, data))
+
+
+def sync_from_content(conn, feature_id, content):
+    """ブロブに書かれた content['events'] をテーブルに反映し、ブロブからは取り除く。
+    content['events'] がある場合はそれを正とし、含まれないイベントは削除する。ブロブを変更したら True"""
+    if not isinstance(content, dict) or not isinstance(content.get('events'), dict):
+        return False
+    incoming = content['events']
+    existing = {
+        row[0]: row[1]
+        for row in conn.execute(
+            'SELECT event_id, data FROM calendar_events WHERE feature_id = ?', (feature_id,)
+        )
+    }
+    for event_id, event in incoming.items():
+        if not isinstance(event, dict):
+            continue
+        event_id = str(event_id)
+        event = dict(event, id=event.get('id', event_id))
+        previous = existing.pop(event_id, None)
+        if previous is not None and serializer.loads(previous) == event:
+            continue
+        _upsert(conn, feature_id, event_id, event, serializer.dumps(event))
+    if existing:
+        conn.executemany('DELETE FROM calendar_events WHERE feature_id = ? AND event_id = ?',
+                         [(feature_id, event_id) for event_id in existing])
+
+    changed = bool(incoming)
+    content['events'] = {}
+    return changed
+
+
+def events_by_feature(conn, feature_ids):
+    """{feature_id: {event_id: イベント}} を1クエリで返す（展開前の元データ）"""
+    result = {feature_id: {} for feature_id in feature_ids}
+    if not result:
+        return result
+    placeholders = ','.join('?' for _ in result)
+    for row in conn.execute(
+        f'SELECT feature_id, event_id, data FROM calendar_events WHERE feature_id IN ({placeholders})',
+        list(result)
+    ):
+        result[row[0]][row[1]] = serializer.loads(row[2])
+    return result
+
+
+def merge_into_content(content_by_feature, by_feature):
+    """既存クライアントの月表示用に、テーブルのイベントを content['events'] に戻す"""
+    for feature_id, feature_events in by_feature.items():
+        content = content_by_feature.get(feature_id)
+        if isinstance(content, dict):
+            content['events'] = feature_events
+
+
+def _instance(event, start, end, all_day, index=None):
+    item = dict(event)
+    item['date'] = start.date().isoformat()
+    if not all_day:
+        item['time'] = start.strftime('%H:%M')
+    item['start'] = _format(start)
+    item['end'] = _format(end)
+    if index is not None:
+        item['recurring'] = True
+        item['occurrence'] = index
+    return item
+
+
+def get_events(conn, feature_id, range_start, range_end):
+    """[range_start, range_end] と重なるイベント（繰り返しは展開済み）を
+    (開始順の一覧, 上限で打ち切ったか) で返す"""
+    instances = [item for _, item in _expand(conn, [feature_id], range_start, range_end)]
+    instances.sort(key=lambda item: (item['start'], str(item.get('id'))))
+    truncated = len(instances) > MAX_OCCURRENCES
+    return instances[:MAX_OCCURRENCES], truncated
+
+
+def upcoming_events(conn, feature_ids, range_start, range_end):
+    """複数のカレンダー機能から期間内のイベントを開始順に集める（ホーム画面用）。
+    各イベントには featureId を付け、件数は MAX_OCCURRENCES で打ち切る"""
+    instances = [dict(item, featureId=feature_id)
+                 for feature_id, item in _expand(conn, feature_ids, range_start, range_end)]
+    instances.sort(key=lambda item: (item['start'], item['featureId'], str(item.get('id'))))
+    return instances[:MAX_OCCURRENCES]
+
+
+def _expand(conn, feature_ids, range_start, range_end):
+    """期間と重なるイベントを (feature_id, 展開済みイベント) の一覧で返す（並びは未整列）"""
+    if not feature_ids:
+        return []
+    window_start = _format(range_start)
+    window_end = _format(range_end)
+    placeholders = ','.join('?' for _ in feature_ids)
+    instances = []
+
+    # 単発イベント: 開始が期間の終わり以前、終了が期間の始め以降
+    for row in conn.execute(f'''
+        SELECT feature_id, start_at, end_at, all_day, data FROM calendar_events
+        WHERE feature_id IN ({placeholders}) AND rrule IS NULL AND start_at <= ? AND end_at >= ?
+        ORDER BY start_at
+    ''', (*feature_ids, window_end, window_start)):
+        start = datetime.strptime(row[1], DATETIME_FORMAT)
+        end = datetime.strptime(row[2], DATETIME_FORMAT)
+        instances.append((row[0], _instance(serializer.loads(row[4]), start, end, bool(row[3]))))
+
+    # 繰り返しイベント: 系列が期間と重なるものだけを展開
+    for row in conn.execute(f'''
+        SELECT feature_id, start_at, end_at, all_day, rrule, data FROM calendar_events
+        WHERE feature_id IN ({placeholders}) AND rrule IS NOT NULL AND start_at <= ?
+              AND (series_end IS NULL OR series_end >= ?)
+    ''', (*feature_ids, window_end, window_start)):
+        start = datetime.strptime(row[1], DATETIME_FORMAT)
+        duration = datetime.strptime(row[2], DATETIME_FORMAT) - start
+        rule = serializer.loads(row[4])
+        until = datetime.strptime(rule['until'], DATETIME_FORMAT) if rule.get('until') else None
+        event = serializer.loads(row[5])
+        index = _first_index(start, rule, range_start - duration)
+        while len(instances) <= MAX_OCCURRENCES:
+            if rule.get('count') and index >= rule['count']:
+                break
+            occurrence = _occurrence(start, rule, index)
+            if occurrence > range_end or (until and occurrence > until):
+                break
+            if occurrence + duration >= range_start:
+                instances.append((row[0], _instance(event, occurrence, occurrence + duration,
+                                                    bool(row[3]), index)))
+            index += 1
+
+    return instances
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""圧縮ユーティリティ
+
+- feature_content の大きな行を zlib / zstd で圧縮する（serializer から利用）
+- Accept-Encoding に応じて HTTP レスポンスを gzip / brotli で圧縮する
+"""
+
+import gzip
+import zlib
+
+from config import Config
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 任意依存
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 任意依存
+    brotli = None
+
+
+# 保存用ヘッダーの上位4ビット
+COMPRESS_NONE = 0x00
+COMPRESS_ZLIB = 0x10
+COMPRESS_ZSTD = 0x20
+COMPRESS_MASK = 0xF0
+
+COMPRESSIBLE_MIMETYPES = (
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/javascript',
+    'text/plain',
+    'image/svg+xml',
+)
+
+if zstandard is not None:
+    _zstd_compressor = zstandard.ZstdCompressor(level=Config.CONTENT_COMPRESSION_LEVEL)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+
+
+def blob_compression():
+    """設定から保存用の圧縮方式を決める（zstd が無ければ zlib）"""
+    method = Config.CONTENT_COMPRESSION
+    if method == 'zstd' and zstandard is not None:
+        return COMPRESS_ZSTD
+    if method in ('zlib', 'zstd'):
+        return COMPRESS_ZLIB
+    return COMPRESS_NONE
+
+
+def compress_blob(data, method):
+    if method == COMPRESS_ZSTD:
+        return _zstd_compressor.compress(data)
+    if method == COMPRESS_ZLIB:
+        return zlib.compress(data, min(Config.CONTENT_COMPRESSION_LEVEL, 9))
+    return data
+
+
+def decompress_blob(data, method):
+    if method == COMPRESS_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('zstd で圧縮された行を読むには zstandard が必要です')
+        return _zstd_decompressor.decompress(data)
+    if method == COMPRESS_ZLIB:
+        return zlib.decompress(data)
+    return data
+
+
+def negotiate_encoding(accept_encoding):
+    """Accept-Encoding ヘッダーから使用するエンコーディングを選ぶ"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0 or accepted.get('*', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=Config.RESPONSE_BROTLI_QUALITY)
+    # mtime=0 で同じ入力からは同じ出力になる
+    return gzip.compress(data, compresslevel=Config.RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response, accept_encoding):
+    """after_request 用: 条件を満たすレスポンスを圧縮する"""
+    if not Config.RESPONSE_COMPRESSION:
+        return response
+    if response.status_code != 200:
+        return response
+    # ジェネレーターによるストリーミングは対象外（send_file() のファイルは除く）
+    if response.is_streamed and not response.direct_passthrough:
+        return response
+    if 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    # send_file() の direct_passthrough を解除して本文を取得
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < Config.RESPONSE_COMPRESSION_MIN_SIZE:
+        return response
+
+    response.set_data(compress_body(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # 圧縮後は同一バイト列ではないため弱い ETag にする（304 判定は引き続き有効）
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -7,3 +7,113 @@ class Config:
     DEBUG = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
     HOST = os.environ.get('FLASK_HOST', '0.0.0.0')
     PORT = int(os.environ.get('FLASK_PORT', 8060))
+
+    # JSON シリアライザ（auto / orjson / msgspec / json）
+    JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto').lower()
+    # feature_content の保存形式（json / msgpack）
+    CONTENT_ENCODING = os.environ.get('CONTENT_ENCODING', 'json').lower()
+
+    # feature_content の圧縮（none / zlib / zstd）としきい値（バイト）
+    CONTENT_COMPRESSION = os.environ.get('CONTENT_COMPRESSION', 'none').lower()
+    CONTENT_COMPRESSION_THRESHOLD = int(os.environ.get('CONTENT_COMPRESSION_THRESHOLD', 4096))
+    CONTENT_COMPRESSION_LEVEL = int(os.environ.get('CONTENT_COMPRESSION_LEVEL', 6))
+
+    # HTTP レスポンス圧縮（Accept-Encoding で gzip / brotli を選択）
+    RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', 'True').lower() == 'true'
+    RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', 1024))
+    RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', 6))
+    RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', 5))
+
+    # index.html を起動時に事前圧縮して ETag / 304 付きで配信
+    STATIC_PRECOMPRESS = os.environ.get('STATIC_PRECOMPRESS', 'True').lower() == 'true'
+    # インラインの CSS / JS をハッシュ付きアセットに切り出す
+    STATIC_SPLIT_ASSETS = os.environ.get('STATIC_SPLIT_ASSETS', 'False').lower() == 'true'
+
+    # リクエストプロファイリング（遅いリクエストを logs/ に JSON Lines で記録）
+    PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', 'False').lower() == 'true'
+    PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 500))
+    PROFILE_LOG_ALL = os.environ.get('PROFILE_LOG_ALL', 'False').lower() == 'true'
+    PROFILE_LOG_DIR = os.environ.get('PROFILE_LOG_DIR', 'logs')
+    PROFILE_LOG_MAX_BYTES = int(os.environ.get('PROFILE_LOG_MAX_BYTES', 10 * 1024 * 1024))
+    PROFILE_LOG_BACKUP_COUNT = int(os.environ.get('PROFILE_LOG_BACKUP_COUNT', 5))
+    # cProfile を取るリクエストの割合（0.0〜1.0）と出力行数
+    PROFILE_CPROFILE_RATE = float(os.environ.get('PROFILE_CPROFILE_RATE', 0.0))
+    PROFILE_CPROFILE_LINES = int(os.environ.get('PROFILE_CPROFILE_LINES', 30))
+    # しきい値を超えたリクエストのスタックを記録
+    PROFILE_STACK_CAPTURE = os.environ.get('PROFILE_STACK_CAPTURE', 'True').lower() == 'true'
+
+    # SQL トレース（/api.cgi に X-SQL-* ヘッダーを付け、N+1 の疑いを出力）
+    SQL_TRACE = os.environ.get('SQL_TRACE', 'False').lower() == 'true'
+    SQL_TRACE_REPEAT_THRESHOLD = int(os.environ.get('SQL_TRACE_REPEAT_THRESHOLD', 3))
+
+    # 予算管理の年度の開始月（1〜12）
+    BUDGET_FISCAL_YEAR_START_MONTH = int(os.environ.get('BUDGET_FISCAL_YEAR_START_MONTH', 4))
+
+    # Wiki の版履歴で全文スナップショットを置く間隔（それ以外の版は差分で保存）
+    WIKI_SNAPSHOT_INTERVAL = int(os.environ.get('WIKI_SNAPSHOT_INTERVAL', 20))
+
+    # メンバーシップ／ロールのキャッシュを保持する秒数（他プロセスでの変更が反映されるまでの上限）
+    MEMBERSHIP_CACHE_TTL = float(os.environ.get('MEMBERSHIP_CACHE_TTL', 60))
+
+    # 最終ログイン時刻・ダウンロード数などの記録をまとめて書き込む間隔と件数（無効にすると即時に書き込む）
+    WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', 'True').lower() == 'true'
+    WRITE_BEHIND_INTERVAL_MS = float(os.environ.get('WRITE_BEHIND_INTERVAL_MS', 500))
+    WRITE_BEHIND_MAX_ITEMS = int(os.environ.get('WRITE_BEHIND_MAX_ITEMS', 1000))
+
+    # 投稿などの書き込みを1本のスレッドでまとめてコミットする（無効にするとリクエストごとにコミット）
+    WRITE_GROUP_COMMIT = os.environ.get('WRITE_GROUP_COMMIT', 'True').lower() == 'true'
+    WRITE_GROUP_MAX_JOBS = int(os.environ.get('WRITE_GROUP_MAX_JOBS', 32))
+    WRITE_GROUP_MAX_DELAY_MS = float(os.environ.get('WRITE_GROUP_MAX_DELAY_MS', 2))
+
+    # パスワードのハッシュ方式（scrypt / pbkdf2_sha256）とコスト、計算に使うスレッド数
+    PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'scrypt')
+    PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+    PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+    PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+    PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600000))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+
+    # ログイン試行の制限（ユーザー名ごと・IP ごとのトークンバケット。登録は IP ごと）
+    LOGIN_RATE_LIMIT = os.environ.get('LOGIN_RATE_LIMIT', 'True').lower() == 'true'
+    LOGIN_USER_BURST = int(os.environ.get('LOGIN_USER_BURST', 10))
+    LOGIN_USER_PER_MINUTE = float(os.environ.get('LOGIN_USER_PER_MINUTE', 5))
+    LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST', 30))
+    LOGIN_IP_PER_MINUTE = float(os.environ.get('LOGIN_IP_PER_MINUTE', 60))
+
+    # オンラインバックアップ（backup.py）。BACKUP_ADMINS はカンマ区切りのユーザー名で、
+    # 空なら API からは実行できない（python backup.py create は使える）
+    BACKUP_DIR = os.environ.get('BACKUP_DIR') or 'data/backups'
+    BACKUP_COMPRESSION = os.environ.get('BACKUP_COMPRESSION', 'gzip')
+    BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))
+    BACKUP_STEP_SLEEP_MS = float(os.environ.get('BACKUP_STEP_SLEEP_MS', 10))
+    BACKUP_MAX_RESTARTS = int(os.environ.get('BACKUP_MAX_RESTARTS', 5))
+    BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 14))
+    BACKUP_ADMINS = frozenset(name.strip() for name in os.environ.get('BACKUP_ADMINS', '').split(',') if name.strip())
+
+    # 保存先のバックエンド（database.py / blobstore.py）。DATABASE_URL が空なら
+    # DATABASE_PATH の SQLite、postgresql://... は psycopg、BLOB_BACKEND=s3 は boto3 が必要
+    DATABASE_URL = os.environ.get('DATABASE_URL', '')
+    BLOB_BACKEND = os.environ.get('BLOB_BACKEND', 'local').lower()
+    BLOB_LOCAL_ROOT = os.environ.get('BLOB_LOCAL_ROOT') or 'files'
+    BLOB_S3_BUCKET = os.environ.get('BLOB_S3_BUCKET', '')
+    BLOB_S3_PREFIX = os.environ.get('BLOB_S3_PREFIX', '')
+    BLOB_S3_ENDPOINT_URL = os.environ.get('BLOB_S3_ENDPOINT_URL', '')
+    BLOB_S3_REGION = os.environ.get('BLOB_S3_REGION', '')
+
+    # リアルタイムのイベント配信（events.py）。EVENT_TRANSPORT は memory / sqlite / redis
+    EVENT_TRANSPORT = os.environ.get('EVENT_TRANSPORT', 'memory').lower()
+    EVENT_BATCH_MS = float(os.environ.get('EVENT_BATCH_MS', 20))
+    EVENT_BATCH_MAX = int(os.environ.get('EVENT_BATCH_MAX', 100))
+    EVENT_BUFFER_SIZE = int(os.environ.get('EVENT_BUFFER_SIZE', 2000))
+    EVENT_POLL_TIMEOUT = float(os.environ.get('EVENT_POLL_TIMEOUT', 25))
+    EVENT_POLL_LIMIT = int(os.environ.get('EVENT_POLL_LIMIT', 200))
+    EVENT_SQLITE_PATH = os.environ.get('EVENT_SQLITE_PATH') or 'data/events.db'
+    EVENT_POLL_MS = float(os.environ.get('EVENT_POLL_MS', 200))
+    EVENT_RETENTION_SECONDS = int(os.environ.get('EVENT_RETENTION_SECONDS', 3600))
+    EVENT_REDIS_URL = os.environ.get('EVENT_REDIS_URL', 'redis://localhost:6379/0')
+    EVENT_REDIS_PREFIX = os.environ.get('EVENT_REDIS_PREFIX', 'circle')
+    EVENT_REDIS_RETAIN = int(os.environ.get('EVENT_REDIS_RETAIN', 10000))
+
+    # オンライン状態・入力中の表示の期限（秒、presence.py）
+    PRESENCE_TTL = float(os.environ.get('PRESENCE_TTL', 45))
+    PRESENCE_TYPING_TTL = float(os.environ.get('PRESENCE_TYPING_TTL', 6))
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""データベースの接続（バックエンドの切り替え）
+
+DATABASE_URL でバックエンドを選ぶ。既定は sqlite:///<DATABASE_PATH>。
+
+- SQLite: 従来どおり sqlite3 の接続（行は sqlite3.Row、SQL の計測付き）を返す。
+- PostgreSQL（postgresql://...、psycopg が必要）: sqlite3 の接続と同じ使い方が
+  できるラッパーを返す。行は位置とカラム名のどちらでも読める。
+
+各モジュールの SQL は SQLite と PostgreSQL の共通部分で書き（? のプレースホルダー、
+INSERT ... ON CONFLICT、ON CONFLICT の UPDATE 側ではテーブル名で修飾した列）、
+PostgreSQL では translate で次だけを書き換える。
+
+- ? → %s、INSERT OR IGNORE → ON CONFLICT DO NOTHING、BEGIN IMMEDIATE → BEGIN
+- LIKE → ILIKE（SQLite の LIKE は英字の大文字・小文字を区別しない）
+- CURRENT_TIMESTAMP → UTC の 'YYYY-MM-DD HH:MM:SS'（日時は SQLite と同じく文字列で持つ）
+- CREATE TABLE / ALTER TABLE の型: INTEGER PRIMARY KEY AUTOINCREMENT → BIGSERIAL、
+  INTEGER → BIGINT（ミリ秒の時刻が入る）、REAL → DOUBLE PRECISION、BLOB → BYTEA、
+  BOOLEAN → SMALLINT（0 / 1 で比較している）、TIMESTAMP / DATETIME → TEXT
+
+パラメーターの bool は 0 / 1、datetime は sqlite3 と同じ ISO 形式の文字列にして渡す。
+SQLite にしか無いもの（sqlite_master、PRAGMA table_info）は table_exists / columns を使う。
+"""
+
+import datetime
+import decimal
+import functools
+import os
+import re
+import sqlite3
+import time
+
+import profiling
+import querytrace
+from config import Config
+
+try:
+    import psycopg
+except ImportError:  # pragma: no cover - 任意依存
+    psycopg = None
+
+SQLITE = 'sqlite'
+POSTGRESQL = 'postgresql'
+
+# 両方のバックエンドの例外（except database.Error: で受ける）
+Error = (sqlite3.Error,) + ((psycopg.Error,) if psycopg else ())
+IntegrityError = (sqlite3.IntegrityError,) + ((psycopg.IntegrityError,) if psycopg else ())
+OperationalError = (sqlite3.OperationalError,) + ((psycopg.OperationalError,) if psycopg else ())
+
+
+class SQLiteBackend:
+    name = SQLITE
+
+    def __init__(self, path):
+        self.path = path
+
+    def _prepare(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def connect(self):
+        """ハンドラー用の接続（行は sqlite3.Row、SQL を計測する）"""
+        self._prepare()
+        conn = sqlite3.connect(self.path, factory=profiling.ProfiledConnection)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def connect_raw(self):
+        """スキーマ作成やバックアップ用の素の接続"""
+        self._prepare()
+        return sqlite3.connect(self.path)
+
+
+class PostgresBackend:
+    name = POSTGRESQL
+
+    def __init__(self, url):
+        if psycopg is None:
+            raise RuntimeError('PostgreSQL を使うには psycopg をインストールしてください（pip install "psycopg[binary]"）')
+        self.url = url
+
+    def connect(self):
+        return PostgresConnection(psycopg.connect(self.url, row_factory=_row_factory))
+
+    connect_raw = connect
+
+
+# ---- PostgreSQL 用のラッパー ----------------------------------------------
+
+class Row(tuple):
+    """sqlite3.Row と同じく位置でもカラム名でも読める行"""
+
+    def __new__(cls, values, index):
+        row = super().__new__(cls, values)
+        row._index = index
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return super().__getitem__(key)
+
+    def keys(self):
+        return list(self._index)
+
+
+def _value(value):
+    # SUM などの numeric は sqlite3 と同じく int / float で返す
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+def _row_factory(cursor):
+    index = {column.name: i for i, column in enumerate(cursor.description or ())}
+    return lambda values: Row([_value(value) for value in values], index)
+
+
+def _param(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(' ')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+_NOW = "(to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'))"
+_TOKENS = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\?|%|\bCURRENT_TIMESTAMP\b|\bLIKE\b", re.IGNORECASE
+)
+_INSERT_OR_IGNORE = re.compile(r'^\s*INSERT\s+OR\s+IGNORE\s+INTO\b', re.IGNORECASE)
+_DDL = re.compile(r'^\s*(CREATE\s+TABLE|ALTER\s+TABLE)\b', re.IGNORECASE)
+_DDL_TYPES = (
+    (re.compile(r'\bINTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT\b', re.IGNORECASE), 'BIGSERIAL PRIMARY KEY'),
+    (re.compile(r'\bINTEGER\b', re.IGNORECASE), 'BIGINT'),
+    (re.compile(r'\bREAL\b', re.IGNORECASE), 'DOUBLE PRECISION'),
+    (re.compile(r'\bBLOB\b', re.IGNORECASE), 'BYTEA'),
+    (re.compile(r'\bBOOLEAN\b', re.IGNORECASE), 'SMALLINT'),
+    (re.compile(r'\b(?:TIMESTAMP|DATETIME)\b', re.IGNORECASE), 'TEXT'),
+)
+
+
+@functools.lru_cache(maxsize=2048)
+def translate(sql):
+    """SQLite と共通の書き方の SQL を PostgreSQL（psycopg）向けに書き換える"""
+    stripped = sql.strip().rstrip(';')
+    if re.fullmatch(r'BEGIN(\s+(IMMEDIATE|DEFERRED|EXCLUSIVE))?', stripped, re.IGNORECASE):
+        return 'BEGIN'
+    if _INSERT_OR_IGNORE.match(stripped):
+        stripped = _INSERT_OR_IGNORE.sub('INSERT INTO', stripped) + ' ON CONFLICT DO NOTHING'
+    ddl = _DDL.match(stripped) is not None
+
+    def replace(match):
+        token = match.group(0)
+        if token == '?':
+            return '%s'
+        if token[0] in '\'"':
+            # psycopg はパラメーターがあると文字列リテラルの中の % も解釈する
+            return token.replace('%', '%%')
+        if token == '%':
+            return '%%'
+        upper = token.upper()
+        if upper == 'LIKE':
+            return 'ILIKE'
+        return _NOW
+
+    if ddl:
+        # 型の書き換えは文字列リテラルの外だけに行う
+        parts = re.split(r"('(?:[^']|'')*')", stripped)
+        for i in range(0, len(parts), 2):
+            for pattern, replacement in _DDL_TYPES:
+                parts[i] = pattern.sub(replacement, parts[i])
+        stripped = ''.join(parts)
+    return _TOKENS.sub(replace, stripped)
+
+
+class PostgresCursor:
+    backend = POSTGRESQL
+
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+
+    def _observed(self, method, sql, parameters, recorded):
+        # profiling.ProfiledCursor と同じくプロファイルとクエリトレースに記録する
+        profile = profiling.current()
+        traces = querytrace.active()
+        if profile is None and not traces:
+            return method(translate(sql), parameters)
+        start = time.perf_counter()
+        try:
+            return method(translate(sql), parameters)
+        finally:
+            duration = time.perf_counter() - start
+            if profile is not None:
+                profile.add_query(sql, duration)
+            for trace in traces:
+                trace.add_query(sql, recorded, duration)
+
+    def execute(self, sql, params=()):
+        if re.fullmatch(r'\s*BEGIN(\s+\w+)?\s*;?\s*', sql, re.IGNORECASE) and not self._conn.raw.autocommit:
+            # 自動コミットでなければ psycopg が次の文の前に BEGIN を発行する
+            return self
+        # 空でもタプルを渡し、% のエスケープを常に解釈させる
+        params = tuple(_param(value) for value in params)
+        self._observed(self._cursor.execute, sql, params, params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        rows = [tuple(_param(value) for value in params) for params in seq_of_params]
+        if rows:
+            self._observed(self._cursor.executemany, sql, rows, ('<many>',))
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone() if self._cursor.description else None
+
+    def fetchmany(self, size=None):
+        if not self._cursor.description:
+            return []
+        return self._cursor.fetchmany(size) if size else self._cursor.fetchmany()
+
+    def fetchall(self):
+        return self._cursor.fetchall() if self._cursor.description else []
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def lastrowid(self):
+        # 直前に採番したシーケンスの値（BIGSERIAL の id）。失敗してもトランザクションを壊さない
+        raw = self._conn.raw
+        savepoint = self._conn.in_transaction
+        with raw.cursor() as cursor:
+            if savepoint:
+                cursor.execute('SAVEPOINT lastrowid')
+            try:
+                cursor.execute('SELECT lastval()')
+                value = cursor.fetchone()[0]
+            except psycopg.Error:
+                if savepoint:
+                    cursor.execute('ROLLBACK TO SAVEPOINT lastrowid')
+                value = None
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT lastrowid')
+        return value
+
+    def close(self):
+        self._cursor.close()
+
+
+class PostgresConnection:
+    """sqlite3.Connection と同じ使い方ができる PostgreSQL の接続"""
+
+    backend = POSTGRESQL
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def cursor(self):
+        return PostgresCursor(self, self.raw.cursor())
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+    @property
+    def in_transaction(self):
+        return self.raw.info.transaction_status != psycopg.pq.TransactionStatus.IDLE
+
+    @property
+    def isolation_level(self):
+        return None if self.raw.autocommit else ''
+
+    @isolation_level.setter
+    def isolation_level(self, value):
+        # sqlite3 と同じく None で BEGIN / COMMIT を呼び出し側が発行する
+        self.raw.autocommit = value is None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+def is_postgres(conn):
+    """接続（またはカーソル）が PostgreSQL のものか"""
+    return getattr(conn, 'backend', SQLITE) == POSTGRESQL
+
+
+def table_exists(conn, name):
+    if is_postgres(conn):
+        return conn.execute('''
+            SELECT 1 FROM information_schema.tables
+            WHERE table_schema = current_schema() AND table_name = ?
+        ''', (name,)).fetchone() is not None
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def columns(conn, table):
+    """テーブルのカラム名の一覧（定義順）"""
+    if is_postgres(conn):
+        return [row[0] for row in conn.execute('''
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = ?
+            ORDER BY ordinal_position
+        ''', (table,))]
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+# ---- バックエンドの選択 ------------------------------------------------------
+
+def create_backend(url=None):
+    url = url or Config.DATABASE_URL or f'sqlite:///{Config.DATABASE_PATH}'
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith(('postgresql://', 'postgres://')):
+        return PostgresBackend(url)
+    raise RuntimeError(f'DATABASE_URL のバックエンドに対応していません: {url.split(":", 1)[0]}')
+
+
+_backend = None
+
+
+def backend():
+    """設定から作ったバックエンド（プロセスで1つ）"""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+
+def connect():
+    return backend().connect()
+
+
+def connect_raw():
+    return backend().connect_raw()
+
+
+def sqlite_path():
+    """SQLite のファイルのパス（SQLite 以外なら None）"""
+    current = backend()
+    return current.path if current.name == SQLITE else None
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""日記エントリの保存と月単位の取得
+
+エントリは diary_entries に1行ずつ保存し、diary 機能のブロブには書き込まない。
+今日の日記は1行の INSERT で済み、日記を開いたときは (feature_id, entry_date) の
+インデックスで1か月分だけを返す。クライアントは全件を持たないので、ブロブ経由で
+届いた content['entries'] は含まれるエントリの追加・更新だけに使い、含まれない
+エントリを削除扱いにはしない（削除は deleteDiaryEntry で行う）。
+"""
+
+import time
+
+import database
+import repository
+import serializer
+
+# 専用の列を持つフィールド（それ以外は data に JSON で保存）
+_COLUMNS = ('id', 'title', 'content', 'author', 'private', 'created_at', 'updated_at')
+
+
+def init_diary_tables(cursor):
+    """日記用テーブルを作成し、新規作成時は既存ブロブのエントリを取り込む"""
+    exists = database.table_exists(cursor, 'diary_entries')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diary_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            feature_id TEXT NOT NULL,
+            entry_id TEXT NOT NULL,
+            author TEXT,
+            entry_date TEXT NOT NULL,
+            title TEXT NOT NULL,
+            body TEXT NOT NULL,
+            is_private INTEGER NOT NULL DEFAULT 0,
+            created_at REAL,
+            updated_at REAL,
+            data TEXT,
+            UNIQUE(feature_id, entry_id),
+            FOREIGN KEY (feature_id) REFERENCES features (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_diary_entries_date
+        ON diary_entries (feature_id, entry_date)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_diary_entries_author
+        ON diary_entries (feature_id, author, entry_date)
+    ''')
+
+    if not exists:
+        rows = cursor.execute('''
+            SELECT f.id, fc.content FROM features f
+            JOIN feature_content fc ON fc.feature_id = f.id
+            WHERE f.type = 'diary'
+        ''').fetchall()
+        for feature_id, raw in rows:
+            try:
+                content = serializer.decode_content(raw)
+            except serializer.DecodeError:
+                continue
+            if sync_from_content(cursor, feature_id, content):
+                repository.update_content(cursor, feature_id, content)
+
+
+def _text(value):
+    return value if isinstance(value, str) else ('' if value is None else str(value))
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def entry_date(timestamp):
+    """UNIX 時刻をサーバーのローカル日付（YYYY-MM-DD）にする"""
+    return time.strftime('%Y-%m-%d', time.localtime(timestamp))
+
+
+def month_range(month):
+    """'YYYY-MM' を [月初, 翌月初) の日付文字列にする。不正なら ValueError"""
+    year, mon = (int(part) for part in month.split('-'))
+    if not 1 <= mon <= 12 or not 1 <= year <= 9999:
+        raise ValueError(month)
+    next_year, next_mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+    return f'{year:04d}-{mon:02d}-01', f'{next_year:04d}-{next_mon:02d}-01'
+
+
+def _row_values(entry):
+    data = {k: v for k, v in entry.items() if k not in _COLUMNS}
+    created_at = _number(entry.get('created_at')) or time.time()
+    return (
+        entry.get('author'),
+        entry_date(created_at),
+        _text(entry.get('title')),
+        _text(entry.get('content')),
+        1 if entry.get('private') else 0,
+        created_at,
+        _number(entry.get('updated_at')),
+        serializer.dumps(data) if data else None,
+    )
+
+
+def save_entry(conn, feature_id, entry_id, entry, author=None):
+    """エントリを1件追加・更新する。author を指定したら既存のエントリは本人のものだけ上書きする。
+    書き込んだら True"""
+    sql = '''
+        INSERT INTO diary_entries (feature_id, entry_id, author, entry_date, title, body,
+                                   is_private, created_at, updated_at, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (feature_id, entry_id) DO UPDATE SET
+            author = excluded.author, entry_date = excluded.entry_date, title = excluded.title,
+            body = excluded.body, is_private = excluded.is_private,
+            created_at = excluded.created_at, updated_at = excluded.updated_at, data = excluded.data
+    '''
+    params = (feature_id, str(entry_id)) + _row_values(entry)
+    if author is not None:
+        sql += ' WHERE diary_entries.author = ?'
+        params += (author,)
+    return conn.execute(sql, params).rowcount > 0
+
+
+def delete_entry(conn, feature_id, entry_id, author=None):
+    """エントリを削除する。author を指定したら本人のエントリだけ。削除したら True"""
+    sql = 'DELETE FROM diary_entries WHERE feature_id = ? AND entry_id = ?'
+    params = [feature_id, entry_id]
+    if author is not None:
+        sql += ' AND author = ?'
+        params.append(author)
+    return conn.execute(sql, params).rowcount > 0
+
+
+def sync_from_content(conn, feature_id, content, username=None):
+    """ブロブに書かれた content['entries'] をテーブルに反映し、ブロブからは取り除く。
+    変更のあったエントリだけ書き込み、含まれないエントリはそのまま残す。
+    username を指定したら、そのユーザーが作者のエントリだけを受け付ける（他人のエントリの
+    書き換えや作者のなりすましは無視する）。書き込んだエントリを {entry_id: エントリ} で返す"""
+    saved = {}
+    if not isinstance(content, dict) or not isinstance(content.get('entries'), dict):
+        return saved
+    incoming = content['entries']
+    existing = {}
+    if incoming:
+        for row in conn.execute(_SELECT + ' WHERE feature_id = ?', (feature_id,)):
+            existing[row[0]] = _row_values(_entry_from_row(row))
+
+    for entry_id, entry in incoming.items():
+        if not isinstance(entry, dict):
+            continue
+        entry_id = str(entry_id)
+        entry = dict(entry, id=entry_id)
+        if username is not None and entry.get('author') != username:
+            continue
+        if existing.get(entry_id) == _row_values(entry):
+            continue
+        if save_entry(conn, feature_id, entry_id, entry, username):
+            saved[entry_id] = entry
+
+    content['entries'] = {}
+    return saved
+
+
+_SELECT = '''
+    SELECT entry_id, author, title, body, is_private, created_at, updated_at, data
+    FROM diary_entries
+'''
+
+
+def _entry_from_row(row):
+    entry_id, author, title, body, is_private, created_at, updated_at, data = tuple(row)
+    entry = serializer.loads(data) if data else {}
+    entry.update({
+        'id': entry_id,
+        'title': title,
+        'content': body,
+        'author': author,
+        'private': bool(is_private),
+        'created_at': created_at,
+    })
+    if updated_at is not None:
+        entry['updated_at'] = updated_at
+    return entry
+
+
+def entries_by_feature(conn, feature_ids=None):
+    """{feature_id: {entry_id: エントリ}} を1クエリで返す（検索インデックスの再構築用）"""
+    sql = '''
+        SELECT feature_id, entry_id, author, title, body, is_private, created_at, updated_at, data
+        FROM diary_entries
+    '''
+    params = []
+    if feature_ids is not None:
+        result = {feature_id: {} for feature_id in feature_ids}
+        if not result:
+            return result
+        sql += ' WHERE feature_id IN (%s)' % ','.join('?' for _ in result)
+        params = list(result)
+    else:
+        result = {}
+    for row in conn.execute(sql, params):
+        result.setdefault(row[0], {})[row[1]] = _entry_from_row(row[1:])
+    return result
+
+
+def _visible(username):
+    # 非公開のエントリは本人にだけ見せる（検索と同じ扱い）
+    return '(is_private = 0 OR author = ?)', [username]
+
+
+def list_month(conn, feature_id, month, username, author=None):
+    """指定月のエントリを新しい順に返す"""
+    start, end = month_range(month)
+    visible, params = _visible(username)
+    where = ['feature_id = ?', 'entry_date >= ?', 'entry_date < ?', visible]
+    params = [feature_id, start, end] + params
+    if author:
+        where.append('author = ?')
+        params.append(author)
+    rows = conn.execute(
+        _SELECT + f" WHERE {' AND '.join(where)} ORDER BY entry_date DESC, created_at DESC, id DESC",
+        params
+    ).fetchall()
+    return [_entry_from_row(row) for row in rows]
+
+
+def month_counts(conn, feature_id, username, author=None):
+    """エントリのある月と件数（新しい月から）"""
+    visible, params = _visible(username)
+    where = ['feature_id = ?', visible]
+    params = [feature_id] + params
+    if author:
+        where.append('author = ?')
+        params.append(author)
+    return [
+        {'month': row[0], 'count': row[1]}
+        for row in conn.execute(f'''
+            SELECT substr(entry_date, 1, 7) AS month, COUNT(*) FROM diary_entries
+            WHERE {' AND '.join(where)}
+            GROUP BY month ORDER BY month DESC
+        ''', params)
+    ]
+
+
+def get_entry(conn, feature_id, entry_id, username):
+    """エントリ1件。無いか見られなければ None"""
+    visible, params = _visible(username)
+    row = conn.execute(
+        _SELECT + f' WHERE feature_id = ? AND entry_id = ? AND {visible}',
+        [feature_id, entry_id] + params
+    ).fetchone()
+    return _entry_from_row(row) if row else None
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""リアルタイムのイベント（チャットの投稿・ホワイトボードや機能の変更）の配信
+
+書き込みのハンドラーは EventBus.publish でイベントを出し、クライアントは
+pollEvents（ロングポーリング）で自分のサーバーのイベントを受け取る。
+publish はキューに入れるだけで、バックグラウンドのスレッドが
+EVENT_BATCH_MS ごと、または EVENT_BATCH_MAX 件たまった時点でまとめて
+トランスポートに送る。トランスポートは各イベントに全体で増え続ける番号（seq）を
+振ってすべてのノードに届け、各ノードは直近 EVENT_BUFFER_SIZE 件をメモリに持つ。
+クライアントは最後に受け取った seq を since に渡して続きから受け取り、
+バッファより古い分はトランスポートの記録から読み直す（読めなければ reset を返す）。
+
+トランスポート（EVENT_TRANSPORT）:
+
+- memory: 同じプロセスの中だけで配信する（既定。ワーカーが1つの場合）
+- sqlite: EVENT_SQLITE_PATH のテーブルに書き、各ノードが EVENT_POLL_MS ごとに
+  新しい行を読む。同じファイルを共有できる複数のワーカー・コンテナ向け
+- redis: EVENT_REDIS_URL の Redis に番号の採番・記録・PUBLISH を1回の
+  スクリプトで行い、各ノードは pub/sub で受け取る（redis が必要）
+
+イベントは通知なので、送れなかった分は記録して捨てる（データ自体は DB にある）。
+"""
+
+import atexit
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - 任意依存
+    redis = None
+
+
+def _encode(event):
+    return json.dumps(event, ensure_ascii=False, separators=(',', ':'))
+
+
+# ---- トランスポート ----------------------------------------------------------
+#
+# start(deliver) で受信を始めて現在の seq を返し、以後に届いたイベントを seq の順に
+# deliver(events) に渡す。
+# publish(events) は seq の無いイベントのリストを送る。
+# replay(since, limit) は seq > since のイベントを最大 limit 件返し、
+# 記録が残っていなければ None を返す。
+# shared はほかのノードと番号を共有するか（クライアントは別のノードで受け取った
+# seq を持ってくることがある）。
+
+class MemoryTransport:
+    name = 'memory'
+    shared = False
+
+    def __init__(self):
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._deliver = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+        return self._seq
+
+    def publish(self, events):
+        with self._lock:
+            for event in events:
+                self._seq += 1
+                event['seq'] = self._seq
+            self._deliver(events)
+
+    def replay(self, since, limit):
+        # 記録はバス側のバッファだけ
+        return None
+
+    def close(self):
+        pass
+
+
+class SQLiteTransport:
+    name = 'sqlite'
+    shared = True
+
+    def __init__(self, path=None, poll_ms=None, retention_seconds=None):
+        self.path = path or Config.EVENT_SQLITE_PATH
+        self.poll_interval = (Config.EVENT_POLL_MS if poll_ms is None else poll_ms) / 1000.0
+        self.retention = Config.EVENT_RETENTION_SECONDS if retention_seconds is None else retention_seconds
+        self._deliver = None
+        self._last = 0
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._last_prune = 0.0
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def start(self, deliver):
+        self._deliver = deliver
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS event_log (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        event TEXT NOT NULL,
+                        created_at REAL NOT NULL
+                    )
+                ''')
+            # 起動前のイベントは配信しない（再接続したクライアントは replay で読む）
+            self._last = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM event_log').fetchone()[0]
+        finally:
+            conn.close()
+        self._thread = threading.Thread(target=self._run, name='event-poll', daemon=True)
+        self._thread.start()
+        return self._last
+
+    def publish(self, events):
+        now = time.time()
+        conn = self._connect()
+        try:
+            # 書き込みロックを持ったまま採番とコミットをするので、seq はコミット順に並ぶ
+            with conn:
+                conn.executemany('INSERT INTO event_log (event, created_at) VALUES (?, ?)',
+                                 [(_encode(event), now) for event in events])
+                if now - self._last_prune > 60:
+                    conn.execute('DELETE FROM event_log WHERE created_at < ?', (now - self.retention,))
+                    self._last_prune = now
+        finally:
+            conn.close()
+        # 自分のノードにはポーリングを待たずに届ける
+        self._wake.set()
+
+    def _read(self, conn, since, limit):
+        events = []
+        for seq, data in conn.execute(
+            'SELECT seq, event FROM event_log WHERE seq > ? ORDER BY seq LIMIT ?', (since, limit)
+        ):
+            event = json.loads(data)
+            event['seq'] = seq
+            events.append(event)
+        return events
+
+    def _run(self):
+        conn = None
+        while not self._stopped:
+            try:
+                if conn is None:
+                    conn = self._connect()
+                while True:
+                    events = self._read(conn, self._last, 1000)
+                    if not events:
+                        break
+                    self._last = events[-1]['seq']
+                    self._deliver(events)
+            except sqlite3.Error as e:
+                print(f"Event poll failed: {e}")
+                if conn is not None:
+                    conn.close()
+                    conn = None
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+        if conn is not None:
+            conn.close()
+
+    def replay(self, since, limit):
+        conn = self._connect()
+        try:
+            oldest = conn.execute('SELECT MIN(seq) FROM event_log').fetchone()[0]
+            if oldest is not None and oldest > since + 1:
+                return None
+            return self._read(conn, since, limit)
+        finally:
+            conn.close()
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+# KEYS: 番号のキー、記録の ZSET、チャンネル / ARGV: 残す件数、イベントの JSON...
+# 採番・記録・PUBLISH を1回で行うので、どのノードにも seq の順に届く
+_REDIS_PUBLISH = '''
+local count = #ARGV - 1
+local first = redis.call('INCRBY', KEYS[1], count) - count
+local encoded = {}
+for i = 1, count do
+    local seq = first + i
+    encoded[i] = '{"seq":' .. seq .. ',' .. string.sub(ARGV[i + 1], 2)
+    redis.call('ZADD', KEYS[2], seq, encoded[i])
+end
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -(tonumber(ARGV[1]) + 1))
+redis.call('PUBLISH', KEYS[3], '[' .. table.concat(encoded, ',') .. ']')
+return first + count
+'''
+
+
+class RedisTransport:
+    name = 'redis'
+    shared = True
+
+    def __init__(self, url=None, prefix=None, retain=None, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError('EVENT_TRANSPORT=redis には redis パッケージをインストールしてください')
+            client = redis.Redis.from_url(url or Config.EVENT_REDIS_URL)
+        self.client = client
+        prefix = prefix if prefix is not None else Config.EVENT_REDIS_PREFIX
+        self.keys = (f'{prefix}:seq', f'{prefix}:log', f'{prefix}:events')
+        self.retain = Config.EVENT_REDIS_RETAIN if retain is None else retain
+        self._script = client.register_script(_REDIS_PUBLISH)
+        self._deliver = None
+        self._last = 0
+        self._stopped = False
+        self._pubsub = None
+        self._thread = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+        self._last = int(self.client.get(self.keys[0]) or 0)
+        self._thread = threading.Thread(target=self._run, name='event-subscribe', daemon=True)
+        self._thread.start()
+        return self._last
+
+    def publish(self, events):
+        self._script(keys=self.keys, args=[self.retain] + [_encode(event) for event in events])
+
+    def _receive(self, events):
+        if not events or events[-1]['seq'] <= self._last:
+            return
+        if events[0]['seq'] > self._last + 1:
+            # 再接続の間などに取りこぼした分は記録から読む
+            missed = self.replay(self._last, events[0]['seq'] - self._last - 1) or []
+            events = missed + events
+        events = [event for event in events if event['seq'] > self._last]
+        self._last = events[-1]['seq']
+        self._deliver(events)
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                self._pubsub.subscribe(self.keys[2])
+                # 購読を始めるまでの間の分
+                self._receive(self.replay(self._last, 10000) or [])
+                while not self._stopped:
+                    message = self._pubsub.get_message(timeout=1.0)
+                    if message and message['type'] == 'message':
+                        self._receive(json.loads(message['data']))
+            except Exception as e:
+                if self._stopped:
+                    break
+                print(f"Event subscription failed: {e}")
+                time.sleep(1.0)
+            finally:
+                if self._pubsub is not None:
+                    try:
+                        self._pubsub.close()
+                    except Exception:
+                        pass
+
+    def replay(self, since, limit):
+        oldest = self.client.zrange(self.keys[1], 0, 0, withscores=True)
+        if oldest and oldest[0][1] > since + 1:
+            return None
+        return [json.loads(data) for data in
+                self.client.zrangebyscore(self.keys[1], f'({since}', '+inf', start=0, num=limit)]
+
+    def close(self):
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+# ---- バス ------------------------------------------------------------------
+
+class EventBus:
+    """イベントをまとめて送り、届いたイベントを待っている購読者に渡す"""
+
+    def __init__(self, transport, batch_ms=None, max_batch=None, buffer_size=None):
+        self.transport = transport
+        self.batch_interval = (Config.EVENT_BATCH_MS if batch_ms is None else batch_ms) / 1000.0
+        self.max_batch = max(1, Config.EVENT_BATCH_MAX if max_batch is None else max_batch)
+        self._pending = []
+        self._pending_cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self._started = False
+        self._start_lock = threading.Lock()
+        # 届いたイベント（seq の順）
+        self._buffer = collections.deque(maxlen=Config.EVENT_BUFFER_SIZE if buffer_size is None else buffer_size)
+        self._last_seq = 0
+        self._cond = threading.Condition()
+        self._listeners = []
+        self.published = 0
+        self.batches = 0
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if not self._started:
+                seq = self.transport.start(self._deliver)
+                with self._cond:
+                    self._last_seq = max(self._last_seq, seq)
+                self._started = True
+
+    # ---- 送信 ----
+
+    def publish(self, server_id, kind, feature_id=None, data=None):
+        """サーバーのメンバーに届けるイベントをキューに入れる"""
+        self._ensure_started()
+        event = {'serverId': server_id, 'featureId': feature_id, 'type': kind,
+                 'data': data or {}, 'time': time.time()}
+        if self.batch_interval <= 0:
+            self._send([event])
+            return
+        with self._pending_cond:
+            self._pending.append(event)
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name='event-batch', daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.max_batch:
+                self._pending_cond.notify()
+
+    def _send(self, events):
+        try:
+            self.transport.publish(events)
+        except Exception as e:
+            print(f"Event publish failed ({len(events)} events dropped): {e}")
+            return
+        self.published += len(events)
+        self.batches += 1
+
+    def flush(self):
+        """キューのイベントをすぐに送る"""
+        with self._flush_lock:
+            with self._pending_cond:
+                pending, self._pending = self._pending, []
+            for start in range(0, len(pending), self.max_batch):
+                self._send(pending[start:start + self.max_batch])
+
+    def _run(self):
+        while True:
+            with self._pending_cond:
+                if not self._stopped and len(self._pending) < self.max_batch:
+                    self._pending_cond.wait(self.batch_interval)
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+
+    # ---- 受信 ----
+
+    def add_listener(self, listener):
+        """届いたイベント（どのノードから出たものも）を listener(events) にも渡す"""
+        self._listeners.append(listener)
+
+    def _deliver(self, events):
+        with self._cond:
+            fresh = [event for event in events if event['seq'] > self._last_seq]
+            for event in fresh:
+                self._buffer.append(event)
+            if fresh:
+                self._last_seq = fresh[-1]['seq']
+            self._cond.notify_all()
+        for listener in self._listeners:
+            try:
+                listener(fresh)
+            except Exception as e:
+                print(f"Event listener failed: {e}")
+
+    def _buffered_after(self, since):
+        """バッファのうち seq > since の分。バッファから溢れていれば None"""
+        if since >= self._last_seq:
+            return []
+        if not self._buffer or self._buffer[0]['seq'] > since + 1:
+            return None
+        found = []
+        for event in reversed(self._buffer):
+            if event['seq'] <= since:
+                break
+            found.append(event)
+        found.reverse()
+        return found
+
+    def wait(self, server_ids, since=None, timeout=0.0, limit=None):
+        """server_ids のイベントのうち seq > since の分を返す。無ければ timeout 秒まで待つ。
+
+        {'events': [...], 'cursor': 次に since に渡す値, 'reset': 取りこぼしがあるか} を返す。
+        since が None なら現在の位置だけを返す。reset が True のときは、
+        クライアントは画面の内容を取得し直してから cursor の続きを待つ。
+        """
+        self._ensure_started()
+        limit = limit or Config.EVENT_POLL_LIMIT
+        deadline = time.monotonic() + max(0.0, timeout)
+        with self._cond:
+            if since is not None and since > self._last_seq and self.transport.shared:
+                # 別のノードで受け取った位置に、このノードへの配信がまだ追いついていないだけのことがある
+                self._cond.wait_for(lambda: self._last_seq >= since, max(0.0, deadline - time.monotonic()))
+            if since is None or since > self._last_seq:
+                # 初回、またはトランスポートの番号が振り直された（memory で再起動したなど）
+                return {'events': [], 'cursor': self._last_seq, 'reset': since is not None}
+            while True:
+                found = self._buffered_after(since)
+                if found is None:
+                    break
+                matched = [event for event in found if event['serverId'] in server_ids]
+                if matched:
+                    if len(matched) > limit:
+                        matched = matched[:limit]
+                        return {'events': matched, 'cursor': matched[-1]['seq'], 'reset': False}
+                    return {'events': matched, 'cursor': self._last_seq, 'reset': False}
+                # 関係の無いイベントは読み飛ばす
+                since = self._last_seq
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {'events': [], 'cursor': since, 'reset': False}
+                self._cond.wait(remaining)
+
+        # バッファより古い位置からの再開はトランスポートの記録から読む
+        replayed = self.transport.replay(since, limit)
+        if replayed is None:
+            return {'events': [], 'cursor': self._last_seq, 'reset': True}
+        matched = [event for event in replayed if event['serverId'] in server_ids]
+        return {'events': matched, 'cursor': replayed[-1]['seq'] if replayed else since, 'reset': False}
+
+    @property
+    def last_seq(self):
+        return self._last_seq
+
+    def close(self):
+        """キューに残ったイベントを送ってから止める"""
+        with self._pending_cond:
+            self._stopped = True
+            self._pending_cond.notify()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=max(1.0, self.batch_interval * 2))
+        self.flush()
+        if self._started:
+            self.transport.close()
+            self._started = False
+
+
+_buses = []
+
+
+def create_transport(name=None):
+    name = (name or Config.EVENT_TRANSPORT).lower()
+    if name == 'memory':
+        return MemoryTransport()
+    if name == 'sqlite':
+        return SQLiteTransport()
+    if name == 'redis':
+        return RedisTransport()
+    raise RuntimeError(f'不明な EVENT_TRANSPORT です: {name}')
+
+
+def create_bus(transport=None, **kwargs):
+    """バスを作成し、プロセス終了時に残りのイベントを送るよう登録する"""
+    bus = EventBus(transport or create_transport(), **kwargs)
+    _buses.append(bus)
+    return bus
+
+
+@atexit.register
+def _close_all():
+    for bus in _buses:
+        try:
+            bus.close()
+        except Exception as e:
+            print(f"Event bus close failed: {e}")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""アップロード済みファイルの一覧
+
+ファイル一覧は get_user_state には含めず、listFiles で必要な分だけ返す。
+並びは (created_at, id) の新しい順で、続きは前ページ最後の (created_at, id) を
+カーソルにしたキーセット方式で取得する（OFFSET を使わないので深いページでも一定のコスト）。
+"""
+
+import base64
+import binascii
+
+import serializer
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class CursorError(ValueError):
+    """カーソルが不正"""
+
+
+def init_file_indexes(cursor):
+    """サーバー・機能ごとの新しい順の一覧に使うインデックスを作成"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_files_server_created
+        ON files (server_id, created_at, id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_files_feature_created
+        ON files (server_id, feature_id, created_at, id)
+    ''')
+
+
+def encode_cursor(created_at, file_id):
+    raw = serializer.dumps([created_at, file_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, file_id = serializer.loads(raw.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise CursorError(cursor)
+    if not isinstance(created_at, str) or not isinstance(file_id, str):
+        raise CursorError(cursor)
+    return created_at, file_id
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def list_files(conn, user_id, server_id=None, feature_id=None, mime_prefix=None, cursor=None,
+               limit=DEFAULT_PAGE_SIZE):
+    """ユーザーが所属するサーバーのファイルを新しい順に返す。
+    (ファイル一覧, 次ページのカーソル or None)。server_id が所属外なら空"""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    where = ['f.server_id IN (SELECT server_id FROM server_members WHERE user_id = ?)']
+    params = [user_id]
+    if server_id:
+        where.append('f.server_id = ?')
+        params.append(server_id)
+    if feature_id:
+        where.append('f.feature_id = ?')
+        params.append(feature_id)
+    if mime_prefix:
+        where.append("f.mime_type LIKE ? ESCAPE '\\'")
+        params.append(_escape_like(mime_prefix) + '%')
+    if cursor:
+        where.append('(f.created_at, f.id) < (?, ?)')
+        params.extend(decode_cursor(cursor))
+
+    rows = conn.execute(f'''
+        SELECT f.id, f.original_filename, f.server_id, f.feature_id, f.file_size,
+               u.username, f.created_at, f.mime_type, f.download_count
+        FROM files f
+        LEFT JOIN users u ON f.upload_by = u.id
+        WHERE {' AND '.join(where)}
+        ORDER BY f.created_at DESC, f.id DESC
+        LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+
+    files = [{
+        'id': row[0],
+        'filename': row[1],
+        'serverId': row[2],
+        'featureId': row[3],
+        'size': row[4],
+        'uploadedBy': row[5],
+        'uploadedAt': row[6],
+        'mimeType': row[7],
+        'downloadCount': row[8],
+    } for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = files[-1]
+        next_cursor = encode_cursor(last['uploadedAt'], last['id'])
+    return files, next_cursor
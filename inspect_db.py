@@ -1,5 +1,6 @@
-import sqlite3, os, json
-path = os.path.join('data', 'circle_platform.db')
+import sqlite3, os, sys, json
+# 展開済みのバックアップを調べる場合はパスを渡す（圧縮されたものは python backup.py verify）
+path = sys.argv[1] if len(sys.argv) > 1 else os.path.join('data', 'circle_platform.db')
 print('DB PATH:', path)
 print('EXISTS:', os.path.exists(path))
 if not os.path.exists(path):
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""物品管理のアイテム保存・検索と CSV 入出力
+
+アイテムは inventory_items に1行ずつ保存し、inventory 機能のブロブには
+カテゴリと保管場所の一覧だけを残す。カテゴリ・保管場所・状態で絞り込み、
+並べ替えとページ指定をインデックスで行う。
+CSV の取り込みは全行を読んで検証してから IMPORT_BATCH_SIZE 件ずつ別の書き込みジョブで
+書き込み、書き出しはカーソルから少しずつ読んでストリームで返すので、数千件でも全体を JSON にしない。
+"""
+
+import csv
+import io
+import time
+
+import database
+import repository
+import serializer
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+IMPORT_BATCH_SIZE = 500
+EXPORT_FETCH_SIZE = 500
+MAX_IMPORT_ERRORS = 100
+
+# CSV の列（クライアントのアイテムのキーと同じ）
+CSV_FIELDS = ('id', 'name', 'category', 'location', 'status', 'quantity', 'unitPrice',
+              'minStock', 'description')
+
+SORT_COLUMNS = {
+    'name': 'name',
+    'category': 'category',
+    'location': 'location',
+    'status': 'status',
+    'quantity': 'quantity',
+    'unitPrice': 'unit_price',
+    'createdAt': 'created_at',
+    'updatedAt': 'updated_at',
+}
+
+
+def init_inventory_tables(cursor):
+    """物品用テーブルを作成し、新規作成時は既存ブロブのアイテムを取り込む"""
+    exists = database.table_exists(cursor, 'inventory_items')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            feature_id TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            category TEXT,
+            location TEXT,
+            status TEXT,
+            quantity INTEGER,
+            unit_price REAL,
+            min_stock INTEGER,
+            created_by TEXT,
+            created_at REAL,
+            updated_at REAL,
+            data TEXT NOT NULL,
+            UNIQUE(feature_id, item_id),
+            FOREIGN KEY (feature_id) REFERENCES features (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_inventory_items_category
+        ON inventory_items (feature_id, category, status)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_inventory_items_location
+        ON inventory_items (feature_id, location, status)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_inventory_items_name ON inventory_items (feature_id, name)')
+
+    if not exists:
+        rows = cursor.execute('''
+            SELECT f.id, fc.content FROM features f
+            JOIN feature_content fc ON fc.feature_id = f.id
+            WHERE f.type = 'inventory'
+        ''').fetchall()
+        for feature_id, raw in rows:
+            try:
+                content = serializer.decode_content(raw)
+            except serializer.DecodeError:
+                continue
+            if sync_from_content(cursor, feature_id, content):
+                repository.update_content(cursor, feature_id, content)
+
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _timestamp(value):
+    # クライアントは Date.now()（ミリ秒）で保存している
+    number = _float(value)
+    if number is None:
+        return None
+    return number / 1000 if number > 1e11 else number
+
+
+def _row_values(feature_id, item_id, item):
+    return (
+        feature_id, item_id, str(item.get('name') or ''), item.get('category'), item.get('location'),
+        item.get('status') or 'available', _int(item.get('quantity')), _float(item.get('unitPrice')),
+        _int(item.get('minStock')), item.get('createdBy') or item.get('created_by'),
+        _timestamp(item.get('createdAt') or item.get('created_at')),
+        _timestamp(item.get('updatedAt') or item.get('updated_at')),
+        serializer.dumps(item),
+    )
+
+
+_UPSERT = '''
+    INSERT INTO inventory_items (feature_id, item_id, name, category, location, status, quantity,
+                                 unit_price, min_stock, created_by, created_at, updated_at, data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (feature_id, item_id) DO UPDATE SET
+        name = excluded.name, category = excluded.category, location = excluded.location,
+        status = excluded.status, quantity = excluded.quantity, unit_price = excluded.unit_price,
+        min_stock = excluded.min_stock, created_by = excluded.created_by,
+        created_at = excluded.created_at, updated_at = excluded.updated_at, data = excluded.data
+'''
+
+
+def sync_from_content(conn, feature_id, content):
+    """ブロブに書かれた content['items'] をテーブルに反映し、ブロブからは取り除く。
+    content['items'] がある場合はそれを正とし、含まれないアイテムは削除する。ブロブを変更したら True"""
+    if not isinstance(content, dict) or not isinstance(content.get('items'), dict):
+        return False
+    incoming = content['items']
+    existing = {
+        row[0]: row[1]
+        for row in conn.execute('SELECT item_id, data FROM inventory_items WHERE feature_id = ?', (feature_id,))
+    }
+    rows = []
+    for item_id, item in incoming.items():
+        if not isinstance(item, dict):
+            continue
+        item_id = str(item_id)
+        item = dict(item, id=item.get('id', item_id))
+        previous = existing.pop(item_id, None)
+        if previous is not None and serializer.loads(previous) == item:
+            continue
+        rows.append(_row_values(feature_id, item_id, item))
+    if rows:
+        conn.executemany(_UPSERT, rows)
+    if existing:
+        conn.executemany('DELETE FROM inventory_items WHERE feature_id = ? AND item_id = ?',
+                         [(feature_id, item_id) for item_id in existing])
+
+    changed = bool(incoming)
+    content['items'] = {}
+    return changed
+
+
+def items_by_feature(conn, feature_ids):
+    """{feature_id: {item_id: アイテム}} を1クエリで返す"""
+    result = {feature_id: {} for feature_id in feature_ids}
+    if not result:
+        return result
+    placeholders = ','.join('?' for _ in result)
+    for row in conn.execute(
+        f'SELECT feature_id, item_id, data FROM inventory_items WHERE feature_id IN ({placeholders})',
+        list(result)
+    ):
+        result[row[0]][row[1]] = serializer.loads(row[2])
+    return result
+
+
+def merge_into_content(content_by_feature, by_feature):
+    """既存クライアントの一覧表示用に、テーブルのアイテムを content['items'] に戻す"""
+    for feature_id, feature_items in by_feature.items():
+        content = content_by_feature.get(feature_id)
+        if isinstance(content, dict):
+            content['items'] = feature_items
+
+
+def _filters(feature_id, category=None, location=None, statuses=None, query=None, low_stock=False):
+    where = ['feature_id = ?']
+    params = [feature_id]
+    if category:
+        where.append('category = ?')
+        params.append(category)
+    if location:
+        where.append('location = ?')
+        params.append(location)
+    if statuses:
+        where.append('status IN (%s)' % ','.join('?' for _ in statuses))
+        params.extend(statuses)
+    if query:
+        like = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where.append("name LIKE ? ESCAPE '\\'")
+        params.append(like)
+    if low_stock:
+        where.append('quantity IS NOT NULL AND min_stock IS NOT NULL AND quantity <= min_stock')
+    return ' AND '.join(where), params
+
+
+def list_items(conn, feature_id, category=None, location=None, statuses=None, query=None,
+               low_stock=False, sort='name', descending=False, limit=DEFAULT_PAGE_SIZE, offset=0):
+    """条件に合うアイテムを (一覧, 総件数, カテゴリ別件数, 保管場所別件数) で返す"""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    offset = max(0, int(offset))
+    column = SORT_COLUMNS.get(sort, 'name')
+    direction = 'DESC' if descending else 'ASC'
+    where, params = _filters(feature_id, category, location, statuses, query, low_stock)
+
+    total = conn.execute(f'SELECT COUNT(*) FROM inventory_items WHERE {where}', params).fetchone()[0]
+    rows = conn.execute(f'''
+        SELECT data FROM inventory_items WHERE {where}
+        ORDER BY {column} IS NULL, {column} {direction}, id {direction}
+        LIMIT ? OFFSET ?
+    ''', params + [limit, offset]).fetchall()
+
+    # サイドバーの件数はカテゴリ／保管場所の絞り込み前の条件で数える
+    facets = {}
+    for facet in ('category', 'location'):
+        facet_where, facet_params = _filters(
+            feature_id,
+            category if facet != 'category' else None,
+            location if facet != 'location' else None,
+            statuses, query, low_stock
+        )
+        facets[facet] = {
+            row[0] or '': row[1]
+            for row in conn.execute(
+                f'SELECT {facet}, COUNT(*) FROM inventory_items WHERE {facet_where} GROUP BY {facet}',
+                facet_params
+            )
+        }
+    return [serializer.loads(row[0]) for row in rows], total, facets['category'], facets['location']
+
+
+def _item_from_csv(row, created_by):
+    item = {key: (row.get(key) or '').strip() for key in CSV_FIELDS if row.get(key) is not None}
+    if not item.get('name'):
+        raise ValueError('name is required')
+    for key, convert in (('quantity', _int), ('minStock', _int), ('unitPrice', _float)):
+        if item.get(key):
+            value = convert(item[key])
+            if value is None:
+                raise ValueError(f'{key} must be a number')
+            item[key] = value
+        else:
+            item.pop(key, None)
+    if not item.get('status'):
+        item.pop('status', None)
+    if not item.get('id'):
+        item.pop('id', None)
+    item['updatedAt'] = time.time() * 1000
+    return item
+
+
+def _write_batch(conn, feature_id, batch, created_by):
+    # 既存アイテムの更新は CSV に無いキー（作成日時など）を残して上書きする
+    placeholders = ','.join('?' for _ in batch)
+    existing = {
+        row[0]: serializer.loads(row[1])
+        for row in conn.execute(
+            f'SELECT item_id, data FROM inventory_items WHERE feature_id = ? AND item_id IN ({placeholders})',
+            [feature_id] + [item_id for item_id, _ in batch]
+        )
+    }
+    rows = []
+    for item_id, item in batch:
+        if item_id in existing:
+            item = dict(existing[item_id], **item)
+        else:
+            item.setdefault('createdAt', item['updatedAt'])
+            item.setdefault('createdBy', created_by)
+        rows.append(_row_values(feature_id, item_id, item))
+    conn.executemany(_UPSERT, rows)
+
+
+def read_csv(stream, created_by=None):
+    """CSV を最後まで読んで検証し、(IMPORT_BATCH_SIZE 件ずつの [(id, アイテム)] の一覧, 行エラー) を返す。
+    データベースには触れない"""
+    reader = csv.DictReader(stream)
+    if 'name' not in (reader.fieldnames or []):
+        raise ValueError('CSV に name 列がありません')
+
+    prefix = f'{int(time.time() * 1000)}'
+    batches = []
+    errors = []
+    batch = {}
+    for line_number, row in enumerate(reader, start=2):
+        try:
+            item = _item_from_csv(row, created_by)
+        except ValueError as e:
+            if len(errors) < MAX_IMPORT_ERRORS:
+                errors.append({'line': line_number, 'error': str(e)})
+            continue
+        item['id'] = item.get('id') or f'{prefix}_{line_number}'
+        batch[item['id']] = item
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            batches.append(list(batch.items()))
+            batch = {}
+    if batch:
+        batches.append(list(batch.items()))
+    return batches, errors
+
+
+def import_csv(run, feature_id, stream, created_by=None):
+    """CSV を取り込み、(件数, 行エラー) を返す。
+
+    run(job) は job(conn) を1トランザクションで実行する関数（app の writes.run）。
+    CSV の読み込みと検証を先に済ませてから、IMPORT_BATCH_SIZE 件ごとに別のジョブで
+    書き込むので、書き込みのロックを持つのは1バッチ分の INSERT の間だけになる。
+    id 列が既存のアイテムと一致すれば更新、空なら新規作成。
+    """
+    batches, errors = read_csv(stream, created_by)
+    imported = 0
+    for batch in batches:
+        run(lambda conn, batch=batch: _write_batch(conn, feature_id, batch, created_by))
+        imported += len(batch)
+    return imported, errors
+
+
+def export_csv(conn, feature_id, category=None, location=None, statuses=None, query=None):
+    """CSV の行を少しずつ生成するジェネレーター（先頭は Excel 用の BOM 付きヘッダー）"""
+    where, params = _filters(feature_id, category, location, statuses, query)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction='ignore')
+    buffer.write('\ufeff')
+    writer.writeheader()
+    cursor = conn.execute(f'SELECT data FROM inventory_items WHERE {where} ORDER BY name, id', params)
+    while True:
+        rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            writer.writerow(serializer.loads(row[0]))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
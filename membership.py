@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""サーバーのメンバーシップとロールのプロセス内キャッシュ
+
+認可チェックのたびに server_members を引かないよう、ユーザーごとの
+{server_id: ロール} と feature_id → server_id の対応をメモリに持つ。
+招待の受諾・ロール変更・サーバー作成で該当ユーザーを無効化し、別プロセスでの
+変更も MEMBERSHIP_CACHE_TTL 秒で反映される。
+"""
+
+import threading
+import time
+
+import repository
+from config import Config
+
+ADMIN_ROLES = ('owner', 'admin')
+
+
+class MembershipCache:
+    """ユーザーごとのロールと機能の所属サーバーを保持する"""
+
+    def __init__(self, connect, ttl=None):
+        self._connect = connect
+        self._ttl = Config.MEMBERSHIP_CACHE_TTL if ttl is None else ttl
+        self._roles = {}
+        self._features = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _load_roles(self, user_id):
+        with self._lock:
+            generation = self._generation
+        conn = self._connect()
+        try:
+            roles = repository.server_roles(conn, user_id)
+        finally:
+            conn.close()
+        with self._lock:
+            # 読み込み中に無効化されたら古い結果を残さない
+            if generation == self._generation:
+                self._roles[user_id] = (time.monotonic(), roles)
+        return roles
+
+    def roles(self, user_id):
+        """{server_id: ロール}"""
+        cached = self._roles.get(user_id)
+        if cached is not None and time.monotonic() - cached[0] < self._ttl:
+            return cached[1]
+        return self._load_roles(user_id)
+
+    def role(self, user_id, server_id):
+        """サーバーでのロール。メンバーでなければ None"""
+        return self.roles(user_id).get(server_id)
+
+    def feature_server(self, feature_id):
+        """機能が属するサーバーの ID。機能が無ければ None"""
+        server_id = self._features.get(feature_id)
+        if server_id is not None:
+            return server_id
+        conn = self._connect()
+        try:
+            row = repository.get_feature(conn, feature_id)
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        # 機能が別のサーバーに移ることはないので期限なしで保持する
+        self._features[feature_id] = row[1]
+        return row[1]
+
+    def feature_role(self, user_id, feature_id):
+        """機能のサーバーでのロール。機能が無いかメンバーでなければ None"""
+        server_id = self.feature_server(feature_id)
+        return self.role(user_id, server_id) if server_id is not None else None
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._roles.pop(user_id, None)
+
+    def invalidate_feature(self, feature_id):
+        self._features.pop(feature_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._roles.clear()
+            self._features.clear()
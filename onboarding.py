@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""招待コードの一括発行と CSV からのメンバー一括登録
+
+新入生などをまとめて迎えるときに、招待コードを1件ずつ発行・受諾すると
+人数分の往復と状態の再構築が発生する。ここでは招待を1回の executemany で発行し、
+メンバーはユーザー名の CSV を読み終えてから IMPORT_BATCH_SIZE 件ずつ別の書き込みジョブで
+（ユーザー検索・既存メンバー確認・追加をそれぞれ1クエリで）登録する。
+"""
+
+import csv
+import secrets
+import uuid
+from datetime import datetime, timedelta
+
+import repository
+
+MAX_BULK_INVITES = 500
+MAX_INVITE_HOURS = 24 * 30
+IMPORT_BATCH_SIZE = 500
+IMPORT_ROLES = ('member', 'moderator', 'admin')
+
+# importMembers の行ごとの結果
+ADDED = 'added'
+ALREADY_MEMBER = 'already_member'
+NOT_FOUND = 'not_found'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+
+
+def create_invites(conn, server_id, inviter_id, count, hours=24):
+    """招待コードを count 件発行して [{inviteId, inviteCode, expiresAt}] を返す"""
+    if not 1 <= count <= MAX_BULK_INVITES:
+        raise ValueError(f'発行数は 1〜{MAX_BULK_INVITES} で指定してください')
+    if not 0 < hours <= MAX_INVITE_HOURS:
+        raise ValueError(f'有効期限は {MAX_INVITE_HOURS} 時間以内で指定してください')
+    expires_at = datetime.utcnow() + timedelta(hours=hours)
+    invites = [(str(uuid.uuid4()), secrets.token_urlsafe(8)) for _ in range(count)]
+    repository.create_invites(conn, server_id, inviter_id, invites, expires_at)
+    return [{'inviteId': invite_id, 'inviteCode': code, 'expiresAt': expires_at.isoformat()}
+            for invite_id, code in invites]
+
+
+def _add_batch(conn, server_id, inviter_id, batch, results, added_user_ids):
+    """batch は [(行番号, ユーザー名, ロール)]。結果を results に追記する"""
+    user_ids = repository.user_ids_by_name(conn, {username for _, username, _ in batch})
+    members = repository.member_ids(conn, server_id, user_ids.values())
+
+    rows = []
+    for line, username, role in batch:
+        user_id = user_ids.get(username)
+        if user_id is None:
+            status = NOT_FOUND
+        elif user_id in members:
+            status = ALREADY_MEMBER
+        else:
+            status = ADDED
+            members.add(user_id)
+            rows.append((server_id, user_id, role, inviter_id))
+            added_user_ids.append(user_id)
+        results.append({'line': line, 'username': username, 'status': status})
+    repository.add_members(conn, rows)
+
+
+def read_members(stream):
+    """CSV を最後まで読んで検証し、(IMPORT_BATCH_SIZE 件ずつの [(行番号, ユーザー名, ロール)] の一覧,
+    追加しない行の結果) を返す。データベースには触れない"""
+    reader = csv.DictReader(stream)
+    fields = reader.fieldnames or []
+    if 'username' not in fields:
+        raise ValueError('CSV に username 列がありません')
+
+    batches = []
+    results = []
+    seen = set()
+    batch = []
+    for line, row in enumerate(reader, start=2):
+        username = (row.get('username') or '').strip()
+        role = (row.get('role') or '').strip() or 'member'
+        if not username:
+            continue
+        if role not in IMPORT_ROLES:
+            results.append({'line': line, 'username': username, 'status': INVALID,
+                            'error': f'無効なロールです: {role}'})
+            continue
+        if username in seen:
+            results.append({'line': line, 'username': username, 'status': DUPLICATE})
+            continue
+        seen.add(username)
+        batch.append((line, username, role))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+    return batches, results
+
+
+def import_members(run, server_id, inviter_id, stream):
+    """username 列（任意で role 列）の CSV からメンバーを追加する。
+    (行ごとの結果, 追加したユーザー ID の一覧) を返す。
+
+    run(job) は job(conn) を1トランザクションで実行する関数（app の writes.run）。
+    CSV は先に読み終えてから、IMPORT_BATCH_SIZE 件ごとに別のジョブで追加する。
+    """
+    batches, results = read_members(stream)
+    added_user_ids = []
+    for batch in batches:
+        run(lambda conn, batch=batch: _add_batch(conn, server_id, inviter_id, batch, results, added_user_ids))
+    results.sort(key=lambda result: result['line'])
+    return results, added_user_ids
+
+
+def summarize(results):
+    """{状態: 件数}"""
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return counts
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""パスワードのハッシュ化と照合
+
+保存形式は "<方式>$<パラメーター>$<ソルト>$<ハッシュ>" で、方式は scrypt か
+pbkdf2_sha256（PASSWORD_HASHER で選択、コストも環境変数で調整できる）。
+以前の形式（ソルト無し SHA-256 の16進文字列）も照合でき、その場合や
+設定したコストと異なる場合は needs_rehash を返すので、ログイン時に新しい形式へ
+置き換える。比較は hmac.compare_digest で行う。
+
+ハッシュ計算は CPU とメモリを多く使うため、PASSWORD_HASH_WORKERS 本に
+制限したスレッドプールで実行し、同時に大量のログインが来ても他のリクエストの
+処理を食いつぶさないようにする。
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+SCRYPT = 'scrypt'
+PBKDF2 = 'pbkdf2_sha256'
+HASH_LENGTH = 32
+SALT_LENGTH = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def scrypt_available():
+    return hasattr(hashlib, 'scrypt')
+
+
+def configured_hasher():
+    """設定された方式（scrypt が使えない環境では pbkdf2_sha256）"""
+    hasher = Config.PASSWORD_HASHER.lower()
+    if hasher not in (SCRYPT, PBKDF2):
+        hasher = SCRYPT
+    if hasher == SCRYPT and not scrypt_available():
+        return PBKDF2
+    return hasher
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem は必要量（128 * n * r * p）に余裕を持たせる
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * n * r * (p + 1) + 1024 * 1024, dklen=HASH_LENGTH)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations, dklen=HASH_LENGTH)
+
+
+def _current_params(hasher):
+    if hasher == SCRYPT:
+        return (Config.PASSWORD_SCRYPT_N, Config.PASSWORD_SCRYPT_R, Config.PASSWORD_SCRYPT_P)
+    return (Config.PASSWORD_PBKDF2_ITERATIONS,)
+
+
+def _hash(password):
+    hasher = configured_hasher()
+    params = _current_params(hasher)
+    salt = os.urandom(SALT_LENGTH)
+    digest = _scrypt(password, salt, *params) if hasher == SCRYPT else _pbkdf2(password, salt, *params)
+    return '$'.join([hasher] + [str(v) for v in params] + [_b64encode(salt), _b64encode(digest)])
+
+
+def _legacy_hash(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def _verify(password, stored):
+    """(一致したか, 新しい形式で保存し直すべきか)"""
+    if not stored:
+        return False, False
+    parts = stored.split('$')
+    try:
+        if parts[0] == SCRYPT and len(parts) == 6:
+            params = tuple(int(v) for v in parts[1:4])
+            digest = _scrypt(password, _b64decode(parts[4]), *params)
+        elif parts[0] == PBKDF2 and len(parts) == 4:
+            params = (int(parts[1]),)
+            digest = _pbkdf2(password, _b64decode(parts[2]), *params)
+        else:
+            # 以前の形式（ソルト無し SHA-256）
+            ok = hmac.compare_digest(_legacy_hash(password).encode('ascii'), stored.encode('ascii', 'replace'))
+            return ok, ok
+        expected = _b64decode(parts[-1])
+    except (ValueError, TypeError):
+        return False, False
+    ok = hmac.compare_digest(digest, expected)
+    return ok, ok and (parts[0] != configured_hasher() or params != _current_params(parts[0]))
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, Config.PASSWORD_HASH_WORKERS),
+                                               thread_name_prefix='password-hash')
+    return _executor
+
+
+def hash_password(password):
+    """新しい形式のハッシュを作る（ハッシュ用のスレッドプールで実行）"""
+    return _pool().submit(_hash, password).result()
+
+
+def verify_password(password, stored):
+    """保存されたハッシュと照合し、(一致したか, 保存し直すべきか) を返す"""
+    return _pool().submit(_verify, password, stored).result()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""オンライン状態と入力中の表示（メモリ上の一時的な状態）
+
+サーバーごとのオンラインのユーザーと、チャンネル（機能とサブアイテム）ごとの
+入力中のユーザーを期限付きでメモリに持つ。DB には一切書かない。
+
+- presenceHeartbeat でオンラインの期限を PRESENCE_TTL 秒延ばす。
+- setTyping で入力中の期限を PRESENCE_TYPING_TTL 秒延ばす（キー入力ごとに呼んでよい）。
+
+変化はイベントバス（presence / typing）で他のクライアントと他のノードに伝えるが、
+ハートビートとキー入力はまとめ、オンラインになったとき・入力を始めたときと、
+期限の 1/3（入力中は 1/2）ごとの延長のときだけ送る。他のノードのイベントも
+同じ apply で取り込むので、どのノードでも同じ状態が読める。期限切れは読み込み時と
+定期的な掃除で取り除き、通知はしない（クライアントは一覧を取り直して気づく）。
+"""
+
+import threading
+import time
+
+from config import Config
+
+SWEEP_INTERVAL = 60.0
+
+
+class PresenceTracker:
+    """オンライン状態と入力中の状態を期限付きで保持する"""
+
+    def __init__(self, publish=None, ttl=None, typing_ttl=None):
+        # publish(server_id, kind, feature_id, data)。None ならこのプロセスの中だけで持つ
+        self._publish = publish
+        self.ttl = Config.PRESENCE_TTL if ttl is None else ttl
+        self.typing_ttl = Config.PRESENCE_TYPING_TTL if typing_ttl is None else typing_ttl
+        # {server_id: {username: 期限}}
+        self._online = {}
+        # {(feature_id, sub_item_id): {username: 期限}}
+        self._typing = {}
+        # このノードから最後に送った時刻 {キー: 時刻}
+        self._announced = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.coalesced = 0
+
+    def _should_announce(self, key, now, interval):
+        last = self._announced.get(key)
+        if last is not None and now - last < interval:
+            self.coalesced += 1
+            return False
+        self._announced[key] = now
+        return True
+
+    def _send(self, server_id, kind, feature_id, data):
+        if self._publish is not None:
+            self._publish(server_id, kind, feature_id, data)
+
+    def heartbeat(self, server_id, username):
+        """オンラインの期限を延ばす"""
+        now = time.monotonic()
+        with self._lock:
+            self._online.setdefault(server_id, {})[username] = now + self.ttl
+            announce = self._should_announce(('presence', server_id, username), now, self.ttl / 3)
+            self._maybe_sweep(now)
+        if announce:
+            self._send(server_id, 'presence', None, {'username': username, 'online': True})
+
+    def leave(self, server_id, username):
+        """オフラインにする（入力中の表示もサーバー全体で消える）"""
+        with self._lock:
+            was_online = self._online.get(server_id, {}).pop(username, None) is not None
+            self._announced.pop(('presence', server_id, username), None)
+        if was_online:
+            self._send(server_id, 'presence', None, {'username': username, 'online': False})
+
+    def set_typing(self, server_id, feature_id, sub_item_id, username, typing=True):
+        """入力中の状態を設定する。入力中は期限を延ばす"""
+        now = time.monotonic()
+        key = ('typing', feature_id, sub_item_id, username)
+        with self._lock:
+            users = self._typing.setdefault((feature_id, sub_item_id), {})
+            if typing:
+                expires = users.get(username)
+                users[username] = now + self.typing_ttl
+                if expires is None or expires <= now:
+                    # 期限が切れていたら入力の開始として必ず送る
+                    self._announced.pop(key, None)
+                announce = self._should_announce(key, now, self.typing_ttl / 2)
+            else:
+                announce = users.pop(username, None) is not None
+                self._announced.pop(key, None)
+        if announce:
+            self._send(server_id, 'typing', feature_id,
+                       {'subItemId': sub_item_id, 'username': username, 'typing': typing})
+
+    def apply(self, events):
+        """イベントバスに届いた presence / typing のイベントを取り込む（自分のノードの分も含む）"""
+        now = time.monotonic()
+        with self._lock:
+            for event in events:
+                data = event.get('data') or {}
+                if event.get('type') == 'presence':
+                    users = self._online.setdefault(event['serverId'], {})
+                    if data.get('online'):
+                        users[data['username']] = max(users.get(data['username'], 0), now + self.ttl)
+                    else:
+                        users.pop(data['username'], None)
+                elif event.get('type') == 'typing':
+                    users = self._typing.setdefault((event['featureId'], data.get('subItemId')), {})
+                    if data.get('typing'):
+                        users[data['username']] = max(users.get(data['username'], 0), now + self.typing_ttl)
+                    else:
+                        users.pop(data['username'], None)
+                elif event.get('type') == 'message':
+                    # 投稿したら入力中の表示は消す
+                    message = data.get('message') or {}
+                    users = self._typing.get((event['featureId'], data.get('subItemId')))
+                    if users:
+                        users.pop(message.get('authorId'), None)
+
+    def snapshot(self, server_id, feature_id=None, sub_item_id=None):
+        """{'online': [ユーザー名], 'typing': [ユーザー名]}（期限切れは含めない）"""
+        now = time.monotonic()
+        with self._lock:
+            online = self._live(self._online, server_id, now)
+            typing = self._live(self._typing, (feature_id, sub_item_id), now) if feature_id else []
+        return {'online': online, 'typing': typing}
+
+    @staticmethod
+    def _live(table, key, now):
+        users = table.get(key)
+        if not users:
+            table.pop(key, None)
+            return []
+        for username in [name for name, expires in users.items() if expires <= now]:
+            del users[username]
+        if not users:
+            del table[key]
+        return sorted(users)
+
+    def _maybe_sweep(self, now):
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for table in (self._online, self._typing):
+            for key in list(table):
+                self._live(table, key, now)
+        horizon = max(self.ttl, self.typing_ttl)
+        for key in [key for key, sent in self._announced.items() if now - sent > horizon]:
+            del self._announced[key]
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""リクエスト単位のプロファイリングと遅いリクエストのログ
+
+PROFILE_REQUESTS=true のときだけ有効になる（無効時はスレッドローカルの確認だけ）。
+- フェーズ別の時間: auth / state / json_decode / json_encode / db
+- 実行した SQL と所要時間
+- しきい値を超えたリクエストのスタック、サンプリングした cProfile の結果
+を logs/ 以下のローテーションする JSON Lines ログに書き出す。
+"""
+
+import cProfile
+import functools
+import io
+import json
+import logging
+import logging.handlers
+import os
+import pstats
+import random
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import querytrace
+from config import Config
+
+MAX_LOGGED_QUERIES = 200
+
+_local = threading.local()
+_profiles_by_thread = {}
+_logger = None
+_logger_lock = threading.Lock()
+
+
+class RequestProfile:
+    """1リクエスト分の計測結果"""
+
+    def __init__(self, action, path):
+        self.action = action
+        self.path = path
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.queries = []
+        self.db_time = 0.0
+        self.error = None
+        self.stack = None
+        self.profiler = None
+        self.watchdog = None
+        self._active = set()
+
+    @contextmanager
+    def phase(self, name):
+        # 同じフェーズの入れ子（dumps -> dumps_bytes など）は外側だけ数える
+        if name in self._active:
+            yield
+            return
+        self._active.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active.discard(name)
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def add_query(self, sql, duration):
+        self.db_time += duration
+        self.queries.append((' '.join(sql.split()), duration))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+def current():
+    """実行中のリクエストのプロファイル（無効時は None）"""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def attached(profile):
+    """ブロック内でこのスレッドが実行した SQL を、別のスレッドのリクエストの profile に記録する"""
+    if profile is None:
+        yield
+        return
+    previous = current()
+    _local.profile = profile
+    try:
+        yield
+    finally:
+        _local.profile = previous
+
+
+@contextmanager
+def phase(name):
+    profile = current()
+    if profile is None:
+        yield
+        return
+    with profile.phase(name):
+        yield
+
+
+def timed(name):
+    """関数全体を指定フェーズとして計測するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = current()
+            if profile is None:
+                return func(*args, **kwargs)
+            with profile.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """execute の SQL と所要時間を現在のプロファイル／クエリトレースに記録するカーソル"""
+
+    def _observed(self, method, sql, parameters, recorded):
+        profile = current()
+        traces = querytrace.active()
+        if profile is None and not traces:
+            return method(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        finally:
+            duration = time.perf_counter() - start
+            if profile is not None:
+                profile.add_query(sql, duration)
+            for trace in traces:
+                trace.add_query(sql, recorded, duration)
+
+    def execute(self, sql, parameters=()):
+        return self._observed(super().execute, sql, parameters, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # パラメーター列はイテレーターの場合があるので記録しない
+        return self._observed(super().executemany, sql, seq_of_parameters, ('<many>',))
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """sqlite3.connect(factory=...) 用。conn.execute も ProfiledCursor を通す"""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                os.makedirs(Config.PROFILE_LOG_DIR, exist_ok=True)
+                logger = logging.getLogger('circle_platform.profile')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                handler = logging.handlers.RotatingFileHandler(
+                    os.path.join(Config.PROFILE_LOG_DIR, 'slow_requests.log'),
+                    maxBytes=Config.PROFILE_LOG_MAX_BYTES,
+                    backupCount=Config.PROFILE_LOG_BACKUP_COUNT,
+                    encoding='utf-8'
+                )
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                logger.addHandler(handler)
+                _logger = logger
+    return _logger
+
+
+def _capture_stack(profile, thread_id):
+    # しきい値を超えても終わっていないリクエストのスタックを記録
+    frame = sys._current_frames().get(thread_id)
+    if frame is not None and current_for(thread_id) is profile:
+        profile.stack = ''.join(traceback.format_stack(frame))
+
+
+def current_for(thread_id):
+    return _profiles_by_thread.get(thread_id)
+
+
+def start_request(action, path):
+    """リクエスト開始時に呼ぶ（無効時は何もしない）"""
+    if not Config.PROFILE_REQUESTS:
+        return None
+    profile = RequestProfile(action, path)
+    _local.profile = profile
+    thread_id = threading.get_ident()
+    _profiles_by_thread[thread_id] = profile
+
+    if Config.PROFILE_CPROFILE_RATE > 0 and random.random() < Config.PROFILE_CPROFILE_RATE:
+        profile.profiler = cProfile.Profile()
+        profile.profiler.enable()
+    if Config.PROFILE_STACK_CAPTURE:
+        profile.watchdog = threading.Timer(
+            Config.PROFILE_SLOW_MS / 1000.0, _capture_stack, args=(profile, thread_id)
+        )
+        profile.watchdog.daemon = True
+        profile.watchdog.start()
+    return profile
+
+
+def record_error(error):
+    profile = current()
+    if profile is not None:
+        profile.error = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+
+
+def _cprofile_text(profiler):
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(Config.PROFILE_CPROFILE_LINES)
+    return out.getvalue()
+
+
+def server_timing(profile, total):
+    parts = [f'total;dur={total * 1000:.1f}', f'db;dur={profile.db_time * 1000:.1f}']
+    parts.extend(f'{name};dur={seconds * 1000:.1f}' for name, seconds in profile.phases.items())
+    return ', '.join(parts)
+
+
+def finish_request(response, user_id=None):
+    """リクエスト終了時に呼ぶ。遅いリクエストはログに書き出す"""
+    profile = current()
+    if profile is None:
+        return response
+    _local.profile = None
+    _profiles_by_thread.pop(threading.get_ident(), None)
+    if profile.watchdog is not None:
+        profile.watchdog.cancel()
+    if profile.profiler is not None:
+        profile.profiler.disable()
+
+    total = profile.elapsed()
+    response.headers['Server-Timing'] = server_timing(profile, total)
+
+    slow = total * 1000 >= Config.PROFILE_SLOW_MS
+    if not (slow or Config.PROFILE_LOG_ALL or profile.error):
+        return response
+
+    queries = sorted(profile.queries, key=lambda q: q[1], reverse=True)[:MAX_LOGGED_QUERIES]
+    record = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'action': profile.action,
+        'path': profile.path,
+        'status': response.status_code,
+        'user_id': user_id,
+        'slow': slow,
+        'total_ms': round(total * 1000, 3),
+        'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in profile.phases.items()},
+        'db': {
+            'count': len(profile.queries),
+            'total_ms': round(profile.db_time * 1000, 3),
+            'queries': [{'sql': sql, 'ms': round(d * 1000, 3)} for sql, d in queries],
+        },
+    }
+    if profile.error:
+        record['error'] = profile.error
+    if profile.stack:
+        record['stack'] = profile.stack
+    if profile.profiler is not None and slow:
+        record['cprofile'] = _cprofile_text(profile.profiler)
+    _get_logger().info(json.dumps(record, ensure_ascii=False))
+    return response
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""SQL クエリのトレースと N+1 検出
+
+get_db_connection() の接続（profiling.ProfiledConnection）で実行された SQL を、
+アクティブな QueryTrace すべてに通知する。同じ SQL 文がパラメーターだけ変えて
+何度も実行されていれば N+1 の疑いとして報告する。
+
+SQL_TRACE=true のときは /api.cgi のレスポンスに X-SQL-* ヘッダーを付ける。
+テストでは assert_max_queries() でアクションごとのクエリ数の上限を確認できる。
+
+    with querytrace.assert_max_queries(10):
+        client.post('/api.cgi', data={'action': 'checkSession'})
+"""
+
+import threading
+from contextlib import contextmanager
+
+from config import Config
+
+_local = threading.local()
+
+
+class QueryTrace:
+    """実行された SQL の記録"""
+
+    def __init__(self):
+        self.queries = []
+        self.total_time = 0.0
+
+    def add_query(self, sql, parameters, duration):
+        self.total_time += duration
+        self.queries.append((' '.join(sql.split()), _freeze(parameters), duration))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def repeated(self, threshold=None):
+        """同じ SELECT が異なるパラメーターで threshold 回以上実行されたものを返す"""
+        threshold = threshold or Config.SQL_TRACE_REPEAT_THRESHOLD
+        groups = {}
+        for sql, params, duration in self.queries:
+            # 書き込みのループはまとめて実行できるが N+1（読み込み）とは区別する
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            group = groups.setdefault(sql, {'count': 0, 'params': set(), 'ms': 0.0})
+            group['count'] += 1
+            group['params'].add(params)
+            group['ms'] += duration * 1000
+        return [
+            {'sql': sql, 'count': g['count'], 'distinct_params': len(g['params']), 'ms': round(g['ms'], 3)}
+            for sql, g in groups.items()
+            if g['count'] >= threshold and len(g['params']) > 1
+        ]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_time * 1000, 3),
+            'repeated': self.repeated(),
+        }
+
+
+def _freeze(parameters):
+    if isinstance(parameters, dict):
+        frozen = tuple(sorted(parameters.items()))
+    elif isinstance(parameters, (list, tuple)):
+        frozen = tuple(parameters)
+    else:
+        frozen = (parameters,)
+    try:
+        hash(frozen)
+    except TypeError:
+        frozen = (repr(frozen),)
+    return frozen
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def active():
+    """現在のスレッドで有効なトレース（無ければ空リスト）"""
+    return getattr(_local, 'stack', None) or ()
+
+
+def start():
+    trace = QueryTrace()
+    _stack().append(trace)
+    return trace
+
+
+def stop(trace):
+    stack = _stack()
+    if trace in stack:
+        stack.remove(trace)
+    return trace
+
+
+@contextmanager
+def tracing():
+    trace = start()
+    try:
+        yield trace
+    finally:
+        stop(trace)
+
+
+@contextmanager
+def attached(traces):
+    """ブロック内でこのスレッドが実行した SQL を、別のスレッドで取得した traces にも記録する"""
+    stack = _stack()
+    stack.extend(traces)
+    try:
+        yield
+    finally:
+        for trace in traces:
+            stop(trace)
+
+
+@contextmanager
+def assert_max_queries(max_count, allow_repeated=True):
+    """ブロック内で実行された SQL が max_count 件以下であることを確認するテスト用ヘルパー"""
+    with tracing() as trace:
+        yield trace
+    lines = [f'  {sql}  {params!r}' for sql, params, _ in trace.queries]
+    if trace.count > max_count:
+        raise AssertionError(
+            f'{trace.count} queries executed, expected at most {max_count}:\n' + '\n'.join(lines)
+        )
+    if not allow_repeated and trace.repeated():
+        raise AssertionError(f'repeated statements (N+1?): {trace.repeated()}')
+
+
+def _ascii(text, limit=200):
+    return text.encode('ascii', 'replace').decode('ascii')[:limit]
+
+
+def annotate_response(response, trace, action=None):
+    """デバッグ用ヘッダーを付け、N+1 の疑いがあればログに出す"""
+    summary = trace.summary()
+    response.headers['X-SQL-Query-Count'] = str(summary['count'])
+    response.headers['X-SQL-Query-Time'] = f"{summary['total_ms']:.3f}ms"
+    if summary['repeated']:
+        response.headers['X-SQL-Repeated'] = '; '.join(
+            f"{r['count']}x {_ascii(r['sql'], 120)}" for r in summary['repeated']
+        )
+        for r in summary['repeated']:
+            print(f"N+1 suspected in {action}: {r['count']}x ({r['distinct_params']} params) {r['sql']}")
+    return response
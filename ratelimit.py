@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""メモリ上のトークンバケットによる試行回数の制限
+
+キー（ユーザー名や IP アドレス）ごとに最大 burst 個のトークンを持ち、
+per_minute 個/分の割合で補充する。トークンが無ければ拒否するので、
+ログイン試行の集中を DB やパスワードのハッシュ計算の前に止められる。
+プロセスごとの制限で、複数プロセスで動かす場合はプロセス数倍まで通る。
+"""
+
+import threading
+import time
+
+MAX_KEYS = 100000
+
+
+class TokenBucketLimiter:
+    """キーごとのトークンバケット"""
+
+    def __init__(self, burst, per_minute, max_keys=MAX_KEYS):
+        self.burst = float(max(1, burst))
+        self.rate = max(per_minute, 0) / 60.0
+        self.max_keys = max_keys
+        # {キー: (残りトークン, 最終更新時刻)}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def allow(self, key, cost=1):
+        """トークンを消費できれば True、足りなければ False"""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            allowed = tokens >= cost
+            self._buckets[key] = (tokens - cost if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return allowed
+
+    def retry_after(self, key, cost=1):
+        """次に cost 個のトークンがたまるまでの秒数"""
+        with self._lock:
+            missing = cost - self._tokens(key, time.monotonic())
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate else float('inf')
+
+    def _prune(self, now):
+        # 満タンに戻ったバケットは持っていなくても同じ
+        full = [key for key in self._buckets if self._tokens(key, now) >= self.burst]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) > self.max_keys:
+            oldest = sorted(self._buckets, key=lambda key: self._buckets[key][1])
+            for key in oldest[:len(self._buckets) - self.max_keys]:
+                del self._buckets[key]
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._buckets.clear()
+            else:
+                self._buckets.pop(key, None)
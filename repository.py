@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""コアのテーブル（users / servers / server_members / server_invites / password_recovery /
+features / feature_content / files）へのアクセス
+
+ハンドラーはこのモジュールを通して読み書きし、SQL を直接書かない（機能ごとの派生テーブルは
+tasks.py などの各モジュールが持つ）。SQL は SQLite と PostgreSQL の共通部分で書くので、
+database.py のどちらの接続でも動く。行は位置で読むので、row_factory の無い接続でも使える。
+"""
+
+import database
+import serializer
+
+
+# ---- ユーザー ----------------------------------------------------------------
+
+def get_user(conn, user_id):
+    return conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+
+
+def find_user(conn, username):
+    return conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+
+
+def username_exists(conn, username):
+    return conn.execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone() is not None
+
+
+def create_user(conn, username, password_hash):
+    conn.execute('INSERT INTO users (username, password_hash) VALUES (?, ?)', (username, password_hash))
+
+
+def user_ids_by_name(conn, usernames):
+    """{ユーザー名: id}（存在するユーザーだけ）"""
+    usernames = list(usernames)
+    if not usernames:
+        return {}
+    return {row[1]: row[0] for row in conn.execute(
+        f'SELECT id, username FROM users WHERE username IN ({_in_clause(usernames)})', usernames
+    )}
+
+
+def update_profile(conn, user_id, fields):
+    """fields は {カラム名: 値}。カラム名は呼び出し側で決めたものだけを渡す"""
+    set_clause = ', '.join(f'{name} = ?' for name in fields)
+    conn.execute(f'''
+        UPDATE users
+        SET {set_clause}, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', list(fields.values()) + [user_id])
+
+
+def set_password_hash(conn, user_id, password_hash, expected=None):
+    """パスワードのハッシュを置き換える。expected を渡すと、その値のときだけ置き換える"""
+    if expected is None:
+        conn.execute('''
+            UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', (password_hash, user_id))
+    else:
+        conn.execute('''
+            UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND password_hash = ?
+        ''', (password_hash, user_id, expected))
+
+
+# ---- サーバーとメンバー ------------------------------------------------------
+
+def create_server(conn, server_id, name, icon, owner_id, invite_code):
+    """サーバーを作成し、作成者を owner として追加する"""
+    conn.execute('''
+        INSERT INTO servers (id, name, icon, owner_id, invite_code)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (server_id, name, icon, owner_id, invite_code))
+    add_member(conn, server_id, owner_id, 'owner')
+
+
+def user_servers(conn, user_id):
+    """参加しているサーバー（servers の列とロール・参加日時）を参加順に返す"""
+    return conn.execute('''
+        SELECT s.*, sm.role, sm.joined_at
+        FROM servers s
+        JOIN server_members sm ON s.id = sm.server_id
+        WHERE sm.user_id = ?
+        ORDER BY sm.joined_at
+    ''', (user_id,)).fetchall()
+
+
+def server_roles(conn, user_id):
+    """{server_id: ロール}"""
+    return {row[0]: row[1] for row in conn.execute(
+        'SELECT server_id, role FROM server_members WHERE user_id = ?', (user_id,)
+    )}
+
+
+def is_member(conn, server_id, user_id):
+    return conn.execute('''
+        SELECT 1 FROM server_members
+        WHERE server_id = ? AND user_id = ?
+    ''', (server_id, user_id)).fetchone() is not None
+
+
+def member_ids(conn, server_id, user_ids):
+    """user_ids のうち、既にサーバーのメンバーのものの集合"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+    return {row[0] for row in conn.execute(
+        f'SELECT user_id FROM server_members WHERE server_id = ? AND user_id IN ({_in_clause(user_ids)})',
+        [server_id] + user_ids
+    )}
+
+
+def add_member(conn, server_id, user_id, role='member', invited_by=None):
+    conn.execute('''
+        INSERT INTO server_members (server_id, user_id, role, invited_by)
+        VALUES (?, ?, ?, ?)
+    ''', (server_id, user_id, role, invited_by))
+
+
+def add_members(conn, rows):
+    """rows は [(server_id, user_id, ロール, invited_by)]。既にメンバーの行は飛ばす"""
+    conn.executemany('''
+        INSERT OR IGNORE INTO server_members (server_id, user_id, role, invited_by)
+        VALUES (?, ?, ?, ?)
+    ''', rows)
+
+
+def set_member_role(conn, server_id, user_id, role):
+    conn.execute('''
+        UPDATE server_members
+        SET role = ?
+        WHERE server_id = ? AND user_id = ?
+    ''', (role, server_id, user_id))
+
+
+def server_members(conn, server_id):
+    """メンバー（id / username / nickname / avatar とロール・参加日時）を参加順に返す"""
+    return conn.execute('''
+        SELECT u.id, u.username, u.nickname, u.avatar, sm.role, sm.joined_at
+        FROM server_members sm
+        JOIN users u ON sm.user_id = u.id
+        WHERE sm.server_id = ?
+        ORDER BY sm.joined_at
+    ''', (server_id,)).fetchall()
+
+
+# ---- 招待 --------------------------------------------------------------------
+
+def create_invites(conn, server_id, inviter_id, invites, expires_at):
+    """invites は [(招待 ID, 招待コード)]"""
+    conn.executemany('''
+        INSERT INTO server_invites (id, server_id, inviter_id, invite_code, expires_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(invite_id, server_id, inviter_id, code, expires_at) for invite_id, code in invites])
+
+
+def find_valid_invite(conn, invite_code):
+    """未使用で期限内の招待（無ければ None）"""
+    return conn.execute('''
+        SELECT * FROM server_invites
+        WHERE invite_code = ? AND used_at IS NULL AND expires_at > CURRENT_TIMESTAMP
+    ''', (invite_code,)).fetchone()
+
+
+def mark_invite_used(conn, invite_id, user_id):
+    conn.execute('''
+        UPDATE server_invites
+        SET used_at = CURRENT_TIMESTAMP, used_by = ?, current_uses = current_uses + 1
+        WHERE id = ?
+    ''', (user_id, invite_id))
+
+
+# ---- パスワード復旧 ----------------------------------------------------------
+
+def has_pending_recovery(conn, user_id, partner_id):
+    return conn.execute('''
+        SELECT 1 FROM password_recovery
+        WHERE user_id = ? AND recovery_partner_id = ? AND status = 'pending'
+    ''', (user_id, partner_id)).fetchone() is not None
+
+
+def create_recovery(conn, user_id, partner_id, recovery_token, expires_at):
+    conn.execute('''
+        INSERT INTO password_recovery (user_id, recovery_partner_id, initiated_by, recovery_token, expires_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (user_id, partner_id, user_id, recovery_token, expires_at))
+
+
+def find_pending_recovery(conn, recovery_token, partner_id):
+    """パートナーが承認できる復旧リクエスト（無ければ None）"""
+    return conn.execute('''
+        SELECT * FROM password_recovery
+        WHERE recovery_token = ? AND recovery_partner_id = ? AND status = 'pending'
+    ''', (recovery_token, partner_id)).fetchone()
+
+
+def find_approved_recovery(conn, recovery_token):
+    """承認済みで期限内の復旧リクエスト（無ければ None）"""
+    return conn.execute('''
+        SELECT * FROM password_recovery
+        WHERE recovery_token = ? AND status = 'approved' AND expires_at > CURRENT_TIMESTAMP
+    ''', (recovery_token,)).fetchone()
+
+
+def approve_recovery(conn, recovery_id):
+    conn.execute('''
+        UPDATE password_recovery
+        SET status = 'approved', approved_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (recovery_id,))
+
+
+def complete_recovery(conn, recovery_id):
+    conn.execute('''
+        UPDATE password_recovery
+        SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (recovery_id,))
+
+
+# ---- 機能 --------------------------------------------------------------------
+
+def get_feature(conn, feature_id):
+    """機能の種類とサーバー（無ければ None）"""
+    return conn.execute('SELECT type, server_id FROM features WHERE id = ?', (feature_id,)).fetchone()
+
+
+def server_features(conn, server_ids):
+    """サーバーの機能を表示順に返す"""
+    server_ids = list(server_ids)
+    if not server_ids:
+        return []
+    return conn.execute(f'''
+        SELECT * FROM features WHERE server_id IN ({_in_clause(server_ids)})
+        ORDER BY position, created_at
+    ''', server_ids).fetchall()
+
+
+def add_feature(conn, feature_id, server_id, name, feature_type, icon, position):
+    conn.execute('''
+        INSERT INTO features (id, server_id, name, type, icon, position)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (feature_id, server_id, name, feature_type, icon, position))
+
+
+# ---- 機能のコンテンツ --------------------------------------------------------
+
+def load_content(conn, feature_id):
+    """デコードしたコンテンツ（行が無ければ None）"""
+    row = conn.execute('SELECT content FROM feature_content WHERE feature_id = ?', (feature_id,)).fetchone()
+    if row is None:
+        return None
+    return serializer.decode_content(row[0])
+
+
+def load_raw_contents(conn, feature_ids):
+    """{feature_id: 保存されている値}。デコードは呼び出し側で行う（行の無い機能は含まない）"""
+    feature_ids = list(feature_ids)
+    if not feature_ids:
+        return {}
+    return {row[0]: row[1] for row in conn.execute(
+        f'SELECT feature_id, content FROM feature_content WHERE feature_id IN ({_in_clause(feature_ids)})',
+        feature_ids
+    )}
+
+
+def content_value(conn, content):
+    """feature_content.content に入れる値。PostgreSQL のカラムは BYTEA なので、
+    プレーンな JSON の文字列もヘッダー付きのバイト列にする"""
+    value = serializer.encode_content(content)
+    if isinstance(value, str) and database.is_postgres(conn):
+        return bytes([serializer.FORMAT_JSON]) + value.encode('utf-8')
+    return value
+
+
+def store_content(conn, feature_id, content, updated_at=None):
+    """コンテンツを保存する（行が無ければ作成）。updated_at を省くと現在時刻"""
+    conn.execute('''
+        INSERT INTO feature_content (feature_id, content, updated_at)
+        VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        ON CONFLICT (feature_id) DO UPDATE SET content = excluded.content, updated_at = excluded.updated_at
+    ''', (feature_id, content_value(conn, content), updated_at))
+
+
+def update_content(conn, feature_id, content):
+    """既にある行のコンテンツだけを書き換える（派生テーブルへ移したあとの縮めたブロブなど）"""
+    conn.execute('UPDATE feature_content SET content = ? WHERE feature_id = ?',
+                 (content_value(conn, content), feature_id))
+
+
+# ---- ファイル ----------------------------------------------------------------
+
+def add_file(conn, file_id, filename, original_filename, file_path, file_size, mime_type,
+             upload_by, server_id=None, feature_id=None):
+    conn.execute('''
+        INSERT INTO files (id, filename, original_filename, file_path, file_size,
+                           mime_type, upload_by, server_id, feature_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (file_id, filename, original_filename, file_path, file_size, mime_type,
+          upload_by, server_id, feature_id))
+
+
+def _in_clause(values):
+    return ','.join('?' for _ in values)
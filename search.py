@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""全文検索インデックス（SQLite FTS5 / trigram）
+
+チャット・フォーラムの投稿、Wiki ページ、日記、アンケートを
+search_documents（メタデータ）と search_index（FTS5 本文）に保持する。
+書き込みハンドラーから差分更新され、検索は呼び出し元が所属するサーバーに限定される。
+trigram トークナイザーなので日本語も分かち書き無しで部分一致検索できる。
+
+trigram は3文字未満の語（「会議」のような2文字の語など）をインデックスで引けない。
+3文字以上の語と組み合わせた場合はその語でインデックスを引いてから絞り込むが、
+すべての語が2文字以下の場合は LIKE による全件走査になる（件数が多いと遅い）。
+スニペットは HTML エスケープ済みで、一致箇所だけを <mark> で囲んで返す。
+
+PostgreSQL（database.py）では search_index は rowid・title・body の普通のテーブルで、
+すべての語を ILIKE で絞り込み新しい順に返す（pg_trgm 拡張が使えれば trigram の
+GIN インデックスを張る）。スニペットは Python で切り出す。
+"""
+
+import hashlib
+import html
+import re
+import sqlite3
+
+import database
+import diary
+import serializer
+import wiki
+
+# trigram は3文字未満の語を MATCH できないため、その場合は LIKE で検索する
+MIN_MATCH_LENGTH = 3
+MAX_PAGE_SIZE = 50
+SNIPPET_LENGTH = 80
+
+# snippet() の一致箇所の目印（本文に現れない制御文字。エスケープ後に <mark> に置き換える）
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+SEARCH_KINDS = ('message', 'post', 'wiki', 'diary', 'survey')
+
+
+def init_search_index(cursor):
+    """検索用テーブルを作成し、新規作成時は既存データから構築する。FTS5 が無ければ False"""
+    exists = database.table_exists(cursor, 'search_index')
+    if database.is_postgres(cursor):
+        _init_postgres_index(cursor)
+    else:
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                    title, body, tokenize = 'trigram'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            print(f"Search index disabled: {e}")
+            return False
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            feature_id TEXT NOT NULL,
+            server_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            parent_id TEXT NOT NULL DEFAULT '',
+            item_id TEXT NOT NULL,
+            author TEXT,
+            is_private BOOLEAN DEFAULT 0,
+            created_at REAL,
+            content_hash TEXT NOT NULL,
+            UNIQUE(feature_id, kind, parent_id, item_id),
+            FOREIGN KEY (feature_id) REFERENCES features (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_documents_server ON search_documents (server_id)')
+
+    if not exists:
+        rebuild_search_index(cursor)
+    return True
+
+
+def _init_postgres_index(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_index (
+            rowid INTEGER PRIMARY KEY,
+            title TEXT NOT NULL DEFAULT '',
+            body TEXT NOT NULL DEFAULT ''
+        )
+    ''')
+    # 拡張を作れない（権限が無い・入っていない）ときはインデックス無しの ILIKE で検索する
+    cursor.execute('SAVEPOINT search_trgm')
+    try:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_index_title ON search_index USING gin (title gin_trgm_ops)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_index_body ON search_index USING gin (body gin_trgm_ops)')
+    except database.Error as e:
+        cursor.execute('ROLLBACK TO SAVEPOINT search_trgm')
+        print(f"Search trigram index disabled: {e}")
+    cursor.execute('RELEASE SAVEPOINT search_trgm')
+
+
+def _text(value):
+    return value if isinstance(value, str) else ('' if value is None else str(value))
+
+
+def extract_documents(feature_type, content):
+    """機能コンテンツから検索対象のドキュメントを取り出す"""
+    if not isinstance(content, dict):
+        return
+    if feature_type in ('chat', 'forum'):
+        for sub_id, sub_item in (content.get('subItems') or {}).items():
+            if not isinstance(sub_item, dict):
+                continue
+            for key, kind in (('messages', 'message'), ('posts', 'post')):
+                for message in sub_item.get(key) or []:
+                    yield message_document(sub_id, sub_item, message, kind)
+    elif feature_type == 'wiki':
+        for page_id, page in (content.get('pages') or {}).items():
+            if isinstance(page, dict):
+                yield wiki_document(page_id, page)
+    elif feature_type == 'diary':
+        for entry_id, entry in (content.get('entries') or {}).items():
+            if isinstance(entry, dict):
+                yield diary_document(entry_id, entry)
+    elif feature_type == 'survey':
+        for survey_id, survey in (content.get('surveys') or {}).items():
+            if not isinstance(survey, dict):
+                continue
+            questions = survey.get('questions') or []
+            body = '\n'.join(_text(q.get('text')) for q in questions if isinstance(q, dict))
+            yield {
+                'kind': 'survey', 'parent_id': '', 'item_id': _text(survey_id),
+                'title': _text(survey.get('title')), 'body': body,
+                'author': survey.get('created_by') or survey.get('author'), 'is_private': 0,
+                'created_at': survey.get('created_at'),
+            }
+
+
+def wiki_document(page_id, page):
+    return {
+        'kind': 'wiki', 'parent_id': '', 'item_id': _text(page_id),
+        'title': _text(page.get('title')), 'body': _text(page.get('content')),
+        'author': page.get('author'), 'is_private': 0,
+        'created_at': page.get('updated_at') or page.get('created_at'),
+    }
+
+
+def diary_document(entry_id, entry):
+    return {
+        'kind': 'diary', 'parent_id': '', 'item_id': _text(entry_id),
+        'title': _text(entry.get('title')), 'body': _text(entry.get('content')),
+        'author': entry.get('author'), 'is_private': 1 if entry.get('private') else 0,
+        'created_at': entry.get('created_at'),
+    }
+
+
+def message_document(sub_item_id, sub_item, message, kind):
+    return {
+        'kind': kind, 'parent_id': _text(sub_item_id), 'item_id': _text(message.get('id')),
+        'title': _text(sub_item.get('name')), 'body': _text(message.get('content')),
+        'author': message.get('authorId'), 'is_private': 0,
+        'created_at': message.get('timestamp'),
+    }
+
+
+def _hash(doc):
+    key = '\x1f'.join([doc['title'], doc['body'], _text(doc['author']), _text(doc['is_private'])])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _insert(conn, feature_id, server_id, doc, content_hash):
+    cur = conn.execute('''
+        INSERT INTO search_documents (feature_id, server_id, kind, parent_id, item_id,
+                                      author, is_private, created_at, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (feature_id, server_id, doc['kind'], doc['parent_id'], doc['item_id'],
+          doc['author'], doc['is_private'], doc['created_at'], content_hash))
+    conn.execute('INSERT INTO search_index (rowid, title, body) VALUES (?, ?, ?)',
+                 (cur.lastrowid, doc['title'], _strip_marks(doc['body'])))
+
+
+def _delete(conn, doc_ids):
+    for doc_id in doc_ids:
+        conn.execute('DELETE FROM search_index WHERE rowid = ?', (doc_id,))
+        conn.execute('DELETE FROM search_documents WHERE id = ?', (doc_id,))
+
+
+def remove_server(conn, server_id):
+    """サーバーのドキュメントをすべて索引から消す（取り込みに失敗したサーバーの後始末）"""
+    if not _search_enabled(conn):
+        return
+    _delete(conn, [row[0] for row in conn.execute(
+        'SELECT id FROM search_documents WHERE server_id = ?', (server_id,)
+    )])
+
+
+def _search_enabled(conn):
+    return database.table_exists(conn, 'search_documents')
+
+
+def _feature_info(conn, feature_id):
+    feature = conn.execute('SELECT type, server_id FROM features WHERE id = ?', (feature_id,)).fetchone()
+    return (feature[0], feature[1]) if feature else (None, None)
+
+
+def index_feature(conn, feature_id, content, feature_type=None, server_id=None, new_feature=False):
+    """機能のコンテンツを差分で再インデックスする（変更のあった項目だけ書き込む）"""
+    if feature_type is None or server_id is None:
+        feature_type, server_id = _feature_info(conn, feature_id)
+    if feature_type not in ('chat', 'forum', 'wiki', 'diary', 'survey') or not _search_enabled(conn):
+        return
+
+    existing = {}
+    # 作成直後の機能にはインデックス済みの項目が無いので照会を省く
+    if not new_feature:
+        for row in conn.execute(
+            'SELECT id, kind, parent_id, item_id, content_hash FROM search_documents WHERE feature_id = ?',
+            (feature_id,)
+        ):
+            existing[(row[1], row[2], row[3])] = (row[0], row[4])
+
+    seen = set()
+    for doc in extract_documents(feature_type, content):
+        key = (doc['kind'], doc['parent_id'], doc['item_id'])
+        if key in seen:
+            continue
+        seen.add(key)
+        content_hash = _hash(doc)
+        current = existing.pop(key, None)
+        if current and current[1] == content_hash:
+            continue
+        if current:
+            _delete(conn, [current[0]])
+        _insert(conn, feature_id, server_id, doc, content_hash)
+    _delete(conn, [doc_id for doc_id, _ in existing.values()])
+
+
+def index_message(conn, feature_id, sub_item_id, sub_item, message):
+    """新しいチャット／フォーラム投稿を1件だけ追加する"""
+    if not _search_enabled(conn):
+        return
+    _, server_id = _feature_info(conn, feature_id)
+    if server_id is None:
+        return
+    kind = 'message' if sub_item.get('type') == 'channel' else 'post'
+    doc = message_document(sub_item_id, sub_item, message, kind)
+    _insert(conn, feature_id, server_id, doc, _hash(doc))
+
+
+def index_document(conn, feature_id, doc):
+    """1件のドキュメントだけを追加・更新する（内容が同じなら何もしない）"""
+    if not _search_enabled(conn):
+        return
+    current = conn.execute('''
+        SELECT id, content_hash FROM search_documents
+        WHERE feature_id = ? AND kind = ? AND parent_id = ? AND item_id = ?
+    ''', (feature_id, doc['kind'], doc['parent_id'], doc['item_id'])).fetchone()
+    content_hash = _hash(doc)
+    if current and current[1] == content_hash:
+        return
+    _, server_id = _feature_info(conn, feature_id)
+    if server_id is None:
+        return
+    if current:
+        _delete(conn, [current[0]])
+    _insert(conn, feature_id, server_id, doc, content_hash)
+
+
+def remove_document(conn, feature_id, kind, item_id, parent_id=''):
+    if not _search_enabled(conn):
+        return
+    _delete(conn, [row[0] for row in conn.execute('''
+        SELECT id FROM search_documents
+        WHERE feature_id = ? AND kind = ? AND parent_id = ? AND item_id = ?
+    ''', (feature_id, kind, parent_id, item_id))])
+
+
+def rebuild_search_index(conn):
+    """全機能のコンテンツから検索インデックスを作り直す"""
+    conn.execute('DELETE FROM search_index')
+    conn.execute('DELETE FROM search_documents')
+    rows = conn.execute('''
+        SELECT f.id, f.type, f.server_id, fc.content
+        FROM features f
+        JOIN feature_content fc ON fc.feature_id = f.id
+    ''').fetchall()
+    # ページや日記を専用テーブルに移した機能はテーブルから読む
+    wiki_pages = wiki.pages_by_feature(conn) if database.table_exists(conn, 'wiki_pages') else {}
+    diary_entries = diary.entries_by_feature(conn) if database.table_exists(conn, 'diary_entries') else {}
+    for feature_id, feature_type, server_id, raw in rows:
+        try:
+            content = serializer.decode_content(raw)
+        except serializer.DecodeError:
+            continue
+        if feature_type == 'wiki' and isinstance(content, dict) and feature_id in wiki_pages:
+            content['pages'] = wiki_pages[feature_id]
+        if feature_type == 'diary' and isinstance(content, dict) and feature_id in diary_entries:
+            content['entries'] = diary_entries[feature_id]
+        index_feature(conn, feature_id, content, feature_type, server_id)
+
+
+def _match_expression(terms):
+    # 各語をフレーズとして引用し、AND で結合（FTS5 の構文文字を無効化）
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search(conn, user_id, username, query, kinds=None, server_id=None, limit=20, offset=0):
+    """所属サーバー内を検索し、(ヒット一覧, 総件数) を返す"""
+    terms = [t for t in query.split() if t]
+    if not terms:
+        return [], 0
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    offset = max(0, int(offset))
+
+    where = ['d.server_id IN (SELECT server_id FROM server_members WHERE user_id = ?)',
+             '(d.is_private = 0 OR d.author = ?)']
+    params = [user_id, username]
+    if server_id:
+        where.append('d.server_id = ?')
+        params.append(server_id)
+    if kinds:
+        where.append('d.kind IN (%s)' % ','.join('?' for _ in kinds))
+        params.extend(kinds)
+
+    postgres = database.is_postgres(conn)
+    long_terms = [] if postgres else [t for t in terms if len(t) >= MIN_MATCH_LENGTH]
+    short_terms = [t for t in terms if t not in long_terms]
+    if postgres:
+        # 本文から Python でスニペットを切り出す
+        order = 'd.created_at DESC, d.id DESC'
+        snippet = 'search_index.body'
+    elif long_terms:
+        # 3文字以上の語でインデックスを引き、短い語はその結果を LIKE で絞り込む
+        where.insert(0, 'search_index MATCH ?')
+        params.insert(0, _match_expression(long_terms))
+        order = 'bm25(search_index, 2.0, 1.0), d.created_at DESC'
+        snippet = f"snippet(search_index, 1, '{_MARK_START}', '{_MARK_END}', '…', 16)"
+    else:
+        order = 'd.created_at DESC'
+        snippet = f'substr(search_index.body, 1, {SNIPPET_LENGTH})'
+    for term in short_terms:
+        like = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where.append("(search_index.title LIKE ? ESCAPE '\\' OR search_index.body LIKE ? ESCAPE '\\')")
+        params.extend([like, like])
+
+    where_sql = ' AND '.join(where)
+    total = conn.execute(f'''
+        SELECT COUNT(*) FROM search_index
+        JOIN search_documents d ON d.id = search_index.rowid
+        WHERE {where_sql}
+    ''', params).fetchone()[0]
+    rows = conn.execute(f'''
+        SELECT d.feature_id, d.server_id, d.kind, d.parent_id, d.item_id, d.author, d.created_at,
+               search_index.title AS title,
+               {snippet} AS snippet
+        FROM search_index
+        JOIN search_documents d ON d.id = search_index.rowid
+        WHERE {where_sql}
+        ORDER BY {order}
+        LIMIT ? OFFSET ?
+    ''', params + [limit, offset]).fetchall()
+
+    hits = [{
+        'featureId': row[0],
+        'serverId': row[1],
+        'kind': row[2],
+        'parentId': row[3] or None,
+        'itemId': row[4],
+        'author': row[5],
+        'createdAt': row[6],
+        'title': row[7],
+        'snippet': _snippet_html(_mark_terms(row[8], terms) if postgres else row[8]),
+    } for row in rows]
+    return hits, total
+
+
+def _strip_marks(text):
+    # 本文に目印の文字が含まれていると、自分で <mark> を差し込めてしまう
+    return text.replace(_MARK_START, '').replace(_MARK_END, '')
+
+
+def _mark_terms(body, terms):
+    """最初の一致箇所の周りを SNIPPET_LENGTH 文字ほど切り出し、一致箇所を目印で囲む"""
+    body = body or ''
+    pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)),
+                         re.IGNORECASE)
+    first = pattern.search(body)
+    start = max(0, first.start() - SNIPPET_LENGTH // 4) if first else 0
+    text = body[start:start + SNIPPET_LENGTH]
+    marked = pattern.sub(lambda m: _MARK_START + m.group(0) + _MARK_END, text)
+    return ('…' if start > 0 else '') + marked + ('…' if start + SNIPPET_LENGTH < len(body) else '')
+
+
+def _snippet_html(text):
+    """保存された本文をエスケープし、一致箇所の目印だけを <mark> にする"""
+    if not text:
+        return ''
+    escaped = html.escape(text, quote=True)
+    return escaped.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""JSON シリアライザ層
+
+app.py 内のすべての JSON エンコード／デコードはこのモジュールを経由する。
+orjson / msgspec がインストールされていれば高速バックエンドを使い、
+無ければ標準ライブラリの json にフォールバックする。
+
+feature_content.content の保存形式もここで決める。
+- 旧形式: JSON 文字列（TEXT）。そのまま読める。
+- 新形式: 先頭1バイトのヘッダー + ペイロード（BLOB）。
+  ヘッダーの下位4ビットがエンコーディング（1=JSON, 2=MessagePack）、
+  上位4ビットが圧縮方式（0=なし, 1=zlib, 2=zstd。compression.py を参照）。
+"""
+
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+import compression
+import profiling
+from config import Config
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 任意依存
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - 任意依存
+    msgspec = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - 任意依存
+    msgpack = None
+
+
+# 既存ハンドラーの except json.JSONDecodeError をそのまま使えるようにする
+DecodeError = json.JSONDecodeError
+
+FORMAT_JSON = 0x01
+FORMAT_MSGPACK = 0x02
+FORMAT_MASK = 0x0F
+
+
+def _select_backend(name):
+    if name in ('auto', 'orjson') and orjson is not None:
+        return 'orjson'
+    if name in ('auto', 'msgspec') and msgspec is not None:
+        return 'msgspec'
+    return 'json'
+
+
+BACKEND = _select_backend(Config.JSON_BACKEND)
+
+if msgspec is not None:
+    _msgspec_encoder = msgspec.json.Encoder()
+    _msgspec_decoder = msgspec.json.Decoder()
+
+
+@profiling.timed('json_encode')
+def dumps_bytes(obj):
+    """オブジェクトを UTF-8 の JSON バイト列に変換"""
+    if BACKEND == 'orjson':
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    if BACKEND == 'msgspec':
+        return _msgspec_encoder.encode(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+@profiling.timed('json_encode')
+def dumps(obj):
+    """オブジェクトを JSON 文字列に変換"""
+    if BACKEND == 'json':
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+    return dumps_bytes(obj).decode('utf-8')
+
+
+@profiling.timed('json_decode')
+def loads(data):
+    """JSON 文字列／バイト列をオブジェクトに変換（失敗時は DecodeError）"""
+    if BACKEND == 'orjson':
+        # orjson.JSONDecodeError は json.JSONDecodeError のサブクラス
+        return orjson.loads(data)
+    if BACKEND == 'msgspec':
+        try:
+            return _msgspec_decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise DecodeError(str(e), data if isinstance(data, str) else '', 0)
+    return json.loads(data)
+
+
+def _msgpack_dumps(obj):
+    if msgspec is not None:
+        return msgspec.msgpack.encode(obj)
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def _msgpack_loads(data):
+    if msgspec is not None:
+        return msgspec.msgpack.decode(data)
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+def msgpack_available():
+    return msgspec is not None or msgpack is not None
+
+
+@profiling.timed('json_encode')
+def encode_content(obj, encoding=None):
+    """feature_content.content に保存する値を作成"""
+    encoding = encoding or Config.CONTENT_ENCODING
+    if encoding == 'msgpack' and msgpack_available():
+        fmt, payload = FORMAT_MSGPACK, _msgpack_dumps(obj)
+    else:
+        fmt, payload = FORMAT_JSON, dumps_bytes(obj)
+
+    method = compression.blob_compression()
+    if method != compression.COMPRESS_NONE and len(payload) >= Config.CONTENT_COMPRESSION_THRESHOLD:
+        return bytes([method | fmt]) + compression.compress_blob(payload, method)
+    if fmt == FORMAT_JSON:
+        # 既定は従来どおり TEXT の JSON
+        return payload.decode('utf-8')
+    return bytes([fmt]) + payload
+
+
+@profiling.timed('json_decode')
+def decode_content(raw):
+    """feature_content.content の値をオブジェクトに戻す（旧形式も読める）"""
+    if isinstance(raw, str):
+        return loads(raw)
+    if not raw:
+        raise DecodeError('empty content', '', 0)
+    raw = bytes(raw)
+    fmt = raw[0] & FORMAT_MASK
+    method = raw[0] & compression.COMPRESS_MASK
+    if fmt not in (FORMAT_JSON, FORMAT_MSGPACK) or method not in (
+            compression.COMPRESS_NONE, compression.COMPRESS_ZLIB, compression.COMPRESS_ZSTD):
+        # ヘッダー無しの JSON バイト列
+        return loads(raw)
+
+    try:
+        payload = compression.decompress_blob(raw[1:], method)
+    except Exception as e:
+        raise DecodeError(f'invalid compressed content: {e}', '', 0)
+    if fmt == FORMAT_MSGPACK:
+        try:
+            return _msgpack_loads(payload)
+        except Exception as e:
+            raise DecodeError(f'invalid msgpack content: {e}', '', 0)
+    return loads(payload)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() でも同じバックエンドを使うための Flask JSON プロバイダー"""
+
+    @profiling.timed('json_encode')
+    def dumps(self, obj, **kwargs):
+        if BACKEND == 'json':
+            return super().dumps(obj, **kwargs)
+        try:
+            return dumps(obj)
+        except TypeError:
+            # datetime などバックエンドが扱えない型は Flask 既定処理に任せる
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps(obj), mimetype=self.mimetype)
@@ -0,0 +1,628 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""サーバー（サークル）単位のエクスポートとインポート
+
+1つのサーバーの行（servers / features / feature_content / server_members /
+files）とファイルの実体（blobstore の保存先）を tar.gz にストリームで書き出し、別のインスタンスに
+新しい ID で取り込む。卒業したサークルの保管や、大きなサークルを別の
+インスタンスに移すときに使う。
+
+アーカイブ内の並び（インポートは先頭から順に1回だけ読む）:
+
+    manifest.json          形式とバージョン、元のサーバー ID
+    users.jsonl            メンバーのユーザー（ユーザー名で対応付ける）
+    server.json            servers の行
+    features.jsonl         features の行
+    members.jsonl          server_members の行
+    files.jsonl            files の行
+    content/<n>.json       機能ごとのコンテンツ（テーブルに移したデータを戻したもの）
+    blobs/<file_id>        ファイルの実体
+
+コンテンツはテーブル側のデータ（タスク・イベント・台帳・物品・Wiki・日記・
+アンケートの回答）をブロブに戻した形で書き出し、インポート時は通常の保存と
+同じ on_content フックで派生テーブルと検索インデックスを作り直す。
+サーバー・機能・ファイルの ID は新しく採番し、コンテンツ内の参照も書き換える。
+JSONL はメモリに溜めずに一時ファイル経由で書く。インポートはアーカイブを一時ディレクトリに
+展開してファイルの実体を先に書き込み、行は BATCH_SIZE 件ずつ別の書き込みジョブで
+executemany する（失敗したら挿入した行とファイルを消す）。
+
+    python server_archive.py export server_1700000000000 circle.tar.gz
+    python server_archive.py import circle.tar.gz [--create-users]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import secrets
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import uuid
+
+import blobstore
+import budget
+import calendar_events
+import diary
+import inventory
+import repository
+import search
+import serializer
+import tasks
+import wiki
+
+FORMAT = 'circle-server-export'
+VERSION = 1
+BATCH_SIZE = 500
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# feature_id を持つ派生テーブル（取り込みに失敗したサーバーを消すときに使う）
+FEATURE_TABLES = ('project_tasks', 'calendar_events', 'budget_accounts', 'budget_ledger', 'budget_rollups',
+                  'inventory_items', 'wiki_pages', 'wiki_revisions', 'diary_entries', 'survey_responses',
+                  'survey_answers', 'survey_choice_stats', 'survey_numeric_stats')
+
+USER_COLUMNS = ('id', 'username', 'password_hash', 'nickname', 'email', 'admission_year',
+                'graduation_year', 'major', 'student_id', 'bio', 'avatar', 'ui_scale', 'theme',
+                'language', 'timezone', 'created_at')
+SERVER_COLUMNS = ('id', 'name', 'description', 'icon', 'banner', 'owner_id', 'is_public',
+                  'max_members', 'settings', 'created_at', 'updated_at')
+FEATURE_COLUMNS = ('id', 'name', 'type', 'icon', 'position', 'created_at')
+MEMBER_COLUMNS = ('user_id', 'role', 'joined_at', 'invited_by', 'permissions')
+FILE_COLUMNS = ('id', 'filename', 'original_filename', 'file_path', 'file_size', 'mime_type',
+                'upload_by', 'feature_id', 'is_public', 'download_count', 'created_at')
+
+
+class ArchiveError(ValueError):
+    """アーカイブの形式が正しくない"""
+
+
+def _row_dict(columns, row):
+    return dict(zip(columns, row))
+
+
+def _in_clause(values):
+    return ','.join('?' for _ in values)
+
+
+# ---- エクスポート ----------------------------------------------------------
+
+class _ChunkBuffer:
+    """tarfile の書き込み先。書かれたバイト列を取り出して返す"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, _BytesReader(data))
+
+
+class _BytesReader:
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._pos = 0
+
+    def read(self, size=-1):
+        end = len(self._data) if size < 0 else self._pos + size
+        chunk = self._data[self._pos:end].tobytes()
+        self._pos += len(chunk)
+        return chunk
+
+
+def _add_jsonl(tar, name, rows):
+    """rows を一時ファイルに書いてから追加する（サイズがヘッダーに必要なため）"""
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+        for row in rows:
+            spool.write(serializer.dumps_bytes(row) + b'\n')
+        info = tarfile.TarInfo(name)
+        info.size = spool.tell()
+        info.mtime = int(time.time())
+        spool.seek(0)
+        tar.addfile(info, spool)
+
+
+def portable_content(conn, feature_id, feature_type, content):
+    """テーブルに移したデータをブロブに戻し、インポート先で取り込める形にする。
+    戻すテーブルは機能の種類で決める（ブロブのキーは保存のしかたによって欠けていることがある）"""
+    if not isinstance(content, dict):
+        return content
+    by_feature = {feature_id: content}
+    if feature_type == 'projects':
+        tasks.merge_into_content(by_feature, tasks.tasks_by_feature(conn, [feature_id]))
+    elif feature_type == 'calendar':
+        calendar_events.merge_into_content(by_feature, calendar_events.events_by_feature(conn, [feature_id]))
+    elif feature_type == 'budget':
+        budget.merge_into_content(by_feature, budget.content_by_feature(conn, [feature_id]))
+    elif feature_type == 'inventory':
+        inventory.merge_into_content(by_feature, inventory.items_by_feature(conn, [feature_id]))
+    elif feature_type == 'wiki':
+        wiki.merge_into_content(by_feature, wiki.pages_by_feature(conn, [feature_id]))
+    elif feature_type == 'diary':
+        content.setdefault('entries', {}).update(diary.entries_by_feature(conn, [feature_id])[feature_id])
+    elif feature_type == 'survey':
+        # 回答は旧 submitSurveyResponse 形式で戻す（surveys.sync_from_content が取り込む）
+        responses = content.setdefault('responses', {})
+        for survey_id, username, answers, submitted_at in conn.execute('''
+            SELECT survey_id, username, answers, submitted_at FROM survey_responses
+            WHERE feature_id = ? ORDER BY id
+        ''', (feature_id,)):
+            responses.setdefault(survey_id, {})[username] = {
+                'responses': serializer.loads(answers), 'submitted_at': submitted_at
+            }
+    return content
+
+
+def export_server(conn, server_id, blobs):
+    """サーバーを tar.gz のバイト列として少しずつ yield する（実体は blobs から読む）"""
+    server = conn.execute(
+        f'SELECT {", ".join(SERVER_COLUMNS)} FROM servers WHERE id = ?', (server_id,)
+    ).fetchone()
+    if not server:
+        raise ArchiveError('サーバーが見つかりません')
+    feature_types = [(row[0], row[1]) for row in conn.execute(
+        'SELECT id, type FROM features WHERE server_id = ? ORDER BY position, id', (server_id,)
+    )]
+    # ホワイトボードの画像は server_id を持たず feature_id だけで記録されている
+    file_sql = f'''
+        SELECT {", ".join('f.' + column for column in FILE_COLUMNS)} FROM files f
+        WHERE f.server_id = ? OR f.feature_id IN (SELECT id FROM features WHERE server_id = ?)
+        ORDER BY f.created_at, f.id
+    '''
+
+    buffer = _ChunkBuffer()
+    tar = tarfile.open(fileobj=buffer, mode='w|gz')
+
+    _add_bytes(tar, 'manifest.json', serializer.dumps_bytes({
+        'format': FORMAT,
+        'version': VERSION,
+        'serverId': server_id,
+        'exportedAt': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }))
+    _add_jsonl(tar, 'users.jsonl', (_row_dict(USER_COLUMNS, row) for row in conn.execute(f'''
+        SELECT {", ".join('u.' + column for column in USER_COLUMNS)} FROM users u
+        WHERE u.id IN (SELECT user_id FROM server_members WHERE server_id = ?)
+           OR u.id = (SELECT owner_id FROM servers WHERE id = ?)
+           OR u.id IN (SELECT upload_by FROM ({file_sql}) AS server_files)
+    ''', (server_id, server_id, server_id, server_id))))
+    _add_bytes(tar, 'server.json', serializer.dumps_bytes(_row_dict(SERVER_COLUMNS, server)))
+    _add_jsonl(tar, 'features.jsonl', (_row_dict(FEATURE_COLUMNS, row) for row in conn.execute(
+        f'SELECT {", ".join(FEATURE_COLUMNS)} FROM features WHERE server_id = ? ORDER BY position, id',
+        (server_id,)
+    )))
+    _add_jsonl(tar, 'members.jsonl', (_row_dict(MEMBER_COLUMNS, row) for row in conn.execute(
+        f'SELECT {", ".join(MEMBER_COLUMNS)} FROM server_members WHERE server_id = ? ORDER BY id',
+        (server_id,)
+    )))
+    # 実体の無いファイルの行は書き出さない
+    files = [f for f in (_row_dict(FILE_COLUMNS, row) for row in conn.execute(file_sql, (server_id, server_id)))
+             if blobs.exists(blobstore.key_for_path(f['file_path']))]
+    _add_jsonl(tar, 'files.jsonl', files)
+    yield buffer.take()
+
+    # コンテンツは機能ごとに1件ずつ読み込んで書き出す
+    for index, (feature_id, feature_type) in enumerate(feature_types):
+        row = conn.execute(
+            'SELECT content, updated_at FROM feature_content WHERE feature_id = ?', (feature_id,)
+        ).fetchone()
+        if not row:
+            continue
+        content = portable_content(conn, feature_id, feature_type, serializer.decode_content(row[0]))
+        _add_bytes(tar, f'content/{index}.json', serializer.dumps_bytes({
+            'featureId': feature_id, 'updatedAt': row[1], 'content': content
+        }))
+        yield buffer.take()
+
+    for f in files:
+        info = tarfile.TarInfo(f'blobs/{f["id"]}')
+        key = blobstore.key_for_path(f['file_path'])
+        info.size = blobs.size(key)
+        info.mtime = int(time.time())
+        with contextlib.closing(blobs.open(key)) as blob:
+            tar.addfile(info, blob)
+        yield buffer.take()
+
+    tar.close()
+    yield buffer.take()
+
+
+# ---- インポート ------------------------------------------------------------
+
+class _IdMap:
+    """元の ID から新しい ID への対応と、コンテンツ内の参照の書き換え"""
+
+    def __init__(self):
+        self.ids = {}
+        self._pattern = None
+
+    def add(self, old, new):
+        self.ids[old] = new
+        self._pattern = None
+
+    def rewrite(self, text):
+        if not self.ids or not isinstance(text, str):
+            return text
+        if self._pattern is None:
+            # 機能 ID はサーバー ID を含むので長いものから照合する
+            alternatives = '|'.join(re.escape(old) for old in sorted(self.ids, key=len, reverse=True))
+            self._pattern = re.compile(r'(?<![\w-])(' + alternatives + r')(?![\w-])')
+        return self._pattern.sub(lambda m: self.ids[m.group(1)], text)
+
+    def rewrite_content(self, content):
+        return json.loads(self.rewrite(json.dumps(content, ensure_ascii=False)))
+
+
+def _jsonl(fileobj):
+    for line in fileobj:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _new_server_id(conn):
+    while True:
+        server_id = f"server_{int(time.time() * 1000)}"
+        if not conn.execute('SELECT 1 FROM servers WHERE id = ?', (server_id,)).fetchone():
+            return server_id
+        time.sleep(0.001)
+
+
+def discard_server(conn, server_id, user_ids=()):
+    """途中まで取り込んだサーバーの行（派生テーブル・検索インデックスを含む）と、
+    取り込みで作成したユーザーを消す"""
+    feature_ids = [row[0] for row in conn.execute('SELECT id FROM features WHERE server_id = ?', (server_id,))]
+    if feature_ids:
+        placeholders = _in_clause(feature_ids)
+        for table in FEATURE_TABLES + ('feature_content', 'files'):
+            conn.execute(f'DELETE FROM {table} WHERE feature_id IN ({placeholders})', feature_ids)
+    search.remove_server(conn, server_id)
+    for table in ('files', 'server_members', 'server_invites', 'features'):
+        conn.execute(f'DELETE FROM {table} WHERE server_id = ?', (server_id,))
+    conn.execute('DELETE FROM servers WHERE id = ?', (server_id,))
+    if user_ids:
+        conn.execute(f'DELETE FROM users WHERE id IN ({_in_clause(user_ids)})', list(user_ids))
+
+
+class _Importer:
+    """アーカイブを一時ディレクトリに展開してから、BATCH_SIZE 行ずつのジョブで取り込む"""
+
+    def __init__(self, run, blobs, owner_id, create_users, on_content, directory):
+        self.run = run
+        self.blobs = blobs
+        self.owner_id = owner_id
+        self.create_users = create_users
+        self.on_content = on_content
+        self.directory = directory
+        self.parts = {}  # users.jsonl などの名前 -> 展開したパス
+        self.contents = []  # 展開した content/<n>.json のパス（アーカイブ内の順）
+        self.users = {}  # 元のユーザー ID -> このインスタンスのユーザー ID
+        self.ids = _IdMap()
+        self.server_id = None
+        self.owner = None
+        self.files = {}  # 元のファイル ID -> (新しい ID, 新しいパス)
+        self.written = []
+        self.created_user_ids = []
+        self.summary = {'features': 0, 'members': 0, 'files': 0, 'createdUsers': [], 'skippedUsers': []}
+
+    # ---- 展開（データベースには触れない） ----
+
+    def manifest(self, data):
+        if data.get('format') != FORMAT or data.get('version') != VERSION:
+            raise ArchiveError('サーバーのエクスポートファイルではないか、対応していないバージョンです')
+
+    def spool(self, name, fileobj):
+        path = os.path.join(self.directory, f'{len(self.parts) + len(self.contents)}.part')
+        with open(path, 'wb') as out:
+            shutil.copyfileobj(fileobj, out)
+        if name.startswith('content/'):
+            self.contents.append(path)
+        else:
+            self.parts[name] = path
+
+    def plan_files(self):
+        """ファイルに新しい ID と保存先を割り当てる（実体はこのあと blobs/ から書き込む）"""
+        # コンテンツ内の URL（/files/uploads/<ID>.png など）も新しい ID に書き換わるよう対応に加える
+        for row in self.rows('files.jsonl'):
+            new_id = str(uuid.uuid4())
+            extension = os.path.splitext(row['filename'] or '')[1]
+            directory = 'whiteboards' if os.path.basename(os.path.dirname(row['file_path'])) == 'whiteboards' \
+                else 'uploads'
+            self.files[row['id']] = (new_id, os.path.join('files', directory, f'{new_id}{extension}'))
+            self.ids.add(row['id'], new_id)
+
+    def import_blob(self, file_id, fileobj):
+        planned = self.files.get(file_id)
+        if planned is None:
+            return
+        key = blobstore.key_for_path(planned[1])
+        self.written.append(key)
+        self.blobs.put(key, fileobj)
+
+    def rows(self, name):
+        path = self.parts.get(name)
+        if path is None:
+            return
+        with open(path, 'rb') as fileobj:
+            yield from _jsonl(fileobj)
+
+    def load(self, name):
+        with open(self.parts[name], 'rb') as fileobj:
+            return json.load(fileobj)
+
+    # ---- 取り込み（1回の run は BATCH_SIZE 行分だけ） ----
+
+    def import_users(self):
+        for batch in _batches(self.rows('users.jsonl')):
+            self.run(lambda conn, batch=batch: self._add_users(conn, batch))
+
+    def _add_users(self, conn, batch):
+        existing = repository.user_ids_by_name(conn, [row['username'] for row in batch])
+        missing = [row for row in batch if row['username'] not in existing]
+        if missing and self.create_users:
+            columns = USER_COLUMNS[1:]
+            conn.executemany(
+                f'INSERT INTO users ({", ".join(columns)}) VALUES ({_in_clause(columns)})',
+                [tuple(row.get(column) for column in columns) for row in missing]
+            )
+            names = [row['username'] for row in missing]
+            created = repository.user_ids_by_name(conn, names)
+            existing.update(created)
+            self.created_user_ids.extend(created.values())
+            self.summary['createdUsers'].extend(names)
+        for row in batch:
+            if row['username'] in existing:
+                self.users[row['id']] = existing[row['username']]
+            else:
+                self.summary['skippedUsers'].append(row['username'])
+
+    def import_server(self):
+        row = self.load('server.json')
+        owner_id = self.owner_id or self.users.get(row['owner_id'])
+        if owner_id is None:
+            raise ArchiveError('サーバーの所有者がこのインスタンスにいません（--create-users で作成できます）')
+        self.owner = owner_id
+
+        def add_server(conn):
+            self.server_id = _new_server_id(conn)
+            conn.execute(f'''
+                INSERT INTO servers ({", ".join(SERVER_COLUMNS)}, invite_code)
+                VALUES ({_in_clause(SERVER_COLUMNS)}, ?)
+            ''', tuple(self.server_id if column == 'id' else owner_id if column == 'owner_id' else row.get(column)
+                       for column in SERVER_COLUMNS) + (secrets.token_urlsafe(8),))
+
+        self.run(add_server)
+        self.ids.add(row['id'], self.server_id)
+
+    def import_features(self):
+        stamp = int(time.time() * 1000)
+        for batch in _batches(self.rows('features.jsonl')):
+            values = []
+            for row in batch:
+                feature_id = f"{self.server_id}_{row['type']}_{stamp}_{self.summary['features']}"
+                self.ids.add(row['id'], feature_id)
+                self.summary['features'] += 1
+                values.append((feature_id, self.server_id, row['name'], row['type'], row['icon'],
+                               row.get('position') or 0, row.get('created_at')))
+            self.run(lambda conn, values=values: conn.executemany('''
+                INSERT INTO features (id, server_id, name, type, icon, position, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', values))
+
+    def import_members(self):
+        # 所有者は最後に追加する（それまでサーバーは誰の一覧にも出ない）
+        for batch in _batches(self.rows('members.jsonl')):
+            values = []
+            for row in batch:
+                user_id = self.users.get(row['user_id'])
+                if user_id is None or user_id == self.owner:
+                    continue
+                role = row.get('role') or 'member'
+                if role == 'owner':
+                    # 所有者は1人だけ（インポートしたユーザーが所有者になる場合）
+                    role = 'admin'
+                values.append((self.server_id, user_id, role, row.get('joined_at'),
+                               self.users.get(row.get('invited_by')), row.get('permissions') or '{}'))
+            self.run(lambda conn, values=values: conn.executemany('''
+                INSERT OR IGNORE INTO server_members (server_id, user_id, role, joined_at, invited_by, permissions)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', values))
+            self.summary['members'] += len(values)
+
+    def import_files(self):
+        for batch in _batches(self.rows('files.jsonl')):
+            values = []
+            for row in batch:
+                new_id, file_path = self.files[row['id']]
+                extension = os.path.splitext(file_path)[1]
+                directory = os.path.basename(os.path.dirname(file_path))
+                values.append((new_id, f'{new_id}{extension}', row['original_filename'], file_path,
+                               row['file_size'], row['mime_type'], self.users.get(row['upload_by'], self.owner),
+                               self.server_id if directory == 'uploads' else None,
+                               self.ids.ids.get(row.get('feature_id')),
+                               row.get('is_public') or 0, row.get('download_count') or 0, row.get('created_at')))
+            self.run(lambda conn, values=values: conn.executemany('''
+                INSERT INTO files (id, filename, original_filename, file_path, file_size, mime_type,
+                                   upload_by, server_id, feature_id, is_public, download_count, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', values))
+            self.summary['files'] += len(values)
+
+    def import_contents(self):
+        # コンテンツは機能ごとに1ジョブ（ID の書き換えはジョブの外で済ませる）
+        for path in self.contents:
+            with open(path, 'rb') as fileobj:
+                data = json.load(fileobj)
+            feature_id = self.ids.ids.get(data.get('featureId'))
+            if feature_id is None:
+                continue
+            content = self.ids.rewrite_content(data.get('content'))
+            self.run(lambda conn, feature_id=feature_id, content=content, data=data:
+                     self._add_content(conn, feature_id, content, data.get('updatedAt')))
+
+    def _add_content(self, conn, feature_id, content, updated_at):
+        if self.on_content is not None:
+            self.on_content(conn, feature_id, content)
+        repository.store_content(conn, feature_id, content, updated_at)
+
+    def finish(self):
+        self.run(lambda conn: repository.add_members(conn, [(self.server_id, self.owner, 'owner', None)]))
+        self.summary['members'] += 1
+
+    def discard(self):
+        """取り込んだ行と書き込んだファイルを消す（失敗時）"""
+        if self.server_id is not None or self.created_user_ids:
+            try:
+                self.run(lambda conn: discard_server(conn, self.server_id, self.created_user_ids))
+            except Exception:
+                pass
+        for key in self.written:
+            try:
+                self.blobs.delete(key)
+            except Exception:
+                pass
+
+
+def import_server(run, stream, blobs, owner_id=None, create_users=False, on_content=None):
+    """export_server のアーカイブを新しいサーバーとして取り込み、概要を返す。
+
+    run(job) は job(conn) を1トランザクションで実行する関数（app の writes.run）。
+    アーカイブはまず一時ディレクトリに展開し、ファイルの実体は書き込みジョブの外で
+    blobs に書き込む。そのあと行を BATCH_SIZE 件ずつ、コンテンツを機能ごとに別のジョブで
+    挿入し、最後に所有者をメンバーに加えてサーバーを見えるようにする。途中で失敗したら
+    挿入した行と書き込んだファイルを消してから例外を送出する。
+
+    owner_id を渡すとそのユーザーが所有者になる（元の所有者は admin）。渡さない場合は
+    元の所有者をユーザー名で対応付ける。create_users が False のときは、この
+    インスタンスにいないユーザーはメンバーに追加せずに skippedUsers で返す。
+    on_content(conn, feature_id, content) はコンテンツを保存する直前に呼ばれる。
+    """
+    with tempfile.TemporaryDirectory(prefix='server-import-') as directory:
+        importer = _Importer(run, blobs, owner_id, create_users, on_content, directory)
+        try:
+            _read_archive(importer, stream)
+            importer.import_users()
+            importer.import_server()
+            importer.import_features()
+            importer.import_members()
+            importer.import_files()
+            importer.import_contents()
+            importer.finish()
+        except BaseException:
+            importer.discard()
+            raise
+    importer.summary['serverId'] = importer.server_id
+    importer.summary['userIds'] = sorted(set(importer.users.values()) | {importer.owner})
+    return importer.summary
+
+
+def _read_archive(importer, stream):
+    """アーカイブを先頭から1回だけ読み、行とコンテンツを展開してファイルの実体を書き込む"""
+    try:
+        with tarfile.open(fileobj=stream, mode='r|*') as tar:
+            seen_manifest = False
+            for member in tar:
+                if not member.isfile():
+                    continue
+                fileobj = tar.extractfile(member)
+                name = member.name
+                if name == 'manifest.json':
+                    importer.manifest(json.load(fileobj))
+                    seen_manifest = True
+                    continue
+                if not seen_manifest:
+                    raise ArchiveError('manifest.json がありません')
+                if name in ('users.jsonl', 'server.json'):
+                    importer.spool(name, fileobj)
+                elif 'server.json' not in importer.parts:
+                    raise ArchiveError('server.json がありません')
+                elif name in ('features.jsonl', 'members.jsonl') or name.startswith('content/'):
+                    importer.spool(name, fileobj)
+                elif name == 'files.jsonl':
+                    importer.spool(name, fileobj)
+                    importer.plan_files()
+                elif name.startswith('blobs/'):
+                    importer.import_blob(name[len('blobs/'):], fileobj)
+        if 'server.json' not in importer.parts:
+            raise ArchiveError('server.json がありません')
+        # 行の形式はジョブを投入する前に確かめる
+        importer.load('server.json')['owner_id']
+        for name in ('users.jsonl', 'features.jsonl', 'members.jsonl'):
+            for _ in importer.rows(name):
+                pass
+    except (tarfile.TarError, EOFError, OSError, json.JSONDecodeError, KeyError, TypeError) as e:
+        raise ArchiveError(f'アーカイブを読み込めません: {e}') from e
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export', help='サーバーをアーカイブに書き出す')
+    export.add_argument('server_id')
+    export.add_argument('path')
+    imported = sub.add_parser('import', help='アーカイブを新しいサーバーとして取り込む')
+    imported.add_argument('path')
+    imported.add_argument('--create-users', action='store_true',
+                          help='このインスタンスにいないユーザーを元のパスワードのまま作成する')
+    args = parser.parse_args(argv)
+
+    # 保存時と同じ派生テーブル・検索インデックスの更新を使う
+    import app as app_module
+    app_module.init_database()
+    conn = app_module.get_db_connection()
+    try:
+        if args.command == 'export':
+            with open(args.path + '.partial', 'wb') as out:
+                for chunk in export_server(conn, args.server_id, app_module.blobs):
+                    out.write(chunk)
+            os.replace(args.path + '.partial', args.path)
+            print(f'{args.path} ({os.path.getsize(args.path)} bytes)')
+        else:
+            with open(args.path, 'rb') as stream:
+                summary = import_server(app_module.writes.run, stream, app_module.blobs,
+                                        create_users=args.create_users,
+                                        on_content=app_module.on_feature_content_saved)
+            print(f"serverId={summary['serverId']} features={summary['features']} "
+                  f"members={summary['members']} files={summary['files']}")
+            if summary['createdUsers']:
+                print('created users:', ', '.join(summary['createdUsers']))
+            if summary['skippedUsers']:
+                print('skipped users (not found):', ', '.join(summary['skippedUsers']))
+    except ArchiveError as e:
+        print('ERROR:', e, file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+        app_module.bookkeeping.close()
+        app_module.writes.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""index.html の事前圧縮・キャッシュ配信
+
+起動時（または index.html の更新検知時）に一度だけ gzip / brotli 版を作成し、
+バリアントごとの強い ETag で条件付きリクエスト（304）に応答する。
+STATIC_SPLIT_ASSETS を有効にすると、インラインの <style> と
+<script type="module"> をハッシュ付きファイル名の外部アセットに切り出し、
+immutable で長期キャッシュさせる。
+"""
+
+import hashlib
+import os
+import re
+import threading
+
+from flask import Response
+
+import compression
+from config import Config
+
+ASSET_URL_PREFIX = '/assets/'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# HTML 自体はハッシュを持たないので毎回 ETag で再検証させる
+INDEX_CACHE_CONTROL = 'no-cache'
+
+_INLINE_STYLE_RE = re.compile(r'<style>(.*?)</style>', re.S)
+_INLINE_MODULE_RE = re.compile(r'<script type="module">(.*?)</script>', re.S)
+
+
+class StaticAsset:
+    """エンコーディングごとに事前圧縮済みの本文と ETag を持つアセット"""
+
+    def __init__(self, body, mimetype, cache_control):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.digest = digest
+        self.variants = {None: (body, digest)}
+        if len(body) >= Config.RESPONSE_COMPRESSION_MIN_SIZE:
+            self.variants['gzip'] = (compression.compress_body(body, 'gzip'), f'{digest}-gz')
+            if compression.brotli is not None:
+                self.variants['br'] = (compression.compress_body(body, 'br'), f'{digest}-br')
+
+    def response(self, request):
+        encoding = compression.negotiate_encoding(request.headers.get('Accept-Encoding'))
+        if encoding not in self.variants:
+            encoding = None
+        body, etag = self.variants[encoding]
+
+        response = Response(body, mimetype=self.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = self.cache_control
+        return response.make_conditional(request)
+
+
+class StaticSite:
+    """index.html と切り出したアセットを保持する"""
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.index = None
+        self.assets = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _split(self, html):
+        assets = {}
+
+        def extract(pattern, ext, mimetype, make_tag):
+            nonlocal html
+            match = pattern.search(html)
+            if not match:
+                return
+            body = match.group(1).encode('utf-8')
+            digest = hashlib.sha256(body).hexdigest()[:16]
+            name = f'app.{digest}.{ext}'
+            assets[name] = StaticAsset(body, mimetype, IMMUTABLE_CACHE_CONTROL)
+            html = html[:match.start()] + make_tag(ASSET_URL_PREFIX + name) + html[match.end():]
+
+        extract(_INLINE_STYLE_RE, 'css', 'text/css',
+                lambda url: f'<link rel="stylesheet" href="{url}">')
+        extract(_INLINE_MODULE_RE, 'js', 'text/javascript',
+                lambda url: f'<script type="module" src="{url}"></script>')
+        return html, assets
+
+    def build(self):
+        """index.html を読み込み、事前圧縮版（と切り出しアセット）を作成"""
+        with self._lock:
+            mtime = os.path.getmtime(self.index_path)
+            if self.index is not None and mtime == self._mtime:
+                return
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            assets = {}
+            if Config.STATIC_SPLIT_ASSETS:
+                html, assets = self._split(html)
+            self.index = StaticAsset(html.encode('utf-8'), 'text/html', INDEX_CACHE_CONTROL)
+            # 古いハッシュのアセットも残しておき、読み込み途中のクライアントを壊さない
+            self.assets.update(assets)
+            self._mtime = mtime
+
+    def index_response(self, request):
+        self.build()
+        return self.index.response(request)
+
+    def asset_response(self, name, request):
+        self.build()
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+        return asset.response(request)
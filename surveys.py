@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""アンケート回答の保存と集計
+
+回答は survey_responses / survey_answers に1行ずつ保存し、feature_content の
+ブロブには書き込まない。選択肢ごとの件数（survey_choice_stats）と数値回答の
+件数・合計・二乗和（survey_numeric_stats）は回答のたびに差分で更新するので、
+getSurveyResults は生の回答を読まずに集計結果を返せる。
+"""
+
+import math
+import time
+
+import database
+import repository
+import serializer
+
+CHOICE_TYPES = ('radio', 'checkbox', 'rating')
+DEFAULT_TEXT_LIMIT = 50
+MAX_TEXT_LIMIT = 500
+
+
+def init_survey_tables(cursor):
+    """アンケート用テーブルを作成し、新規作成時は既存ブロブの回答を取り込む"""
+    exists = database.table_exists(cursor, 'survey_responses')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS survey_responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            feature_id TEXT NOT NULL,
+            survey_id TEXT NOT NULL,
+            username TEXT NOT NULL,
+            user_id INTEGER,
+            response_key TEXT,
+            answers TEXT NOT NULL,
+            submitted_at REAL,
+            UNIQUE(feature_id, survey_id, username),
+            FOREIGN KEY (feature_id) REFERENCES features (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_survey_responses_user ON survey_responses (user_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS survey_answers (
+            response_id INTEGER NOT NULL,
+            feature_id TEXT NOT NULL,
+            survey_id TEXT NOT NULL,
+            question_id TEXT NOT NULL,
+            value TEXT,
+            num REAL,
+            FOREIGN KEY (response_id) REFERENCES survey_responses (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_survey_answers_question
+        ON survey_answers (feature_id, survey_id, question_id, num)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_survey_answers_response ON survey_answers (response_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS survey_choice_stats (
+            feature_id TEXT NOT NULL,
+            survey_id TEXT NOT NULL,
+            question_id TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (feature_id, survey_id, question_id, value)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS survey_numeric_stats (
+            feature_id TEXT NOT NULL,
+            survey_id TEXT NOT NULL,
+            question_id TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            total REAL NOT NULL DEFAULT 0,
+            total_sq REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (feature_id, survey_id, question_id)
+        )
+    ''')
+
+    if not exists:
+        rows = cursor.execute('''
+            SELECT f.id, fc.content FROM features f
+            JOIN feature_content fc ON fc.feature_id = f.id
+            WHERE f.type = 'survey'
+        ''').fetchall()
+        for feature_id, raw in rows:
+            try:
+                content = serializer.decode_content(raw)
+            except serializer.DecodeError:
+                continue
+            if sync_from_content(cursor, feature_id, content):
+                repository.update_content(cursor, feature_id, content)
+
+
+def _question_types(survey):
+    types = {}
+    for q in (survey or {}).get('questions') or []:
+        if isinstance(q, dict) and q.get('id') is not None:
+            types[str(q['id'])] = q.get('type')
+    return types
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else None
+    try:
+        number = float(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _answer_rows(answers):
+    """{question_id: 値 or [値...]} を (question_id, value, num) の列に展開"""
+    if not isinstance(answers, dict):
+        return
+    for question_id, value in answers.items():
+        values = value if isinstance(value, list) else [value]
+        for v in values:
+            if v is None or v == '':
+                continue
+            text = v if isinstance(v, str) else serializer.dumps(v)
+            yield str(question_id), text, _to_number(v)
+
+
+def _apply_stats(conn, feature_id, survey_id, rows, question_types, sign):
+    for question_id, value, num in rows:
+        if question_types.get(question_id, 'radio') in CHOICE_TYPES:
+            conn.execute('''
+                INSERT INTO survey_choice_stats (feature_id, survey_id, question_id, value, count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (feature_id, survey_id, question_id, value)
+                DO UPDATE SET count = survey_choice_stats.count + excluded.count
+            ''', (feature_id, survey_id, question_id, value, sign))
+        if num is not None and question_types.get(question_id) != 'text':
+            conn.execute('''
+                INSERT INTO survey_numeric_stats (feature_id, survey_id, question_id, n, total, total_sq)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (feature_id, survey_id, question_id)
+                DO UPDATE SET n = survey_numeric_stats.n + excluded.n,
+                              total = survey_numeric_stats.total + excluded.total,
+                              total_sq = survey_numeric_stats.total_sq + excluded.total_sq
+            ''', (feature_id, survey_id, question_id, sign, sign * num, sign * num * num))
+
+
+def record_response(conn, feature_id, survey_id, survey, username, answers,
+                    user_id=None, submitted_at=None, response_key=None):
+    """1件の回答を保存し集計を差分更新する（同じユーザーの再回答は置き換え）"""
+    question_types = _question_types(survey)
+    existing = conn.execute('''
+        SELECT id, answers FROM survey_responses
+        WHERE feature_id = ? AND survey_id = ? AND username = ?
+    ''', (feature_id, survey_id, username)).fetchone()
+    if existing:
+        old_rows = list(_answer_rows(serializer.loads(existing[1])))
+        _apply_stats(conn, feature_id, survey_id, old_rows, question_types, -1)
+        conn.execute('DELETE FROM survey_answers WHERE response_id = ?', (existing[0],))
+        conn.execute('DELETE FROM survey_responses WHERE id = ?', (existing[0],))
+
+    cur = conn.execute('''
+        INSERT INTO survey_responses (feature_id, survey_id, username, user_id, response_key,
+                                      answers, submitted_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (feature_id, survey_id, username, user_id, response_key,
+          serializer.dumps(answers), submitted_at or time.time()))
+    rows = list(_answer_rows(answers))
+    conn.executemany('''
+        INSERT INTO survey_answers (response_id, feature_id, survey_id, question_id, value, num)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(cur.lastrowid, feature_id, survey_id, q, v, n) for q, v, n in rows])
+    _apply_stats(conn, feature_id, survey_id, rows, question_types, 1)
+    return cur.lastrowid
+
+
+def sync_from_content(conn, feature_id, content, username=None):
+    """ブロブに書かれた回答（旧ハンドラー形式／クライアント形式）を取り込み、
+    取り込んだ回答はブロブから取り除く。ブロブを変更したら True。
+
+    username を渡すと（updateFeatureContent からの保存）、その本人の回答だけを
+    取り込む。ほかのメンバーの回答を書き換えたり、なりすましたりできないようにする。
+    username が None なのは移行やインポートのようなサーバー側の取り込みだけ。
+    """
+    if not isinstance(content, dict):
+        return False
+    changed = False
+    surveys = content.get('surveys') or {}
+    known = {
+        (row[0], row[1]): row[2]
+        for row in conn.execute(
+            'SELECT survey_id, username, response_key FROM survey_responses WHERE feature_id = ?',
+            (feature_id,)
+        )
+    }
+    user_ids = {}
+
+    def user_id_for(username):
+        if username not in user_ids:
+            row = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+            user_ids[username] = row[0] if row else None
+        return user_ids[username]
+
+    def ingest(survey_id, respondent, answers, submitted_at):
+        if not respondent or not isinstance(answers, dict):
+            return
+        if username is not None and respondent != username:
+            return
+        key = str(submitted_at)
+        if known.get((survey_id, respondent)) == key:
+            return
+        record_response(conn, feature_id, survey_id, surveys.get(survey_id), respondent, answers,
+                        user_id_for(respondent), submitted_at, key)
+        known[(survey_id, respondent)] = key
+
+    # 旧 submitSurveyResponse 形式: content['responses'][survey_id][username]
+    legacy = content.get('responses')
+    if isinstance(legacy, dict):
+        for survey_id, by_user in legacy.items():
+            if not isinstance(by_user, dict):
+                continue
+            for respondent, response in by_user.items():
+                if isinstance(response, dict):
+                    ingest(str(survey_id), respondent, response.get('responses'), response.get('submitted_at'))
+            if by_user:
+                legacy[survey_id] = {}
+                changed = True
+
+    # クライアント形式: content['surveys'][survey_id]['responses'] = [...]
+    for survey_id, survey in surveys.items():
+        if not isinstance(survey, dict):
+            continue
+        responses = survey.get('responses')
+        if not responses:
+            continue
+        for response in responses if isinstance(responses, list) else []:
+            if isinstance(response, dict):
+                ingest(str(survey_id), response.get('respondent'), response.get('responses'),
+                       response.get('submitted_at'))
+        # 集計は getSurveyResults で返すので、回答の一覧はブロブに残さない
+        survey['responses'] = []
+        changed = True
+    return changed
+
+
+def own_responses(conn, user_id, feature_id=None):
+    """ユーザー自身の回答を {feature_id: {survey_id: 回答}} で返す（1クエリ）"""
+    result = {}
+    sql = '''
+        SELECT feature_id, survey_id, username, answers, submitted_at
+        FROM survey_responses WHERE user_id = ?
+    '''
+    params = [user_id]
+    if feature_id is not None:
+        sql += ' AND feature_id = ?'
+        params.append(feature_id)
+    for row in conn.execute(sql, params):
+        result.setdefault(row[0], {})[row[1]] = {
+            'responses': serializer.loads(row[3]),
+            'user': row[2],
+            'submitted_at': row[4]
+        }
+    return result
+
+
+def merge_own_responses(content_by_feature, own):
+    """クライアントの「回答済み」表示用に、本人の回答だけを content['responses'] に戻す"""
+    for feature_id, by_survey in own.items():
+        content = content_by_feature.get(feature_id)
+        if not isinstance(content, dict):
+            continue
+        responses = content.setdefault('responses', {})
+        for survey_id, response in by_survey.items():
+            responses.setdefault(survey_id, {})[response['user']] = response
+
+
+def get_results(conn, feature_id, survey_id, survey, text_limit=DEFAULT_TEXT_LIMIT):
+    """質問ごとの件数・選択肢分布・数値統計を返す"""
+    text_limit = max(0, min(int(text_limit), MAX_TEXT_LIMIT))
+    response_count = conn.execute(
+        'SELECT COUNT(*) FROM survey_responses WHERE feature_id = ? AND survey_id = ?',
+        (feature_id, survey_id)
+    ).fetchone()[0]
+
+    choices = {}
+    for row in conn.execute('''
+        SELECT question_id, value, count FROM survey_choice_stats
+        WHERE feature_id = ? AND survey_id = ? AND count > 0
+    ''', (feature_id, survey_id)):
+        choices.setdefault(row[0], {})[row[1]] = row[2]
+
+    numeric = {}
+    for row in conn.execute('''
+        SELECT question_id, n, total, total_sq FROM survey_numeric_stats
+        WHERE feature_id = ? AND survey_id = ? AND n > 0
+    ''', (feature_id, survey_id)):
+        n, total, total_sq = row[1], row[2], row[3]
+        mean = total / n
+        variance = max(0.0, total_sq / n - mean * mean)
+        numeric[row[0]] = {'count': n, 'mean': mean, 'stddev': math.sqrt(variance)}
+
+    # 最小・最大は (question_id, num) インデックスで求める
+    for row in conn.execute('''
+        SELECT question_id, MIN(num), MAX(num) FROM survey_answers
+        WHERE feature_id = ? AND survey_id = ? AND num IS NOT NULL
+        GROUP BY question_id
+    ''', (feature_id, survey_id)):
+        if row[0] in numeric:
+            numeric[row[0]].update({'min': row[1], 'max': row[2]})
+
+    answered = {
+        row[0]: row[1]
+        for row in conn.execute('''
+            SELECT question_id, COUNT(DISTINCT response_id) FROM survey_answers
+            WHERE feature_id = ? AND survey_id = ?
+            GROUP BY question_id
+        ''', (feature_id, survey_id))
+    }
+
+    questions = []
+    for q in (survey or {}).get('questions') or []:
+        if not isinstance(q, dict):
+            continue
+        question_id = str(q.get('id'))
+        result = {
+            'id': q.get('id'),
+            'text': q.get('text'),
+            'type': q.get('type'),
+            'answered': answered.get(question_id, 0),
+        }
+        if q.get('type') in CHOICE_TYPES:
+            counts = {str(opt): 0 for opt in q.get('options') or []}
+            counts.update(choices.get(question_id, {}))
+            result['counts'] = counts
+        if question_id in numeric:
+            result['numeric'] = numeric[question_id]
+        if q.get('type') == 'text' and text_limit:
+            result['textAnswers'] = [
+                row[0] for row in conn.execute('''
+                    SELECT value FROM survey_answers
+                    WHERE feature_id = ? AND survey_id = ? AND question_id = ?
+                    ORDER BY response_id DESC LIMIT ?
+                ''', (feature_id, survey_id, question_id, text_limit))
+            ]
+        questions.append(result)
+
+    return {'surveyId': survey_id, 'responseCount': response_count, 'questions': questions}
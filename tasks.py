@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""プロジェクトのタスク保存と検索
+
+タスクは project_tasks に1行ずつ保存し、projects 機能のブロブには書き込まない。
+(feature_id, project_id, status) のインデックスでボードの列ごとの取得と件数集計を行い、
+ステータス変更は1行の UPDATE で済む。既存のクライアント向けには
+getFeatureContent で content['tasks'] に戻す（get_user_state には自分の未完了タスクだけを渡す）。
+"""
+
+import time
+import uuid
+
+import database
+import repository
+import serializer
+
+STATUSES = ('todo', 'in-progress', 'done')
+PRIORITY_RANKS = {'high': 0, 'medium': 1, 'low': 2}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# listTasks の sort に指定できる列（priority は rank 順）
+SORT_COLUMNS = {
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    'due_date': 'due_date',
+    'priority': 'priority_rank',
+    'title': 'title',
+    'status': 'status',
+    'position': 'position',
+}
+
+# 専用の列を持つフィールド（それ以外は extra に JSON で保存）
+_COLUMNS = ('project_id', 'title', 'description', 'priority', 'status', 'assigned_to',
+            'due_date', 'created_by', 'created_at', 'updated_at', 'position')
+
+
+def init_task_tables(cursor):
+    """タスク用テーブルを作成し、新規作成時は既存ブロブのタスクを取り込む"""
+    exists = database.table_exists(cursor, 'project_tasks')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS project_tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            feature_id TEXT NOT NULL,
+            task_id TEXT NOT NULL,
+            project_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            priority TEXT,
+            priority_rank INTEGER,
+            status TEXT NOT NULL DEFAULT 'todo',
+            assigned_to TEXT,
+            due_date TEXT,
+            created_by TEXT,
+            created_at REAL,
+            updated_at REAL,
+            position REAL,
+            extra TEXT,
+            UNIQUE(feature_id, task_id),
+            FOREIGN KEY (feature_id) REFERENCES features (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_project_tasks_board
+        ON project_tasks (feature_id, project_id, status)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_project_tasks_assignee
+        ON project_tasks (assigned_to, feature_id)
+    ''')
+
+    if not exists:
+        rows = cursor.execute('''
+            SELECT f.id, fc.content FROM features f
+            JOIN feature_content fc ON fc.feature_id = f.id
+            WHERE f.type = 'projects'
+        ''').fetchall()
+        for feature_id, raw in rows:
+            try:
+                content = serializer.decode_content(raw)
+            except serializer.DecodeError:
+                continue
+            if sync_from_content(cursor, feature_id, content):
+                repository.update_content(cursor, feature_id, content)
+
+
+def _text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _row_values(task):
+    """タスクの dict を project_tasks の列の値に変換"""
+    extra = {k: v for k, v in task.items() if k not in _COLUMNS and k != 'id'}
+    priority = _text(task.get('priority')) or 'medium'
+    return (
+        _text(task.get('project_id')) or '',
+        _text(task.get('title')) or '',
+        _text(task.get('description')),
+        priority,
+        PRIORITY_RANKS.get(priority, len(PRIORITY_RANKS)),
+        _text(task.get('status')) or 'todo',
+        _text(task.get('assigned_to')),
+        _text(task.get('due_date')),
+        _text(task.get('created_by')),
+        _number(task.get('created_at')),
+        _number(task.get('updated_at')),
+        _number(task.get('position')),
+        serializer.dumps(extra) if extra else None,
+    )
+
+
+def _task_from_row(row):
+    # 列の並びは _SELECT と同じ（sqlite3.Row でもタプルでも扱えるように位置で参照）
+    (_, task_id, project_id, title, description, priority, status,
+     assigned_to, due_date, created_by, created_at, updated_at, position, extra) = tuple(row)
+    task = serializer.loads(extra) if extra else {}
+    task.update({
+        'id': task_id,
+        'project_id': project_id,
+        'title': title,
+        'description': description or '',
+        'priority': priority,
+        'status': status,
+        'created_by': created_by,
+        'created_at': created_at,
+    })
+    for key, value in (('assigned_to', assigned_to), ('due_date', due_date),
+                       ('updated_at', updated_at), ('position', position)):
+        if value is not None:
+            task[key] = value
+    return task
+
+
+_SELECT = '''
+    SELECT feature_id, task_id, project_id, title, description, priority, status,
+           assigned_to, due_date, created_by, created_at, updated_at, position, extra
+    FROM project_tasks
+'''
+
+
+_INSERT = '''
+    INSERT INTO project_tasks (feature_id, task_id, project_id, title, description, priority,
+                               priority_rank, status, assigned_to, due_date, created_by,
+                               created_at, updated_at, position, extra)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def _upsert(conn, feature_id, task_id, task):
+    conn.execute(_INSERT + '''
+        ON CONFLICT (feature_id, task_id) DO UPDATE SET
+            project_id = excluded.project_id, title = excluded.title,
+            description = excluded.description, priority = excluded.priority,
+            priority_rank = excluded.priority_rank, status = excluded.status,
+            assigned_to = excluded.assigned_to, due_date = excluded.due_date,
+            created_by = excluded.created_by, created_at = excluded.created_at,
+            updated_at = excluded.updated_at, position = excluded.position, extra = excluded.extra
+    ''', (feature_id, task_id) + _row_values(task))
+
+
+def create_task(conn, feature_id, project_id, title, description='', priority='medium',
+                created_by=None, assigned_to=None, due_date=None):
+    """タスクを1件追加して dict を返す"""
+    # 同じミリ秒に作られても重ならない ID にし、万一重なっても上書きせずに失敗させる
+    task_id = f"task_{uuid.uuid4().hex}"
+    task = {
+        'id': task_id,
+        'project_id': project_id,
+        'title': title,
+        'description': description,
+        'priority': priority,
+        'status': 'todo',
+        'created_by': created_by,
+        'created_at': time.time()
+    }
+    if assigned_to:
+        task['assigned_to'] = assigned_to
+    if due_date:
+        task['due_date'] = due_date
+    conn.execute(_INSERT, (feature_id, task_id) + _row_values(task))
+    return task
+
+
+def update_status(conn, feature_id, task_id, status):
+    """ステータスだけを1行で更新する。タスクが無ければ False"""
+    cur = conn.execute('''
+        UPDATE project_tasks SET status = ?, updated_at = ?
+        WHERE feature_id = ? AND task_id = ?
+    ''', (status, time.time(), feature_id, task_id))
+    return cur.rowcount > 0
+
+
+def sync_from_content(conn, feature_id, content):
+    """ブロブに書かれた content['tasks'] をテーブルに反映し、ブロブからは取り除く。
+    content['tasks'] がある場合はそれを正とし、含まれないタスクは削除する。ブロブを変更したら True"""
+    if not isinstance(content, dict) or not isinstance(content.get('tasks'), dict):
+        return False
+    incoming = content['tasks']
+    existing = {}
+    for row in conn.execute(_SELECT + ' WHERE feature_id = ?', (feature_id,)):
+        existing[row[1]] = _row_values(_task_from_row(row))
+
+    for task_id, task in incoming.items():
+        if not isinstance(task, dict):
+            continue
+        task_id = str(task_id)
+        task = dict(task, id=task_id)
+        current = existing.pop(task_id, None)
+        if current is not None and current == _row_values(task):
+            continue
+        _upsert(conn, feature_id, task_id, task)
+    if existing:
+        conn.executemany('DELETE FROM project_tasks WHERE feature_id = ? AND task_id = ?',
+                         [(feature_id, task_id) for task_id in existing])
+
+    changed = bool(incoming)
+    content['tasks'] = {}
+    return changed
+
+
+def tasks_by_feature(conn, feature_ids):
+    """{feature_id: {task_id: タスク}} を1クエリで返す"""
+    result = {feature_id: {} for feature_id in feature_ids}
+    if not result:
+        return result
+    placeholders = ','.join('?' for _ in result)
+    for row in conn.execute(_SELECT + f' WHERE feature_id IN ({placeholders})', list(result)):
+        result[row[0]][row[1]] = _task_from_row(row)
+    return result
+
+
+def merge_into_content(content_by_feature, by_feature):
+    """クライアントのボード表示用に、テーブルのタスクを content['tasks'] に戻す"""
+    for feature_id, feature_tasks in by_feature.items():
+        content = content_by_feature.get(feature_id)
+        if isinstance(content, dict):
+            content['tasks'] = feature_tasks
+
+
+def open_tasks_for_user(conn, feature_ids, username, limit=DEFAULT_PAGE_SIZE):
+    """複数の projects 機能から、username が担当または作成した未完了タスクを
+    期限の近い順に返す（ホーム画面用）。各タスクには featureId を付ける"""
+    if not feature_ids or not username:
+        return []
+    placeholders = ','.join('?' for _ in feature_ids)
+    rows = conn.execute(
+        _SELECT + f" WHERE feature_id IN ({placeholders}) AND status != 'done' "
+        "AND (assigned_to = ? OR created_by = ?) "
+        "ORDER BY due_date IS NULL, due_date, priority_rank, id LIMIT ?",
+        list(feature_ids) + [username, username, max(1, min(int(limit), MAX_PAGE_SIZE))]
+    ).fetchall()
+    return [dict(_task_from_row(row), featureId=row[0]) for row in rows]
+
+
+def list_tasks(conn, feature_id, project_id=None, statuses=None, priority=None, assigned_to=None,
+               created_by=None, sort='created_at', descending=False, limit=DEFAULT_PAGE_SIZE, offset=0):
+    """条件に合うタスクを (タスク一覧, 総件数, ステータス別件数) で返す"""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    offset = max(0, int(offset))
+    column = SORT_COLUMNS.get(sort, 'created_at')
+    direction = 'DESC' if descending else 'ASC'
+
+    where = ['feature_id = ?']
+    params = [feature_id]
+    if project_id:
+        where.append('project_id = ?')
+        params.append(project_id)
+    if priority:
+        where.append('priority = ?')
+        params.append(priority)
+    if assigned_to:
+        where.append('assigned_to = ?')
+        params.append(assigned_to)
+    if created_by:
+        where.append('created_by = ?')
+        params.append(created_by)
+
+    # ボードの列ごとの件数はステータス絞り込み前の条件で数える
+    counts = {status: 0 for status in STATUSES}
+    for row in conn.execute(
+        f"SELECT status, COUNT(*) FROM project_tasks WHERE {' AND '.join(where)} GROUP BY status",
+        params
+    ):
+        counts[row[0]] = row[1]
+
+    if statuses:
+        where.append('status IN (%s)' % ','.join('?' for _ in statuses))
+        params.extend(statuses)
+        total = sum(counts.get(status, 0) for status in set(statuses))
+    else:
+        total = sum(counts.values())
+
+    rows = conn.execute(
+        _SELECT + f" WHERE {' AND '.join(where)} "
+        f"ORDER BY {column} IS NULL, {column} {direction}, id {direction} LIMIT ? OFFSET ?",
+        params + [limit, offset]
+    ).fetchall()
+    return [_task_from_row(row) for row in rows], total, counts
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""テスト共通のフィクスチャ
+
+db はテストごとに一時ディレクトリへ作業ディレクトリを移し、app.init_database で
+作った SQLite のスキーマへの接続を返す。機能ごとのモジュールはこの接続に対して直接
+呼び出す（HTTP を通さない）。
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config は最初の import で環境変数を読む
+os.environ.setdefault('LOGIN_RATE_LIMIT', 'False')
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import app as app_module
+    app_module.init_database()
+    # キャッシュは前のテストのデータベースの内容を持っている
+    app_module.memberships.clear()
+    try:
+        yield app_module
+    finally:
+        app_module.writes.close()
+        app_module.bookkeeping.close()
+        app_module.event_bus.close()
+
+
+@pytest.fixture
+def db(app_module):
+    conn = app_module.get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def api(app_module):
+    """alice でログインし、サーバーを1つ作ったクライアント。
+    (call, client, server_id, {機能の種類: feature_id}) を返す"""
+    client = app_module.app.test_client()
+
+    def call(**data):
+        result = client.post('/api.cgi', data=data).get_json()
+        assert result['success'], result
+        return result['data']
+
+    call(action='register', username='alice', password='secret1')
+    call(action='login', username='alice', password='secret1')
+    state = call(action='addServer', name='写真部')
+    server_id = next(iter(state['servers']))
+    features = {f['type']: f['id'] for f in state['features'][server_id]}
+    return call, client, server_id, features
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""オンラインバックアップの作成・検証・復元（backup.py）"""
+
+import gzip
+import os
+
+import pytest
+
+import backup
+import database
+import repository
+
+
+@pytest.fixture
+def data(db):
+    for name in ('alice', 'bob'):
+        repository.create_user(db, name, 'x')
+    db.commit()
+    return db
+
+
+def _usernames(conn):
+    return [row[0] for row in conn.execute('SELECT username FROM users ORDER BY id')]
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'none'])
+def test_backup_verify_and_restore_round_trip(data, tmp_path, compression):
+    backup_dir = str(tmp_path / 'backups')
+    created = backup.create_backup(backup_dir=backup_dir, compression=compression, pages=1, sleep_ms=0)
+    assert created['name'].endswith(backup.EXTENSIONS[compression])
+    assert created['method'] == 'backup'
+    assert created['tables']['users'] == 2
+
+    report = backup.verify_backup(created['path'])
+    assert report['ok'] and report['tables']['users'] == 2
+    assert [b['name'] for b in backup.list_backups(backup_dir)] == [created['name']]
+
+    # バックアップのあとに変更してから復元する
+    repository.create_user(data, 'mallory', 'x')
+    data.execute('DELETE FROM users WHERE username = ?', ('alice',))
+    data.commit()
+    restored = backup.restore_backup(created['path'])
+    assert _usernames(data) == ['alice', 'bob']
+
+    # 置き換える前のデータベースは pre-restore として残り、元のバックアップも消えない
+    assert os.path.basename(restored['previous']).startswith(backup.NAME_PREFIX + 'pre-restore-')
+    assert backup.verify_backup(restored['previous'])['tables']['users'] == 2
+    assert backup.verify_backup(created['path'])['ok']
+    assert database.sqlite_path() == os.path.join('data', 'circle_platform.db')
+
+
+def test_vacuum_method(data, tmp_path):
+    created = backup.create_backup(backup_dir=str(tmp_path), method='vacuum', compression='gzip')
+    assert created['method'] == 'vacuum'
+    assert backup.verify_backup(created['path'])['tables']['users'] == 2
+
+
+def test_broken_backups_are_rejected(data, tmp_path):
+    truncated = tmp_path / (backup.NAME_PREFIX + 'broken.db.gz')
+    with gzip.open(truncated, 'wb') as out:
+        out.write(b'SQLite format 3\x00' + b'\x00' * 100)
+    assert not backup.verify_backup(str(truncated))['ok']
+
+    not_gzip = tmp_path / (backup.NAME_PREFIX + 'garbage.db.gz')
+    not_gzip.write_bytes(b'garbage')
+    report = backup.verify_backup(str(not_gzip))
+    assert not report['ok'] and report['integrity'][0].startswith('展開できません')
+
+    with pytest.raises(backup.BackupError):
+        backup.restore_backup(str(not_gzip))
+    assert _usernames(data) == ['alice', 'bob']
+    with pytest.raises(backup.BackupError):
+        backup.verify_backup(str(tmp_path / 'missing.db'))
+
+
+def test_prune_keeps_the_newest(data, tmp_path):
+    for i, name in enumerate(['a', 'b', 'c']):
+        path = tmp_path / f'{backup.NAME_PREFIX}{name}.db'
+        path.write_bytes(b'')
+        os.utime(path, (1000 + i, 1000 + i))
+    assert backup.prune_backups(str(tmp_path), 2) == [f'{backup.NAME_PREFIX}a.db']
+    assert [b['name'] for b in backup.list_backups(str(tmp_path))] == \
+        [f'{backup.NAME_PREFIX}c.db', f'{backup.NAME_PREFIX}b.db']
+
+
+def test_restore_from_the_default_directory_keeps_the_backup(data):
+    # 同じ秒に作る pre-restore のバックアップが、復元元のファイルを上書きしない
+    created = backup.create_backup(compression='gzip')
+    data.execute('DELETE FROM users')
+    data.commit()
+    restored = backup.restore_backup(created['path'])
+    assert _usernames(data) == ['alice', 'bob']
+    assert os.path.exists(created['path']) and restored['previous'] != created['path']
+    assert backup.verify_backup(created['path'])['tables']['users'] == 2
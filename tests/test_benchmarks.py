@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""ベンチマークのハーネスと結果の比較（benchmarks/bench_api.py, benchmarks/compare.py）"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+sys.path.insert(0, BENCHMARKS)
+
+import bench_api  # noqa: E402
+import compare  # noqa: E402
+
+
+def test_percentile_and_mix():
+    values = [float(i) for i in range(1, 101)]
+    assert bench_api._percentile(values, 50) == 50.0
+    assert bench_api._percentile(values, 95) == 95.0
+    assert bench_api._percentile(values, 99) == 99.0
+    assert bench_api._percentile([], 95) == 0.0
+    assert bench_api._percentile([7.0], 99) == 7.0
+
+    assert bench_api._parse_mix(None) == bench_api.DEFAULT_MIX
+    assert bench_api._parse_mix('checkSession=5, search') == {'checkSession': 5.0, 'search': 1.0}
+
+
+def test_replays_the_mix_against_a_seeded_dataset(app_module):
+    args = argparse.Namespace(users=3, servers=2, members_per_server=3, messages=20, pages=3, elements=10)
+    dataset = bench_api.generate_dataset(app_module, args, random.Random(1))
+    assert len(dataset.servers) == 2
+    assert all(set(features) >= {'chat', 'wiki', 'whiteboard'} for features in dataset.features.values())
+
+    mix = {'checkSession': 1, 'postMessage': 1, 'getFeatureContent': 1, 'search': 1}
+    replayer = bench_api.Replayer(app_module.app, dataset, mix, seed=1)
+    replayer.run(12, threads=2)
+    summary = replayer.summary()
+    assert sum(r['count'] for r in summary.values()) == 12
+    assert set(summary) <= set(mix)
+    for result in summary.values():
+        assert result['errors'] == 0
+        assert result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
+
+
+def _result(tmp_path, name, p95, rps=100.0):
+    path = tmp_path / name
+    path.write_text(json.dumps({
+        'meta': {'revision': name},
+        'total': {'throughput_rps': rps},
+        'actions': {'checkSession': {'p50_ms': 1.0, 'p95_ms': p95, 'p99_ms': p95 * 2}},
+    }), encoding='utf-8')
+    return str(path)
+
+
+def _compare(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['compare.py', *argv])
+    compare.main()
+
+
+def test_compare_fails_on_p95_regressions(monkeypatch, tmp_path, capsys):
+    before = _result(tmp_path, 'before.json', 10.0)
+    _compare(monkeypatch, before, _result(tmp_path, 'same.json', 10.5))
+    assert 'regressed' not in capsys.readouterr().out
+
+    worse = _result(tmp_path, 'worse.json', 12.0, rps=80.0)
+    with pytest.raises(SystemExit) as exc:
+        _compare(monkeypatch, before, worse)
+    assert exc.value.code == 1
+    out = capsys.readouterr().out
+    assert 'regressed (p95): checkSession' in out and '(-20%)' in out
+    # しきい値を緩めれば通る
+    _compare(monkeypatch, before, worse, '--threshold', '25')
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""予算の台帳（取り消し行の追記）と月別・年度別の集計（budget.py）"""
+
+import budget
+
+FEATURE_ID = 'f_budget'
+
+
+def _sync(conn, accounts=None, transactions=None):
+    content = {}
+    if accounts is not None:
+        content['accounts'] = accounts
+    if transactions is not None:
+        content['transactions'] = transactions
+    budget.sync_from_content(conn, FEATURE_ID, content)
+
+
+def _ledger(conn):
+    return [tuple(row) for row in conn.execute('''
+        SELECT transaction_id, entry_type, reverses, amount, balance_after FROM budget_ledger ORDER BY id
+    ''')]
+
+
+def test_changes_and_deletions_append_reversals(db):
+    _sync(db, accounts={'a1': {'id': 'a1', 'name': '現金', 'balance': 1000}})
+    _sync(db, transactions={
+        't1': {'amount': 5000, 'category': 'income', 'account': 'a1', 'date': '2030-05-01'},
+        't2': {'amount': 1200, 'category': 'expense', 'account': 'a1', 'date': '2030-05-02'},
+    })
+    assert _ledger(db) == [('t1', 'transaction', None, 5000, 6000), ('t2', 'transaction', None, -1200, 4800)]
+
+    # t1 の金額を変更し、t2 を削除する。元の行は残したまま取り消し行を追記する
+    _sync(db, transactions={
+        't1': {'amount': 3000, 'category': 'income', 'account': 'a1', 'date': '2030-05-01'},
+    })
+    assert _ledger(db) == [
+        ('t1', 'transaction', None, 5000, 6000),
+        ('t2', 'transaction', None, -1200, 4800),
+        ('t1', 'reversal', 1, -5000, -200),
+        ('t1', 'transaction', None, 3000, 2800),
+        ('t2', 'reversal', 2, 1200, 4000),
+    ]
+    content = budget.content_by_feature(db, [FEATURE_ID])[FEATURE_ID]
+    assert list(content['transactions']) == ['t1']
+    assert content['transactions']['t1']['amount'] == 3000
+    assert content['accounts']['a1']['balance'] == 4000
+
+
+def test_rollups_by_month_and_fiscal_year(db):
+    _sync(db, accounts={'a1': {'id': 'a1', 'name': '現金'}, 'a2': {'id': 'a2', 'name': '銀行'}})
+    _sync(db, transactions={
+        't1': {'amount': 5000, 'category': 'income', 'account': 'a1', 'date': '2030-03-31'},
+        't2': {'amount': 800, 'category': 'expense', 'account': 'a1', 'date': '2030-04-01'},
+        't3': {'amount': 2000, 'category': 'income', 'account': 'a2', 'date': '2030-04-15'},
+        't4': {'amount': -300, 'category': 'transfer', 'account': 'a2', 'date': '2031-03-31'},
+    })
+
+    summary = budget.get_summary(db, FEATURE_ID, year=2030)
+    # 年度は4月始まり（3/31 は前年度）
+    assert {r['year']: (r['income'], r['expense'], r['count']) for r in summary['fiscalYears']} == {
+        2029: (5000, 0, 1), 2030: (2000, 800, 3),
+    }
+    assert summary['fiscalYearTotals']['net'] == 1200
+    assert summary['fiscalYearTotals']['transfer'] == -300
+    months = {m['month']: (m['income'], m['expense'], m['count']) for m in summary['months']}
+    assert months['2030-04'] == (2000, 800, 2)
+    assert months['2031-03'] == (0, 0, 1)
+    assert len(months) == 12 and '2030-03' not in months
+    assert summary['totalBalance'] == 5000 - 800 + 2000 - 300
+
+    only_a2 = budget.get_summary(db, FEATURE_ID, year=2030, account_id='a2')
+    assert only_a2['fiscalYearTotals']['income'] == 2000
+    assert only_a2['fiscalYearTotals']['expense'] == 0
+    assert only_a2['totalBalance'] == 1700
+
+    # 取り消しは元の取引と同じ列から引き、作り直しても同じ集計になる
+    _sync(db, transactions={
+        't1': {'amount': 5000, 'category': 'income', 'account': 'a1', 'date': '2030-03-31'},
+        't3': {'amount': 2000, 'category': 'income', 'account': 'a2', 'date': '2030-04-15'},
+        't4': {'amount': -300, 'category': 'transfer', 'account': 'a2', 'date': '2031-03-31'},
+    })
+    after = budget.get_summary(db, FEATURE_ID, year=2030)
+    assert (after['fiscalYearTotals']['expense'], after['fiscalYearTotals']['count']) == (0, 2)
+    budget.rebuild_rollups(db)
+    assert budget.get_summary(db, FEATURE_ID, year=2030)['fiscalYears'] == after['fiscalYears']
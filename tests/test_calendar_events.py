@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""カレンダーのイベントテーブルと繰り返しの展開（calendar_events.py / getEvents）"""
+
+import json
+from datetime import datetime
+
+import calendar_events
+
+FEATURE_ID = 'f_calendar'
+
+
+def _sync(conn, events):
+    calendar_events.sync_from_content(conn, FEATURE_ID, {'events': events})
+
+
+def _dates(conn, range_from, range_to):
+    events, truncated = calendar_events.get_events(
+        conn, FEATURE_ID, calendar_events.parse_datetime(range_from),
+        calendar_events.parse_datetime(range_to, end_of_day=True))
+    return [(e['id'], e['date']) for e in events], truncated
+
+
+def test_expands_recurrences_within_the_range(db):
+    _sync(db, {
+        'w': {'title': '定例', 'date': '2030-01-07', 'time': '18:00', 'recurrence': {'freq': 'weekly', 'count': 3}},
+        'm': {'title': '締め', 'date': '2030-01-31', 'recurrence': 'monthly'},
+        'u': {'title': '朝練', 'date': '2030-01-30', 'recurrence': {'freq': 'daily', 'until': '2030-02-02'}},
+        'o': {'title': '合宿', 'date': '2030-02-10', 'endDate': '2030-02-12'},
+    })
+
+    dates, truncated = _dates(db, '2030-01-01', '2030-01-31')
+    assert not truncated
+    assert dates == [('w', '2030-01-07'), ('w', '2030-01-14'), ('w', '2030-01-21'),
+                     ('u', '2030-01-30'), ('m', '2030-01-31'), ('u', '2030-01-31')]
+
+    # 月末の繰り返しはその月の末日にそろえ、until の日まで含める。期間をまたぐ単発イベントも返す
+    dates, _ = _dates(db, '2030-02-01', '2030-02-28')
+    assert dates == [('u', '2030-02-01'), ('u', '2030-02-02'), ('o', '2030-02-10'), ('m', '2030-02-28')]
+    dates, _ = _dates(db, '2030-02-12', '2030-02-12')
+    assert dates == [('o', '2030-02-10')]
+
+    # 系列が終わったあとの期間は展開しない
+    dates, _ = _dates(db, '2031-01-01', '2031-01-31')
+    assert dates == [('m', '2031-01-31')]
+
+
+def test_sync_replaces_and_deletes_events(db):
+    _sync(db, {'a': {'title': 'A', 'date': '2030-01-01'}, 'b': {'title': 'B', 'date': '2030-01-02'}})
+    _sync(db, {'a': {'title': 'A2', 'date': '2030-01-03'}})
+    events, _ = calendar_events.get_events(db, FEATURE_ID, datetime(2030, 1, 1), datetime(2030, 1, 31))
+    assert [(e['id'], e['title'], e['date']) for e in events] == [('a', 'A2', '2030-01-03')]
+
+
+def test_occurrences_are_capped(db, monkeypatch):
+    monkeypatch.setattr(calendar_events, 'MAX_OCCURRENCES', 5)
+    _sync(db, {'d': {'title': '毎日', 'date': '2030-01-01', 'recurrence': 'daily'}})
+    dates, truncated = _dates(db, '2030-01-01', '2030-12-31')
+    assert truncated
+    assert dates == [('d', f'2030-01-0{day}') for day in range(1, 6)]
+
+
+def test_get_events_limits_the_range(api):
+    call, client, _, features = api
+    events = {'e1': {'title': '定例', 'date': '2030-01-07', 'recurrence': {'freq': 'weekly', 'count': 3}}}
+    call(action='updateFeatureContent', featureId=features['calendar'], content=json.dumps({'events': events}))
+    data = call(action='getEvents', featureId=features['calendar'], **{'from': '2030-01-01', 'to': '2030-12-31'})
+    assert [e['date'] for e in data['events']] == ['2030-01-07', '2030-01-14', '2030-01-21']
+
+    too_long = client.post('/api.cgi', data={
+        'action': 'getEvents', 'featureId': features['calendar'], 'from': '2030-01-01', 'to': '2031-12-31',
+    }).get_json()
+    assert not too_long['success']
+    assert str(calendar_events.MAX_RANGE_DAYS) in too_long['error']
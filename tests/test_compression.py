@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""feature_content の圧縮と API レスポンスの圧縮（compression.py）"""
+
+import gzip
+import json
+
+import pytest
+
+import compression
+import serializer
+from config import Config
+
+LARGE = {'pages': {str(i): {'title': f'ページ{i}', 'content': '本文' * 50} for i in range(50)}}
+
+
+def test_large_content_is_compressed_with_a_header(monkeypatch):
+    monkeypatch.setattr(Config, 'CONTENT_ENCODING', 'json')
+    monkeypatch.setattr(Config, 'CONTENT_COMPRESSION', 'zlib')
+    monkeypatch.setattr(Config, 'CONTENT_COMPRESSION_THRESHOLD', 1024)
+
+    stored = serializer.encode_content(LARGE)
+    assert isinstance(stored, bytes)
+    assert stored[0] == compression.COMPRESS_ZLIB | serializer.FORMAT_JSON
+    assert len(stored) < len(serializer.dumps_bytes(LARGE)) / 5
+    assert serializer.decode_content(stored) == LARGE
+
+    # しきい値未満は従来どおりの TEXT
+    assert serializer.encode_content({'a': 1}) == '{"a":1}'
+
+
+def test_zstd_falls_back_to_zlib_without_the_module(monkeypatch):
+    monkeypatch.setattr(Config, 'CONTENT_COMPRESSION', 'zstd')
+    expected = compression.COMPRESS_ZSTD if compression.zstandard is not None else compression.COMPRESS_ZLIB
+    assert compression.blob_compression() == expected
+    monkeypatch.setattr(Config, 'CONTENT_COMPRESSION', 'none')
+    assert compression.blob_compression() == compression.COMPRESS_NONE
+
+
+def test_broken_compressed_content_raises_decode_error():
+    broken = bytes([compression.COMPRESS_ZLIB | serializer.FORMAT_JSON]) + b'not zlib'
+    with pytest.raises(serializer.DecodeError, match='invalid compressed content'):
+        serializer.decode_content(broken)
+
+
+def test_negotiate_encoding():
+    expected_br = 'br' if compression.brotli is not None else 'gzip'
+    assert compression.negotiate_encoding('gzip, deflate, br') == expected_br
+    assert compression.negotiate_encoding('gzip;q=0, br;q=0') is None
+    assert compression.negotiate_encoding('deflate') is None
+    assert compression.negotiate_encoding('*') == 'gzip'
+    assert compression.negotiate_encoding('') is None
+    assert compression.negotiate_encoding('gzip;q=abc') is None
+
+
+def test_api_responses_are_gzipped(api):
+    call, client, _, features = api
+    call(action='updateFeatureContent', featureId=features['wiki'], content=json.dumps(LARGE))
+
+    response = client.post('/api.cgi', data={'action': 'getFeatureContent', 'featureId': features['wiki']},
+                           headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    body = json.loads(gzip.decompress(response.data))
+    assert body['success'] and len(body['data']['pages']) == 50
+
+    plain = client.post('/api.cgi', data={'action': 'getFeatureContent', 'featureId': features['wiki']})
+    assert 'Content-Encoding' not in plain.headers
+    # 小さいレスポンスは圧縮しない
+    small = client.post('/api.cgi', data={'action': 'noSuchAction'}, headers={'Accept-Encoding': 'gzip'})
+    assert len(small.data) < Config.RESPONSE_COMPRESSION_MIN_SIZE
+    assert 'Content-Encoding' not in small.headers
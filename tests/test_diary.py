@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""日記のエントリの保存（作者を限定した上書き）と月ごとの読み込み（diary.py）"""
+
+import time
+
+import diary
+
+FEATURE_ID = 'f_diary'
+CREATED = time.mktime((2030, 5, 10, 12, 0, 0, 0, 0, -1))
+
+
+def _entry(author, title, **extra):
+    return dict({'author': author, 'title': title, 'content': '本文', 'created_at': CREATED}, **extra)
+
+
+def _titles(conn, username='alice'):
+    return {e['id']: (e['author'], e['title']) for e in diary.list_month(conn, FEATURE_ID, '2030-05', username)}
+
+
+def test_save_only_overwrites_the_authors_own_entries(db):
+    assert diary.save_entry(db, FEATURE_ID, 'e1', _entry('alice', '初日'), 'alice')
+    assert diary.save_entry(db, FEATURE_ID, 'e2', _entry('bob', '二日目'), 'bob')
+
+    # bob は alice のエントリを上書きできず、作者も書き換わらない
+    assert not diary.save_entry(db, FEATURE_ID, 'e1', _entry('bob', '乗っ取り'), 'bob')
+    assert diary.save_entry(db, FEATURE_ID, 'e1', _entry('alice', '初日（修正）'), 'alice')
+    assert _titles(db) == {'e1': ('alice', '初日（修正）'), 'e2': ('bob', '二日目')}
+
+    assert not diary.delete_entry(db, FEATURE_ID, 'e1', 'bob')
+    assert diary.delete_entry(db, FEATURE_ID, 'e1', 'alice')
+    assert list(_titles(db)) == ['e2']
+
+
+def test_sync_accepts_only_the_saving_users_entries(db):
+    diary.save_entry(db, FEATURE_ID, 'e1', _entry('alice', '初日'))
+    content = {'entries': {
+        'e1': _entry('bob', '上書き'),           # 他人のエントリを自分の名前で上書き
+        'e2': _entry('alice', 'なりすまし'),     # 他人を作者にした新規エントリ
+        'e3': _entry('bob', '自分の日記'),
+    }}
+    saved = diary.sync_from_content(db, FEATURE_ID, content, username='bob')
+    assert list(saved) == ['e3']
+    assert content['entries'] == {}
+    assert _titles(db) == {'e1': ('alice', '初日'), 'e3': ('bob', '自分の日記')}
+
+    # 変わっていないエントリは書き込まない
+    again = {'entries': {'e3': _entry('bob', '自分の日記')}}
+    assert diary.sync_from_content(db, FEATURE_ID, again, username='bob') == {}
+
+
+def test_private_entries_and_month_counts(db):
+    diary.save_entry(db, FEATURE_ID, 'e1', _entry('alice', '公開'))
+    diary.save_entry(db, FEATURE_ID, 'e2', _entry('alice', '非公開', private=True))
+    diary.save_entry(db, FEATURE_ID, 'e3', _entry('alice', '先月', created_at=CREATED - 31 * 86400))
+
+    assert set(_titles(db, 'alice')) == {'e1', 'e2'}
+    assert set(_titles(db, 'bob')) == {'e1'}
+    assert diary.get_entry(db, FEATURE_ID, 'e2', 'bob') is None
+    assert diary.month_counts(db, FEATURE_ID, 'bob') == [{'month': '2030-05', 'count': 1},
+                                                         {'month': '2030-04', 'count': 1}]
+    assert diary.month_counts(db, FEATURE_ID, 'alice')[0] == {'month': '2030-05', 'count': 2}
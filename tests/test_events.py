@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""イベントバスの配信と、取りこぼした位置からの再開（events.py）"""
+
+import pytest
+
+import events
+
+
+@pytest.fixture
+def bus():
+    bus = events.EventBus(events.MemoryTransport(), batch_ms=0, buffer_size=3)
+    try:
+        yield bus
+    finally:
+        bus.close()
+
+
+def _seqs(result):
+    return [event['seq'] for event in result['events']]
+
+
+def test_resumes_from_the_buffer_and_filters_servers(bus):
+    assert bus.wait({'s1'}) == {'events': [], 'cursor': 0, 'reset': False}
+    bus.publish('s1', 'message', 'f1', {'text': 'a'})
+    bus.publish('s2', 'message', 'f2', {'text': 'b'})
+    bus.publish('s1', 'message', 'f1', {'text': 'c'})
+
+    result = bus.wait({'s1'}, since=0)
+    assert _seqs(result) == [1, 3] and result['cursor'] == 3 and not result['reset']
+    assert [e['data']['text'] for e in result['events']] == ['a', 'c']
+    assert _seqs(bus.wait({'s2'}, since=1)) == [2]
+    assert _seqs(bus.wait({'s1'}, since=0, limit=1)) == [1]
+    assert bus.wait({'s1'}, since=0, limit=1)['cursor'] == 1
+    # 関係の無いイベントだけなら待ったあと位置だけ進める
+    assert bus.wait({'s3'}, since=0, timeout=0.01) == {'events': [], 'cursor': 3, 'reset': False}
+
+
+def test_gap_beyond_the_buffer_resets(bus):
+    for i in range(5):
+        bus.publish('s1', 'message', 'f1', {'n': i})
+    # バッファには seq 3〜5 だけが残る
+    assert _seqs(bus.wait({'s1'}, since=2)) == [3, 4, 5]
+    # memory トランスポートには記録が無いので、画面を取り直させる
+    assert bus.wait({'s1'}, since=1) == {'events': [], 'cursor': 5, 'reset': True}
+    # 番号が振り直された（再起動した）場合も同じ
+    assert bus.wait({'s1'}, since=99) == {'events': [], 'cursor': 5, 'reset': True}
+
+
+def test_sqlite_transport_replays_after_a_gap(tmp_path):
+    path = str(tmp_path / 'events.db')
+
+    def node(buffer_size):
+        transport = events.SQLiteTransport(path, poll_ms=10, retention_seconds=3600)
+        return events.EventBus(transport, batch_ms=0, buffer_size=buffer_size)
+
+    sender, receiver = node(100), node(2)
+    try:
+        receiver.wait({'s1'})
+        for i in range(5):
+            sender.publish('s1', 'message', 'f1', {'n': i})
+
+        # 別のノードのイベントもポーリングで届く
+        result = receiver.wait({'s1'}, since=4, timeout=5)
+        assert _seqs(result) == [5]
+        # バッファ（2件）より古い位置からはトランスポートの記録を読み直す
+        replayed = receiver.wait({'s1'}, since=1, limit=2)
+        assert _seqs(replayed) == [2, 3] and replayed['cursor'] == 3 and not replayed['reset']
+        assert _seqs(receiver.wait({'s1'}, since=3, limit=10)) == [4, 5]
+
+        # 記録も消えている位置からは reset
+        conn = receiver.transport._connect()
+        with conn:
+            conn.execute('DELETE FROM event_log WHERE seq <= 3')
+        conn.close()
+        assert receiver.wait({'s1'}, since=1) == {'events': [], 'cursor': 5, 'reset': True}
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_batched_publish_is_flushed_on_close():
+    bus = events.EventBus(events.MemoryTransport(), batch_ms=60000, max_batch=100)
+    received = []
+    bus.add_listener(received.extend)
+    bus.publish('s1', 'message', 'f1')
+    bus.publish('s1', 'message', 'f1')
+    assert received == []
+    bus.close()
+    assert [event['seq'] for event in received] == [1, 2]
+    assert (bus.published, bus.batches) == (2, 1)
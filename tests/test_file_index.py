@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""ファイル一覧のキーセット方式のページ送り（file_index.py）"""
+
+import io
+
+import pytest
+
+import file_index
+
+USER_ID = 1
+
+
+def _add(db, file_id, created_at, server_id='s1', feature_id='f1', mime_type='image/png'):
+    db.execute('''
+        INSERT INTO files (id, filename, original_filename, file_path, file_size, mime_type,
+                           upload_by, server_id, feature_id, created_at)
+        VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+    ''', (file_id, file_id, file_id, file_id, mime_type, USER_ID, server_id, feature_id, created_at))
+
+
+@pytest.fixture
+def files_db(db):
+    db.execute("INSERT INTO server_members (server_id, user_id, role) VALUES ('s1', ?, 'owner')", (USER_ID,))
+    # 同じ時刻のファイルは id の降順に並ぶ
+    for i in range(5):
+        _add(db, f'a{i}', '2030-05-01 10:00:00')
+    _add(db, 'b0', '2030-05-02 10:00:00', feature_id='f2', mime_type='text/plain')
+    _add(db, 'x0', '2030-05-03 10:00:00', server_id='s2')
+    db.commit()
+    return db
+
+
+def _pages(db, limit, **kwargs):
+    pages, cursor = [], None
+    while True:
+        files, cursor = file_index.list_files(db, USER_ID, cursor=cursor, limit=limit, **kwargs)
+        pages.append([f['id'] for f in files])
+        if cursor is None:
+            return pages
+
+
+def test_pages_follow_the_keyset_cursor(files_db):
+    # 所属していないサーバー（s2）のファイルは出ない
+    assert _pages(files_db, 2) == [['b0', 'a4'], ['a3', 'a2'], ['a1', 'a0']]
+    assert _pages(files_db, 10) == [['b0', 'a4', 'a3', 'a2', 'a1', 'a0']]
+    assert _pages(files_db, 3, feature_id='f1') == [['a4', 'a3', 'a2'], ['a1', 'a0']]
+    assert _pages(files_db, 10, mime_prefix='text/') == [['b0']]
+    assert _pages(files_db, 10, server_id='s2') == [[]]
+
+
+def test_new_uploads_do_not_shift_later_pages(files_db):
+    first, cursor = file_index.list_files(files_db, USER_ID, limit=3)
+    _add(files_db, 'c0', '2030-05-04 10:00:00')
+    rest, _ = file_index.list_files(files_db, USER_ID, cursor=cursor, limit=10)
+    assert [f['id'] for f in first + rest] == ['b0', 'a4', 'a3', 'a2', 'a1', 'a0']
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    cursor = file_index.encode_cursor('2030-05-01 10:00:00', 'a4')
+    assert '=' not in cursor
+    assert file_index.decode_cursor(cursor) == ('2030-05-01 10:00:00', 'a4')
+    for broken in ('!!!', 'e30', file_index.encode_cursor(1, 'a4')):
+        with pytest.raises(file_index.CursorError):
+            file_index.decode_cursor(broken)
+
+
+def test_list_files_api(api):
+    call, client, server_id, features = api
+    for name in ('a.txt', 'b.txt', 'c.txt'):
+        client.post('/api.cgi', data={
+            'action': 'uploadFile', 'serverId': server_id, 'featureId': features['storage'],
+            'file': (io.BytesIO(b'x'), name),
+        })
+    first = call(action='listFiles', serverId=server_id, limit=2)
+    rest = call(action='listFiles', serverId=server_id, limit=2, cursor=first['nextCursor'])
+    assert sorted(f['filename'] for f in first['files'] + rest['files']) == ['a.txt', 'b.txt', 'c.txt']
+    assert rest['nextCursor'] is None
+
+    broken = client.post('/api.cgi', data={'action': 'listFiles', 'cursor': '!!!'}).get_json()
+    assert not broken['success']
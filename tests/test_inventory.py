@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""物品の一覧と CSV の取り込み・書き出し（inventory.py）"""
+
+import csv
+import io
+
+import pytest
+
+import inventory
+
+FEATURE_ID = 'f_inventory'
+
+CSV_TEXT = (
+    'id,name,category,location,status,quantity,unitPrice,minStock,description\n'
+    ',三脚,機材,部室,available,3,4500,2,\n'
+    ',レフ板,機材,倉庫,,1,,2,折りたたみ\n'
+    ',,機材,部室,,1,,,名前が無い\n'
+    ',ストロボ,機材,部室,,たくさん,,,\n'
+    ',模造紙,消耗品,部室,,50,30.5,,\n'
+)
+
+
+def _run(db):
+    jobs = []
+
+    def run(job):
+        jobs.append(job)
+        return job(db)
+    return run, jobs
+
+
+def _names(db, **kwargs):
+    return [item['name'] for item in inventory.list_items(db, FEATURE_ID, **kwargs)[0]]
+
+
+def test_import_validates_rows_and_writes_in_batches(monkeypatch, db):
+    monkeypatch.setattr(inventory, 'IMPORT_BATCH_SIZE', 2)
+    run, jobs = _run(db)
+    imported, errors = inventory.import_csv(run, FEATURE_ID, io.StringIO(CSV_TEXT), 'alice')
+    assert imported == 3 and len(jobs) == 2
+    assert errors == [{'line': 4, 'error': 'name is required'},
+                      {'line': 5, 'error': 'quantity must be a number'}]
+
+    items, total, categories, locations = inventory.list_items(db, FEATURE_ID)
+    assert total == 3 and categories == {'機材': 2, '消耗品': 1} and locations == {'部室': 2, '倉庫': 1}
+    tripod = next(item for item in items if item['name'] == '三脚')
+    assert (tripod['quantity'], tripod['unitPrice'], tripod['minStock']) == (3, 4500.0, 2)
+    assert tripod['createdBy'] == 'alice' and tripod['createdAt'] == tripod['updatedAt']
+
+    with pytest.raises(ValueError):
+        inventory.read_csv(io.StringIO('id,title\n1,x\n'))
+
+
+def test_import_updates_existing_items_by_id(db):
+    run, _ = _run(db)
+    inventory.import_csv(run, FEATURE_ID, io.StringIO('id,name,quantity\ntri,三脚,3\n'), 'alice')
+    created = inventory.items_by_feature(db, [FEATURE_ID])[FEATURE_ID]['tri']
+
+    inventory.import_csv(run, FEATURE_ID, io.StringIO('id,name,quantity\ntri,三脚,1\n'), 'bob')
+    updated = inventory.items_by_feature(db, [FEATURE_ID])[FEATURE_ID]['tri']
+    assert updated['quantity'] == 1
+    # CSV に無いキー（作成者・作成日時）は残る
+    assert (updated['createdBy'], updated['createdAt']) == ('alice', created['createdAt'])
+
+
+def test_list_filters_and_low_stock(db):
+    run, _ = _run(db)
+    inventory.import_csv(run, FEATURE_ID, io.StringIO(CSV_TEXT))
+    assert _names(db, low_stock=True) == ['レフ板']
+    assert _names(db, query='板') == ['レフ板']
+    assert _names(db, query='%') == []
+    assert _names(db, sort='quantity', descending=True) == ['模造紙', '三脚', 'レフ板']
+    # 件数は絞り込んだカテゴリ以外も数える
+    _, total, categories, _ = inventory.list_items(db, FEATURE_ID, category='消耗品')
+    assert total == 1 and categories == {'機材': 2, '消耗品': 1}
+
+
+def test_export_streams_in_chunks_and_round_trips(monkeypatch, db):
+    run, _ = _run(db)
+    inventory.import_csv(run, FEATURE_ID, io.StringIO(CSV_TEXT))
+    monkeypatch.setattr(inventory, 'EXPORT_FETCH_SIZE', 1)
+    chunks = list(inventory.export_csv(db, FEATURE_ID))
+    assert len(chunks) == 3 and chunks[0].startswith('\ufeffid,name,')
+    text = ''.join(chunks)
+    rows = list(csv.DictReader(io.StringIO(text.lstrip('\ufeff'))))
+    assert [row['name'] for row in rows] == sorted(['三脚', 'レフ板', '模造紙'])
+
+    # 書き出した CSV をそのまま取り込むと同じアイテムを更新する
+    imported, errors = inventory.import_csv(run, FEATURE_ID, io.StringIO(text.lstrip('\ufeff')))
+    assert (imported, errors) == (3, [])
+    assert inventory.list_items(db, FEATURE_ID)[1] == 3
+    assert ''.join(inventory.export_csv(db, FEATURE_ID, category='消耗品')).count('\n') == 2
+
+
+def test_import_and_export_api(api):
+    _, client, _, features = api
+    body = ('\ufeff' + CSV_TEXT).encode('utf-8')
+    result = client.post('/api.cgi', data={
+        'action': 'importInventory', 'featureId': features['inventory'],
+        'file': (io.BytesIO(body), 'items.csv'),
+    }).get_json()
+    assert result['success'] and result['data']['imported'] == 3
+
+    exported = client.post('/api.cgi', data={'action': 'exportInventory', 'featureId': features['inventory']})
+    assert exported.mimetype == 'text/csv'
+    assert 'attachment' in exported.headers['Content-Disposition']
+    assert exported.get_data(as_text=True).count('\n') == 4
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""メンバーシップのキャッシュ（membership.py）と機能アクションの認可"""
+
+import membership
+import repository
+
+
+def _setup(conn):
+    repository.create_user(conn, 'alice', 'x')
+    repository.create_user(conn, 'bob', 'x')
+    alice, bob = (repository.find_user(conn, name)['id'] for name in ('alice', 'bob'))
+    repository.create_server(conn, 's1', '写真部', 'camera', alice, 'code1')
+    repository.add_feature(conn, 'f1', 's1', 'チャット', 'chat', 'message-circle', 0)
+    conn.commit()
+    return alice, bob
+
+
+def test_invalidation_reloads_roles(app_module, db):
+    alice, bob = _setup(db)
+    cache = membership.MembershipCache(app_module.get_db_connection, ttl=3600)
+    assert cache.role(alice, 's1') == 'owner'
+    assert cache.feature_role(bob, 'f1') is None
+    assert cache.feature_server('missing') is None
+
+    repository.add_member(db, 's1', bob, 'member')
+    db.commit()
+    # TTL 内は無効化されるまで前の結果を使う
+    assert cache.role(bob, 's1') is None
+    cache.invalidate_user(bob)
+    assert cache.feature_role(bob, 'f1') == 'member'
+
+    repository.set_member_role(db, 's1', bob, 'admin')
+    db.commit()
+    cache.clear()
+    assert cache.role(bob, 's1') == 'admin'
+
+
+def test_invalidation_during_a_load_is_not_overwritten(app_module, db, monkeypatch):
+    alice, _ = _setup(db)
+    cache = membership.MembershipCache(app_module.get_db_connection, ttl=3600)
+    server_roles = repository.server_roles
+
+    def racing_server_roles(conn, user_id):
+        # 読み込んだあと、結果を保存する前に別のリクエストがロールを変えて無効化する
+        roles = server_roles(conn, user_id)
+        repository.set_member_role(db, 's1', alice, 'admin')
+        db.commit()
+        cache.invalidate_user(alice)
+        monkeypatch.setattr(repository, 'server_roles', server_roles)
+        return roles
+
+    monkeypatch.setattr(repository, 'server_roles', racing_server_roles)
+    assert cache.role(alice, 's1') == 'owner'
+    # 古い世代で読んだ結果はキャッシュに残らないので、次の呼び出しで読み直す
+    assert cache.role(alice, 's1') == 'admin'
+
+
+def test_feature_actions_follow_membership_changes(api, app_module):
+    call, _, server_id, features = api
+    invite = call(action='createInvite', serverId=server_id)
+
+    bob = app_module.app.test_client()
+    bob.post('/api.cgi', data={'action': 'register', 'username': 'bob', 'password': 'secret1'})
+    bob.post('/api.cgi', data={'action': 'login', 'username': 'bob', 'password': 'secret1'})
+
+    def as_bob(**data):
+        return bob.post('/api.cgi', data=data).get_json()
+
+    denied = as_bob(action='getFeatureContent', featureId=features['chat'])
+    assert not denied['success'] and '権限' in denied['error']
+    assert not as_bob(action='getServerMembers', serverId=server_id)['success']
+
+    # 招待を受けたら、キャッシュの TTL を待たずに使える
+    assert as_bob(action='acceptInvite', inviteCode=invite['inviteCode'])['success']
+    assert as_bob(action='getFeatureContent', featureId=features['chat'])['success']
+
+    # ロールの変更もすぐに反映される
+    bob_id = next(m['id'] for m in call(action='getServerMembers', serverId=server_id)['members']
+                  if m['username'] == 'bob')
+    assert not as_bob(action='createInvite', serverId=server_id)['success']
+    call(action='updateMemberRole', serverId=server_id, userId=str(bob_id), role='admin')
+    assert as_bob(action='createInvite', serverId=server_id)['success']
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""招待コードの一括発行と CSV からのメンバー一括登録（onboarding.py）"""
+
+import io
+
+import pytest
+
+import onboarding
+
+
+def _client(app_module, username):
+    client = app_module.app.test_client()
+    client.post('/api.cgi', data={'action': 'register', 'username': username, 'password': 'secret1'})
+    client.post('/api.cgi', data={'action': 'login', 'username': username, 'password': 'secret1'})
+    return client
+
+
+def _post(client, **data):
+    return client.post('/api.cgi', data=data).get_json()
+
+
+def _import(client, server_id, text):
+    return client.post('/api.cgi', data={
+        'action': 'importMembers', 'serverId': server_id,
+        'file': (io.BytesIO(text.encode('utf-8-sig')), 'members.csv'),
+    }).get_json()
+
+
+def test_read_members_validates_before_writing(monkeypatch):
+    monkeypatch.setattr(onboarding, 'IMPORT_BATCH_SIZE', 2)
+    batches, results = onboarding.read_members(io.StringIO(
+        'username,role\nbob,\ncarol,admin\n,member\nbob,member\ndave,owner\nerin,moderator\n'
+    ))
+    assert batches == [[(2, 'bob', 'member'), (3, 'carol', 'admin')], [(7, 'erin', 'moderator')]]
+    assert [(r['line'], r['status']) for r in results] == [(5, onboarding.DUPLICATE), (6, onboarding.INVALID)]
+    with pytest.raises(ValueError):
+        onboarding.read_members(io.StringIO('name\nbob\n'))
+
+
+def test_import_members_adds_existing_users(monkeypatch, api, app_module):
+    call, client, server_id, features = api
+    bob = _client(app_module, 'bob')
+    _client(app_module, 'carol')
+    # bob の所属はキャッシュされている
+    assert not _post(bob, action='getFeatureContent', featureId=features['chat'])['success']
+
+    monkeypatch.setattr(onboarding, 'IMPORT_BATCH_SIZE', 1)
+    result = _import(client, server_id, 'username,role\nbob,\ncarol,moderator\nalice,\nnobody,\nbob,\n')
+    assert result['success'], result
+    assert [(r['username'], r['status']) for r in result['data']['results']] == [
+        ('bob', 'added'), ('carol', 'added'), ('alice', 'already_member'),
+        ('nobody', 'not_found'), ('bob', 'duplicate'),
+    ]
+    assert result['data']['counts'] == {'added': 2, 'already_member': 1, 'not_found': 1, 'duplicate': 1}
+
+    roles = {m['username']: m['role'] for m in call(action='getServerMembers', serverId=server_id)['members']}
+    assert roles == {'alice': 'owner', 'bob': 'member', 'carol': 'moderator'}
+    # 追加されたユーザーはキャッシュの TTL を待たずに使える
+    assert _post(bob, action='getFeatureContent', featureId=features['chat'])['success']
+    # 一般メンバーは取り込めない
+    assert not _import(bob, server_id, 'username\ncarol\n')['success']
+
+
+def test_create_invites_in_bulk(api, app_module):
+    call, client, server_id, features = api
+    invites = call(action='createInvites', serverId=server_id, count=3, hours=48)['invites']
+    assert len({invite['inviteCode'] for invite in invites}) == 3
+
+    for username, invite in zip(('bob', 'carol'), invites):
+        member = _client(app_module, username)
+        assert _post(member, action='acceptInvite', inviteCode=invite['inviteCode'])['success']
+        assert _post(member, action='getFeatureContent', featureId=features['chat'])['success']
+    assert len(call(action='getServerMembers', serverId=server_id)['members']) == 3
+
+    for count, hours in ((0, 24), (onboarding.MAX_BULK_INVITES + 1, 24), (1, onboarding.MAX_INVITE_HOURS + 1)):
+        assert not _post(client, action='createInvites', serverId=server_id, count=count, hours=hours)['success']
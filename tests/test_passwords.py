@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""パスワードのハッシュ（以前の形式からの移行、passwords.py）とログイン試行の制限（ratelimit.py）"""
+
+import hashlib
+import types
+
+import passwords
+import ratelimit
+import repository
+from config import Config
+
+
+def test_hashes_are_salted_and_verified():
+    first = passwords.hash_password('secret1')
+    second = passwords.hash_password('secret1')
+    assert first != second
+    assert first.split('$')[0] == passwords.configured_hasher()
+    assert passwords.verify_password('secret1', first) == (True, False)
+    assert passwords.verify_password('secret2', first) == (False, False)
+    assert passwords.verify_password('secret1', '') == (False, False)
+    assert passwords.verify_password('secret1', 'scrypt$x$y$z$a$b') == (False, False)
+
+
+def test_cost_or_hasher_changes_ask_for_a_rehash(monkeypatch):
+    stored = passwords.hash_password('secret1')
+    monkeypatch.setattr(Config, 'PASSWORD_SCRYPT_N', Config.PASSWORD_SCRYPT_N * 2)
+    monkeypatch.setattr(Config, 'PASSWORD_PBKDF2_ITERATIONS', Config.PASSWORD_PBKDF2_ITERATIONS + 1)
+    assert passwords.verify_password('secret1', stored) == (True, True)
+
+    monkeypatch.setattr(Config, 'PASSWORD_HASHER', passwords.PBKDF2)
+    monkeypatch.setattr(Config, 'PASSWORD_PBKDF2_ITERATIONS', 1000)
+    pbkdf2 = passwords.hash_password('secret1')
+    assert pbkdf2.startswith('pbkdf2_sha256$1000$')
+    assert passwords.verify_password('secret1', pbkdf2) == (True, False)
+
+
+def test_login_replaces_a_legacy_hash(app_module, db):
+    legacy = hashlib.sha256(b'secret1').hexdigest()
+    assert passwords.verify_password('secret1', legacy) == (True, True)
+    assert passwords.verify_password('secret2', legacy) == (False, False)
+    repository.create_user(db, 'alice', legacy)
+    db.commit()
+
+    client = app_module.app.test_client()
+    for _ in range(2):
+        result = client.post('/api.cgi', data={'action': 'login', 'username': 'alice',
+                                               'password': 'secret1'}).get_json()
+        assert result['success'], result
+        stored = repository.find_user(db, 'alice')['password_hash']
+        assert stored.split('$')[0] == passwords.configured_hasher()
+        assert passwords.verify_password('secret1', stored) == (True, False)
+    assert not client.post('/api.cgi', data={'action': 'login', 'username': 'alice',
+                                             'password': legacy}).get_json()['success']
+
+
+def test_token_bucket_refills_over_time(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(ratelimit, 'time', types.SimpleNamespace(monotonic=lambda: clock[0]))
+    limiter = ratelimit.TokenBucketLimiter(burst=3, per_minute=6)
+
+    assert [limiter.allow('alice') for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow('bob')
+    assert limiter.retry_after('alice') == 10
+
+    # 6個/分なので10秒で1個戻る（burst を超えては貯まらない）
+    clock[0] += 9
+    assert not limiter.allow('alice')
+    clock[0] += 1
+    assert limiter.allow('alice')
+    assert not limiter.allow('alice')
+    clock[0] += 3600
+    assert [limiter.allow('alice') for _ in range(4)] == [True, True, True, False]
+
+    limiter.reset('alice')
+    assert limiter.allow('alice')
+
+
+def test_full_buckets_are_pruned(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(ratelimit, 'time', types.SimpleNamespace(monotonic=lambda: clock[0]))
+    limiter = ratelimit.TokenBucketLimiter(burst=2, per_minute=60, max_keys=3)
+    for key in ('a', 'b', 'c'):
+        limiter.allow(key)
+    clock[0] += 5
+    limiter.allow('d')
+    assert set(limiter._buckets) == {'d'}
+
+
+def test_login_attempts_are_limited(app_module, monkeypatch):
+    monkeypatch.setattr(Config, 'LOGIN_RATE_LIMIT', True)
+    monkeypatch.setattr(app_module, 'login_user_limiter', ratelimit.TokenBucketLimiter(2, 0))
+    client = app_module.app.test_client()
+    client.post('/api.cgi', data={'action': 'register', 'username': 'alice', 'password': 'secret1'})
+
+    def login(password):
+        return client.post('/api.cgi', data={'action': 'login', 'username': 'alice',
+                                             'password': password}).get_json()
+
+    assert login('wrong')['error'] == 'パスワードが間違っています'
+    assert login('wrong')['error'] == 'パスワードが間違っています'
+    # 正しいパスワードでも、トークンが無ければハッシュを計算する前に断る
+    assert login('secret1')['error'] == app_module.RATE_LIMITED_ERROR
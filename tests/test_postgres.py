@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""PostgreSQL バックエンド（DATABASE_URL=postgresql://...）での主要なアクション
+
+TEST_POSTGRES_URL に接続先を渡したときだけ実行する（psycopg が必要）。
+テストごとに新しいスキーマを作り、search_path をそこに向けた DATABASE_URL で
+app を読み込み直す（SQLite で読み込んだモジュールは終了後に元に戻す）。
+
+    docker run --rm -e POSTGRES_PASSWORD=pw -p 5432:5432 postgres:16
+    TEST_POSTGRES_URL=postgresql://postgres:pw@localhost:5432/postgres python -m pytest tests/test_postgres.py
+"""
+
+import io
+import json
+import os
+import sys
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+pytestmark = pytest.mark.skipif(not POSTGRES_URL, reason='TEST_POSTGRES_URL が未設定')
+
+
+def _with_search_path(url, schema):
+    separator = '&' if '?' in url else '?'
+    return f'{url}{separator}options=-csearch_path%3D{schema}'
+
+
+@pytest.fixture(scope='module')
+def pg(tmp_path_factory):
+    psycopg = pytest.importorskip('psycopg')
+    schema = f'circle_test_{uuid.uuid4().hex[:12]}'
+    with psycopg.connect(POSTGRES_URL, autocommit=True) as admin:
+        admin.execute(f'CREATE SCHEMA {schema}')
+
+    # config は最初の import で環境変数を読むので、リポジトリのモジュールを読み込み直す
+    names = {name[:-3] for name in os.listdir(ROOT) if name.endswith('.py')}
+    saved_modules = {name: sys.modules.pop(name) for name in list(sys.modules) if name in names}
+    saved_env = {key: os.environ.get(key) for key in ('DATABASE_URL', 'LOGIN_RATE_LIMIT')}
+    os.environ['DATABASE_URL'] = _with_search_path(POSTGRES_URL, schema)
+    os.environ['LOGIN_RATE_LIMIT'] = 'False'
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('pg'))
+    app_module = None
+    try:
+        import app as app_module
+        app_module.init_database()
+        yield app_module
+    finally:
+        if app_module is not None:
+            app_module.writes.close()
+            app_module.bookkeeping.close()
+            app_module.event_bus.close()
+        os.chdir(cwd)
+        for name in names:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved_modules)
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        with psycopg.connect(POSTGRES_URL, autocommit=True) as admin:
+            admin.execute(f'DROP SCHEMA {schema} CASCADE')
+
+
+@pytest.fixture(scope='module')
+def alice(pg):
+    client = pg.app.test_client()
+
+    def call(**data):
+        result = client.post('/api.cgi', data=data).get_json()
+        assert result['success'], result
+        return result['data']
+
+    call(action='register', username='alice', password='secret1')
+    call(action='login', username='alice', password='secret1')
+    state = call(action='addServer', name='写真部')
+    server_id = next(iter(state['servers']))
+    features = {f['type']: f['id'] for f in state['features'][server_id]}
+    return client, call, server_id, features
+
+
+def test_schema_is_created_on_postgres(pg):
+    import database
+    conn = pg.get_db_connection()
+    try:
+        assert database.is_postgres(conn)
+        for table in ('users', 'feature_content', 'search_index', 'project_tasks', 'budget_ledger',
+                      'wiki_revisions', 'diary_entries', 'survey_responses', 'inventory_items'):
+            assert database.table_exists(conn, table), table
+        assert 'last_login' in database.columns(conn, 'users')
+    finally:
+        conn.close()
+    # 2回目の初期化（既存のスキーマ）でも失敗しない
+    pg.init_database()
+
+
+def test_members_invites_and_password_recovery(pg, alice):
+    client, call, server_id, _ = alice
+    invite = call(action='createInvite', serverId=server_id)
+
+    bob = pg.app.test_client()
+    assert bob.post('/api.cgi', data={'action': 'register', 'username': 'bob', 'password': 'secret1'}).get_json()['success']
+    assert bob.post('/api.cgi', data={'action': 'login', 'username': 'bob', 'password': 'secret1'}).get_json()['success']
+    state = bob.post('/api.cgi', data={'action': 'acceptInvite', 'inviteCode': invite['inviteCode']}).get_json()
+    assert state['success'] and server_id in state['data']['servers']
+    again = bob.post('/api.cgi', data={'action': 'acceptInvite', 'inviteCode': invite['inviteCode']}).get_json()
+    assert not again['success']
+
+    members = {m['username']: m for m in call(action='getServerMembers', serverId=server_id)['members']}
+    assert members['alice']['role'] == 'owner' and members['bob']['role'] == 'member'
+    call(action='updateMemberRole', serverId=server_id, userId=str(members['bob']['id']), role='moderator')
+    members = {m['username']: m for m in call(action='getServerMembers', serverId=server_id)['members']}
+    assert members['bob']['role'] == 'moderator'
+
+    token = call(action='requestPasswordRecovery', username='alice', partnerUsername='bob')['recoveryToken']
+    assert bob.post('/api.cgi', data={'action': 'approvePasswordRecovery',
+                                      'recoveryToken': token}).get_json()['success']
+    call(action='resetPassword', recoveryToken=token, newPassword='secret2')
+    call(action='login', username='alice', password='secret2')
+
+    state = call(action='updateProfile', nickname='アリス', theme='light')
+    assert state['currentUser']['nickname'] == 'アリス'
+
+
+def test_feature_tables_and_search(pg, alice):
+    client, call, server_id, features = alice
+
+    call(action='postMessage', featureId=features['chat'], subItemId='general', content='明日の会議の議事録です')
+    hits = call(action='search', query='会議の議事録')['hits']
+    assert [hit['kind'] for hit in hits] == ['message']
+    assert '<mark>会議の議事録</mark>' in hits[0]['snippet']
+    assert call(action='search', query='会議')['total'] == 1
+
+    call(action='createProject', featureId=features['projects'], name='展示会')
+    project_id = next(iter(call(action='getFeatureContent', featureId=features['projects'])['projects']))
+    call(action='createTask', featureId=features['projects'], projectId=project_id, title='搬入', dueDate='2030-01-01')
+    task = call(action='listTasks', featureId=features['projects'])['tasks'][0]
+    call(action='updateTaskStatus', featureId=features['projects'], taskId=task['id'], status='done')
+    assert call(action='listTasks', featureId=features['projects'], status='done')['tasks'][0]['title'] == '搬入'
+
+    calendar = {'events': {'e1': {'id': 'e1', 'title': '定例', 'date': '2030-01-07', 'time': '18:00',
+                                  'recurrence': {'freq': 'weekly', 'count': 3}}}}
+    call(action='updateFeatureContent', featureId=features['calendar'], content=json.dumps(calendar))
+    events = call(action='getEvents', featureId=features['calendar'], **{'from': '2030-01-01', 'to': '2030-01-31'})
+    assert [e['date'] for e in events['events']] == ['2030-01-07', '2030-01-14', '2030-01-21']
+
+    budget = {'accounts': {'a1': {'id': 'a1', 'name': '現金', 'balance': 1000}}, 'transactions': {}}
+    call(action='updateFeatureContent', featureId=features['budget'], content=json.dumps(budget))
+    budget['transactions'] = {
+        't1': {'id': 't1', 'amount': 5000, 'category': 'income', 'account': 'a1', 'date': '2030-05-01'},
+        't2': {'id': 't2', 'amount': 1200, 'category': 'expense', 'account': 'a1', 'date': '2030-05-02'},
+    }
+    call(action='updateFeatureContent', featureId=features['budget'], content=json.dumps(budget))
+    summary = call(action='getBudgetSummary', featureId=features['budget'], fiscalYear='2030')
+    assert summary['totalBalance'] == 4800
+    assert summary['fiscalYearTotals']['net'] == 3800
+
+    upload = client.post('/api.cgi', data={
+        'action': 'importInventory', 'featureId': features['inventory'],
+        'file': (io.BytesIO('name,category,quantity\nカメラ,機材,2\n三脚,機材,x\n'.encode('utf-8')), 'items.csv'),
+    }).get_json()
+    assert upload['data']['imported'] == 1 and len(upload['data']['errors']) == 1
+    items = call(action='listInventory', featureId=features['inventory'], query='カメ')
+    assert [item['name'] for item in items['items']] == ['カメラ']
+
+    call(action='saveWikiPage', featureId=features['wiki'], pageId='home', title='ホーム', content='1行目\n')
+    call(action='saveWikiPage', featureId=features['wiki'], pageId='home', title='ホーム', content='1行目\n2行目\n')
+    first = call(action='getWikiRevision', featureId=features['wiki'], pageId='home', revision='1')
+    assert first['content'] == '1行目\n'
+
+    call(action='saveDiaryEntry', featureId=features['diary'], title='初日', content='晴れ')
+    listed = call(action='listDiaryEntries', featureId=features['diary'])
+    assert [e['title'] for e in listed['entries']] == ['初日']
+    assert [m['count'] for m in listed['months']] == [1]
+
+    questions = [{'id': 'q1', 'type': 'radio', 'text': '参加', 'options': ['はい', 'いいえ']},
+                 {'id': 'q2', 'type': 'number', 'text': '人数'}]
+    call(action='createSurvey', featureId=features['survey'], title='合宿', questions=json.dumps(questions))
+    survey_id = next(iter(call(action='getFeatureContent', featureId=features['survey'])['surveys']))
+    call(action='submitSurveyResponse', featureId=features['survey'], surveyId=survey_id,
+         responses=json.dumps({'q1': 'はい', 'q2': 3}))
+    call(action='submitSurveyResponse', featureId=features['survey'], surveyId=survey_id,
+         responses=json.dumps({'q1': 'いいえ', 'q2': 5}))
+    results = {q['id']: q for q in call(action='getSurveyResults', featureId=features['survey'],
+                                        surveyId=survey_id)['questions']}
+    # 同じユーザーの再回答は置き換え
+    assert results['q1']['counts'] == {'はい': 0, 'いいえ': 1}
+    assert results['q2']['numeric']['mean'] == 5
+
+    uploaded = client.post('/api.cgi', data={
+        'action': 'uploadFile', 'serverId': server_id, 'featureId': features['storage'],
+        'file': (io.BytesIO(b'hello'), 'hello.txt'),
+    }).get_json()['data']
+    files = call(action='listFiles', serverId=server_id)['files']
+    assert [f['filename'] for f in files] == ['hello.txt']
+    assert pg.blobs.exists(f"uploads/{uploaded['storedFilename']}")
+
+
+def test_export_and_import_server(pg, alice):
+    client, call, server_id, features = alice
+    archive = client.post('/api.cgi', data={'action': 'exportServer', 'serverId': server_id}).data
+    result = client.post('/api.cgi', data={
+        'action': 'importServer', 'file': (io.BytesIO(archive), 'server.tar.gz'),
+    }).get_json()
+    assert result['success'], result
+    new_id = result['data']['serverId']
+
+    state = call(action='checkSession')['state']
+    imported = {f['type']: f['id'] for f in state['features'][new_id]}
+    assert len(imported) == len(features)
+    for kind, action, key in (('wiki', 'listWikiPages', 'pages'), ('inventory', 'listInventory', 'items'),
+                              ('projects', 'listTasks', 'tasks')):
+        original = call(action=action, featureId=features[kind])[key]
+        copied = call(action=action, featureId=imported[kind])[key]
+        assert [item.get('title') or item.get('name') for item in copied] == \
+            [item.get('title') or item.get('name') for item in original]
+        assert copied
+    assert call(action='search', query='議事録', serverId=new_id)['total'] == 1
+
+
+def test_queries_are_traced(alice):
+    import querytrace
+    _, call, _, _ = alice
+    # PostgreSQL の接続でも SQL がクエリトレースに記録され、checkSession の上限は SQLite と同じ
+    with querytrace.assert_max_queries(15, allow_repeated=False) as trace:
+        call(action='checkSession')
+    assert trace.count > 0
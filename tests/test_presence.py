@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""オンライン状態と入力中の表示の期限とまとめ（presence.py）"""
+
+import types
+
+import pytest
+
+import events
+import presence
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(presence, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def tracker(clock):
+    sent = []
+    tracker = presence.PresenceTracker(lambda *event: sent.append(event), ttl=30, typing_ttl=6)
+    return tracker, sent
+
+
+def test_online_expires_after_the_ttl(clock, tracker):
+    tracker, sent = tracker
+    tracker.heartbeat('s1', 'alice')
+    tracker.heartbeat('s1', 'bob')
+    assert tracker.snapshot('s1')['online'] == ['alice', 'bob']
+
+    clock[0] += 20
+    tracker.heartbeat('s1', 'alice')
+    clock[0] += 15
+    # bob は最後のハートビートから 35 秒、alice は 15 秒
+    assert tracker.snapshot('s1')['online'] == ['alice']
+    clock[0] += 15
+    assert tracker.snapshot('s1') == {'online': [], 'typing': []}
+
+    # 期限の 1/3（10秒）より短い間隔のハートビートは通知しない
+    assert [event[3] for event in sent] == [
+        {'username': 'alice', 'online': True}, {'username': 'bob', 'online': True},
+        {'username': 'alice', 'online': True},
+    ]
+
+
+def test_typing_expires_and_coalesces(clock, tracker):
+    tracker, sent = tracker
+    for _ in range(3):
+        tracker.set_typing('s1', 'f1', 'general', 'alice')
+        clock[0] += 1
+    assert tracker.snapshot('s1', 'f1', 'general')['typing'] == ['alice']
+    assert len(sent) == 1 and tracker.coalesced == 2
+    assert tracker.snapshot('s1', 'f1', 'other')['typing'] == []
+
+    clock[0] += 6
+    assert tracker.snapshot('s1', 'f1', 'general')['typing'] == []
+    # 期限が切れたあとの入力は新しい入力の開始として通知する
+    tracker.set_typing('s1', 'f1', 'general', 'alice')
+    tracker.set_typing('s1', 'f1', 'general', 'alice', typing=False)
+    assert [event[3]['typing'] for event in sent] == [True, True, False]
+    assert tracker.snapshot('s1', 'f1', 'general')['typing'] == []
+
+
+def test_events_from_other_nodes(clock):
+    bus = events.EventBus(events.MemoryTransport(), batch_ms=0)
+    here = presence.PresenceTracker(bus.publish, ttl=30, typing_ttl=6)
+    there = presence.PresenceTracker(None, ttl=30, typing_ttl=6)
+    bus.add_listener(here.apply)
+    bus.add_listener(there.apply)
+    try:
+        here.heartbeat('s1', 'alice')
+        here.set_typing('s1', 'f1', 'general', 'alice')
+        assert there.snapshot('s1', 'f1', 'general') == {'online': ['alice'], 'typing': ['alice']}
+
+        # 投稿が届いたら入力中の表示を消す
+        bus.publish('s1', 'message', 'f1', {'subItemId': 'general', 'message': {'authorId': 'alice'}})
+        assert there.snapshot('s1', 'f1', 'general')['typing'] == []
+
+        here.leave('s1', 'alice')
+        assert there.snapshot('s1')['online'] == []
+        clock[0] += 31
+        assert here.snapshot('s1')['online'] == []
+    finally:
+        bus.close()
+
+
+def test_sweep_drops_expired_entries(clock, tracker):
+    tracker, _ = tracker
+    tracker.heartbeat('s1', 'alice')
+    tracker.set_typing('s1', 'f1', 'general', 'alice')
+    clock[0] += presence.SWEEP_INTERVAL + 1
+    tracker.heartbeat('s2', 'bob')
+    assert tracker._online == {'s2': {'bob': clock[0] + 30}}
+    assert tracker._typing == {}
+    assert list(tracker._announced) == [('presence', 's2', 'bob')]
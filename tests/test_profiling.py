@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""リクエスト単位のプロファイリングと遅いリクエストのログ（profiling.py）"""
+
+import json
+import logging
+import time
+
+import pytest
+from flask import Response
+
+import profiling
+from config import Config
+
+
+@pytest.fixture
+def profile_log(monkeypatch, tmp_path):
+    log_dir = tmp_path / 'logs'
+    monkeypatch.setattr(Config, 'PROFILE_REQUESTS', True)
+    monkeypatch.setattr(Config, 'PROFILE_LOG_DIR', str(log_dir))
+    monkeypatch.setattr(Config, 'PROFILE_STACK_CAPTURE', False)
+    monkeypatch.setattr(Config, 'PROFILE_CPROFILE_RATE', 0.0)
+    monkeypatch.setattr(profiling, '_logger', None)
+    try:
+        yield log_dir / 'slow_requests.log'
+    finally:
+        logger = logging.getLogger('circle_platform.profile')
+        for handler in list(logger.handlers):
+            handler.close()
+            logger.removeHandler(handler)
+
+
+def _records(path):
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+
+
+def test_nested_phases_are_counted_once():
+    profile = profiling.RequestProfile('x', '/api.cgi')
+    with profile.phase('json_encode'):
+        with profile.phase('json_encode'):
+            time.sleep(0.01)
+        with profile.phase('db'):
+            pass
+    assert set(profile.phases) == {'json_encode', 'db'}
+    assert 0.01 <= profile.phases['json_encode'] < 0.5
+
+
+def test_disabled_profiling_does_nothing(monkeypatch):
+    monkeypatch.setattr(Config, 'PROFILE_REQUESTS', False)
+    assert profiling.start_request('checkSession', '/api.cgi') is None
+    assert profiling.current() is None
+    with profiling.phase('db'):
+        pass
+
+
+def test_requests_get_server_timing_and_slow_ones_are_logged(monkeypatch, profile_log, api):
+    call, client, _, features = api
+    monkeypatch.setattr(Config, 'PROFILE_SLOW_MS', 60000)
+    response = client.post('/api.cgi', data={'action': 'getFeatureContent', 'featureId': features['chat']})
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('total;dur=') and 'db;dur=' in timing and 'auth;dur=' in timing
+    # 速いリクエストは記録しない
+    assert _records(profile_log) == []
+
+    monkeypatch.setattr(Config, 'PROFILE_SLOW_MS', 0)
+    client.post('/api.cgi', data={'action': 'getFeatureContent', 'featureId': features['chat']})
+    record = _records(profile_log)[-1]
+    assert record['action'] == 'getFeatureContent' and record['slow'] and record['status'] == 200
+    assert record['user_id'] is not None
+    assert record['db']['count'] == len(record['db']['queries']) > 0
+    assert any('feature_content' in query['sql'] for query in record['db']['queries'])
+    # リクエストが終わったらスレッドのプロファイルは外れる
+    assert profiling.current() is None
+
+
+def test_log_all_and_errors(monkeypatch, profile_log, app_module):
+    monkeypatch.setattr(Config, 'PROFILE_SLOW_MS', 60000)
+    monkeypatch.setattr(Config, 'PROFILE_LOG_ALL', True)
+    client = app_module.app.test_client()
+    client.post('/api.cgi', data={'action': 'checkSession'})
+    assert [(r['action'], r['slow']) for r in _records(profile_log)] == [('checkSession', False)]
+
+    profile = profiling.start_request('broken', '/api.cgi')
+    try:
+        raise RuntimeError('boom')
+    except RuntimeError as e:
+        profiling.record_error(e)
+    assert 'RuntimeError: boom' in profile.error
+    # エラーのあったリクエストは速くても記録する
+    monkeypatch.setattr(Config, 'PROFILE_LOG_ALL', False)
+    profiling.finish_request(Response(status=500), user_id=1)
+    assert profiling.current() is None
+    record = _records(profile_log)[-1]
+    assert (record['action'], record['status']) == ('broken', 500) and 'boom' in record['error']
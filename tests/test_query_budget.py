@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""主要なアクションの SQL クエリ数の上限（N+1 の再発防止）
+
+作業ディレクトリを一時ディレクトリに移してから app を読み込み、そこに
+データベースを作る。データを増やしてもクエリ数が変わらないことも確認する。
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config は最初の import で環境変数を読む
+os.environ.setdefault('LOGIN_RATE_LIMIT', 'False')
+
+import querytrace  # noqa: E402
+
+SERVERS = 3
+MESSAGES = 30
+
+
+@pytest.fixture(scope='module')
+def api(tmp_path_factory):
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    import app as app_module
+    app_module.init_database()
+    client = app_module.app.test_client()
+
+    def call(**data):
+        result = client.post('/api.cgi', data=data).get_json()
+        assert result['success'], result
+        return result['data']
+
+    call(action='register', username='alice', password='secret1')
+    call(action='login', username='alice', password='secret1')
+    for i in range(SERVERS):
+        state = call(action='addServer', name=f'S{i}')
+    server_id = sorted(state['servers'])[-1]
+    features = {f['type']: f['id'] for f in state['features'][server_id]}
+    try:
+        yield call, features
+    finally:
+        app_module.writes.close()
+        app_module.bookkeeping.close()
+        app_module.event_bus.close()
+        os.chdir(cwd)
+
+
+def _post(call, features, count):
+    for i in range(count):
+        call(action='postMessage', featureId=features['chat'], subItemId='general', content=f'message {i}')
+
+
+def test_check_session_does_not_grow_with_data(api):
+    call, features = api
+    with querytrace.assert_max_queries(15, allow_repeated=False) as before:
+        call(action='checkSession')
+    _post(call, features, MESSAGES)
+    with querytrace.assert_max_queries(before.count, allow_repeated=False):
+        call(action='checkSession')
+
+
+def test_post_message(api):
+    call, features = api
+    with querytrace.assert_max_queries(25, allow_repeated=False) as trace:
+        call(action='postMessage', featureId=features['chat'], subItemId='general', content='hello')
+    # 書き込みスレッドで実行した SQL も数えられている
+    assert any(sql.startswith('INSERT INTO feature_content') for sql, _, _ in trace.queries)
+
+
+def test_update_feature_content(api):
+    call, features = api
+    content = {'pages': {'p1': {'title': 'Home', 'content': 'hello', 'tags': []}}}
+    with querytrace.assert_max_queries(30, allow_repeated=False):
+        call(action='updateFeatureContent', featureId=features['wiki'], content=json.dumps(content))
+
+
+def test_get_feature_content(api):
+    call, features = api
+    with querytrace.assert_max_queries(5, allow_repeated=False):
+        call(action='getFeatureContent', featureId=features['chat'])
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""全文検索（trigram のインデックス・短い語・スニペットのエスケープ・所属による制限、search.py）"""
+
+import pytest
+
+import search
+
+
+def _search(call, query, **params):
+    return call(action='search', query=query, **params)
+
+
+@pytest.fixture
+def indexed(api):
+    call, client, server_id, features = api
+    call(action='saveWikiPage', featureId=features['wiki'], pageId='p1', title='合宿のしおり',
+         content='夏合宿は<b>軽井沢</b>で行います。会議は初日の夜。')
+    call(action='saveWikiPage', featureId=features['wiki'], pageId='p2', title='機材',
+         content='カメラとレンズの貸し出し手順')
+    call(action='saveDiaryEntry', featureId=features['diary'], entryId='d1', title='日記',
+         content='軽井沢の写真を整理した', private='true')
+    return call, client, server_id, features
+
+
+def test_finds_japanese_substrings_and_escapes_snippets(indexed):
+    call, _, _, features = indexed
+    result = _search(call, '軽井沢', kinds='wiki')
+    assert result['total'] == 1
+    hit = result['hits'][0]
+    assert (hit['featureId'], hit['itemId'], hit['title']) == (features['wiki'], 'p1', '合宿のしおり')
+    # 本文の HTML はエスケープされ、一致箇所だけが <mark> になる
+    assert '&lt;b&gt;<mark>軽井沢</mark>&lt;/b&gt;' in hit['snippet']
+    assert '<b>' not in hit['snippet']
+
+    # 自分の非公開の日記は見える
+    assert {h['kind'] for h in _search(call, '軽井沢')['hits']} == {'wiki', 'diary'}
+
+
+def test_short_terms_are_searched_without_the_index(indexed):
+    call, _, _, _ = indexed
+    # 2文字の語だけなら LIKE で全件から探す
+    assert [h['itemId'] for h in _search(call, '会議')['hits']] == ['p1']
+    # 長い語と組み合わせると、長い語で引いてから短い語で絞り込む
+    assert [h['itemId'] for h in _search(call, 'レンズ 貸し')['hits']] == ['p2']
+    assert _search(call, 'レンズ 会議')['total'] == 0
+    # LIKE のワイルドカードは文字として扱う
+    assert _search(call, '%')['total'] == 0
+
+
+def test_index_follows_edits_and_deletes(indexed):
+    call, _, _, features = indexed
+    call(action='saveWikiPage', featureId=features['wiki'], pageId='p1', title='合宿のしおり',
+         content='夏合宿は蓼科で行います。')
+    assert [h['itemId'] for h in _search(call, '軽井沢', kinds='wiki')['hits']] == []
+    assert [h['itemId'] for h in _search(call, '蓼科')['hits']] == ['p1']
+    assert _search(call, '整理', kinds='diary')['total'] == 1
+    call(action='deleteDiaryEntry', featureId=features['diary'], entryId='d1')
+    assert _search(call, '整理', kinds='diary')['total'] == 0
+
+
+def test_results_are_limited_to_members_and_own_private_entries(indexed):
+    _, client, _, _ = indexed
+    other = client.application.test_client()
+
+    def call(**data):
+        result = other.post('/api.cgi', data=data).get_json()
+        assert result['success'], result
+        return result['data']
+
+    call(action='register', username='bob', password='secret2')
+    call(action='login', username='bob', password='secret2')
+    # 所属していないサーバーの内容は出ない
+    assert _search(call, '軽井沢')['total'] == 0
+    call(action='addServer', name='将棋部')
+    assert _search(call, 'カメラ')['total'] == 0
+
+
+def test_paging_and_validation(indexed):
+    call, client, _, features = indexed
+    for i in range(3):
+        call(action='saveWikiPage', featureId=features['wiki'], pageId=f'n{i}', title=f'記録{i}',
+             content='定例の議事録')
+    first = _search(call, '議事録', pageSize=2)
+    second = _search(call, '議事録', pageSize=2, page=2)
+    assert first['total'] == second['total'] == 3
+    assert len(first['hits']) == 2 and len(second['hits']) == 1
+    assert not {h['itemId'] for h in first['hits']} & {h['itemId'] for h in second['hits']}
+
+    assert not client.post('/api.cgi', data={'action': 'search', 'query': ' '}).get_json()['success']
+    assert not client.post('/api.cgi', data={'action': 'search', 'query': 'x', 'page': 'a'}).get_json()['success']
+
+
+def test_marks_in_the_body_cannot_inject_html():
+    assert search._snippet_html('<i>' + search._MARK_START + 'x' + search._MARK_END) == '&lt;i&gt;<mark>x</mark>'
+    assert search._strip_marks('a' + search._MARK_START + 'b' + search._MARK_END) == 'ab'
+    assert search._mark_terms('abcABC', ['abc']) == '\x02abc\x03\x02ABC\x03'
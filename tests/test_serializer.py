@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""JSON シリアライザ層（バックエンドの切り替えと feature_content の保存形式、serializer.py）"""
+
+import json
+
+import pytest
+
+import serializer
+
+VALUE = {'title': '部会', 'n': 3, 'ratio': 0.5, 'tags': ['a', 'b'], 'nested': {'ok': True, 'none': None}}
+BACKENDS = ['json'] + [name for name in ('orjson', 'msgspec') if serializer._select_backend(name) == name]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backends_round_trip(monkeypatch, backend):
+    monkeypatch.setattr(serializer, 'BACKEND', backend)
+    text = serializer.dumps(VALUE)
+    assert isinstance(text, str) and '部会' in text
+    assert json.loads(text) == VALUE
+    assert serializer.loads(text) == VALUE
+    assert serializer.loads(serializer.dumps_bytes(VALUE)) == VALUE
+    with pytest.raises(serializer.DecodeError):
+        serializer.loads('{"broken"')
+
+
+def test_unknown_backend_falls_back_to_json():
+    assert serializer._select_backend('ujson') == 'json'
+
+
+def test_content_keeps_the_legacy_text_format(monkeypatch):
+    monkeypatch.setattr(serializer.Config, 'CONTENT_ENCODING', 'json')
+    monkeypatch.setattr(serializer.Config, 'CONTENT_COMPRESSION', 'none')
+    stored = serializer.encode_content(VALUE)
+    assert isinstance(stored, str)
+    assert serializer.decode_content(stored) == VALUE
+    # ヘッダー無しの JSON バイト列と、JSON ヘッダー付きのバイト列も読める
+    assert serializer.decode_content(stored.encode('utf-8')) == VALUE
+    assert serializer.decode_content(bytes([serializer.FORMAT_JSON]) + stored.encode('utf-8')) == VALUE
+    with pytest.raises(serializer.DecodeError):
+        serializer.decode_content(b'')
+
+
+@pytest.mark.skipif(not serializer.msgpack_available(), reason='msgspec / msgpack が無い')
+def test_msgpack_content(monkeypatch):
+    monkeypatch.setattr(serializer.Config, 'CONTENT_ENCODING', 'msgpack')
+    monkeypatch.setattr(serializer.Config, 'CONTENT_COMPRESSION', 'none')
+    stored = serializer.encode_content(VALUE)
+    assert isinstance(stored, bytes) and stored[0] == serializer.FORMAT_MSGPACK
+    assert serializer.decode_content(stored) == VALUE
+
+
+def test_flask_responses_use_the_serializer(api, app_module):
+    assert isinstance(app_module.app.json, serializer.FastJSONProvider)
+    call, _, _, _ = api
+    state = call(action='checkSession')
+    assert state['loggedIn'] and state['state']['currentUser']['username'] == 'alice'
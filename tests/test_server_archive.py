@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""サーバーのエクスポートとインポート（新しい ID への対応付け、server_archive.py）"""
+
+import io
+import json
+
+import pytest
+
+import server_archive
+
+
+def test_id_map_rewrites_whole_ids_only():
+    ids = server_archive._IdMap()
+    ids.add('server_1', 'server_9')
+    ids.add('server_1_chat_5_0', 'server_9_chat_7_0')
+    text = 'server_1 server_1_chat_5_0 server_10 xserver_1 server_1-a /files/uploads/server_1.png'
+    assert ids.rewrite(text) == 'server_9 server_9_chat_7_0 server_10 xserver_1 server_1-a /files/uploads/server_9.png'
+    assert ids.rewrite_content({'link': 'server_1', 'n': 1}) == {'link': 'server_9', 'n': 1}
+    assert server_archive._IdMap().rewrite('server_1') == 'server_1'
+
+
+def _import(client, archive):
+    result = client.post('/api.cgi', data={
+        'action': 'importServer', 'file': (io.BytesIO(archive), 'server.tar.gz'),
+    }).get_json()
+    assert result['success'], result
+    return result['data']
+
+
+def test_export_and_import_remap_ids(api, app_module):
+    call, client, server_id, features = api
+
+    uploaded = client.post('/api.cgi', data={
+        'action': 'uploadFile', 'serverId': server_id, 'featureId': features['storage'],
+        'file': (io.BytesIO(b'hello'), 'hello.txt'),
+    }).get_json()['data']
+    link = f"/files/uploads/{uploaded['storedFilename']}"
+    call(action='saveWikiPage', featureId=features['wiki'], pageId='home', title='ホーム',
+         content=f"資料: {link}\nチャット: {features['chat']}\n")
+    call(action='createProject', featureId=features['projects'], name='展示会')
+    project_id = next(iter(call(action='getFeatureContent', featureId=features['projects'])['projects']))
+    call(action='createTask', featureId=features['projects'], projectId=project_id, title='搬入')
+    # 口座と取引を別々に保存したブロブ（accounts キーが無い）でも口座と台帳を書き出す
+    call(action='updateFeatureContent', featureId=features['budget'], content=json.dumps({
+        'accounts': {'a1': {'id': 'a1', 'name': '現金', 'balance': 0}},
+    }))
+    call(action='updateFeatureContent', featureId=features['budget'], content=json.dumps({
+        'transactions': {'t1': {'amount': 500, 'category': 'income', 'account': 'a1', 'date': '2030-05-01'}},
+    }))
+    assert call(action='getBudgetSummary', featureId=features['budget'], fiscalYear='2030')['totalBalance'] == 500
+
+    archive = client.post('/api.cgi', data={'action': 'exportServer', 'serverId': server_id}).data
+    summary = _import(client, archive)
+    new_id = summary['serverId']
+    assert new_id != server_id
+    assert summary['files'] == 1 and summary['members'] == 1
+
+    state = call(action='checkSession')['state']
+    imported = {f['type']: f['id'] for f in state['features'][new_id]}
+    assert set(imported) == set(features)
+    assert not set(imported.values()) & set(features.values())
+    assert all(feature_id.startswith(new_id) for feature_id in imported.values())
+
+    # コンテンツ内の機能・ファイルの参照は新しい ID に書き換わる
+    files = call(action='listFiles', serverId=new_id)['files']
+    assert [f['filename'] for f in files] == ['hello.txt']
+    new_link = f"/files/uploads/{files[0]['id']}.txt"
+    assert new_link != link and app_module.blobs.exists(new_link[len('/files/'):])
+    page = call(action='getWikiPage', featureId=imported['wiki'], pageId='home')
+    assert page['content'] == f"資料: {new_link}\nチャット: {imported['chat']}\n"
+
+    tasks = call(action='listTasks', featureId=imported['projects'])['tasks']
+    assert [t['title'] for t in tasks] == ['搬入']
+    summary = call(action='getBudgetSummary', featureId=imported['budget'], fiscalYear='2030')
+    assert summary['totalBalance'] == 500
+    assert [a['name'] for a in summary['accounts']] == ['現金']
+
+    # 元のサーバーは変わらない
+    assert call(action='getWikiPage', featureId=features['wiki'], pageId='home')['content'].startswith(f'資料: {link}')
+
+
+def test_rejects_other_archives(api):
+    _, client, _, _ = api
+    result = client.post('/api.cgi', data={
+        'action': 'importServer', 'file': (io.BytesIO(b'not an archive'), 'server.tar.gz'),
+    }).get_json()
+    assert not result['success']
+    with pytest.raises(server_archive.ArchiveError):
+        server_archive._Importer(None, None, None, False, None, '').manifest({'format': 'other'})
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""index.html の事前圧縮と条件付きリクエスト（static_assets.py）"""
+
+import gzip
+
+import pytest
+from flask import Flask, request
+
+import static_assets
+from config import Config
+
+HTML = ('<html><head><style>body { color: red; }' + ' ' * 2000 + '</style></head>'
+        '<body>' + '<p>サークル</p>' * 200 + '<script type="module">console.log(1);</script></body></html>')
+
+
+@pytest.fixture
+def site(tmp_path):
+    path = tmp_path / 'index.html'
+    path.write_text(HTML, encoding='utf-8')
+    return static_assets.StaticSite(str(path))
+
+
+@pytest.fixture
+def flask_app():
+    return Flask(__name__)
+
+
+def _get(flask_app, handler, headers=None):
+    with flask_app.test_request_context('/', headers=headers or {}):
+        return handler(request)
+
+
+def test_index_is_precompressed_with_strong_etags(monkeypatch, site, flask_app):
+    monkeypatch.setattr(Config, 'STATIC_SPLIT_ASSETS', False)
+    plain = _get(flask_app, site.index_response)
+    assert plain.status_code == 200 and plain.get_data(as_text=True) == HTML
+    assert plain.headers['Cache-Control'] == static_assets.INDEX_CACHE_CONTROL
+    assert 'Content-Encoding' not in plain.headers
+
+    gzipped = _get(flask_app, site.index_response, {'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.get_data()).decode('utf-8') == HTML
+    assert 'Accept-Encoding' in gzipped.headers['Vary']
+    # バリアントごとに別の強い ETag
+    etag, gz_etag = plain.headers['ETag'], gzipped.headers['ETag']
+    assert etag != gz_etag and not etag.startswith('W/')
+
+    not_modified = _get(flask_app, site.index_response, {'Accept-Encoding': 'gzip', 'If-None-Match': gz_etag})
+    assert not_modified.status_code == 304
+    # 別のエンコーディングの ETag では 304 にしない
+    assert _get(flask_app, site.index_response, {'If-None-Match': gz_etag}).status_code == 200
+
+
+def test_split_assets_are_immutable(monkeypatch, site, flask_app):
+    monkeypatch.setattr(Config, 'STATIC_SPLIT_ASSETS', True)
+    html = _get(flask_app, site.index_response).get_data(as_text=True)
+    assert '<style>' not in html and 'console.log' not in html
+    names = sorted(site.assets, key=lambda name: name.rsplit('.', 1)[1])
+    assert [name.rsplit('.', 1)[1] for name in names] == ['css', 'js']
+    for name in names:
+        assert static_assets.ASSET_URL_PREFIX + name in html
+
+    css = _get(flask_app, lambda req: site.asset_response(names[0], req))
+    assert css.mimetype == 'text/css' and css.get_data(as_text=True).startswith('body { color: red; }')
+    assert css.headers['Cache-Control'] == static_assets.IMMUTABLE_CACHE_CONTROL
+    assert _get(flask_app, lambda req: site.asset_response('app.unknown.js', req)) is None
+
+
+def test_rebuilds_when_index_changes(monkeypatch, site, flask_app, tmp_path):
+    monkeypatch.setattr(Config, 'STATIC_SPLIT_ASSETS', True)
+    site.build()
+    old_names = set(site.assets)
+    first = site.index
+
+    # 変更が無ければ作り直さない
+    site.build()
+    assert site.index is first
+
+    path = tmp_path / 'index.html'
+    path.write_text(HTML.replace('red', 'blue'), encoding='utf-8')
+    site._mtime = None
+    site.build()
+    assert site.index is not first
+    # 古いハッシュのアセットも配信し続ける
+    assert old_names < set(site.assets) and len(site.assets) == 3
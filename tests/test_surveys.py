@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""アンケートの回答テーブルと差分更新される集計（surveys.py）"""
+
+import pytest
+
+import repository
+import surveys
+
+FEATURE_ID = 'f_survey'
+SURVEY = {
+    'id': 's1',
+    'questions': [
+        {'id': 'q1', 'type': 'radio', 'text': '参加', 'options': ['はい', 'いいえ']},
+        {'id': 'q2', 'type': 'number', 'text': '人数'},
+        {'id': 'q3', 'type': 'text', 'text': '感想'},
+    ],
+}
+
+
+@pytest.fixture
+def conn(db):
+    for username in ('alice', 'bob', 'carol'):
+        repository.create_user(db, username, 'x')
+    return db
+
+
+def _results(conn):
+    return {q['id']: q for q in surveys.get_results(conn, FEATURE_ID, 's1', SURVEY)['questions']}
+
+
+def test_aggregates_follow_responses(conn):
+    surveys.record_response(conn, FEATURE_ID, 's1', SURVEY, 'alice', {'q1': 'はい', 'q2': 3, 'q3': '楽しみ'})
+    surveys.record_response(conn, FEATURE_ID, 's1', SURVEY, 'bob', {'q1': 'はい', 'q2': 5})
+    surveys.record_response(conn, FEATURE_ID, 's1', SURVEY, 'carol', {'q1': 'いいえ', 'q2': 7})
+
+    results = _results(conn)
+    assert results['q1']['counts'] == {'はい': 2, 'いいえ': 1}
+    assert results['q2']['numeric']['count'] == 3
+    assert results['q2']['numeric']['mean'] == 5
+    assert (results['q2']['numeric']['min'], results['q2']['numeric']['max']) == (3, 7)
+    assert results['q3']['answered'] == 1
+
+    # 再回答は前の回答の分を引いてから足す
+    surveys.record_response(conn, FEATURE_ID, 's1', SURVEY, 'alice', {'q1': 'いいえ', 'q2': 9})
+    results = _results(conn)
+    assert results['q1']['counts'] == {'はい': 1, 'いいえ': 2}
+    assert results['q2']['numeric']['count'] == 3
+    assert results['q2']['numeric']['mean'] == 7
+    assert results['q3']['answered'] == 0
+    assert conn.execute('SELECT COUNT(*) FROM survey_responses').fetchone()[0] == 3
+
+
+def test_sync_ignores_forged_respondents(conn):
+    content = {
+        'surveys': {'s1': dict(SURVEY, responses=[
+            {'respondent': 'alice', 'responses': {'q1': 'はい'}, 'submitted_at': 1},
+            {'respondent': 'bob', 'responses': {'q1': 'いいえ'}, 'submitted_at': 1},
+        ])},
+        'responses': {'s1': {'carol': {'responses': {'q1': 'いいえ'}, 'submitted_at': 1}}},
+    }
+    assert surveys.sync_from_content(conn, FEATURE_ID, content, username='alice')
+
+    rows = conn.execute('SELECT username, user_id FROM survey_responses').fetchall()
+    assert [tuple(row) for row in rows] == [('alice', repository.find_user(conn, 'alice')['id'])]
+    assert _results(conn)['q1']['counts'] == {'はい': 1, 'いいえ': 0}
+    # 取り込んだかどうかに関係なく、回答の一覧はブロブから取り除く
+    assert content['surveys']['s1']['responses'] == []
+    assert content['responses'] == {'s1': {}}
+
+
+def test_sync_without_username_imports_everyone_once(conn):
+    content = {'surveys': {'s1': dict(SURVEY, responses=[
+        {'respondent': 'alice', 'responses': {'q1': 'はい'}, 'submitted_at': 1},
+        {'respondent': 'bob', 'responses': {'q1': 'いいえ'}, 'submitted_at': 2},
+    ])}}
+    surveys.sync_from_content(conn, FEATURE_ID, content)
+    # 同じ submitted_at の回答をもう一度渡しても二重に数えない
+    content['surveys']['s1']['responses'] = [
+        {'respondent': 'bob', 'responses': {'q1': 'いいえ'}, 'submitted_at': 2},
+    ]
+    surveys.sync_from_content(conn, FEATURE_ID, content)
+    assert _results(conn)['q1']['counts'] == {'はい': 1, 'いいえ': 1}
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""プロジェクトのタスクの保存・一覧・ブロブとの同期（tasks.py）"""
+
+import tasks
+
+FEATURE_ID = 'f_projects'
+
+
+def _create(db, title, **kwargs):
+    return tasks.create_task(db, FEATURE_ID, kwargs.pop('project_id', 'p1'), title, **kwargs)
+
+
+def test_created_tasks_get_unique_ids(db):
+    created = [_create(db, f'タスク{i}', created_by='alice') for i in range(20)]
+    assert len({task['id'] for task in created}) == 20
+    assert all(task['id'].startswith('task_') for task in created)
+    listed, total, counts = tasks.list_tasks(db, FEATURE_ID, limit=100)
+    assert total == 20 and counts == {'todo': 20, 'in-progress': 0, 'done': 0}
+    assert [task['title'] for task in listed] == [f'タスク{i}' for i in range(20)]
+
+
+def test_list_filters_sorts_and_counts(db):
+    a = _create(db, 'a', priority='low', assigned_to='bob', due_date='2030-05-03')
+    b = _create(db, 'b', priority='high', due_date='2030-05-01')
+    c = _create(db, 'c', priority='medium', project_id='p2')
+    assert tasks.update_status(db, FEATURE_ID, b['id'], 'done')
+    assert not tasks.update_status(db, FEATURE_ID, 'missing', 'done')
+
+    def titles(**kwargs):
+        return [task['title'] for task in tasks.list_tasks(db, FEATURE_ID, **kwargs)[0]]
+
+    assert titles(sort='priority') == ['b', 'c', 'a']
+    assert titles(sort='due_date') == ['b', 'a', 'c']   # 期限の無いタスクは最後
+    assert titles(sort='title', descending=True) == ['c', 'b', 'a']
+    assert titles(project_id='p1') == ['a', 'b']
+    assert titles(assigned_to='bob') == ['a']
+
+    # 件数はステータスで絞り込む前の条件で数える
+    listed, total, counts = tasks.list_tasks(db, FEATURE_ID, statuses=['todo'], sort='title', limit=1)
+    assert [task['title'] for task in listed] == ['a'] and total == 2
+    assert counts == {'todo': 2, 'in-progress': 0, 'done': 1}
+    assert titles(statuses=['todo'], sort='title', limit=1, offset=1) == ['c']
+    assert c['status'] == 'todo'
+
+
+def test_sync_from_content_moves_tasks_out_of_the_blob(db):
+    kept = _create(db, '残す')
+    _create(db, '消える')
+    content = {'projects': {}, 'tasks': {
+        kept['id']: dict(kept, title='残す（修正）'),
+        'legacy': {'project_id': 'p1', 'title': '古いタスク', 'status': 'done', 'color': 'red'},
+    }}
+    assert tasks.sync_from_content(db, FEATURE_ID, content)
+    assert content['tasks'] == {}
+
+    by_id = tasks.tasks_by_feature(db, [FEATURE_ID])[FEATURE_ID]
+    assert {task_id: task['title'] for task_id, task in by_id.items()} == {
+        kept['id']: '残す（修正）', 'legacy': '古いタスク'}
+    # 専用の列が無いフィールドも戻ってくる
+    assert by_id['legacy']['color'] == 'red'
+
+    # tasks キーの無いブロブは触らない
+    assert not tasks.sync_from_content(db, FEATURE_ID, {'projects': {}})
+    assert len(tasks.tasks_by_feature(db, [FEATURE_ID])[FEATURE_ID]) == 2
+
+
+def test_open_tasks_for_user(db):
+    _create(db, '担当', assigned_to='alice', due_date='2030-05-02')
+    _create(db, '作成', created_by='alice', due_date='2030-05-01')
+    done = _create(db, '完了', assigned_to='alice')
+    _create(db, '他人', assigned_to='bob')
+    tasks.update_status(db, FEATURE_ID, done['id'], 'done')
+    opened = tasks.open_tasks_for_user(db, [FEATURE_ID], 'alice')
+    assert [task['title'] for task in opened] == ['作成', '担当']
+    assert all(task['featureId'] == FEATURE_ID for task in opened)
+
+
+def test_list_tasks_api(api):
+    call, _, _, features = api
+    call(action='createProject', featureId=features['projects'], name='展示会')
+    project_id = next(iter(call(action='getFeatureContent', featureId=features['projects'])['projects']))
+    for title in ('搬入', '設営', '撤収'):
+        call(action='createTask', featureId=features['projects'], projectId=project_id, title=title)
+
+    first = call(action='listTasks', featureId=features['projects'], sort='title', pageSize=2)
+    assert first['total'] == 3 and len(first['tasks']) == 2 and first['counts']['todo'] == 3
+    task_id = first['tasks'][0]['id']
+    call(action='updateTaskStatus', featureId=features['projects'], taskId=task_id, status='done')
+    done = call(action='listTasks', featureId=features['projects'], status='done')
+    assert [task['id'] for task in done['tasks']] == [task_id]
+    # getFeatureContent はテーブルのタスクを content['tasks'] に戻す
+    content = call(action='getFeatureContent', featureId=features['projects'])
+    assert content['tasks'][task_id]['status'] == 'done' and len(content['tasks']) == 3
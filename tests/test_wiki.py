@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Wiki の版の履歴（差分とスナップショットからの復元、wiki.py）"""
+
+import wiki
+from config import Config
+
+FEATURE_ID = 'f_wiki'
+
+
+def _bodies():
+    lines = ['# ホーム\n', '部室は2階です。\n', '活動日は火曜と金曜。\n']
+    bodies = [''.join(lines)]
+    for i in range(6):
+        if i % 3 == 0:
+            lines.insert(1, f'お知らせ {i}\n')
+        elif i % 3 == 1:
+            lines[-1] = f'活動日は{i}曜日。'  # 末尾の改行なし
+        else:
+            del lines[1]
+        bodies.append(''.join(lines))
+    return bodies
+
+
+def test_every_revision_is_reconstructed(db, monkeypatch):
+    monkeypatch.setattr(Config, 'WIKI_SNAPSHOT_INTERVAL', 3)
+    bodies = _bodies()
+    for i, body in enumerate(bodies):
+        assert wiki.save_page(db, FEATURE_ID, 'home', {'title': f'ホーム{i}', 'content': body}, 'alice') == i + 1
+
+    kinds = [row[0] for row in db.execute(
+        'SELECT kind FROM wiki_revisions WHERE page_id = ? ORDER BY revision', ('home',))]
+    assert kinds == ['snapshot', 'delta', 'delta', 'snapshot', 'delta', 'delta', 'snapshot']
+
+    for i, body in enumerate(bodies):
+        revision = wiki.get_revision(db, FEATURE_ID, 'home', i + 1)
+        assert revision['content'] == body
+        assert revision['title'] == f'ホーム{i}'
+        assert revision['size'] == len(body.encode('utf-8'))
+    assert wiki.get_revision(db, FEATURE_ID, 'home', len(bodies) + 1) is None
+    assert wiki.get_revision(db, FEATURE_ID, 'other', 1) is None
+
+
+def test_unchanged_saves_and_deletes_keep_history(db):
+    wiki.save_page(db, FEATURE_ID, 'p', {'title': 'A', 'content': '1\n'})
+    # タイトルも本文も同じなら版を増やさない
+    assert wiki.save_page(db, FEATURE_ID, 'p', {'title': 'A', 'content': '1\n', 'tags': ['x']}) == 1
+    assert wiki.list_pages(db, FEATURE_ID)[0]['tags'] == ['x']
+
+    content = {'pages': {}}
+    wiki.sync_from_content(db, FEATURE_ID, content)
+    assert wiki.get_page(db, FEATURE_ID, 'p') is None
+    assert wiki.get_revision(db, FEATURE_ID, 'p', 1)['content'] == '1\n'
+
+    # 削除したページを同じ内容で保存し直すと新しい版になる
+    assert wiki.save_page(db, FEATURE_ID, 'p', {'title': 'A', 'content': '1\n'}) == 2
+    assert [r['revision'] for r in wiki.get_page(db, FEATURE_ID, 'p')['revisions']] == [2, 1]
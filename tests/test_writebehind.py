@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""記録用の書き込みのまとめと、書き込みに失敗したときの持ち越し（writebehind.py）"""
+
+import sqlite3
+
+import pytest
+
+import repository
+import writebehind
+
+LAST_LOGIN = 'UPDATE users SET last_login = ? WHERE id = ?'
+DOWNLOADS = 'UPDATE files SET download_count = download_count + ? WHERE id = ?'
+
+
+@pytest.fixture
+def rows(db):
+    for name in ('alice', 'bob'):
+        repository.create_user(db, name, 'x')
+    alice = repository.find_user(db, 'alice')['id']
+    repository.add_file(db, 'file1', 'a.txt', 'a.txt', 'uploads/a.txt', 1, 'text/plain', alice)
+    db.commit()
+    return db
+
+
+def _state(conn):
+    users = {row[0]: row[1] for row in conn.execute('SELECT username, last_login FROM users')}
+    downloads = conn.execute('SELECT download_count FROM files WHERE id = ?', ('file1',)).fetchone()[0]
+    return users, downloads
+
+
+def _buffer(app_module, connect=None):
+    # バックグラウンドのスレッドは書き込まず、flush を呼んだときだけ書き込む
+    return writebehind.WriteBehindBuffer(connect or app_module.get_db_connection,
+                                         interval_ms=3600 * 1000, max_items=1000, enabled=True)
+
+
+def test_updates_to_the_same_row_are_coalesced(app_module, rows):
+    buffer = _buffer(app_module)
+    try:
+        for stamp in ('2030-01-01 00:00:00', '2030-01-02 00:00:00', '2030-01-03 00:00:00'):
+            buffer.set_value(LAST_LOGIN, 1, stamp)
+        for _ in range(3):
+            buffer.increment(DOWNLOADS, 'file1')
+        buffer.increment(DOWNLOADS, 'file1', 2)
+        assert buffer.pending_count() == 2
+        assert _state(rows) == ({'alice': None, 'bob': None}, 0)
+
+        assert buffer.flush() == 2
+        assert _state(rows) == ({'alice': '2030-01-03 00:00:00', 'bob': None}, 5)
+        assert buffer.pending_count() == 0
+        assert buffer.flush() == 0
+    finally:
+        buffer.close()
+
+
+def test_failed_flush_is_merged_back(app_module, rows):
+    buffer = None
+    failures = []
+
+    def connect():
+        if failures:
+            failures.pop()
+            # 書き込み中に届いた更新は、持ち越した古い値より優先する
+            buffer.set_value(LAST_LOGIN, 1, '2030-01-09 00:00:00')
+            buffer.increment(DOWNLOADS, 'file1', 10)
+            raise sqlite3.OperationalError('database is locked')
+        return app_module.get_db_connection()
+
+    buffer = _buffer(app_module, connect)
+    try:
+        buffer.set_value(LAST_LOGIN, 1, '2030-01-01 00:00:00')
+        buffer.set_value(LAST_LOGIN, 2, '2030-01-02 00:00:00')
+        buffer.increment(DOWNLOADS, 'file1', 3)
+        failures.append(True)
+        assert buffer.flush() == 0
+        assert buffer.pending_count() == 3
+        assert _state(rows) == ({'alice': None, 'bob': None}, 0)
+
+        assert buffer.flush() == 3
+        assert _state(rows) == ({'alice': '2030-01-09 00:00:00', 'bob': '2030-01-02 00:00:00'}, 13)
+    finally:
+        buffer.close()
+
+
+def test_close_writes_what_is_left(app_module, rows):
+    buffer = _buffer(app_module)
+    buffer.increment(DOWNLOADS, 'file1')
+    buffer.close()
+    assert _state(rows)[1] == 1
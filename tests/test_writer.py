@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""書き込みジョブのグループコミット（writer.py）"""
+
+import pytest
+
+import database
+import repository
+import writer
+
+
+@pytest.fixture
+def writes(app_module):
+    group = writer.GroupCommitWriter(app_module.get_db_connection, max_jobs=10, max_delay_ms=200,
+                                     enabled=True)
+    try:
+        yield group
+    finally:
+        group.close()
+
+
+def _usernames(conn):
+    return [row[0] for row in conn.execute('SELECT username FROM users ORDER BY id')]
+
+
+def test_a_failed_job_only_rolls_back_its_own_writes(writes, db):
+    def add(name):
+        def job(conn):
+            repository.create_user(conn, name, 'x')
+            return name
+        return job
+
+    def fail(conn):
+        repository.create_user(conn, 'mallory', 'x')
+        raise ValueError('失敗')
+
+    futures = [writes.submit(add('alice')), writes.submit(fail), writes.submit(add('bob')),
+               writes.submit(add('alice'))]
+    assert futures[0].result() == 'alice'
+    with pytest.raises(ValueError):
+        futures[1].result()
+    assert futures[2].result() == 'bob'
+    # 制約違反もそのジョブだけの失敗になる
+    with pytest.raises(database.IntegrityError):
+        futures[3].result()
+
+    assert (writes.batches, writes.jobs) == (1, 2)
+    assert _usernames(db) == ['alice', 'bob']
+
+
+def test_results_are_returned_after_commit(writes, db):
+    assert writes.run(lambda conn: repository.create_user(conn, 'carol', 'x')) is None
+    # 別の接続から見えている（コミット済み）
+    assert _usernames(db) == ['carol']
+    with pytest.raises(KeyError):
+        writes.run(lambda conn: {}['missing'])
+    assert writes.run(lambda conn: repository.username_exists(conn, 'carol'))
+
+
+def test_disabled_writer_commits_each_job(app_module, db):
+    alone = writer.GroupCommitWriter(app_module.get_db_connection, enabled=False)
+    alone.run(lambda conn: repository.create_user(conn, 'dave', 'x'))
+    with pytest.raises(ValueError):
+        alone.run(lambda conn: (repository.create_user(conn, 'erin', 'x'), int('x')))
+    assert _usernames(db) == ['dave']
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Wiki ページと版の履歴
+
+ページは wiki_pages に1行ずつ（本文は最新版をそのまま）保存し、wiki 機能のブロブには
+書き込まない。保存のたびに wiki_revisions に版を追加するが、本文は直前の版との
+行単位の差分を圧縮して持ち、WIKI_SNAPSHOT_INTERVAL 版ごとに全文のスナップショットを置く。
+古い版は直前のスナップショットから差分を順に当てて復元する。
+"""
+
+import difflib
+import time
+
+import compression
+import database
+import repository
+import serializer
+from config import Config
+
+KIND_SNAPSHOT = 'snapshot'
+KIND_DELTA = 'delta'
+REVISION_LIST_LIMIT = 50
+
+
+def init_wiki_tables(cursor):
+    """Wiki 用テーブルを作成し、新規作成時は既存ブロブのページを第1版として取り込む"""
+    exists = database.table_exists(cursor, 'wiki_pages')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS wiki_pages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            feature_id TEXT NOT NULL,
+            page_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            body TEXT NOT NULL,
+            author TEXT,
+            revision INTEGER NOT NULL DEFAULT 0,
+            size INTEGER NOT NULL DEFAULT 0,
+            created_at REAL,
+            updated_at REAL,
+            deleted_at REAL,
+            data TEXT NOT NULL,
+            UNIQUE(feature_id, page_id),
+            FOREIGN KEY (feature_id) REFERENCES features (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS wiki_revisions (
+            feature_id TEXT NOT NULL,
+            page_id TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            compression INTEGER NOT NULL DEFAULT 0,
+            payload BLOB NOT NULL,
+            title TEXT,
+            author TEXT,
+            size INTEGER,
+            created_at REAL,
+            PRIMARY KEY (feature_id, page_id, revision)
+        )
+    ''')
+
+    if not exists:
+        rows = cursor.execute('''
+            SELECT f.id, fc.content FROM features f
+            JOIN feature_content fc ON fc.feature_id = f.id
+            WHERE f.type = 'wiki'
+        ''').fetchall()
+        for feature_id, raw in rows:
+            try:
+                content = serializer.decode_content(raw)
+            except serializer.DecodeError:
+                continue
+            if sync_from_content(cursor, feature_id, content):
+                repository.update_content(cursor, feature_id, content)
+
+
+def _text(value):
+    return value if isinstance(value, str) else ('' if value is None else str(value))
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def make_delta(old, new):
+    """old から new を作る操作列: ['=', 開始行, 終了行]（old の行をコピー）か ['+', [行...]]"""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(['=', i1, i2])
+        elif tag in ('replace', 'insert'):
+            ops.append(['+', new_lines[j1:j2]])
+    return ops
+
+
+def apply_delta(old, ops):
+    old_lines = old.splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if op[0] == '=':
+            parts.extend(old_lines[op[1]:op[2]])
+        else:
+            parts.extend(op[1])
+    return ''.join(parts)
+
+
+def _pack(value):
+    method = compression.blob_compression() or compression.COMPRESS_ZLIB
+    return method, compression.compress_blob(serializer.dumps_bytes(value), method)
+
+
+def _unpack(method, payload):
+    return serializer.loads(compression.decompress_blob(payload, method))
+
+
+def _add_revision(conn, feature_id, page_id, revision, title, body, previous_body, author):
+    interval = max(1, Config.WIKI_SNAPSHOT_INTERVAL)
+    if previous_body is None or (revision - 1) % interval == 0:
+        kind, value = KIND_SNAPSHOT, body
+    else:
+        kind, value = KIND_DELTA, make_delta(previous_body, body)
+    method, payload = _pack(value)
+    conn.execute('''
+        INSERT INTO wiki_revisions (feature_id, page_id, revision, kind, compression, payload,
+                                    title, author, size, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (feature_id, page_id, revision, kind, method, payload, title, author,
+          len(body.encode('utf-8')), time.time()))
+
+
+def _metadata(page):
+    return {k: v for k, v in page.items() if k != 'content'}
+
+
+def save_page(conn, feature_id, page_id, page, author=None, current=None):
+    """ページを保存する。タイトルか本文が変わったときだけ新しい版を追加し、版番号を返す。
+    current は (タイトル, 本文, 版, 削除済みか, メタデータ) で、省略時は読み込む"""
+    page_id = str(page_id)
+    title = _text(page.get('title'))
+    body = _text(page.get('content'))
+    metadata = dict(_metadata(page), id=page.get('id', page_id))
+    if current is None:
+        row = conn.execute('''
+            SELECT title, body, revision, deleted_at, data FROM wiki_pages
+            WHERE feature_id = ? AND page_id = ?
+        ''', (feature_id, page_id)).fetchone()
+        current = (row[0], row[1], row[2], row[3] is not None, serializer.loads(row[4])) if row else None
+
+    author = author or page.get('updated_by') or page.get('author')
+    now = time.time()
+    if current is None:
+        _add_revision(conn, feature_id, page_id, 1, title, body, None, author)
+        conn.execute('''
+            INSERT INTO wiki_pages (feature_id, page_id, title, body, author, revision, size,
+                                    created_at, updated_at, data)
+            VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?)
+        ''', (feature_id, page_id, title, body, page.get('author') or author,
+              len(body.encode('utf-8')), _number(page.get('created_at')) or now,
+              _number(page.get('updated_at')) or now, serializer.dumps(metadata)))
+        return 1
+
+    old_title, old_body, revision, deleted, old_metadata = current
+    if old_title == title and old_body == body and not deleted:
+        if old_metadata != metadata:
+            conn.execute('''
+                UPDATE wiki_pages SET data = ?, updated_at = COALESCE(?, updated_at)
+                WHERE feature_id = ? AND page_id = ?
+            ''', (serializer.dumps(metadata), _number(page.get('updated_at')), feature_id, page_id))
+        return revision
+
+    revision += 1
+    _add_revision(conn, feature_id, page_id, revision, title, body, old_body, author)
+    conn.execute('''
+        UPDATE wiki_pages SET title = ?, body = ?, revision = ?, size = ?, updated_at = ?,
+                              deleted_at = NULL, data = ?
+        WHERE feature_id = ? AND page_id = ?
+    ''', (title, body, revision, len(body.encode('utf-8')), _number(page.get('updated_at')) or now,
+          serializer.dumps(metadata), feature_id, page_id))
+    return revision
+
+
+def delete_page(conn, feature_id, page_id):
+    """ページを一覧から外す（版の履歴は残す）"""
+    cur = conn.execute('''
+        UPDATE wiki_pages SET deleted_at = ? WHERE feature_id = ? AND page_id = ? AND deleted_at IS NULL
+    ''', (time.time(), feature_id, page_id))
+    return cur.rowcount > 0
+
+
+def sync_from_content(conn, feature_id, content, author=None):
+    """ブロブに書かれた content['pages'] を反映し、ブロブからは取り除く。
+    変更のあったページだけ版を追加し、含まれないページは削除扱いにする。ブロブを変更したら True"""
+    if not isinstance(content, dict) or not isinstance(content.get('pages'), dict):
+        return False
+    incoming = content['pages']
+    existing = {
+        row[0]: (row[1], row[2], row[3], row[4] is not None, serializer.loads(row[5]))
+        for row in conn.execute('''
+            SELECT page_id, title, body, revision, deleted_at, data FROM wiki_pages WHERE feature_id = ?
+        ''', (feature_id,))
+    }
+    for page_id, page in incoming.items():
+        if not isinstance(page, dict):
+            continue
+        page_id = str(page_id)
+        save_page(conn, feature_id, page_id, page, author, existing.pop(page_id, None))
+    for page_id, current in existing.items():
+        if not current[3]:
+            delete_page(conn, feature_id, page_id)
+
+    changed = bool(incoming)
+    content['pages'] = {}
+    return changed
+
+
+def _page_from_row(data, body):
+    page = serializer.loads(data)
+    page['content'] = body
+    return page
+
+
+def pages_by_feature(conn, feature_ids=None):
+    """{feature_id: {page_id: ページ（本文付き）}} を1クエリで返す。feature_ids が None なら全機能"""
+    sql = 'SELECT feature_id, page_id, data, body FROM wiki_pages WHERE deleted_at IS NULL'
+    params = []
+    if feature_ids is not None:
+        result = {feature_id: {} for feature_id in feature_ids}
+        if not result:
+            return result
+        sql += ' AND feature_id IN (%s)' % ','.join('?' for _ in result)
+        params = list(result)
+    else:
+        result = {}
+    for row in conn.execute(sql, params):
+        result.setdefault(row[0], {})[row[1]] = _page_from_row(row[2], row[3])
+    return result
+
+
+def merge_into_content(content_by_feature, by_feature):
+    """既存クライアント向けに、テーブルのページを content['pages'] に戻す"""
+    for feature_id, pages in by_feature.items():
+        content = content_by_feature.get(feature_id)
+        if isinstance(content, dict):
+            content['pages'] = pages
+
+
+def list_pages(conn, feature_id):
+    """本文を含まないページ一覧（更新の新しい順）"""
+    pages = []
+    for row in conn.execute('''
+        SELECT page_id, title, author, revision, size, created_at, updated_at, data FROM wiki_pages
+        WHERE feature_id = ? AND deleted_at IS NULL
+        ORDER BY updated_at DESC
+    ''', (feature_id,)):
+        metadata = serializer.loads(row[7])
+        pages.append({
+            'id': row[0],
+            'title': row[1],
+            'author': row[2],
+            'revision': row[3],
+            'size': row[4],
+            'created_at': row[5],
+            'updated_at': row[6],
+            'tags': metadata.get('tags') or [],
+        })
+    return pages
+
+
+def get_page(conn, feature_id, page_id):
+    """本文と版の一覧（新しい順、最大 REVISION_LIST_LIMIT 件）付きのページ。無ければ None"""
+    row = conn.execute('''
+        SELECT data, body, revision FROM wiki_pages
+        WHERE feature_id = ? AND page_id = ? AND deleted_at IS NULL
+    ''', (feature_id, page_id)).fetchone()
+    if not row:
+        return None
+    page = _page_from_row(row[0], row[1])
+    page['revision'] = row[2]
+    page['revisions'] = [
+        {'revision': r[0], 'title': r[1], 'author': r[2], 'size': r[3], 'created_at': r[4]}
+        for r in conn.execute('''
+            SELECT revision, title, author, size, created_at FROM wiki_revisions
+            WHERE feature_id = ? AND page_id = ?
+            ORDER BY revision DESC LIMIT ?
+        ''', (feature_id, page_id, REVISION_LIST_LIMIT))
+    ]
+    return page
+
+
+def get_revision(conn, feature_id, page_id, revision):
+    """指定した版の本文を直前のスナップショットと差分から復元する。無ければ None"""
+    rows = conn.execute('''
+        SELECT revision, kind, compression, payload, title, author, size, created_at
+        FROM wiki_revisions
+        WHERE feature_id = ? AND page_id = ? AND revision <= ? AND revision >= (
+            SELECT MAX(revision) FROM wiki_revisions
+            WHERE feature_id = ? AND page_id = ? AND revision <= ? AND kind = ?
+        )
+        ORDER BY revision
+    ''', (feature_id, page_id, revision, feature_id, page_id, revision, KIND_SNAPSHOT)).fetchall()
+    if not rows or rows[-1][0] != revision:
+        return None
+    body = ''
+    for row in rows:
+        value = _unpack(row[2], row[3])
+        body = value if row[1] == KIND_SNAPSHOT else apply_delta(body, value)
+    last = rows[-1]
+    return {
+        'id': page_id,
+        'revision': last[0],
+        'title': last[4],
+        'author': last[5],
+        'size': last[6],
+        'created_at': last[7],
+        'content': body,
+    }
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""重要度の低い記録用の書き込みをまとめて後から反映するバッファ
+
+最終ログイン時刻やダウンロード数のような記録は、リクエストの処理中に書き込むと
+そのたびに SQLite の書き込みロックと fsync が発生する。ここではメモリ上で
+同じ行への更新をまとめ（時刻は最後の値、カウンタは合計）、バックグラウンドの
+スレッドが WRITE_BEHIND_INTERVAL_MS ごと、または WRITE_BEHIND_MAX_ITEMS 件たまった
+時点で1トランザクションにまとめて書き込む。プロセスが異常終了した場合は
+未反映の分が失われるので、失ってよい記録だけに使う。
+"""
+
+import atexit
+import threading
+import time
+
+from config import Config
+
+_SET = 'set'
+_ADD = 'add'
+
+
+class WriteBehindBuffer:
+    """UPDATE 文とキーごとに値をまとめ、バックグラウンドでまとめて書き込む"""
+
+    def __init__(self, connect, interval_ms=None, max_items=None, enabled=None):
+        self._connect = connect
+        self.interval = (Config.WRITE_BEHIND_INTERVAL_MS if interval_ms is None else interval_ms) / 1000.0
+        self.max_items = Config.WRITE_BEHIND_MAX_ITEMS if max_items is None else max_items
+        self.enabled = Config.WRITE_BEHIND_ENABLED if enabled is None else enabled
+        # {(文, 種類): {キー: 値}}
+        self._pending = {}
+        self._count = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+    def set_value(self, statement, key, value):
+        """statement（パラメータは (値, キー)）を後で実行する。同じキーは最後の値だけ残す"""
+        self._add(statement, _SET, key, value)
+
+    def increment(self, statement, key, amount=1):
+        """statement（パラメータは (増分, キー)）を後で実行する。同じキーの増分は合計する"""
+        self._add(statement, _ADD, key, amount)
+
+    def _add(self, statement, kind, key, value):
+        if not self.enabled:
+            self._write({(statement, kind): {key: value}})
+            return
+        with self._cond:
+            entries = self._pending.setdefault((statement, kind), {})
+            if key not in entries:
+                self._count += 1
+                entries[key] = value
+            elif kind == _ADD:
+                entries[key] += value
+            else:
+                entries[key] = value
+            self._ensure_thread()
+            if self._count >= self.max_items:
+                self._cond.notify()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def _take(self):
+        with self._cond:
+            pending, self._pending, self._count = self._pending, {}, 0
+        return pending
+
+    def _merge_back(self, pending):
+        with self._cond:
+            for group, entries in pending.items():
+                current = self._pending.setdefault(group, {})
+                for key, value in entries.items():
+                    if key not in current:
+                        self._count += 1
+                        current[key] = value
+                    elif group[1] == _ADD:
+                        current[key] += value
+
+    def _write(self, pending):
+        conn = self._connect()
+        try:
+            with conn:
+                for (statement, _), entries in pending.items():
+                    conn.executemany(statement, [(value, key) for key, value in entries.items()])
+        finally:
+            conn.close()
+
+    def flush(self):
+        """たまっている分をすぐに書き込む。書き込んだ件数を返す"""
+        with self._flush_lock:
+            pending = self._take()
+            if not pending:
+                return 0
+            try:
+                self._write(pending)
+            except Exception as e:
+                # ロック待ちのタイムアウトなどは次回に持ち越す
+                print(f"Write-behind flush failed: {e}")
+                self._merge_back(pending)
+                return 0
+            return sum(len(entries) for entries in pending.values())
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and self._count < self.max_items:
+                    self._cond.wait(self.interval)
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+
+    def pending_count(self):
+        with self._cond:
+            return self._count
+
+    def close(self):
+        """スレッドを止めて残りを書き込む"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=max(1.0, self.interval * 2))
+        self.flush()
+
+
+_buffers = []
+
+
+def create_buffer(connect, **kwargs):
+    """バッファを作成し、プロセス終了時に残りを書き込むよう登録する"""
+    buffer = WriteBehindBuffer(connect, **kwargs)
+    _buffers.append(buffer)
+    return buffer
+
+
+@atexit.register
+def _close_all():
+    for buffer in _buffers:
+        try:
+            buffer.close()
+        except Exception as e:
+            print(f"Write-behind close failed: {e}")
+
+
+def utc_timestamp():
+    """CURRENT_TIMESTAMP と同じ形式の現在時刻（UTC）"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""書き込みジョブを1本のスレッドでまとめてコミットする（グループコミット）
+
+ハンドラーがそれぞれ commit すると、チャットの投稿が集中したときに投稿ごとに
+fsync が走り、書き込み側は SQLite のロック待ちで並ぶ。ここでは書き込みを
+「接続を受け取る関数」としてキューに入れ、専用スレッドが最大
+WRITE_GROUP_MAX_JOBS 件（最初のジョブから WRITE_GROUP_MAX_DELAY_MS まで待つ）を
+1トランザクションで実行してコミットする。ジョブごとに SAVEPOINT を切るので、
+失敗したジョブだけが取り消される。呼び出し元は Future で結果を待ち、結果は
+コミットが終わってから返るため、永続性はジョブごとに commit する場合と変わらない。
+ジョブが実行した SQL は、投入したリクエストのクエリトレースとプロファイルに記録する。
+
+ジョブの中で commit / rollback を呼んではいけない。
+"""
+
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import profiling
+import querytrace
+from config import Config
+
+
+class GroupCommitWriter:
+    """書き込みジョブを受け付け、まとめてコミットする"""
+
+    def __init__(self, connect, max_jobs=None, max_delay_ms=None, enabled=None):
+        self._connect = connect
+        self.max_jobs = max(1, Config.WRITE_GROUP_MAX_JOBS if max_jobs is None else max_jobs)
+        self.max_delay = (Config.WRITE_GROUP_MAX_DELAY_MS if max_delay_ms is None else max_delay_ms) / 1000.0
+        self.enabled = Config.WRITE_GROUP_COMMIT if enabled is None else enabled
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.batches = 0
+        self.jobs = 0
+
+    def submit(self, job):
+        """job(conn) を書き込みスレッドで実行する Future を返す"""
+        future = Future()
+        if not self.enabled:
+            self._run_alone(job, future)
+            return future
+        self._ensure_thread()
+        # 書き込みスレッドで実行した SQL も投入したリクエストの分として数える
+        context = (profiling.current(), tuple(querytrace.active()))
+        self._queue.put((job, future, context))
+        return future
+
+    def run(self, job):
+        """job(conn) を実行し、コミット後にその戻り値を返す（例外はそのまま送出）"""
+        return self.submit(job).result()
+
+    def _run_alone(self, job, future):
+        conn = self._connect()
+        try:
+            # 読み込みから書き込みまでを他の書き込みと重ねない
+            conn.execute('BEGIN IMMEDIATE')
+            result = job(conn)
+            conn.commit()
+        except BaseException as e:
+            conn.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            conn.close()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='group-commit', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_jobs:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 停止の合図は今のバッチを書き終えてから処理する
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        conn = self._connect()
+        # BEGIN / COMMIT はここで明示的に発行する
+        conn.isolation_level = None
+        try:
+            while True:
+                batch = self._collect()
+                if batch is None:
+                    return
+                try:
+                    self._commit_batch(conn, batch)
+                except BaseException as e:
+                    # 取り消せない失敗（ディスク不足など）はバッチ全体を失敗にする
+                    try:
+                        if conn.in_transaction:
+                            conn.execute('ROLLBACK')
+                    except Exception:
+                        pass
+                    for _, future, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn, batch):
+        conn.execute('BEGIN IMMEDIATE')
+        done = []
+        for job, future, (profile, traces) in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            conn.execute('SAVEPOINT job')
+            try:
+                with profiling.attached(profile), querytrace.attached(traces):
+                    result = job(conn)
+            except Exception as e:
+                conn.execute('ROLLBACK TO job')
+                conn.execute('RELEASE job')
+                future.set_exception(e)
+            else:
+                conn.execute('RELEASE job')
+                done.append((future, result))
+        conn.execute('COMMIT')
+        self.batches += 1
+        self.jobs += len(done)
+        for future, result in done:
+            future.set_result(result)
+
+    def close(self):
+        """キューに残ったジョブを書き終えてからスレッドを止める"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+
+_writers = []
+
+
+def create_writer(connect, **kwargs):
+    """書き込みスレッドを作成し、プロセス終了時に残りを書き終えるよう登録する"""
+    writer = GroupCommitWriter(connect, **kwargs)
+    _writers.append(writer)
+    return writer
+
+
+@atexit.register
+def _close_all():
+    for writer in _writers:
+        writer.close()